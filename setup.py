@@ -73,6 +73,20 @@ else:
         fh.write(version_template.format(__version__))
 
 
+# Compiler flags for OpenMP, used to parallelize the pair potentials. Yaff
+# still compiles (without threads) if the flags are removed.
+if sys.platform == 'win32':
+    openmp_compile_args = ['/openmp']
+    openmp_link_args = []
+elif sys.platform == 'darwin':
+    # The default compiler on macOS does not support OpenMP.
+    openmp_compile_args = []
+    openmp_link_args = []
+else:
+    openmp_compile_args = ['-fopenmp']
+    openmp_link_args = ['-fopenmp']
+
+
 setup(
     name='yaff',
     version=__version__,
@@ -112,6 +126,8 @@ setup(
                      'yaff/pes/slater.h', 'yaff/pes/slater.pxd',
                      'yaff/pes/constants.h', 'yaff/pes/tailcorr.h'],
             include_dirs=[np.get_include()],
+            extra_compile_args=openmp_compile_args,
+            extra_link_args=openmp_link_args,
         ),
     ],
     classifiers=[
@@ -39,7 +39,7 @@ from molmod.units import kcalmol, angstrom, kelvin, amu, pascal, deg
 from molmod.constants import boltzmann
 from molmod.periodic import periodic
 
-__all__ = ['write_raspa_input','read_raspa_loading']
+__all__ = ['write_raspa_input','read_raspa_loading','read_raspa_block']
 
 def write_raspa_input(guests, parameters, host=None, workdir='.',
         guestdata=None, hostname='host'):
@@ -393,3 +393,25 @@ def read_raspa_loading(fn):
         raise ValueError("Failed to read `Average loading absolute` "
                          "and `absolute adsorption` from file %s"%(fn))
     return T, P, fugacity, N, Nerr
+
+
+def read_raspa_block(fn):
+    """Read the blocked pockets of a host from a RASPA .block file
+
+       The first line contains the number of pockets, each following line
+       the fractional coordinates of the center of a pocket and its radius in
+       angstrom.
+
+       **Returns:** an array with the fractional coordinates of the centers
+       and an array with the radii, as expected by the pockets argument of
+       :class:`yaff.sampling.mcenergy.HostOccupancy`.
+    """
+    with open(fn,'r') as f:
+        lines = [line.split() for line in f if line.strip()!='']
+    if len(lines)==0:
+        raise ValueError("Failed to read the number of pockets from file %s"%(fn))
+    npocket = int(lines[0][0])
+    if len(lines)<npocket+1:
+        raise ValueError("Expected %d pockets in file %s"%(npocket,fn))
+    data = np.array([[float(word) for word in line[:4]] for line in lines[1:npocket+1]]).reshape(-1,4)
+    return data[:,:3], data[:,3]*angstrom
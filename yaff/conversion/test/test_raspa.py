@@ -29,7 +29,7 @@ from __future__ import print_function
 import pkg_resources
 
 from yaff.conversion.raspa import *
-from molmod.units import kelvin, pascal
+from molmod.units import kelvin, pascal, angstrom
 
 def test_raspa_read_loading():
     fn = pkg_resources.resource_filename(__name__,
@@ -40,3 +40,14 @@ def test_raspa_read_loading():
     assert fugacity==9994.52870926490505*pascal
     assert N==0.2916750000
     assert Nerr==0.0178022822
+
+
+def test_raspa_read_block():
+    fn = pkg_resources.resource_filename(__name__,
+            '../../data/test/CAU_13.block')
+    centers, radii = read_raspa_block(fn)
+    assert centers.shape == (2,3)
+    assert (centers[0] == [0.25, 0.5, 0.5]).all()
+    assert (centers[1] == 0.0).all()
+    assert abs(radii[0] - 1.2*angstrom) < 1e-10
+    assert abs(radii[1] - 0.8*angstrom) < 1e-10
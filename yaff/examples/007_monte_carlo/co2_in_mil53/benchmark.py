@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+'''Timings of energy-only evaluations in the GCMC simulation of CO2 in MIL-53
+
+   The trial moves of a GCMC simulation only need energies. This script
+   compares, for the force fields used in the trial moves, energy-only
+   evaluations (``compute_energy``) with evaluations that also compute the
+   gradient and the virial tensor. Finally, the number of MC steps per second
+   of a short simulation is reported, with random numbers drawn one at a time
+   and every trial timed (as before the random numbers were buffered), and
+   with random numbers generated in blocks and a sampled timer.
+
+   Usage: python benchmark.py [nguests] [nrep] [nsteps]
+'''
+
+
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import time
+
+import numpy as np
+
+from molmod.units import kelvin, bar, angstrom
+
+from yaff.pes.eos import PREOS
+from yaff.pes.ff import ForceField
+from yaff.sampling.mc import GCMC
+from yaff.sampling.mcutils import random_insertion
+from yaff.system import System
+from yaff import log
+log.set_level(log.silent)
+
+
+def time_ff(ff, guest, nrep, derivs):
+    '''Average wall time of nrep evaluations with random positions of the last guest'''
+    np.random.seed(1)
+    gpos = np.zeros(ff.system.pos.shape) if derivs else None
+    vtens = np.zeros((3, 3)) if derivs else None
+    natom = guest.natom
+    elapsed = 0.0
+    for irep in range(nrep):
+        ff.system.pos[-natom:] = random_insertion(guest)
+        ff.update_pos(ff.system.pos)
+        t0 = time.time()
+        if derivs:
+            ff.compute(gpos, vtens)
+        else:
+            ff.compute_energy()
+        elapsed += time.time() - t0
+    return elapsed/nrep
+
+
+def main(nguests=10, nrep=2000, nsteps=5000):
+    T = 298.0*kelvin
+    P = 10.0*bar
+    host = System.from_file('MIL53.chk')
+    gcmc = GCMC.from_files('CO2.chk', ['pars.txt'], host=host,
+        rcut=12.0*angstrom, tr=None, tailcorrections=True,
+        reci_ei='ewald_interaction', nguests=nguests)
+    eos = PREOS.from_name('carbondioxide')
+    gcmc.set_external_conditions(T, eos.calculate_fugacity(T, P))
+
+    # The force fields of the trial moves use the Ewald interaction part,
+    # which cannot compute gradients. For the comparison with full
+    # evaluations, the same force fields are generated with a regular Ewald
+    # summation instead.
+    hostguest = host.merge(gcmc.guest)
+    nhost = host.natom
+    gcmc.get_ff(nguests)
+    guests = gcmc.guest_ff.get_system()
+    nguest = guests.natom - gcmc.guest.natom
+    ffs = [
+        ('host-guest', ForceField.generate(hostguest, ['pars.txt'],
+            nlow=nhost, nhigh=nhost, rcut=12.0*angstrom, tr=None,
+            tailcorrections=True, reci_ei='ewald')),
+        ('guest-guest (N=%i)' % nguests, ForceField.generate(guests, ['pars.txt'],
+            nlow=nguest, nhigh=nguest, rcut=12.0*angstrom, tr=None,
+            tailcorrections=True, reci_ei='ewald')),
+    ]
+    print('%-28s %12s %12s %8s' % ('Force field', 'full [us]', 'energy [us]', 'speedup'))
+    for label, ff in ffs:
+        t_full = time_ff(ff, gcmc.guest, nrep, True)
+        t_energy = time_ff(ff, gcmc.guest, nrep, False)
+        print('%-28s %12.1f %12.1f %8.2f' % (label, t_full*1e6, t_energy*1e6, t_full/t_energy))
+
+    mc_moves = {'insertion':1.0, 'deletion':1.0, 'translation':1.0, 'rotation':1.0}
+    for label, random_block, timer_step in [('unbuffered', 1, 1), ('buffered', 4096, 100)]:
+        t0 = time.time()
+        gcmc.run(nsteps, mc_moves=mc_moves, seed=1, random_block=random_block,
+            timer_step=timer_step)
+        elapsed = time.time() - t0
+        print('GCMC (%s): %i steps in %.2f s, %.0f steps/s, N = %i' % (
+            label, nsteps, elapsed, nsteps/elapsed, gcmc.N))
+
+
+if __name__=='__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -89,3 +89,4 @@ from yaff.pes.parameters import *
 from yaff.pes.scaling import *
 from yaff.pes.colvar import *
 from yaff.pes.bias import *
+from yaff.pes.hostgrid import *
@@ -520,3 +520,334 @@ double compute_ewald_deltae(double *deltacosfacs,
   }
   return 2.0*e;
 }
+
+long compute_ewald_ktable(cell_type* cell, double alpha, long *gmax, double
+                          gcut, long *gindexes, double *kvecs, double *prefactors,
+                          long *positions) {
+  /*
+  Enumerates the k-vectors in the half space with |k| below the cutoff, in the
+  same order as compute_ewald_reci. When gindexes is NULL, the k-vectors are
+  only counted. The positions refer to the (2*gmax[0]+1,2*gmax[1]+1,gmax[2]+1)
+  arrays used by compute_ewald_prefactors and compute_ewald_structurefactors.
+  */
+  long g0, g1, g2, i, index, nk;
+  double k[3], ksq, fac1, fac2;
+  double gvecs[9];
+  for (i=0; i<9; i++) {
+    gvecs[i] = M_TWO_PI*(*cell).gvecs[i];
+  }
+  fac1 = M_FOUR_PI/(*cell).volume;
+  fac2 = 0.25/alpha/alpha;
+  gcut *= M_TWO_PI;
+  gcut *= gcut;
+  index = 0;
+  nk = 0;
+  for (g0=-gmax[0]; g0 <= gmax[0]; g0++) {
+    for (g1=-gmax[1]; g1 <= gmax[1]; g1++) {
+      for (g2=0; g2 <= gmax[2]; g2++) {
+        index++;
+        if (g2==0) {
+          if (g1<0) continue;
+          if ((g1==0)&&(g0<=0)) continue;
+        }
+        k[0] = (g0*gvecs[0] + g1*gvecs[3] + g2*gvecs[6]);
+        k[1] = (g0*gvecs[1] + g1*gvecs[4] + g2*gvecs[7]);
+        k[2] = (g0*gvecs[2] + g1*gvecs[5] + g2*gvecs[8]);
+        ksq = k[0]*k[0] + k[1]*k[1] + k[2]*k[2];
+        if (ksq > gcut) continue;
+        if (gindexes != NULL) {
+          gindexes[3*nk] = g0;
+          gindexes[3*nk+1] = g1;
+          gindexes[3*nk+2] = g2;
+          kvecs[3*nk] = k[0];
+          kvecs[3*nk+1] = k[1];
+          kvecs[3*nk+2] = k[2];
+          prefactors[nk] = fac1*exp(-ksq*fac2)/ksq;
+          positions[nk] = index;
+        }
+        nk++;
+      }
+    }
+  }
+  return nk;
+}
+
+static void fill_ewald_eikr(double *pos, long natom, cell_type* cell, long *gmax,
+                            double *eikr) {
+  /*
+  Computes exp(i*m*theta_j) with theta_j = 2*pi*g_j.r for every atom and for
+  m from -gmax[j] to gmax[j] (j=0,1) or from 0 to gmax[2] (j=2). Only one
+  sine and cosine per atom and axis is needed, the other powers follow from
+  the recurrence exp(i*(m+1)*theta) = exp(i*m*theta)*exp(i*theta).
+
+  Layout: for each axis a block with shape (nm,natom,2), where the last index
+  distinguishes the real and imaginary part.
+  */
+  long a, i, m, mlow, nm;
+  double theta, c1, s1, c, s, *block, *row;
+  block = eikr;
+  for (a=0; a<3; a++) {
+    mlow = (a==2)?0:gmax[a];
+    nm = mlow + gmax[a] + 1;
+    for (i=0; i<natom; i++) {
+      theta = M_TWO_PI*((*cell).gvecs[3*a]*pos[3*i] +
+                        (*cell).gvecs[3*a+1]*pos[3*i+1] +
+                        (*cell).gvecs[3*a+2]*pos[3*i+2]);
+      c1 = cos(theta);
+      s1 = sin(theta);
+      c = 1.0;
+      s = 0.0;
+      row = block + 2*(mlow*natom + i);
+      row[0] = c;
+      row[1] = s;
+      for (m=1; m<=gmax[a]; m++) {
+        theta = c*c1 - s*s1;
+        s = s*c1 + c*s1;
+        c = theta;
+        row = block + 2*((mlow+m)*natom + i);
+        row[0] = c;
+        row[1] = s;
+        if (a<2) {
+          row = block + 2*((mlow-m)*natom + i);
+          row[0] = c;
+          row[1] = -s;
+        }
+      }
+    }
+    block += 2*nm*natom;
+  }
+}
+
+static double* get_ewald_eikr(double *eikr, long natom, long *gmax, long axis, long g) {
+  // Returns a pointer to exp(i*g*theta_axis) of the first atom.
+  if (axis > 0) eikr += 2*natom*(2*gmax[0]+1);
+  if (axis > 1) eikr += 2*natom*(2*gmax[1]+1);
+  if (axis < 2) g += gmax[axis];
+  return eikr + 2*natom*g;
+}
+
+static void update_ewald_eikr01(double *eikr, long natom, long *gmax, long g0, long g1, double *eikr01) {
+  // Computes exp(i*(g0*theta_0 + g1*theta_1)) for all atoms.
+  long i;
+  double *e0, *e1;
+  e0 = get_ewald_eikr(eikr, natom, gmax, 0, g0);
+  e1 = get_ewald_eikr(eikr, natom, gmax, 1, g1);
+  for (i=0; i<natom; i++) {
+    eikr01[2*i] = e0[2*i]*e1[2*i] - e0[2*i+1]*e1[2*i+1];
+    eikr01[2*i+1] = e0[2*i]*e1[2*i+1] + e0[2*i+1]*e1[2*i];
+  }
+}
+
+double compute_ewald_reci_ktable(double *pos, long natom, long nlow, long nhigh,
+                          double *charges, cell_type* cell, double alpha,
+                          long *gmax, long nk, long *gindexes, double *kvecs,
+                          double *prefactors, double dielectric, double *gpos,
+                          double *work, double *eikr, double* vtens) {
+  long ik, i, g0, g1;
+  double energy, *k, ksq, cosfac, sinfac, cosfac_low, sinfac_low, cosfac_high, sinfac_high, x, c, s, fac2, dielectric_factor;
+  double *eikr01, *e2;
+  fill_ewald_eikr(pos, natom, cell, gmax, eikr);
+  eikr01 = eikr + 2*natom*(2*gmax[0] + 2*gmax[1] + gmax[2] + 3);
+  energy = 0.0;
+  fac2 = 0.25/alpha/alpha;
+  g0 = 0;
+  g1 = 0;
+  for (ik=0; ik<nk; ik++) {
+    // The k-vectors are sorted by (g0,g1), so the product of the first two
+    // factors only has to be updated occasionally.
+    if ((ik==0) || (gindexes[3*ik] != g0) || (gindexes[3*ik+1] != g1)) {
+      g0 = gindexes[3*ik];
+      g1 = gindexes[3*ik+1];
+      update_ewald_eikr01(eikr, natom, gmax, g0, g1, eikr01);
+    }
+    e2 = get_ewald_eikr(eikr, natom, gmax, 2, gindexes[3*ik+2]);
+    k = kvecs + 3*ik;
+    cosfac = 0.0; cosfac_low = 0.0; cosfac_high = 0.0;
+    sinfac = 0.0; sinfac_low = 0.0; sinfac_high = 0.0;
+    for (i=0; i<natom; i++) {
+      c = charges[i]*(eikr01[2*i]*e2[2*i] - eikr01[2*i+1]*e2[2*i+1]);
+      s = charges[i]*(eikr01[2*i]*e2[2*i+1] + eikr01[2*i+1]*e2[2*i]);
+      if (i < nlow) {
+          cosfac_low += c;
+          sinfac_low += s;
+      }
+      else if (i >= nhigh) {
+          cosfac_high += c;
+          sinfac_high += s;
+      }
+      else {
+        cosfac += c;
+        sinfac += s;
+      }
+      if (gpos != NULL) {
+        work[2*i] = c;
+        work[2*i+1] = -s;
+      }
+    }
+    c = prefactors[ik];
+    // See compute_ewald_reci for the treatment of the excluded subsystems.
+    s = cosfac*(cosfac+2.0*(cosfac_low+cosfac_high)) + sinfac*(sinfac+2.0*(sinfac_low+sinfac_high));
+    s += 2.0*(cosfac_low*cosfac_high + sinfac_low*sinfac_high);
+    energy += c*s;
+    if (gpos != NULL) {
+      x = 2.0*c;
+      cosfac *= x;
+      sinfac *= x;
+      cosfac_low *= x;
+      sinfac_low *= x;
+      cosfac_high *= x;
+      sinfac_high *= x;
+      for (i=0; i<natom; i++) {
+        x = cosfac*work[2*i+1] + sinfac*work[2*i];
+        if (i<nhigh) x += cosfac_high*work[2*i+1] + sinfac_high*work[2*i];
+        if (i>=nlow) x += cosfac_low*work[2*i+1] + sinfac_low*work[2*i];
+        gpos[3*i] += k[0]*x;
+        gpos[3*i+1] += k[1]*x;
+        gpos[3*i+2] += k[2]*x;
+      }
+    }
+    if (vtens != NULL) {
+      ksq = k[0]*k[0] + k[1]*k[1] + k[2]*k[2];
+      c *= 2.0*(1.0/ksq+fac2)*s;
+      vtens[0] += c*k[0]*k[0];
+      vtens[4] += c*k[1]*k[1];
+      vtens[8] += c*k[2]*k[2];
+      x = c*k[1]*k[0];
+      vtens[1] += x;
+      vtens[3] += x;
+      x = c*k[2]*k[0];
+      vtens[2] += x;
+      vtens[6] += x;
+      x = c*k[2]*k[1];
+      vtens[5] += x;
+      vtens[7] += x;
+    }
+  }
+  if (vtens != NULL) {
+    vtens[0] -= energy;
+    vtens[4] -= energy;
+    vtens[8] -= energy;
+  }
+  //Corrections for dielectric constant
+  dielectric_factor = 1.0/dielectric;
+  if (gpos != NULL) {
+    for (i=0; i<(3*natom); i++) {
+      gpos[i] *= dielectric_factor;
+    }
+  }
+  if (vtens != NULL) {
+    for (i=0; i<9; i++) {
+    vtens[i] *= dielectric_factor;
+    }
+  }
+  energy *= dielectric_factor;
+  return energy;
+}
+
+void compute_ewald_structurefactors_ktable(double *pos, long natom,
+                          double *charges, cell_type* cell, long *gmax, long nk,
+                          long *gindexes, long *positions, double *eikr,
+                          double *cosfacs, double* sinfacs) {
+  long ik, i, g0, g1;
+  double cosfac, sinfac, *eikr01, *e2;
+  fill_ewald_eikr(pos, natom, cell, gmax, eikr);
+  eikr01 = eikr + 2*natom*(2*gmax[0] + 2*gmax[1] + gmax[2] + 3);
+  g0 = 0;
+  g1 = 0;
+  for (ik=0; ik<nk; ik++) {
+    if ((ik==0) || (gindexes[3*ik] != g0) || (gindexes[3*ik+1] != g1)) {
+      g0 = gindexes[3*ik];
+      g1 = gindexes[3*ik+1];
+      update_ewald_eikr01(eikr, natom, gmax, g0, g1, eikr01);
+    }
+    e2 = get_ewald_eikr(eikr, natom, gmax, 2, gindexes[3*ik+2]);
+    cosfac = 0.0;
+    sinfac = 0.0;
+    for (i=0; i<natom; i++) {
+      cosfac += charges[i]*(eikr01[2*i]*e2[2*i] - eikr01[2*i+1]*e2[2*i+1]);
+      sinfac += charges[i]*(eikr01[2*i]*e2[2*i+1] + eikr01[2*i+1]*e2[2*i]);
+    }
+    cosfacs[positions[ik]] += cosfac;
+    sinfacs[positions[ik]] += sinfac;
+  }
+}
+
+double compute_ewald_move_ktable(double *pos, long natom, double *charges,
+                          cell_type* cell, long *gmax, long nk,
+                          long *gindexes, long *positions, double *prefactors,
+                          double *eikr, double *cosfacs, double *sinfacs,
+                          double *deltacosfacs, double *deltasinfacs) {
+  /*
+  Computes the change in reciprocal interaction energy when natom atoms are
+  moved from their old positions (the first natom rows of pos) to their new
+  positions (the last natom rows of pos). The cosfacs and sinfacs contain the
+  structure factors of the entire system, including the atoms at their old
+  positions. The change of the structure factors for the k-vectors in the
+  table is stored in deltacosfacs and deltasinfacs, with shape (nk,).
+  */
+  long ik, i, g0, g1;
+  double e, c, s, cosfac_old, sinfac_old, cosfac_new, sinfac_new, *eikr01, *e2;
+  fill_ewald_eikr(pos, 2*natom, cell, gmax, eikr);
+  eikr01 = eikr + 4*natom*(2*gmax[0] + 2*gmax[1] + gmax[2] + 3);
+  e = 0.0;
+  g0 = 0;
+  g1 = 0;
+  for (ik=0; ik<nk; ik++) {
+    if ((ik==0) || (gindexes[3*ik] != g0) || (gindexes[3*ik+1] != g1)) {
+      g0 = gindexes[3*ik];
+      g1 = gindexes[3*ik+1];
+      update_ewald_eikr01(eikr, 2*natom, gmax, g0, g1, eikr01);
+    }
+    e2 = get_ewald_eikr(eikr, 2*natom, gmax, 2, gindexes[3*ik+2]);
+    cosfac_old = 0.0; sinfac_old = 0.0;
+    cosfac_new = 0.0; sinfac_new = 0.0;
+    for (i=0; i<natom; i++) {
+      cosfac_old += charges[i]*(eikr01[2*i]*e2[2*i] - eikr01[2*i+1]*e2[2*i+1]);
+      sinfac_old += charges[i]*(eikr01[2*i]*e2[2*i+1] + eikr01[2*i+1]*e2[2*i]);
+    }
+    for (i=natom; i<2*natom; i++) {
+      cosfac_new += charges[i-natom]*(eikr01[2*i]*e2[2*i] - eikr01[2*i+1]*e2[2*i+1]);
+      sinfac_new += charges[i-natom]*(eikr01[2*i]*e2[2*i+1] + eikr01[2*i+1]*e2[2*i]);
+    }
+    c = cosfac_new - cosfac_old;
+    s = sinfac_new - sinfac_old;
+    deltacosfacs[ik] = c;
+    deltasinfacs[ik] = s;
+    // Interaction of the change with the structure factors of all other atoms
+    e += prefactors[ik]*((cosfacs[positions[ik]] - cosfac_old)*c +
+                         (sinfacs[positions[ik]] - sinfac_old)*s);
+  }
+  return 2.0*e;
+}
+
+void compute_ewald_potential_ktable(double *pos, long npoint, cell_type* cell,
+                          long *gmax, long nk, long *gindexes, long *positions,
+                          double *prefactors, double *eikr, double *cosfacs,
+                          double *sinfacs, double *potentials) {
+  /*
+  Adds the reciprocal interaction energy of a unit charge with the atoms
+  described by the structure factors cosfacs and sinfacs to potentials, for
+  each of the npoint positions. All positions are treated in one pass over
+  the table of k-vectors.
+  */
+  long ik, i, g0, g1;
+  double c, s, *eikr01, *e2;
+  fill_ewald_eikr(pos, npoint, cell, gmax, eikr);
+  eikr01 = eikr + 2*npoint*(2*gmax[0] + 2*gmax[1] + gmax[2] + 3);
+  g0 = 0;
+  g1 = 0;
+  for (ik=0; ik<nk; ik++) {
+    if ((ik==0) || (gindexes[3*ik] != g0) || (gindexes[3*ik+1] != g1)) {
+      g0 = gindexes[3*ik];
+      g1 = gindexes[3*ik+1];
+      update_ewald_eikr01(eikr, npoint, gmax, g0, g1, eikr01);
+    }
+    e2 = get_ewald_eikr(eikr, npoint, gmax, 2, gindexes[3*ik+2]);
+    c = 2.0*prefactors[ik]*cosfacs[positions[ik]];
+    s = 2.0*prefactors[ik]*sinfacs[positions[ik]];
+    for (i=0; i<npoint; i++) {
+      potentials[i] += c*(eikr01[2*i]*e2[2*i] - eikr01[2*i+1]*e2[2*i+1]) +
+                       s*(eikr01[2*i]*e2[2*i+1] + eikr01[2*i+1]*e2[2*i]);
+    }
+  }
+}
@@ -61,3 +61,33 @@ cdef extern from "ewald.h":
                                 double *deltasinfacs,
                                 double *sinfacs,
                                 double *prefactors, long nk)
+
+    long compute_ewald_ktable(cell.cell_type* cell, double alpha, long *gmax,
+                              double gcut, long *gindexes, double *kvecs,
+                              double *prefactors, long *positions)
+
+    double compute_ewald_reci_ktable(double *pos, long natom, long nlow, long nhigh,
+                              double *charges, cell.cell_type *unitcell,
+                              double alpha, long *gmax, long nk, long *gindexes,
+                              double *kvecs, double *prefactors,
+                              double dielectric, double *gpos, double *work,
+                              double *eikr, double* vtens)
+
+    void compute_ewald_structurefactors_ktable(double *pos, long natom,
+                              double *charges, cell.cell_type* cell, long *gmax,
+                              long nk, long *gindexes, long *positions,
+                              double *eikr, double *cosfacs, double* sinfacs)
+
+    double compute_ewald_move_ktable(double *pos, long natom, double *charges,
+                              cell.cell_type* cell, long *gmax, long nk,
+                              long *gindexes, long *positions,
+                              double *prefactors, double *eikr,
+                              double *cosfacs, double *sinfacs,
+                              double *deltacosfacs, double *deltasinfacs)
+
+    void compute_ewald_potential_ktable(double *pos, long npoint,
+                              cell.cell_type* cell, long *gmax, long nk,
+                              long *gindexes, long *positions,
+                              double *prefactors, double *eikr,
+                              double *cosfacs, double *sinfacs,
+                              double *potentials)
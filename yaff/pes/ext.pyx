@@ -34,6 +34,7 @@ from __future__ import division
 
 import numpy as np
 cimport numpy as np
+from libc.stdlib cimport malloc, free
 cimport cell
 cimport nlist
 cimport pair_pot
@@ -50,21 +51,28 @@ from yaff.log import log
 
 __all__ = [
     'Cell',
-    'neigh_dtype', 'nlist_status_init', 'nlist_build', 'nlist_status_finish',
-    'nlist_recompute', 'nlist_inc_r',
+    'neigh_dtype', 'nlist_status_init', 'nlist_build', 'nlist_build_binned',
+    'nlist_cells_insert', 'nlist_cells_remove', 'nlist_build_cells',
+    'nlist_status_finish', 'nlist_recompute', 'nlist_inc_r',
     'Hammer', 'Switch3',
-    'scaling_dtype', 'PairPot', 'PairPotLJ', 'PairPotMM3', 'PairPotMM3CAP', 'PairPotGrimme',
+    'scaling_dtype', 'pair_pot_set_nthread', 'pair_pot_get_nthread',
+    'pair_pot_compute_multi', 'pair_pot_compute_points',
+    'PairPot', 'PairPotLJ', 'PairPotMM3', 'PairPotMM3CAP', 'PairPotGrimme',
     'PairPotExpRep', 'PairPotQMDFFRep', 'PairPotLJCross', 'PairPotDampDisp',
     'PairPotDisp68BJDamp', 'PairPotEI', 'PairPotEIDip', 'PairPotEiSlater1s1sCorr',
     'PairPotEiSlater1sp1spCorr', 'PairPotOlpSlater1s1s','PairPotChargeTransferSlater1s1s',
+    'PairPotTabulated',
     'compute_ewald_reci', 'compute_ewald_reci_dd',  'compute_ewald_corr_dd',
     'compute_ewald_corr', 'compute_ewald_prefactors', 'compute_ewald_structurefactors',
+    'compute_ewald_ktable', 'compute_ewald_reci_ktable',
+    'compute_ewald_structurefactors_ktable', 'compute_ewald_move_ktable',
+    'compute_ewald_potential_ktable',
     'compute_ewald_deltae',
     'comlist_dtype', 'comlist_forward', 'comlist_back',
     'delta_dtype', 'dlist_forward', 'dlist_back',
     'iclist_dtype', 'iclist_forward', 'iclist_back',
     'vlist_dtype', 'vlist_forward', 'vlist_back',
-    'compute_grid3d',
+    'compute_grid3d', 'compute_grid3d_atoms',
 ]
 
 
@@ -439,6 +447,238 @@ def nlist_build(np.ndarray[double, ndim=2] pos, double rcut,
     )
 
 
+def nlist_build_binned(np.ndarray[double, ndim=2] pos, double rcut,
+                       np.ndarray[long, ndim=1] rmax,
+                       Cell unitcell, np.ndarray[long, ndim=1] status,
+                       np.ndarray[nlist.neigh_row_type, ndim=1] neighs,
+                       int nlow, int nhigh,
+                       np.ndarray[long, ndim=1] nbins,
+                       np.ndarray[long, ndim=1] bin_start,
+                       np.ndarray[long, ndim=1] bin_atoms,
+                       np.ndarray[long, ndim=2] atom_bins,
+                       np.ndarray[long, ndim=2] atom_shifts):
+    '''Linked-cell variant of ``nlist_build`` for 3D periodic systems
+
+       **Arguments:**
+
+       pos, rcut, rmax, unitcell, status, neighs, nlow, nhigh
+            See ``nlist_build``.
+
+       nbins
+            The number of bins along each cell vector, shape (3,).
+
+       bin_start
+            Index of the first atom of each bin in ``bin_atoms``, shape
+            (nbins.prod()+1,). The bins are stored in C order.
+
+       bin_atoms
+            The atom indexes sorted by bin, shape (natom,).
+
+       atom_bins
+            The (integer) bin coordinates of each atom, shape (natom, 3).
+
+       atom_shifts
+            The cell vectors added to each atom to bring it into the
+            bins, shape (natom, 3).
+
+       The rows in the neighbor list are exactly the same, and in the same
+       order, as with ``nlist_build``. The main difference is that
+       ``status[-1]`` is only increased when all rows of a central atom are
+       stored. When the neighs array is too small, one must call this
+       function again with ``neighs[status[-1]:]`` of a larger array.
+
+       **Returns:**
+
+       ``True`` if the neighbor list is complete. ``False`` otherwise
+    '''
+    assert pos.shape[1] == 3
+    assert pos.flags['C_CONTIGUOUS']
+    assert rcut > 0
+    assert rmax.flags['C_CONTIGUOUS']
+    assert status.shape[0] == 7
+    assert status.flags['C_CONTIGUOUS']
+    assert neighs.flags['C_CONTIGUOUS']
+    assert unitcell.nvec == 3
+    assert rmax.shape[0] == 3
+    assert nbins.shape[0] == 3
+    assert nbins.flags['C_CONTIGUOUS']
+    assert bin_start.shape[0] == nbins.prod()+1
+    assert bin_start.flags['C_CONTIGUOUS']
+    assert bin_atoms.shape[0] == pos.shape[0]
+    assert bin_atoms.flags['C_CONTIGUOUS']
+    assert atom_bins.shape[0] == pos.shape[0]
+    assert atom_bins.shape[1] == 3
+    assert atom_bins.flags['C_CONTIGUOUS']
+    assert atom_shifts.shape[0] == pos.shape[0]
+    assert atom_shifts.shape[1] == 3
+    assert atom_shifts.flags['C_CONTIGUOUS']
+    return nlist.nlist_build_binned_low(
+        <double*>pos.data, rcut, <long*>rmax.data,
+        unitcell._c_cell, <long*>status.data,
+        <nlist.neigh_row_type*>neighs.data, len(pos), nlow, nhigh, len(neighs),
+        <long*>nbins.data, <long*>bin_start.data, <long*>bin_atoms.data,
+        <long*>atom_bins.data, <long*>atom_shifts.data
+    )
+
+
+def nlist_cells_insert(np.ndarray[double, ndim=2] pos, Cell unitcell,
+                       np.ndarray[long, ndim=1] nbins,
+                       np.ndarray[long, ndim=1] bin_head,
+                       np.ndarray[long, ndim=1] atom_next,
+                       np.ndarray[long, ndim=1] atom_prev,
+                       np.ndarray[long, ndim=1] atom_ibins,
+                       np.ndarray[long, ndim=2] atom_shifts,
+                       np.ndarray[double, ndim=2] atom_wpos,
+                       long begin, long end):
+    '''Add atoms to linked cells stored as doubly linked lists
+
+       **Arguments:**
+
+       pos
+            The atomic positions, shape (natom, 3).
+
+       unitcell
+            A 3D periodic Cell instance.
+
+       nbins
+            The number of bins along each cell vector, shape (3,).
+
+       bin_head
+            The first atom in each bin or -1 for an empty bin, shape
+            (nbins.prod(),). The bins are stored in C order.
+
+       atom_next, atom_prev
+            The next and the previous atom in the same bin, or -1 at the end
+            of a list, shape (natom,).
+
+       atom_ibins
+            The bin of each atom, shape (natom,).
+
+       atom_shifts
+            The cell vectors added to each atom to bring it into the bins,
+            shape (natom, 3).
+
+       atom_wpos
+            The positions of the atoms after adding these cell vectors,
+            shape (natom, 3).
+
+       begin, end
+            The atoms begin to end-1 are added to the bins.
+    '''
+    assert pos.shape[1] == 3
+    assert pos.flags['C_CONTIGUOUS']
+    assert unitcell.nvec == 3
+    assert nbins.shape[0] == 3
+    assert nbins.flags['C_CONTIGUOUS']
+    assert bin_head.shape[0] == nbins.prod()
+    assert bin_head.flags['C_CONTIGUOUS']
+    assert 0 <= begin and begin <= end and end <= pos.shape[0]
+    assert atom_next.shape[0] >= end
+    assert atom_next.flags['C_CONTIGUOUS']
+    assert atom_prev.shape[0] == atom_next.shape[0]
+    assert atom_prev.flags['C_CONTIGUOUS']
+    assert atom_ibins.shape[0] == atom_next.shape[0]
+    assert atom_ibins.flags['C_CONTIGUOUS']
+    assert atom_shifts.shape[0] == atom_next.shape[0]
+    assert atom_shifts.shape[1] == 3
+    assert atom_shifts.flags['C_CONTIGUOUS']
+    assert atom_wpos.shape[0] == atom_next.shape[0]
+    assert atom_wpos.shape[1] == 3
+    assert atom_wpos.flags['C_CONTIGUOUS']
+    nlist.nlist_cells_insert_low(
+        <double*>pos.data, unitcell._c_cell, <long*>nbins.data,
+        <long*>bin_head.data, <long*>atom_next.data, <long*>atom_prev.data,
+        <long*>atom_ibins.data, <long*>atom_shifts.data,
+        <double*>atom_wpos.data, begin, end
+    )
+
+
+def nlist_cells_remove(np.ndarray[long, ndim=1] bin_head,
+                       np.ndarray[long, ndim=1] atom_next,
+                       np.ndarray[long, ndim=1] atom_prev,
+                       np.ndarray[long, ndim=1] atom_ibins,
+                       long begin, long end):
+    '''Remove atoms from linked cells stored as doubly linked lists
+
+       **Arguments:**
+
+       bin_head, atom_next, atom_prev, atom_ibins
+            See ``nlist_cells_insert``.
+
+       begin, end
+            The atoms begin to end-1 are removed from the bins.
+    '''
+    assert bin_head.flags['C_CONTIGUOUS']
+    assert 0 <= begin and begin <= end
+    assert atom_next.shape[0] >= end
+    assert atom_next.flags['C_CONTIGUOUS']
+    assert atom_prev.shape[0] == atom_next.shape[0]
+    assert atom_prev.flags['C_CONTIGUOUS']
+    assert atom_ibins.shape[0] == atom_next.shape[0]
+    assert atom_ibins.flags['C_CONTIGUOUS']
+    nlist.nlist_cells_remove_low(
+        <long*>bin_head.data, <long*>atom_next.data, <long*>atom_prev.data,
+        <long*>atom_ibins.data, begin, end
+    )
+
+
+def nlist_build_cells(np.ndarray[double, ndim=2] pos, double rcut,
+                      np.ndarray[long, ndim=1] rmax, Cell unitcell,
+                      np.ndarray[nlist.neigh_row_type, ndim=1] neighs,
+                      long nlow, np.ndarray[long, ndim=1] nbins,
+                      np.ndarray[long, ndim=1] bin_head,
+                      np.ndarray[long, ndim=1] atom_next,
+                      np.ndarray[long, ndim=2] atom_shifts,
+                      np.ndarray[double, ndim=2] atom_wpos):
+    '''Neighbors of the atoms nlow and higher in linked cells of other atoms
+
+       **Arguments:**
+
+       pos, rcut, rmax, unitcell, neighs, nlow
+            See ``nlist_build``.
+
+       nbins, bin_head, atom_next, atom_shifts, atom_wpos
+            The linked cells, see ``nlist_cells_insert``.
+
+       Only the atoms in the bins with an index lower than nlow are
+       considered as neighbors of the atoms nlow up to the last atom in pos,
+       which do not have to be in the bins. Atoms below nlow that are not in
+       the bins are ignored. The rows are the same as those
+       obtained with ``nlist_build`` with nlow=nhigh, except for their order.
+
+       **Returns:** the number of rows, or -1 if the neighs array is too small,
+       and the shortest distance among all rows, or rcut if there are none.
+    '''
+    cdef double dmin
+    cdef long nneigh
+    assert pos.shape[1] == 3
+    assert pos.flags['C_CONTIGUOUS']
+    assert rcut > 0
+    assert rmax.flags['C_CONTIGUOUS']
+    assert neighs.flags['C_CONTIGUOUS']
+    assert unitcell.nvec == 3
+    assert rmax.shape[0] == 3
+    assert nlow >= 0 and nlow <= pos.shape[0]
+    assert nbins.shape[0] == 3
+    assert nbins.flags['C_CONTIGUOUS']
+    assert bin_head.shape[0] == nbins.prod()
+    assert bin_head.flags['C_CONTIGUOUS']
+    assert atom_next.flags['C_CONTIGUOUS']
+    assert atom_shifts.shape[0] == atom_next.shape[0]
+    assert atom_shifts.shape[1] == 3
+    assert atom_shifts.flags['C_CONTIGUOUS']
+    assert atom_wpos.shape[0] == atom_next.shape[0]
+    assert atom_wpos.shape[1] == 3
+    assert atom_wpos.flags['C_CONTIGUOUS']
+    nneigh = nlist.nlist_build_cells_low(
+        <double*>pos.data, rcut, <long*>rmax.data, unitcell._c_cell,
+        <nlist.neigh_row_type*>neighs.data, len(pos), nlow, len(neighs),
+        <long*>nbins.data, <long*>bin_head.data, <long*>atom_next.data,
+        <long*>atom_shifts.data, <double*>atom_wpos.data, &dmin
+    )
+    return nneigh, dmin
+
+
 def nlist_status_finish(status):
     '''status
             The status array, either obtained from ``nlist_status_init``, or
@@ -687,7 +927,8 @@ cdef class PairPot:
         return corrections[0], corrections[1]
 
     def compute(self, np.ndarray[nlist.neigh_row_type, ndim=1] neighs,
-                np.ndarray[pair_pot.scaling_row_type, ndim=1] stab,
+                np.ndarray[pair_pot.scaling_row_type, ndim=1] partners,
+                np.ndarray[long, ndim=1] offsets,
                 np.ndarray[double, ndim=2] gpos,
                 np.ndarray[double, ndim=2] vtens, long nneigh):
         '''Compute the pairwise interactions
@@ -698,9 +939,10 @@ cdef class PairPot:
                 The neighbor list array. One element is of the datatype
                 nlist.neigh_row_type.
 
-           stab
-                The array with short-range scalings. Each element is of the
-                datatype pair_pot.scaling_row_type
+           partners, offsets
+                The per-atom index of short-range scalings, see the attributes
+                with the same names of the ``Scalings`` class. The elements of
+                partners are of the datatype pair_pot.scaling_row_type.
 
            gpos
                 The output array for the derivative of the energy towards the
@@ -714,20 +956,33 @@ cdef class PairPot:
                 The number of records to consider in the neighbor list.
 
            **Returns:** the energy.
+
+           When Yaff is compiled with OpenMP support, the neighbor list is
+           split into contiguous blocks, one for each thread. Each thread has
+           its own gradient and virial arrays, which are added up in a fixed
+           order. Hence, the result does not depend on the scheduling of the
+           threads. See ``pair_pot_set_nthread``. The scalings are looked up
+           for each pair separately, so the rows of the neighbor list may be
+           in any order.
         '''
         cdef double *my_gpos
         cdef double *my_vtens
+        cdef long natom
+        cdef double energy
 
         assert pair_pot.pair_pot_ready(self._c_pair_pot)
         assert neighs.flags['C_CONTIGUOUS']
-        assert stab.flags['C_CONTIGUOUS']
+        assert partners.flags['C_CONTIGUOUS']
+        assert offsets.flags['C_CONTIGUOUS']
 
         if gpos is None:
             my_gpos = NULL
+            natom = 0
         else:
             assert gpos.flags['C_CONTIGUOUS']
             assert gpos.shape[1] == 3
             my_gpos = <double*>gpos.data
+            natom = gpos.shape[0]
 
         if vtens is None:
             my_vtens = NULL
@@ -737,11 +992,225 @@ cdef class PairPot:
             assert vtens.shape[1] == 3
             my_vtens = <double*>vtens.data
 
-        return pair_pot.pair_pot_compute(
-            <nlist.neigh_row_type*>neighs.data, nneigh,
-            <pair_pot.scaling_row_type*>stab.data, len(stab),
-            self._c_pair_pot, my_gpos, my_vtens
-        )
+        # The GIL is released, such that other Python threads can continue
+        # while the (possibly multithreaded) pair potential is computed.
+        with nogil:
+            energy = pair_pot.pair_pot_compute(
+                <nlist.neigh_row_type*>neighs.data, nneigh,
+                <pair_pot.scaling_row_type*>partners.data, <long*>offsets.data,
+                self._c_pair_pot, my_gpos, my_vtens, natom
+            )
+        return energy
+
+    def _sample(self, np.ndarray[long, ndim=1] centers not None,
+                np.ndarray[long, ndim=1] others not None,
+                np.ndarray[double, ndim=1] ds not None, bint derivs=True):
+        '''Evaluate the unscaled pair potential, including truncation, for
+           the given pairs of atoms at the given distances.
+
+           **Returns:** the energies and, if derivs is True, the derivatives
+           of the energies towards the distances.
+        '''
+        cdef np.ndarray[double, ndim=1] vs
+        cdef np.ndarray[double, ndim=1] dvs
+        assert pair_pot.pair_pot_ready(self._c_pair_pot)
+        assert centers.flags['C_CONTIGUOUS']
+        assert others.flags['C_CONTIGUOUS']
+        assert ds.flags['C_CONTIGUOUS']
+        assert centers.shape[0] == ds.shape[0]
+        assert others.shape[0] == ds.shape[0]
+        vs = np.zeros(ds.shape[0], float)
+        if derivs:
+            dvs = np.zeros(ds.shape[0], float)
+            pair_pot.pair_pot_sample(
+                self._c_pair_pot, ds.shape[0], <long*>centers.data,
+                <long*>others.data, <double*>ds.data, <double*>vs.data,
+                <double*>dvs.data)
+            return vs, dvs
+        else:
+            pair_pot.pair_pot_sample(
+                self._c_pair_pot, ds.shape[0], <long*>centers.data,
+                <long*>others.data, <double*>ds.data, <double*>vs.data, NULL)
+            return vs
+
+
+def pair_pot_compute_multi(pair_pots,
+                           np.ndarray[nlist.neigh_row_type, ndim=1] neighs,
+                           partners, offsets,
+                           np.ndarray[double, ndim=2] gpos,
+                           np.ndarray[double, ndim=2] vtens, long nneigh):
+    '''Compute several pairwise interactions in one pass over the neighbor list
+
+       **Arguments:**
+
+       pair_pots
+            A list of ``PairPot`` instances.
+
+       neighs
+            The neighbor list array. One element is of the datatype
+            nlist.neigh_row_type.
+
+       partners, offsets
+            Lists with the per-atom index of short-range scalings for each
+            pair potential, see the attributes with the same names of the
+            ``Scalings`` class. When the same partners array is used for
+            several pair potentials, the scaling of a pair of atoms is looked
+            up only once.
+
+       gpos
+            The output array for the derivative of the total energy towards
+            the atomic positions. If None, these derivatives are not computed.
+
+       vtens
+            The output array for the total virial tensor. If none, it is not
+            computed.
+
+       nneigh
+            The number of records to consider in the neighbor list.
+
+       **Returns:** an array with the energy of each pair potential.
+    '''
+    cdef long npot = len(pair_pots)
+    cdef PairPot pp
+    cdef np.ndarray[pair_pot.scaling_row_type, ndim=1] my_partners
+    cdef np.ndarray[long, ndim=1] my_offsets
+    cdef np.ndarray[double, ndim=1] energies
+    cdef pair_pot.pair_pot_type** c_pair_pots
+    cdef pair_pot.scaling_row_type** c_partners
+    cdef long** c_offsets
+    cdef double *my_gpos
+    cdef double *my_vtens
+    cdef long natom
+
+    if npot > pair_pot.PAIR_POT_MAX_MULTI:
+        raise ValueError('At most %i pair potentials can be computed at once.' % pair_pot.PAIR_POT_MAX_MULTI)
+    assert len(partners) == npot
+    assert len(offsets) == npot
+    assert neighs.flags['C_CONTIGUOUS']
+
+    if gpos is None:
+        my_gpos = NULL
+        natom = 0
+    else:
+        assert gpos.flags['C_CONTIGUOUS']
+        assert gpos.shape[1] == 3
+        my_gpos = <double*>gpos.data
+        natom = gpos.shape[0]
+
+    if vtens is None:
+        my_vtens = NULL
+    else:
+        assert vtens.flags['C_CONTIGUOUS']
+        assert vtens.shape[0] == 3
+        assert vtens.shape[1] == 3
+        my_vtens = <double*>vtens.data
+
+    energies = np.zeros(npot, float)
+    c_pair_pots = <pair_pot.pair_pot_type**>malloc(npot*sizeof(pair_pot.pair_pot_type*))
+    c_partners = <pair_pot.scaling_row_type**>malloc(npot*sizeof(pair_pot.scaling_row_type*))
+    c_offsets = <long**>malloc(npot*sizeof(long*))
+    try:
+        if c_pair_pots is NULL or c_partners is NULL or c_offsets is NULL:
+            raise MemoryError()
+        for i in range(npot):
+            pp = pair_pots[i]
+            assert pair_pot.pair_pot_ready(pp._c_pair_pot)
+            c_pair_pots[i] = pp._c_pair_pot
+            my_partners = partners[i]
+            my_offsets = offsets[i]
+            assert my_partners.flags['C_CONTIGUOUS']
+            assert my_offsets.flags['C_CONTIGUOUS']
+            c_partners[i] = <pair_pot.scaling_row_type*>my_partners.data
+            c_offsets[i] = <long*>my_offsets.data
+        with nogil:
+            pair_pot.pair_pot_compute_multi(
+                <nlist.neigh_row_type*>neighs.data, nneigh, c_partners,
+                c_offsets, c_pair_pots, npot, my_gpos, my_vtens,
+                natom, <double*>energies.data
+            )
+    finally:
+        free(c_pair_pots)
+        free(c_partners)
+        free(c_offsets)
+    return energies
+
+
+def pair_pot_compute_points(pair_pots,
+                            np.ndarray[nlist.neigh_row_type, ndim=1] neighs,
+                            long nneigh, long nlow, long iatom,
+                            np.ndarray[double, ndim=1] energies):
+    '''Compute the interaction of a probe atom at several points with a host
+
+       **Arguments:**
+
+       pair_pots
+            A list of ``PairPot`` instances.
+
+       neighs
+            The neighbor list array, as built by ``nlist_build_cells``, in
+            which the points have indexes nlow, nlow+1, ...
+
+       nneigh
+            The number of records to consider in the neighbor list.
+
+       nlow
+            The number of host atoms.
+
+       iatom
+            The index of the probe atom, used to look up its parameters in the
+            pair potentials.
+
+       energies
+            Output array with shape (npoint,). The interaction energy with
+            the host is added for each point. No scalings are applied.
+    '''
+    cdef long npot = len(pair_pots)
+    cdef PairPot pp
+    cdef pair_pot.pair_pot_type** c_pair_pots
+
+    assert neighs.flags['C_CONTIGUOUS']
+    assert energies.flags['C_CONTIGUOUS']
+    assert nneigh <= neighs.shape[0]
+    if nneigh > 0:
+        assert np.maximum(neighs['a'][:nneigh], neighs['b'][:nneigh]).max() < nlow + energies.shape[0]
+
+    c_pair_pots = <pair_pot.pair_pot_type**>malloc(npot*sizeof(pair_pot.pair_pot_type*))
+    try:
+        if c_pair_pots is NULL and npot > 0:
+            raise MemoryError()
+        for i in range(npot):
+            pp = pair_pots[i]
+            assert pair_pot.pair_pot_ready(pp._c_pair_pot)
+            c_pair_pots[i] = pp._c_pair_pot
+        with nogil:
+            pair_pot.pair_pot_compute_points(
+                <nlist.neigh_row_type*>neighs.data, nneigh, c_pair_pots, npot,
+                nlow, iatom, <double*>energies.data
+            )
+    finally:
+        free(c_pair_pots)
+
+
+def pair_pot_set_nthread(long nthread):
+    '''Set the number of threads used to compute pair potentials
+
+       **Arguments:**
+
+       nthread
+            The number of threads. When zero, the default of OpenMP is used,
+            which can be set with the ``OMP_NUM_THREADS`` environment
+            variable.
+
+       This setting has no effect when Yaff is compiled without OpenMP.
+    '''
+    if nthread < 0:
+        raise ValueError('The number of threads must not be negative.')
+    pair_pot.pair_pot_set_nthread(nthread)
+
+
+def pair_pot_get_nthread():
+    '''Return the number of threads used to compute pair potentials'''
+    return pair_pot.pair_pot_get_nthread()
 
 
 cdef class PairPotLJ(PairPot):
@@ -1914,13 +2383,14 @@ cdef class PairPotEIDip(PairPot):
             self.poltens_i[3*i:3*(i+1) , 3*i:3*(i+1)] = poltens_i[3*i:3*(i+1),:]
 
     def compute(self, np.ndarray[nlist.neigh_row_type, ndim=1] neighs,
-                np.ndarray[pair_pot.scaling_row_type, ndim=1] stab,
+                np.ndarray[pair_pot.scaling_row_type, ndim=1] partners,
+                np.ndarray[long, ndim=1] offsets,
                 np.ndarray[double, ndim=2] gpos,
                 np.ndarray[double, ndim=2] vtens, long nneigh):
         #Override parents method to add dipole creation energy
         #TODO: Does this contribute to gpos or vtens?
         log("Computing PairPotEIDip energy and gradient")
-        E = PairPot.compute(self, neighs, stab, gpos, vtens, nneigh)
+        E = PairPot.compute(self, neighs, partners, offsets, gpos, vtens, nneigh)
         E += 0.5*np.dot( np.transpose(np.reshape( self._c_dipoles, (-1,) )) , np.dot( self.poltens_i, np.reshape( self._c_dipoles, (-1,) ) ) )
         return E
 
@@ -2342,6 +2812,229 @@ cdef class PairPotChargeTransferSlater1s1s(PairPot):
     width_power = property(_get_width_power)
 
 
+cdef class PairPotTabulated(PairPot):
+    r'''Cubic spline interpolation of another pair potential
+
+        The source potential, including its truncation scheme, is sampled on
+        an equidistant grid of distances between rmin and its cutoff, for each
+        pair of atom types. In between the grid points, the energy and its
+        derivative are evaluated with a cubic Hermite spline through the exact
+        energies and derivatives. Hence, the cost of a pair interaction no
+        longer depends on the complexity of the source potential. Distances
+        below rmin are not tabulated and fall back to the source potential.
+
+        The interpolation error scales as the fourth power of the grid
+        spacing. It is estimated at the midpoints of all grid intervals, see
+        the attributes ``energy_errors`` and ``deriv_errors``.
+
+        **Arguments:**
+
+        source
+            The pair potential to be tabulated, an instance of a subclass of
+            ``PairPot``. Potentials that depend on the orientation of the
+            relative vector, like ``PairPotEIDip``, are not supported.
+
+        ffatype_ids
+            An array with atom type IDs for each atom. The IDs are integer
+            indexes for the atom types that start counting from zero. shape =
+            (natom,).
+
+        **Optional arguments:**
+
+        rmin
+            The shortest tabulated distance.
+
+        npoint
+            The number of grid points per pair of atom types.
+
+        A ``ValueError`` is raised when the source potential is not the same
+        for all atoms with the same atom type, e.g. with charges derived from
+        bond charge increments.
+    '''
+    cdef PairPot _source
+    cdef readonly object name
+    cdef long _c_nffatype
+    cdef long _c_npoint
+    cdef double _c_rmin
+    cdef np.ndarray _c_ffatype_ids
+    cdef np.ndarray _c_pair_ids
+    cdef np.ndarray _c_coeffs
+    cdef np.ndarray _c_energy_errors
+    cdef np.ndarray _c_deriv_errors
+
+    def __cinit__(self, PairPot source not None,
+                  np.ndarray[long, ndim=1] ffatype_ids not None,
+                  double rmin=1.8897261339212517, long npoint=4096):
+        if isinstance(source, (PairPotEIDip, PairPotTabulated)):
+            raise ValueError('A %s potential can not be tabulated.' % source.name)
+        assert ffatype_ids.flags['C_CONTIGUOUS']
+        assert ffatype_ids.min() >= 0
+        assert pair_pot.pair_pot_ready(source._c_pair_pot)
+        rcut = source.rcut
+        if rmin <= 0.0 or rmin >= rcut:
+            raise ValueError('The argument rmin must be positive and smaller than the cutoff.')
+        if npoint < 2:
+            raise ValueError('At least two grid points are needed.')
+        self._source = source
+        self.name = source.name
+        self._c_ffatype_ids = ffatype_ids
+        self._c_nffatype = ffatype_ids.max() + 1
+        self._c_npoint = npoint
+        self._c_rmin = rmin
+        self._init_table()
+        self._check_ffatypes()
+        pair_pot.pair_pot_set_rcut(self._c_pair_pot, rcut)
+        self.set_truncation(None)
+        pair_pot.pair_data_tabulated_init(
+            self._c_pair_pot, self._c_nffatype, <long*> self._c_ffatype_ids.data,
+            <long*> self._c_pair_ids.data, npoint, rmin, self.dr,
+            <double*> self._c_coeffs.data, source._c_pair_pot
+        )
+        if not pair_pot.pair_pot_ready(self._c_pair_pot):
+            raise MemoryError()
+
+    def _get_representatives(self):
+        # The first atom of each atom type, -1 for absent atom types.
+        reps = -np.ones(self._c_nffatype, int)
+        iatoms = np.arange(len(self._c_ffatype_ids))[::-1]
+        reps[self._c_ffatype_ids[::-1]] = iatoms
+        return reps
+
+    def _init_table(self):
+        nffatype = self._c_nffatype
+        npoint = self._c_npoint
+        reps = self._get_representatives()
+        dr = self.dr
+        ds = self._c_rmin + dr*np.arange(npoint)
+        dms = ds[:-1] + 0.5*dr
+        self._c_pair_ids = -np.ones((nffatype, nffatype), int)
+        self._c_energy_errors = np.zeros((nffatype, nffatype), float)
+        self._c_deriv_errors = np.zeros((nffatype, nffatype), float)
+        samples = {}
+        rows = []
+        for i0 in range(nffatype):
+            for i1 in range(nffatype):
+                if reps[i0] < 0 or reps[i1] < 0:
+                    continue
+                centers = np.zeros(npoint, int) + reps[i0]
+                others = np.zeros(npoint, int) + reps[i1]
+                vs, dvs = self._source._sample(centers, others, ds)
+                if (vs == 0.0).all() and (dvs == 0.0).all():
+                    continue
+                # Most pair potentials are symmetric, in which case both
+                # orders of the atom types share the same table.
+                if i1 < i0 and (i1, i0) in samples:
+                    vs_swap, dvs_swap = samples.pop((i1, i0))
+                    if (vs == vs_swap).all() and (dvs == dvs_swap).all():
+                        self._c_pair_ids[i0, i1] = self._c_pair_ids[i1, i0]
+                        self._c_energy_errors[i0, i1] = self._c_energy_errors[i1, i0]
+                        self._c_deriv_errors[i0, i1] = self._c_deriv_errors[i1, i0]
+                        continue
+                elif i1 > i0:
+                    samples[i0, i1] = vs, dvs
+                # Cubic Hermite coefficients in the reduced coordinate of each
+                # interval.
+                m0 = dvs[:-1]*dr
+                m1 = dvs[1:]*dr
+                row = np.zeros((npoint-1, 4), float)
+                row[:,0] = vs[:-1]
+                row[:,1] = m0
+                row[:,2] = 3*(vs[1:] - vs[:-1]) - 2*m0 - m1
+                row[:,3] = 2*(vs[:-1] - vs[1:]) + m0 + m1
+                # Estimate the interpolation errors at the midpoints.
+                vms, dvms = self._source._sample(centers[:-1], others[:-1], dms)
+                vis = row[:,0] + 0.5*row[:,1] + 0.25*row[:,2] + 0.125*row[:,3]
+                dvis = (row[:,1] + row[:,2] + 0.75*row[:,3])/dr
+                self._c_energy_errors[i0, i1] = abs(vis - vms).max()
+                self._c_deriv_errors[i0, i1] = abs(dvis - dvms).max()
+                self._c_pair_ids[i0, i1] = len(rows)
+                rows.append(row)
+        if len(rows) == 0:
+            self._c_coeffs = np.zeros((1, npoint-1, 4), float)
+        else:
+            self._c_coeffs = np.array(rows)
+
+    def _check_ffatypes(self):
+        # The table is only valid when all atoms of one atom type interact in
+        # the same way. This is tested at a few distances for all atoms.
+        natom = len(self._c_ffatype_ids)
+        reps = self._get_representatives()
+        rcut = self._source.rcut
+        probes = self._c_rmin + (rcut - self._c_rmin)*np.array([0.0, 0.1, 0.25, 0.5, 0.8])
+        nprobe = len(probes)
+        ds = np.tile(probes, natom)
+        atoms = np.repeat(np.arange(natom), nprobe)
+        atoms_ref = reps[self._c_ffatype_ids[atoms]]
+        for i1 in range(self._c_nffatype):
+            if reps[i1] < 0:
+                continue
+            others = np.zeros(natom*nprobe, int) + reps[i1]
+            for vs, vs_ref in [
+                (self._source._sample(atoms, others, ds, False),
+                 self._source._sample(atoms_ref, others, ds, False)),
+                (self._source._sample(others, atoms, ds, False),
+                 self._source._sample(others, atoms_ref, ds, False))]:
+                if (abs(vs - vs_ref) > 1e-8*np.maximum(abs(vs), abs(vs_ref))).any():
+                    raise ValueError('The %s potential can not be tabulated per pair of atom types because atoms with the same type have different parameters.' % self.name)
+
+    def _get_dr(self):
+        '''The grid spacing'''
+        return (self._source.rcut - self._c_rmin)/(self._c_npoint - 1)
+
+    dr = property(_get_dr)
+
+    def _get_rmin(self):
+        '''The shortest tabulated distance'''
+        return self._c_rmin
+
+    rmin = property(_get_rmin)
+
+    def _get_npoint(self):
+        '''The number of grid points per pair of atom types'''
+        return self._c_npoint
+
+    npoint = property(_get_npoint)
+
+    def _get_source(self):
+        '''The tabulated pair potential'''
+        return self._source
+
+    source = property(_get_source)
+
+    def _get_energy_errors(self):
+        '''The estimated maximal error on the energy for each pair of atom types'''
+        return self._c_energy_errors.view()
+
+    energy_errors = property(_get_energy_errors)
+
+    def _get_deriv_errors(self):
+        '''The estimated maximal error on the derivative of the energy
+           towards the distance for each pair of atom types'''
+        return self._c_deriv_errors.view()
+
+    deriv_errors = property(_get_deriv_errors)
+
+    def __getattr__(self, name):
+        # Parameters of the source potential, e.g. charges, remain accessible.
+        return getattr(self._source, name)
+
+    def get_truncation(self):
+        '''Returns the truncation scheme of the source potential'''
+        return self._source.get_truncation()
+
+    def prepare_tailcorrections(self, natom, nlow=0, nhigh=-1):
+        '''Tail corrections are computed with the source potential'''
+        return self._source.prepare_tailcorrections(natom, nlow, nhigh)
+
+    def log(self):
+        '''Print suitable initialization info on screen.'''
+        if log.do_medium:
+            log('  tabulated:          %i points from %s' % (self._c_npoint, log.length(self._c_rmin)))
+            log('  max energy error:   %s' % log.energy(self._c_energy_errors.max()))
+            log('  max force error:    %s' % log.force(self._c_deriv_errors.max()))
+        self._source.log()
+
+
 
 #
 # Ewald summation stuff
@@ -2450,6 +3143,163 @@ def compute_ewald_reci(np.ndarray[double, ndim=2] pos,
                                     my_vtens)
 
 
+def compute_ewald_ktable(Cell unitcell, double alpha,
+                         np.ndarray[long, ndim=1] gmax, double gcut):
+    '''Tabulate the k-vectors and prefactors of the reciprocal interaction
+       term in the Ewald summation scheme
+
+       **Arguments:**
+
+       unitcell
+            An instance of the ``Cell`` class that describes the periodic
+            boundary conditions.
+
+       alpha
+            The :math:`\\alpha` parameter from the Ewald summation scheme.
+
+       gmax
+            The maximum range of periodic images in reciprocal space to be
+            considered for the Ewald sum. integer numpy array with shape (3,).
+
+       gcut
+            The cutoff in reciprocal space. The caller is responsible for the
+            compatibility of ``gcut`` with ``gmax``.
+
+       **Returns:** ``(gindexes, kvecs, prefactors, positions)``. The integer
+       array ``gindexes`` with shape (nk,3) contains the reciprocal lattice
+       indexes of the k-vectors in the half space within the cutoff, in the
+       same order as in ``compute_ewald_reci``. ``kvecs`` with shape (nk,3)
+       contains the corresponding Cartesian wavevectors (including the factor
+       :math:`2\\pi`), ``prefactors`` with shape (nk,) the factors
+       :math:`4\\pi\\exp(-k^2/4\\alpha^2)/(Vk^2)` and ``positions`` with shape
+       (nk,) the flat indexes in the arrays used by
+       ``compute_ewald_prefactors`` and ``compute_ewald_structurefactors``.
+    '''
+    cdef np.ndarray[long, ndim=2] gindexes
+    cdef np.ndarray[double, ndim=2] kvecs
+    cdef np.ndarray[double, ndim=1] prefactors
+    cdef np.ndarray[long, ndim=1] positions
+
+    assert unitcell.nvec == 3
+    assert alpha > 0
+    assert gmax.flags['C_CONTIGUOUS']
+    assert gmax.shape[0] == 3
+
+    nk = ewald.compute_ewald_ktable(unitcell._c_cell, alpha, <long*>gmax.data,
+                                    gcut, NULL, NULL, NULL, NULL)
+    gindexes = np.zeros((nk, 3), int)
+    kvecs = np.zeros((nk, 3), float)
+    prefactors = np.zeros(nk, float)
+    positions = np.zeros(nk, int)
+    ewald.compute_ewald_ktable(unitcell._c_cell, alpha, <long*>gmax.data, gcut,
+                               <long*>gindexes.data, <double*>kvecs.data,
+                               <double*>prefactors.data, <long*>positions.data)
+    return gindexes, kvecs, prefactors, positions
+
+
+def _check_ewald_ktable(np.ndarray[double, ndim=2] pos,
+                        np.ndarray[double, ndim=1] charges,
+                        np.ndarray[long, ndim=1] gmax,
+                        np.ndarray[long, ndim=2] gindexes,
+                        np.ndarray[double, ndim=3] eikr):
+    assert pos.flags['C_CONTIGUOUS']
+    assert pos.shape[1] == 3
+    assert charges.flags['C_CONTIGUOUS']
+    assert charges.shape[0] == pos.shape[0]
+    assert gmax.flags['C_CONTIGUOUS']
+    assert gmax.shape[0] == 3
+    assert gindexes.flags['C_CONTIGUOUS']
+    assert gindexes.shape[1] == 3
+    if gindexes.shape[0] > 0:
+        assert abs(gindexes[:,0]).max() <= gmax[0]
+        assert abs(gindexes[:,1]).max() <= gmax[1]
+        assert gindexes[:,2].min() >= 0
+        assert gindexes[:,2].max() <= gmax[2]
+    assert eikr.flags['C_CONTIGUOUS']
+    assert eikr.shape[0] == 2*gmax[0] + 2*gmax[1] + gmax[2] + 4
+    assert eikr.shape[1] == pos.shape[0]
+    assert eikr.shape[2] == 2
+
+
+def compute_ewald_reci_ktable(np.ndarray[double, ndim=2] pos,
+                              np.ndarray[double, ndim=1] charges,
+                              Cell unitcell, double alpha,
+                              np.ndarray[long, ndim=1] gmax,
+                              np.ndarray[long, ndim=2] gindexes,
+                              np.ndarray[double, ndim=2] kvecs,
+                              np.ndarray[double, ndim=1] prefactors,
+                              double dielectric,
+                              np.ndarray[double, ndim=2] gpos,
+                              np.ndarray[double, ndim=1] work,
+                              np.ndarray[double, ndim=3] eikr,
+                              np.ndarray[double, ndim=2] vtens,
+                              int nlow, int nhigh):
+    '''Compute the reciprocal interaction term in the Ewald summation scheme
+       with a table of k-vectors
+
+       The result is the same as with ``compute_ewald_reci``, but the
+       k-vectors and prefactors are taken from a table computed with
+       ``compute_ewald_ktable``, and the factors :math:`\\exp(i\\mathbf{k}
+       \\cdot\\mathbf{r})` are constructed as products of powers of
+       :math:`\\exp(2\\pi i\\mathbf{g}_j\\cdot\\mathbf{r})`, which requires
+       only three sine and cosine evaluations per atom.
+
+       **Arguments:**
+
+       pos, charges, unitcell, alpha, gmax, dielectric, gpos, work, vtens, nlow, nhigh
+            See ``compute_ewald_reci``.
+
+       gindexes, kvecs, prefactors
+            The table returned by ``compute_ewald_ktable``.
+
+       eikr
+            A work array with shape (2*gmax[0]+2*gmax[1]+gmax[2]+4, natom, 2).
+            Its contents will be overwritten.
+    '''
+    cdef double *my_gpos
+    cdef double *my_work
+    cdef double *my_vtens
+
+    _check_ewald_ktable(pos, charges, gmax, gindexes, eikr)
+    assert unitcell.nvec == 3
+    assert alpha > 0
+    assert dielectric >= 1.0
+    assert kvecs.flags['C_CONTIGUOUS']
+    assert kvecs.shape[0] == gindexes.shape[0]
+    assert kvecs.shape[1] == 3
+    assert prefactors.flags['C_CONTIGUOUS']
+    assert prefactors.shape[0] == gindexes.shape[0]
+
+    if gpos is None:
+        my_gpos = NULL
+        my_work = NULL
+    else:
+        assert gpos.flags['C_CONTIGUOUS']
+        assert gpos.shape[1] == 3
+        assert gpos.shape[0] == pos.shape[0]
+        assert work.flags['C_CONTIGUOUS']
+        assert gpos.shape[0]*2 == work.shape[0]
+        my_gpos = <double*>gpos.data
+        my_work = <double*>work.data
+
+    if vtens is None:
+        my_vtens = NULL
+    else:
+        assert vtens.flags['C_CONTIGUOUS']
+        assert vtens.shape[0] == 3
+        assert vtens.shape[1] == 3
+        my_vtens = <double*>vtens.data
+
+    return ewald.compute_ewald_reci_ktable(<double*>pos.data, len(pos), nlow,
+                                    nhigh, <double*>charges.data,
+                                    unitcell._c_cell, alpha, <long*>gmax.data,
+                                    len(gindexes), <long*>gindexes.data,
+                                    <double*>kvecs.data,
+                                    <double*>prefactors.data, dielectric,
+                                    my_gpos, my_work, <double*>eikr.data,
+                                    my_vtens)
+
+
 def compute_ewald_reci_dd(np.ndarray[double, ndim=2] pos,
                        np.ndarray[double, ndim=1] charges,
                        np.ndarray[double, ndim=2] dipoles,
@@ -2841,6 +3691,211 @@ def compute_ewald_structurefactors(np.ndarray[double, ndim=2] pos,
                  <double*>sinfacs.data)
 
 
+def compute_ewald_structurefactors_ktable(np.ndarray[double, ndim=2] pos,
+                       np.ndarray[double, ndim=1] charges,
+                       Cell unitcell,
+                       np.ndarray[long, ndim=1] gmax,
+                       np.ndarray[long, ndim=2] gindexes,
+                       np.ndarray[long, ndim=1] positions,
+                       np.ndarray[double, ndim=3] eikr,
+                       np.ndarray[double, ndim=3] cosfacs,
+                       np.ndarray[double, ndim=3] sinfacs):
+    '''Compute structure factors of the reciprocal interaction term in the Ewald
+       summation scheme with a table of k-vectors
+
+       The result is the same as with ``compute_ewald_structurefactors``, but
+       only the k-vectors in the table are visited and the factors
+       :math:`\\exp(i\\mathbf{k}\\cdot\\mathbf{r})` are constructed with
+       recurrences, as in ``compute_ewald_reci_ktable``.
+
+       **Arguments:**
+
+       pos, charges, unitcell, gmax, cosfacs, sinfacs
+            See ``compute_ewald_structurefactors``.
+
+       gindexes, positions
+            Arrays returned by ``compute_ewald_ktable``.
+
+       eikr
+            A work array with shape (2*gmax[0]+2*gmax[1]+gmax[2]+4, natom, 2).
+            Its contents will be overwritten.
+    '''
+    _check_ewald_ktable(pos, charges, gmax, gindexes, eikr)
+    assert unitcell.nvec == 3
+    assert positions.flags['C_CONTIGUOUS']
+    assert positions.shape[0] == gindexes.shape[0]
+
+    assert cosfacs.flags['C_CONTIGUOUS']
+    assert cosfacs.shape[0] == 2*gmax[0]+1
+    assert cosfacs.shape[1] == 2*gmax[1]+1
+    assert cosfacs.shape[2] == gmax[2]+1
+    assert sinfacs.flags['C_CONTIGUOUS']
+    assert sinfacs.shape[0] == 2*gmax[0]+1
+    assert sinfacs.shape[1] == 2*gmax[1]+1
+    assert sinfacs.shape[2] == gmax[2]+1
+    if positions.shape[0] > 0:
+        assert positions.max() < cosfacs.size
+
+    ewald.compute_ewald_structurefactors_ktable(<double*>pos.data, len(pos),
+                 <double*>charges.data, unitcell._c_cell, <long*>gmax.data,
+                 len(gindexes), <long*>gindexes.data, <long*>positions.data,
+                 <double*>eikr.data, <double*>cosfacs.data,
+                 <double*>sinfacs.data)
+
+
+def compute_ewald_move_ktable(np.ndarray[double, ndim=2] oldpos,
+                              np.ndarray[double, ndim=2] newpos,
+                              np.ndarray[double, ndim=1] charges,
+                              Cell unitcell,
+                              np.ndarray[long, ndim=1] gmax,
+                              np.ndarray[long, ndim=2] gindexes,
+                              np.ndarray[long, ndim=1] positions,
+                              np.ndarray[double, ndim=1] prefactors,
+                              np.ndarray[double, ndim=3] eikr,
+                              np.ndarray[double, ndim=3] cosfacs,
+                              np.ndarray[double, ndim=3] sinfacs,
+                              np.ndarray[double, ndim=1] deltacosfacs,
+                              np.ndarray[double, ndim=1] deltasinfacs):
+    '''Compute the change in reciprocal interaction energy when a set of
+       atoms is moved, with a table of k-vectors
+
+       This is equivalent to a deletion of the atoms at their old positions,
+       followed by an insertion at their new positions, but the change in
+       structure factors is computed in one pass and only for the k-vectors
+       in the table.
+
+       **Arguments:**
+
+       oldpos, newpos
+            The old and new positions of the moved atoms, numpy arrays with
+            shape (natom,3).
+
+       charges
+            The charges of the moved atoms.
+
+       unitcell, gmax
+            See ``compute_ewald_structurefactors``.
+
+       gindexes, positions, prefactors
+            Arrays returned by ``compute_ewald_ktable``.
+
+       eikr
+            A work array with shape (2*gmax[0]+2*gmax[1]+gmax[2]+4, 2*natom,
+            2). Its contents will be overwritten.
+
+       cosfacs, sinfacs
+            The structure factors of the entire system, including the moved
+            atoms at their old positions. These are not modified.
+
+       deltacosfacs, deltasinfacs
+            Output arrays with shape (nk,) for the change in structure
+            factors for each k-vector in the table.
+
+       **Returns:** the energy difference, without the dielectric constant.
+    '''
+    cdef np.ndarray[double, ndim=2] pos
+    assert oldpos.shape[1] == 3
+    assert newpos.shape[0] == oldpos.shape[0]
+    assert newpos.shape[1] == 3
+    assert charges.flags['C_CONTIGUOUS']
+    assert charges.shape[0] == oldpos.shape[0]
+    pos = np.concatenate([oldpos, newpos])
+    _check_ewald_ktable(pos, np.concatenate([charges, charges]), gmax,
+                        gindexes, eikr)
+    assert unitcell.nvec == 3
+    assert positions.flags['C_CONTIGUOUS']
+    assert positions.shape[0] == gindexes.shape[0]
+    assert prefactors.flags['C_CONTIGUOUS']
+    assert prefactors.shape[0] == gindexes.shape[0]
+    assert deltacosfacs.flags['C_CONTIGUOUS']
+    assert deltacosfacs.shape[0] == gindexes.shape[0]
+    assert deltasinfacs.flags['C_CONTIGUOUS']
+    assert deltasinfacs.shape[0] == gindexes.shape[0]
+
+    assert cosfacs.flags['C_CONTIGUOUS']
+    assert cosfacs.shape[0] == 2*gmax[0]+1
+    assert cosfacs.shape[1] == 2*gmax[1]+1
+    assert cosfacs.shape[2] == gmax[2]+1
+    assert sinfacs.flags['C_CONTIGUOUS']
+    assert sinfacs.shape[0] == 2*gmax[0]+1
+    assert sinfacs.shape[1] == 2*gmax[1]+1
+    assert sinfacs.shape[2] == gmax[2]+1
+    if positions.shape[0] > 0:
+        assert positions.max() < cosfacs.size
+
+    return ewald.compute_ewald_move_ktable(<double*>pos.data, len(oldpos),
+                 <double*>charges.data, unitcell._c_cell, <long*>gmax.data,
+                 len(gindexes), <long*>gindexes.data, <long*>positions.data,
+                 <double*>prefactors.data, <double*>eikr.data,
+                 <double*>cosfacs.data, <double*>sinfacs.data,
+                 <double*>deltacosfacs.data, <double*>deltasinfacs.data)
+
+
+def compute_ewald_potential_ktable(np.ndarray[double, ndim=2] pos,
+                              Cell unitcell,
+                              np.ndarray[long, ndim=1] gmax,
+                              np.ndarray[long, ndim=2] gindexes,
+                              np.ndarray[long, ndim=1] positions,
+                              np.ndarray[double, ndim=1] prefactors,
+                              np.ndarray[double, ndim=3] eikr,
+                              np.ndarray[double, ndim=3] cosfacs,
+                              np.ndarray[double, ndim=3] sinfacs,
+                              np.ndarray[double, ndim=1] potentials):
+    '''Compute the reciprocal Ewald potential of a set of atoms at many
+       points, with a table of k-vectors
+
+       The potential at a point is the energy needed to insert a unit charge
+       at that point, as in ``compute_ewald_deltae``. All points are treated
+       in a single pass over the table of k-vectors.
+
+       **Arguments:**
+
+       pos
+            The points, a numpy array with shape (npoint,3).
+
+       unitcell, gmax
+            See ``compute_ewald_structurefactors``.
+
+       gindexes, positions, prefactors
+            Arrays returned by ``compute_ewald_ktable``.
+
+       eikr
+            A work array with shape (2*gmax[0]+2*gmax[1]+gmax[2]+4, npoint,
+            2). Its contents will be overwritten.
+
+       cosfacs, sinfacs
+            The structure factors of the atoms that generate the potential.
+
+       potentials
+            Output array with shape (npoint,). The potentials are added to
+            this array, without the dielectric constant.
+    '''
+    _check_ewald_ktable(pos, potentials, gmax, gindexes, eikr)
+    assert unitcell.nvec == 3
+    assert positions.flags['C_CONTIGUOUS']
+    assert positions.shape[0] == gindexes.shape[0]
+    assert prefactors.flags['C_CONTIGUOUS']
+    assert prefactors.shape[0] == gindexes.shape[0]
+
+    assert cosfacs.flags['C_CONTIGUOUS']
+    assert cosfacs.shape[0] == 2*gmax[0]+1
+    assert cosfacs.shape[1] == 2*gmax[1]+1
+    assert cosfacs.shape[2] == gmax[2]+1
+    assert sinfacs.flags['C_CONTIGUOUS']
+    assert sinfacs.shape[0] == 2*gmax[0]+1
+    assert sinfacs.shape[1] == 2*gmax[1]+1
+    assert sinfacs.shape[2] == gmax[2]+1
+    if positions.shape[0] > 0:
+        assert positions.max() < cosfacs.size
+
+    ewald.compute_ewald_potential_ktable(<double*>pos.data, len(pos),
+                 unitcell._c_cell, <long*>gmax.data, len(gindexes),
+                 <long*>gindexes.data, <long*>positions.data,
+                 <double*>prefactors.data, <double*>eikr.data,
+                 <double*>cosfacs.data, <double*>sinfacs.data,
+                 <double*>potentials.data)
+
+
 def compute_ewald_deltae(np.ndarray[double, ndim=3] prefactors,
                          np.ndarray[double, ndim=3] deltacosfacs,
                          np.ndarray[double, ndim=3] cosfacs,
@@ -3183,3 +4238,76 @@ def compute_grid3d(double[::1] center not None,
     cdef size_t shape[3]
     shape[:] = egrid.shape
     return grid.compute_grid3d(&center[0], unitcell._c_cell, &egrid[0, 0, 0], &shape[0])
+
+
+def compute_grid3d_atoms(np.ndarray[double, ndim=2] pos,
+                         np.ndarray[long, ndim=1] iatoms,
+                         Cell unitcell,
+                         double[:,:,::1] egrid not None,
+                         bint cubic,
+                         np.ndarray[double, ndim=2] gpos,
+                         np.ndarray[double, ndim=1] energies=None):
+    '''Interpolate an energy grid at the positions of a selection of atoms
+
+       **Arguments:**
+
+       pos
+            The atomic positions. numpy array with shape (natom,3).
+
+       iatoms
+            The indexes of the atoms for which the grid is interpolated.
+
+       unitcell
+            An instance of the ``Cell`` class with three cell vectors. The
+            grid points are equidistant in fractional coordinates, the point
+            with indexes (i0,i1,i2) corresponds to the fractional coordinates
+            (i0/n0,i1/n1,i2/n2), where (n0,n1,n2) is the shape of the grid.
+
+       egrid
+            A periodic grid with energies.
+
+       cubic
+            When True, a tricubic (Catmull-Rom) interpolation is used, which
+            has continuous derivatives. Otherwise, a trilinear interpolation
+            is used.
+
+       gpos
+            If not set to None, the Cartesian gradient of the interpolated
+            energy is ADDED to this array. numpy array with shape (natom,3).
+
+       **Optional arguments:**
+
+       energies
+            If given, the interpolated energy of each selected atom is stored
+            in this array. numpy array with shape (len(iatoms),).
+
+       **Returns:** the sum of the interpolated energies.
+    '''
+    cdef size_t shape[3]
+    cdef double *my_gpos
+    cdef double *my_energies
+    assert pos.flags['C_CONTIGUOUS']
+    assert pos.shape[1] == 3
+    assert iatoms.flags['C_CONTIGUOUS']
+    if iatoms.shape[0] > 0:
+        assert iatoms.min() >= 0
+        assert iatoms.max() < pos.shape[0]
+    assert unitcell.nvec == 3
+    shape[:] = egrid.shape
+    if gpos is None:
+        my_gpos = NULL
+    else:
+        assert gpos.flags['C_CONTIGUOUS']
+        assert gpos.shape[0] == pos.shape[0]
+        assert gpos.shape[1] == 3
+        my_gpos = <double*>gpos.data
+    if energies is None:
+        my_energies = NULL
+    else:
+        assert energies.flags['C_CONTIGUOUS']
+        assert energies.shape[0] == iatoms.shape[0]
+        my_energies = <double*>energies.data
+    return grid.compute_grid3d_atoms(<double*>pos.data, <long*>iatoms.data,
+                                     len(iatoms), unitcell._c_cell,
+                                     &egrid[0, 0, 0], &shape[0], cubic, my_gpos,
+                                     my_energies)
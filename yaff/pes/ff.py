@@ -45,8 +45,11 @@ import numpy as np
 from yaff.log import log, timer
 from yaff.pes.ext import compute_ewald_reci, compute_ewald_reci_dd, \
     compute_ewald_corr, compute_ewald_corr_dd, compute_ewald_prefactors, \
-    compute_ewald_structurefactors, compute_ewald_deltae, PairPotEI, \
-    PairPotLJ, PairPotMM3, PairPotMM3CAP, PairPotGrimme, compute_grid3d
+    compute_ewald_structurefactors, compute_ewald_deltae, compute_ewald_ktable, \
+    compute_ewald_reci_ktable, compute_ewald_structurefactors_ktable, \
+    compute_ewald_move_ktable, compute_ewald_potential_ktable, PairPotEI, \
+    PairPotLJ, PairPotMM3, PairPotMM3CAP, PairPotGrimme, compute_grid3d_atoms, \
+    pair_pot_compute_multi
 from yaff.pes.dlist import DeltaList
 from yaff.pes.iclist import InternalCoordinateList
 from yaff.pes.vlist import ValenceList, ValenceTerm
@@ -54,8 +57,9 @@ from yaff.pes.bias import BiasPotential
 
 
 __all__ = [
-    'ForcePart', 'ForceField', 'ForcePartPair', 'ForcePartEwaldReciprocal',
-    'ForcePartEwaldReciprocalDD', 'ForcePartEwaldCorrectionDD',
+    'ForcePart', 'ForceField', 'ForcePartPair', 'ForcePartPairMulti',
+    'ForcePartEwaldReciprocal',
+    'ForcePartEwaldReciprocalPME', 'ForcePartEwaldReciprocalDD', 'ForcePartEwaldCorrectionDD',
     'ForcePartEwaldCorrection', 'ForcePartEwaldNeutralizing',
     'ForcePartValence', 'ForcePartBias', 'ForcePartPressure', 'ForcePartGrid',
     'ForcePartTailCorrection', 'ForcePartEwaldReciprocalInteraction',
@@ -66,6 +70,10 @@ class ForcePart(object):
     '''Base class for anything that can compute energies (and optionally gradient
        and virial) for a ``System`` object.
     '''
+    # Whether the cached gpos and vtens arrays may contain results of a
+    # previous call to compute.
+    _derivs_valid = True
+
     def __init__(self, name, system):
         """
            **Arguments:**
@@ -91,8 +99,12 @@ class ForcePart(object):
            become invalid.
         """
         self.energy = np.nan
-        self.gpos[:] = np.nan
-        self.vtens[:] = np.nan
+        # Energy-only evaluations never fill in the cached gpos and vtens, so
+        # there is no need to overwrite them again after every update.
+        if self._derivs_valid:
+            self.gpos[:] = np.nan
+            self.vtens[:] = np.nan
+            self._derivs_valid = False
 
     def update_rvecs(self, rvecs):
         '''Let the ``ForcePart`` object know that the cell vectors have changed.
@@ -143,7 +155,11 @@ class ForcePart(object):
            The energy is returned. The optional arguments are Fortran-style
            output arguments. When they are present, the corresponding results
            are computed and **added** to the current contents of the array.
+           When both are absent, this is equivalent to ``compute_energy``.
         """
+        if gpos is None and vtens is None:
+            return self.compute_energy()
+        self._derivs_valid = True
         if gpos is None:
             my_gpos = None
         else:
@@ -167,8 +183,29 @@ class ForcePart(object):
             vtens += my_vtens
         return self.energy
 
+    def compute_energy(self):
+        """Compute only the energy for this FF (part)
+
+           No gradient or virial tensor is computed: all parts pass ``None``
+           for both down to the low-level routines, which then skip the
+           corresponding work. The cached ``gpos`` and ``vtens`` arrays are
+           not touched. This is the preferred way to evaluate energies when
+           no forces are needed, e.g. in Monte Carlo simulations or when
+           recomputing energies along a trajectory.
+
+           The energy is returned.
+        """
+        self.energy = self._internal_compute(None, None)
+        if np.isnan(self.energy):
+            raise ValueError('The energy is not-a-number (nan).')
+        return self.energy
+
     def _internal_compute(self, gpos, vtens):
-        '''Subclasses implement their compute code here.'''
+        '''Subclasses implement their compute code here.
+
+           When gpos and vtens are both None, only the energy is needed and no
+           work related to derivatives should be done.
+        '''
         raise NotImplementedError
 
 
@@ -208,12 +245,32 @@ class ForceField(ForcePart):
 
     def add_part(self, part):
         self.parts.append(part)
+        self._add_part_attribute(part)
+        # The pair parts in a ForcePartPairMulti remain accessible.
+        if isinstance(part, ForcePartPairMulti):
+            for part_pair in part.parts:
+                self._add_part_attribute(part_pair)
+
+    def _add_part_attribute(self, part):
         # Make the parts also accessible as simple attributes.
         name = 'part_%s' % part.name
         if name in self.__dict__:
             raise ValueError('The part %s occurs twice in the force field.' % name)
         self.__dict__[name] = part
 
+    def iter_contribs(self):
+        '''Iterate over all parts that contribute to the energy
+
+           This is the same as iterating over ``parts``, except that every
+           ``ForcePartPairMulti`` is replaced by the pair parts it computes.
+        '''
+        for part in self.parts:
+            if isinstance(part, ForcePartPairMulti):
+                for part_pair in part.parts:
+                    yield part_pair
+            else:
+                yield part
+
     @classmethod
     def generate(cls, system, parameters, **kwargs):
         """Create a force field for the given system with the given parameters.
@@ -277,11 +334,11 @@ class ForcePartPair(ForcePart):
     '''A pairwise (short-range) non-bonding interaction term.
 
        This part can be used for the short-range electrostatics, Van der Waals
-       terms, etc. Currently, one has to use multiple ``ForcePartPair``
-       objects in a ``ForceField`` in order to combine different types of pairwise
-       energy terms, e.g. to combine an electrostatic term with a Van der
-       Waals term. (This may be changed in future to improve the computational
-       efficiency.)
+       terms, etc. One has to use multiple ``ForcePartPair`` objects in a
+       ``ForceField`` in order to combine different types of pairwise energy
+       terms, e.g. to combine an electrostatic term with a Van der Waals term.
+       These can be computed together in a single pass over the neighbor list
+       with ``ForcePartPairMulti``.
     '''
     def __init__(self, system, nlist, scalings, pair_pot):
         '''
@@ -325,7 +382,80 @@ class ForcePartPair(ForcePart):
 
     def _internal_compute(self, gpos, vtens):
         with timer.section('PP %s' % self.pair_pot.name):
-            return self.pair_pot.compute(self.nlist.neighs, self.scalings.stab, gpos, vtens, self.nlist.nneigh)
+            return self.pair_pot.compute(self.nlist.neighs, self.scalings.partners, self.scalings.offsets, gpos, vtens, self.nlist.nneigh)
+
+
+class ForcePartPairMulti(ForcePart):
+    '''Several pairwise interactions computed in one pass over the neighbor list
+
+       Each pair part in a ``ForceField`` loops over the entire neighbor list
+       and looks up the scaling of every pair of atoms. This part computes
+       the interactions of several ``ForcePartPair`` objects in one loop
+       instead. The scalings are looked up only once for all pair parts with
+       the same scaling table.
+
+       The energy of each pair part is still available in its ``energy``
+       attribute after every call to ``compute``. The gradient and the virial
+       tensor are only computed for all pair parts together.
+    '''
+    def __init__(self, system, nlist, parts, name='pair_multi'):
+        '''
+           **Arguments:**
+
+           system
+                The system to which the pairwise interactions apply.
+
+           nlist
+                A ``NeighborList`` object. This has to be the same as the one
+                passed to the ForceField object that contains this part and the
+                one used by all pair parts.
+
+           parts
+                A list of ``ForcePartPair`` objects.
+
+           **Optional arguments:**
+
+           name
+                The name of this part.
+        '''
+        ForcePart.__init__(self, name, system)
+        for part in parts:
+            if not isinstance(part, ForcePartPair):
+                raise TypeError('Only ForcePartPair objects can be combined.')
+            if part.nlist is not nlist:
+                raise ValueError('All pair parts must use the same neighbor list.')
+        self.nlist = nlist
+        self.parts = list(parts)
+        # Pair parts with identical scalings share the same scaling index, such
+        # that each scaling is looked up only once.
+        self.scalings = []
+        for part in self.parts:
+            scalings = part.scalings
+            for other in self.scalings:
+                if np.array_equal(scalings.partners, other.partners):
+                    scalings = other
+                    break
+            self.scalings.append(scalings)
+        if log.do_medium:
+            with log.section('FPINIT'):
+                log('Force part: %s' % self.name)
+                log.hline()
+                log('  pair parts:        %s' % (', '.join(part.name for part in self.parts)))
+                log('  scaling tables:    %i' % len(set(id(scalings) for scalings in self.scalings)))
+                log.hline()
+
+    def _internal_compute(self, gpos, vtens):
+        with timer.section('PP multi'):
+            energies = pair_pot_compute_multi(
+                [part.pair_pot for part in self.parts], self.nlist.neighs,
+                [scalings.partners for scalings in self.scalings],
+                [scalings.offsets for scalings in self.scalings],
+                gpos, vtens, self.nlist.nneigh
+            )
+        for part, energy in zip(self.parts, energies):
+            part.clear()
+            part.energy = energy
+        return energies.sum()
 
 
 class ForcePartEwaldReciprocal(ForcePart):
@@ -387,6 +517,14 @@ class ForcePartEwaldReciprocal(ForcePart):
         if log.do_debug:
             with log.section('EWALD'):
                 log('gmax a,b,c   = %i,%i,%i' % tuple(self.gmax))
+        self.update_ktable()
+
+    def update_ktable(self):
+        '''Tabulate the k-vectors and prefactors for the current cell and gmax'''
+        self.gindexes, self.kvecs, self.prefactors = compute_ewald_ktable(
+            self.system.cell, self.alpha, self.gmax, self.gcut)[:3]
+        self.eikr = np.zeros((2*self.gmax[:2].sum() + self.gmax[2] + 4, self.system.natom, 2))
+        self.rvecs0 = self.system.cell.rvecs.copy()
 
     def update_rvecs(self, rvecs):
         '''See :meth:`yaff.pes.ff.ForcePart.update_rvecs`'''
@@ -395,10 +533,302 @@ class ForcePartEwaldReciprocal(ForcePart):
 
     def _internal_compute(self, gpos, vtens):
         with timer.section('Ewald reci.'):
-            return compute_ewald_reci(
+            # The k-vectors depend on the cell. When the cell was changed
+            # without a call to update_rvecs, the table is refreshed with
+            # the same gmax.
+            if not (self.system.cell.rvecs == self.rvecs0).all():
+                self.update_ktable()
+            return compute_ewald_reci_ktable(
                 self.system.pos, self.system.charges, self.system.cell, self.alpha,
-                self.gmax, self.gcut, self.dielectric, gpos, self.work, vtens, self.nlow, self.nhigh
+                self.gmax, self.gindexes, self.kvecs, self.prefactors,
+                self.dielectric, gpos, self.work, self.eikr, vtens, self.nlow, self.nhigh
+            )
+
+
+class ForcePartEwaldReciprocalPME(ForcePart):
+    '''The long-range contribution to the electrostatic interaction in 3D
+       periodic systems, computed with the smooth particle-mesh Ewald method.
+
+       The charges are spread on a regular grid with cardinal B-splines and the
+       reciprocal-space sum is carried out with a fast Fourier transform. [1]_
+       The cost scales as O(N log N) instead of the O(N G) of
+       ``ForcePartEwaldReciprocal``. The result converges to the one of
+       ``ForcePartEwaldReciprocal`` when the spline order and the grid size
+       are increased.
+
+       .. [1] U. Essmann et al., J. Chem. Phys. 103, 8577 (1995).
+    '''
+    def __init__(self, system, alpha, gcut=0.35, dielectric=1.0, nlow=0,
+                 nhigh=-1, order=6, oversampling=2.0, ngrids=None):
+        '''
+           **Arguments:**
+
+           system
+                The system to which this interaction applies.
+
+           alpha
+                The alpha parameter in the Ewald summation method.
+
+           **Optional arguments:**
+
+           gcut
+                The cutoff in reciprocal space. It is used to determine the
+                size of the charge grid, unless ngrids is given.
+
+           dielectric
+                The scalar relative permittivity of the system.
+
+           nlow
+                Atom pairs are only included if at least one atom index is
+                higher than or equal to nlow. The default nlow=0 means no
+                exclusion.
+
+           nhigh
+                Atom pairs are only included if at least one atom index is
+                smaller than nhigh. The default nhigh=-1 means no exclusion.
+
+           order
+                The order of the cardinal B-splines used to spread the
+                charges on the grid. Higher orders are more accurate and more
+                expensive.
+
+           oversampling
+                The number of grid points along each cell vector is at least
+                oversampling times the number of reciprocal lattice points
+                within gcut along that direction. Together with order, this
+                controls the deviation from ``ForcePartEwaldReciprocal``.
+
+           ngrids
+                An array with three integers, the number of grid points along
+                each cell vector. When given, gcut and oversampling are
+                ignored and the grid is kept fixed when the cell changes.
+        '''
+        ForcePart.__init__(self, 'ewald_reci', system)
+        if not system.cell.nvec == 3:
+            raise TypeError('The system must have a 3D periodic cell.')
+        if system.charges is None:
+            raise ValueError('The system does not have charges.')
+        if order < 3:
+            raise ValueError('The spline order must be at least 3.')
+        self.system = system
+        self.alpha = alpha
+        self.gcut = gcut
+        self.dielectric = dielectric
+        self.order = order
+        self.oversampling = oversampling
+        if ngrids is None:
+            self.fixed_ngrids = False
+        else:
+            ngrids = np.array(ngrids, dtype=int)
+            if ngrids.shape != (3,) or (ngrids < order).any():
+                raise ValueError('ngrids must contain three integers, not smaller than order.')
+            self.fixed_ngrids = True
+            self.ngrids = ngrids
+        self.nlow, self.nhigh = check_nlow_nhigh(system, nlow, nhigh)
+        self.update_grid()
+        if log.do_medium:
+            with log.section('FPINIT'):
+                log('Force part: %s' % self.name)
+                log.hline()
+                log('  alpha:                 %s' % log.invlength(self.alpha))
+                log('  gcut:                  %s' % log.invlength(self.gcut))
+                log('  relative permittivity: %5.3f' % self.dielectric)
+                log('  spline order:          %i' % self.order)
+                log('  grid a,b,c:            %i,%i,%i' % tuple(self.ngrids))
+                log.hline()
+
+    def update_grid(self):
+        '''Determine the grid size and precompute all grid prefactors.
+
+           This routine must be called after the attributes gcut, alpha,
+           dielectric, order or oversampling are modified.
+        '''
+        cell = self.system.cell
+        if not self.fixed_ngrids:
+            lengths = np.sqrt((cell.rvecs**2).sum(axis=1))
+            gmax = np.ceil(self.gcut*lengths - 0.5).astype(int)
+            nmin = np.ceil(self.oversampling*(2*gmax + 1)).astype(int)
+            self.ngrids = np.array([_fft_size(max(n, self.order)) for n in nmin])
+        n0, n1, n2 = self.ngrids
+        # Integer Miller indices of the grid points in the layout of rfftn.
+        m0 = np.fft.fftfreq(n0, 1.0/n0)[:,None,None]
+        m1 = np.fft.fftfreq(n1, 1.0/n1)[None,:,None]
+        m2 = np.arange(n2//2+1, dtype=float)[None,None,:]
+        # Cartesian reciprocal vectors, without the factor 2*pi.
+        gvecs = cell.gvecs
+        self.kvecs = [
+            m0*gvecs[0,i] + m1*gvecs[1,i] + m2*gvecs[2,i]
+            for i in range(3)
+        ]
+        k2 = self.kvecs[0]**2 + self.kvecs[1]**2 + self.kvecs[2]**2
+        k2[0,0,0] = 1.0
+        # Influence function, including the B-spline moduli. Terms that are
+        # only present once in the half-complex rfftn output get weight one.
+        fac = np.pi**2/self.alpha**2
+        prefac = np.exp(-fac*k2)/k2/(np.pi*cell.volume*self.dielectric)
+        prefac[0,0,0] = 0.0
+        prefac *= _bspline_moduli(self.order, n0)[:,None,None]
+        prefac *= _bspline_moduli(self.order, n1)[None,:,None]
+        prefac *= _bspline_moduli(self.order, n2)[None,None,:n2//2+1]
+        weights = np.full(n2//2+1, 2.0)
+        weights[0] = 1.0
+        if n2 % 2 == 0:
+            weights[-1] = 1.0
+        self.prefac = prefac
+        self.weights = weights
+        self.rvecs = cell.rvecs.copy()
+        # Factor needed for the virial: 2*(1/k^2 + pi^2/alpha^2).
+        self.vfac = 2*(1/k2 + fac)
+        if log.do_debug:
+            with log.section('EWALD'):
+                log('ngrid a,b,c  = %i,%i,%i' % tuple(self.ngrids))
+
+    def update_rvecs(self, rvecs):
+        '''See :meth:`yaff.pes.ff.ForcePart.update_rvecs`'''
+        ForcePart.update_rvecs(self, rvecs)
+        self.update_grid()
+
+    def _compute_splines(self, derivs=True):
+        '''Compute the B-spline weights of all atoms along the three axes.
+
+           **Optional arguments:**
+
+           derivs
+                When False, the derivatives of the weights are not computed
+                and dtheta is None.
+
+           **Returns:** ``(indexes, theta, dtheta)``. The array indexes
+           (natom, 3, order) contains the grid indexes, theta (same shape) the
+           corresponding spline weights and dtheta their derivatives towards
+           the scaled fractional coordinate.
+        '''
+        order = self.order
+        frac = np.dot(self.system.pos, self.system.cell.gvecs.T)
+        u = (frac - np.floor(frac))*self.ngrids
+        base = np.floor(u)
+        w = u - base
+        # theta[:,:,j] = M_order(w + j), multiplies grid point base - j.
+        j = np.arange(order)
+        x = w[:,:,None] + j
+        theta = np.zeros(w.shape + (order,))
+        theta[:,:,0] = 1.0
+        dtheta = None
+        for p in range(2, order+1):
+            shifted = np.zeros(theta.shape)
+            shifted[:,:,1:] = theta[:,:,:-1]
+            if p == order and derivs:
+                dtheta = theta - shifted
+            theta = (x*theta + (p - x)*shifted)/(p - 1)
+        indexes = (base.astype(int)[:,:,None] - j) % self.ngrids[:,None]
+        return indexes, theta, dtheta
+
+    def _iter_blocks(self, begin, end, size=1024):
+        for start in range(begin, end, size):
+            yield start, min(start + size, end)
+
+    def _spread(self, splines, begin, end):
+        '''Spread the charges of atoms begin:end on the grid.'''
+        indexes, theta, dtheta = splines
+        n0, n1, n2 = self.ngrids
+        charges = self.system.charges
+        result = np.zeros(n0*n1*n2)
+        for start, stop in self._iter_blocks(begin, end):
+            i, t = indexes[start:stop], theta[start:stop]
+            flat = (
+                (i[:,0,:,None,None]*n1 + i[:,1,None,:,None])*n2 + i[:,2,None,None,:]
+            )
+            values = (
+                charges[start:stop,None,None,None]*t[:,0,:,None,None]*
+                t[:,1,None,:,None]*t[:,2,None,None,:]
             )
+            result += np.bincount(flat.ravel(), values.ravel(), n0*n1*n2)
+        return result.reshape(self.ngrids)
+
+    def _gather(self, splines, potential, begin, end, gpos, sign):
+        '''Add the gradient of atoms begin:end to gpos, given the potential on the grid.'''
+        indexes, theta, dtheta = splines
+        n0, n1, n2 = self.ngrids
+        charges = self.system.charges
+        # Derivatives of the scaled fractional coordinates towards Cartesian ones.
+        dudr = self.system.cell.gvecs*self.ngrids[:,None]
+        for start, stop in self._iter_blocks(begin, end):
+            i, t, dt = indexes[start:stop], theta[start:stop], dtheta[start:stop]
+            pot = potential[i[:,0,:,None,None], i[:,1,None,:,None], i[:,2,None,None,:]]
+            du = np.array([
+                np.einsum('ia,ib,ic,iabc->i', dt[:,0], t[:,1], t[:,2], pot),
+                np.einsum('ia,ib,ic,iabc->i', t[:,0], dt[:,1], t[:,2], pot),
+                np.einsum('ia,ib,ic,iabc->i', t[:,0], t[:,1], dt[:,2], pot),
+            ]).T
+            gpos[start:stop] += sign*charges[start:stop,None]*np.dot(du, dudr)
+
+    def _compute_mesh(self, splines, begin, end, sign, gpos, vtens):
+        '''Compute the reciprocal energy of atoms begin:end, multiplied by sign.'''
+        fcharges = np.fft.rfftn(self._spread(splines, begin, end))
+        conv = self.prefac*fcharges
+        terms = 0.5*self.weights*(conv*fcharges.conj()).real
+        energy = terms.sum()
+        if gpos is not None:
+            potential = np.fft.irfftn(conv, s=self.ngrids)*self.ngrids.prod()
+            self._gather(splines, potential, begin, end, gpos, sign)
+        if vtens is not None:
+            terms = terms*self.vfac
+            for i in range(3):
+                for j in range(i+1):
+                    value = (terms*self.kvecs[i]*self.kvecs[j]).sum()
+                    vtens[i,j] += sign*value
+                    if i != j:
+                        vtens[j,i] += sign*value
+                vtens[i,i] -= sign*energy
+        return sign*energy
+
+    def _internal_compute(self, gpos, vtens):
+        with timer.section('Ewald reci. PME'):
+            if (self.rvecs != self.system.cell.rvecs).any():
+                self.update_grid()
+            splines = self._compute_splines(gpos is not None)
+            natom = self.system.natom
+            energy = self._compute_mesh(splines, 0, natom, 1.0, gpos, vtens)
+            # Remove the interactions within the excluded subsystems.
+            if self.nlow > 0:
+                energy += self._compute_mesh(splines, 0, self.nlow, -1.0, gpos, vtens)
+            if self.nhigh < natom:
+                energy += self._compute_mesh(splines, self.nhigh, natom, -1.0, gpos, vtens)
+            return energy
+
+
+def _fft_size(n):
+    '''Return the smallest integer not smaller than n with only factors 2, 3 and 5.'''
+    while True:
+        m = n
+        for factor in 2, 3, 5:
+            while m % factor == 0:
+                m //= factor
+        if m == 1:
+            return n
+        n += 1
+
+
+def _bspline_moduli(order, ngrid):
+    '''Return the inverse squared moduli of the B-spline Fourier coefficients.
+
+       These factors correct for the smoothing of the charge distribution by
+       the cardinal B-splines of the given order on a grid with ngrid points.
+    '''
+    # Values of the cardinal B-spline at the integers 0, ..., order-1.
+    values = np.zeros(order)
+    values[1] = 1.0
+    for p in range(3, order+1):
+        x = np.arange(order, dtype=float)
+        shifted = np.zeros(order)
+        shifted[1:] = values[:-1]
+        values = (x*values + (p - x)*shifted)/(p - 1)
+    phases = np.exp(2j*np.pi*np.outer(np.arange(ngrid), np.arange(order))/ngrid)
+    moduli = abs(np.dot(phases, values))**2
+    # For odd orders, the modulus vanishes at the Nyquist frequency.
+    result = np.zeros(ngrid)
+    mask = moduli > 1e-10
+    result[mask] = 1.0/moduli[mask]
+    return result
 
 
 class ForcePartEwaldReciprocalDD(ForcePart):
@@ -634,14 +1064,7 @@ class ForcePartEwaldNeutralizing(ForcePart):
         self.nlow, self.nhigh = check_nlow_nhigh(system, nlow, nhigh)
         self.fluctuating_charges = fluctuating_charges
         if not self.fluctuating_charges:
-            fac = self.system.charges[:].sum()**2/self.alpha**2
-            fac -= self.system.charges[:self.nlow].sum()**2/self.alpha**2
-            fac -= self.system.charges[self.nhigh:].sum()**2/self.alpha**2
-            if self.system.radii is not None:
-                fac -= self.system.charges.sum()*np.sum( self.system.charges*self.system.radii**2 )
-                fac += self.system.charges[:self.nlow].sum()*np.sum( self.system.charges[:self.nlow]*self.system.radii[:self.nlow]**2)
-                fac += self.system.charges[self.nhigh:].sum()*np.sum( self.system.charges[self.nhigh:]*self.system.radii[self.nhigh:]**2)
-            self.prefactor = fac*np.pi/(2.0*self.dielectric)
+            self.update_prefactor()
         if log.do_medium:
             with log.section('FPINIT'):
                 log('Force part: %s' % self.name)
@@ -650,20 +1073,31 @@ class ForcePartEwaldNeutralizing(ForcePart):
                 log('  relative permittivity:   %5.3f' % self.dielectric)
                 log.hline()
 
+    def _compute_prefactor(self):
+        fac = self.system.charges[:].sum()**2/self.alpha**2
+        fac -= self.system.charges[:self.nlow].sum()**2/self.alpha**2
+        fac -= self.system.charges[self.nhigh:].sum()**2/self.alpha**2
+        if self.system.radii is not None:
+            fac -= self.system.charges.sum()*np.sum( self.system.charges*self.system.radii**2 )
+            fac += self.system.charges[:self.nlow].sum()*np.sum( self.system.charges[:self.nlow]*self.system.radii[:self.nlow]**2)
+            fac += self.system.charges[self.nhigh:].sum()*np.sum( self.system.charges[self.nhigh:]*self.system.radii[self.nhigh:]**2)
+        return fac*np.pi/(2.0*self.dielectric)
+
+    def update_prefactor(self):
+        '''Recompute the prefactor of the energy
+
+           This must be called when the charges (or radii) have been changed
+           and ``fluctuating_charges`` is False.
+        '''
+        self.prefactor = self._compute_prefactor()
+
     def _internal_compute(self, gpos, vtens):
         with timer.section('Ewald neut.'):
             if not self.fluctuating_charges:
                 fac = self.prefactor/self.system.cell.volume
             else:
                 #TODO: interaction of dipoles with background? I think this is zero, need proof...
-                fac = self.system.charges[:].sum()**2/self.alpha**2
-                fac -= self.system.charges[:self.nlow].sum()**2/self.alpha**2
-                fac -= self.system.charges[self.nhigh:].sum()**2/self.alpha**2
-                if self.system.radii is not None:
-                    fac -= self.system.charges.sum()*np.sum( self.system.charges*self.system.radii**2 )
-                    fac += self.system.charges[:self.nlow].sum()*np.sum( self.system.charges[:self.nlow]*self.system.radii[:self.nlow]**2)
-                    fac += self.system.charges[self.nhigh:].sum()*np.sum( self.system.charges[self.nhigh:]*self.system.radii[self.nhigh:]**2)
-                fac *= np.pi/(2.0*self.system.cell.volume*self.dielectric)
+                fac = self._compute_prefactor()/self.system.cell.volume
             if vtens is not None:
                 vtens.ravel()[::4] -= fac
         return fac
@@ -969,7 +1403,7 @@ class ForcePartPressure(ForcePart):
 
 class ForcePartGrid(ForcePart):
     '''Energies obtained by grid interpolation.'''
-    def __init__(self, system, grids):
+    def __init__(self, system, grids, interpolation='linear'):
         '''
            **Arguments:**
 
@@ -980,34 +1414,90 @@ class ForcePartGrid(ForcePart):
                 A dictionary with (ffatype, grid) items. Each grid must be a
                 three-dimensional array with energies.
 
+           **Optional arguments:**
+
+           interpolation
+                Either ``'linear'`` (trilinear) or ``'cubic'`` (tricubic
+                Catmull-Rom interpolation, which has continuous derivatives).
+
            This force part is only applicable to systems that are 3D periodic.
+           Grids can be generated with :func:`yaff.pes.hostgrid.compute_host_grids`.
         '''
         if system.cell.nvec != 3:
             raise ValueError('The system must be 3d periodic for the grid term.')
         for grid in grids.values():
             if grid.ndim != 3:
                 raise ValueError('The energy grids must be 3D numpy arrays.')
+        if interpolation not in ['linear', 'cubic']:
+            raise ValueError('The interpolation must be \'linear\' or \'cubic\'.')
         ForcePart.__init__(self, 'grid', system)
         self.system = system
-        self.grids = grids
+        self.grids = dict((ffatype, np.ascontiguousarray(grid, dtype=float))
+                          for ffatype, grid in grids.items())
+        self.interpolation = interpolation
+        # The indexes of the atoms for each grid
+        ffatypes = [system.get_ffatype(i) for i in range(system.natom)]
+        missing = set(ffatypes) - set(self.grids)
+        if len(missing) > 0:
+            raise ValueError('No grid for atom types: %s' % ', '.join(sorted(missing)))
+        self.iatoms = {}
+        for ffatype in self.grids:
+            self.iatoms[ffatype] = np.array([i for i in range(system.natom)
+                                             if ffatypes[i] == ffatype], dtype=int)
         if log.do_medium:
             with log.section('FPINIT'):
                 log('Force part: %s' % self.name)
                 log.hline()
+                log('  interpolation:     %s' % self.interpolation)
+                log('  grids:             %i' % len(self.grids))
+                log.hline()
 
     def _internal_compute(self, gpos, vtens):
         with timer.section('Grid'):
-            if gpos is not None:
-                raise NotImplementedError('Cartesian gradients are not supported yet in ForcePartGrid')
             if vtens is not None:
                 raise NotImplementedError('Cell deformation are not supported by ForcePartGrid')
-            cell = self.system.cell
-            result = 0
-            for i in range(self.system.natom):
-                grid = self.grids[self.system.get_ffatype(i)]
-                result += compute_grid3d(self.system.pos[i], cell, grid)
+            result = 0.0
+            for ffatype, grid in self.grids.items():
+                iatoms = self.iatoms[ffatype]
+                if len(iatoms) == 0:
+                    continue
+                result += compute_grid3d_atoms(self.system.pos, iatoms,
+                    self.system.cell, grid, self.interpolation == 'cubic', gpos)
             return result
 
+    def compute_batch(self, pos):
+        '''Compute the energies of a batch of configurations
+
+           **Arguments:**
+
+           pos
+                A numpy array with shape (nbatch, natom, 3), containing the
+                atomic positions of nbatch configurations of the system.
+
+           **Returns:** a numpy array with the nbatch energies.
+
+           All configurations are interpolated in one call per grid, which
+           is much faster than updating the positions of the system for each
+           configuration.
+        '''
+        nbatch, natom = pos.shape[:2]
+        if natom != self.system.natom:
+            raise TypeError('The configurations do not have the right number of atoms.')
+        with timer.section('Grid'):
+            pos = np.ascontiguousarray(pos.reshape(-1, 3), dtype=float)
+            energies = np.zeros(nbatch*natom)
+            offsets = natom*np.arange(nbatch)
+            for ffatype, grid in self.grids.items():
+                iatoms = self.iatoms[ffatype]
+                if len(iatoms) == 0:
+                    continue
+                iatoms = (offsets[:,None] + iatoms).ravel()
+                atom_energies = np.zeros(len(iatoms))
+                compute_grid3d_atoms(pos, iatoms, self.system.cell, grid,
+                    self.interpolation == 'cubic', None, atom_energies)
+                energies[iatoms] = atom_energies
+            return energies.reshape(nbatch, natom).sum(axis=1)
+
 
 class ForcePartTailCorrection(ForcePart):
     '''Corrections to energy and virial tensor to compensate for neglecting
@@ -1097,7 +1587,8 @@ class ForcePartEwaldReciprocalInteraction(ForcePart):
        of atoms.
        Only insertions are supported here, but deletions can be achieved by
        taking the negative of the change in structure factors. Translations and
-       rotations can be achieved by combining a deletion and an insertion.
+       rotations are handled by `move_energy`, which computes the change in
+       structure factors for the old and new positions in one pass.
        Note that flexible cells are NOT supported => TODO check this
     '''
     def __init__(self, cell, alpha, gcut, pos=None, charges=None, dielectric=1.0):
@@ -1172,6 +1663,15 @@ class ForcePartEwaldReciprocalInteraction(ForcePart):
         self.cosfacs = np.zeros(self.prefactors.shape)
         self.sinfacs = np.zeros(self.prefactors.shape)
         self.rvecs0 = self.cell.rvecs.copy()
+        # Table of the k-vectors within the cutoff, used to compute the
+        # structure factors
+        self.gindexes, _, self.kprefactors, self.positions = compute_ewald_ktable(
+            self.cell, self.alpha, self.gmax, self.gcut)
+        self.eikr = np.zeros((2*self.gmax[:2].sum() + self.gmax[2] + 4, 0, 2))
+        # Change of the structure factors by the last call to move_energy,
+        # only for the k-vectors in the table
+        self.deltacosfacs = np.zeros(len(self.positions))
+        self.deltasinfacs = np.zeros(len(self.positions))
 
     def compute_structurefactors(self, pos, charges, cosfacs, sinfacs):
         '''Compute the structure factors
@@ -1188,8 +1688,11 @@ class ForcePartEwaldReciprocalInteraction(ForcePart):
                     with log.section('EWALDI'):
                         log('Cell change detected, reinitializing')
                 self.initialize()
-            compute_ewald_structurefactors(pos, charges, self.cell, self.alpha,
-                self.gmax, self.gcut, cosfacs, sinfacs)
+            if self.eikr.shape[1] != len(pos):
+                self.eikr = np.zeros((self.eikr.shape[0], len(pos), 2))
+            compute_ewald_structurefactors_ktable(pos, charges, self.cell,
+                self.gmax, self.gindexes, self.positions, self.eikr, cosfacs,
+                sinfacs)
 
     def compute_deltae(self, cosfacs, sinfacs):
         '''Compute the energy difference arising if the provided structure
@@ -1250,6 +1753,73 @@ class ForcePartEwaldReciprocalInteraction(ForcePart):
             self.sinfacs[:] -= sinfacs
         return sign*self.compute_deltae(cosfacs, sinfacs)
 
+    def move_energy(self, oldpos, newpos, charges):
+        '''
+        Compute the energy difference if atoms with given charges are moved
+        from oldpos to newpos. This gives the same result as a deletion at
+        the old positions followed by an insertion at the new positions, but
+        the change in structure factors is computed in one pass, only for the
+        k-vectors within the cutoff. The current structure factors are not
+        modified, call ``accept_move`` to update them.
+
+            **Arguments:**
+
+            oldpos
+                [Nx3] NumPy array specifying the old coordinates
+
+            newpos
+                [Nx3] NumPy array specifying the new coordinates
+
+            charges
+                [N] NumPy array speficying the charges
+        '''
+        with timer.section('Ew.reci.move'):
+            if not np.all(self.cell.rvecs==self.rvecs0):
+                if log.do_medium:
+                    with log.section('EWALDI'):
+                        log('Cell change detected, reinitializing')
+                self.initialize()
+            if self.eikr.shape[1] != 2*len(oldpos):
+                self.eikr = np.zeros((self.eikr.shape[0], 2*len(oldpos), 2))
+            e = compute_ewald_move_ktable(oldpos, newpos, charges, self.cell,
+                self.gmax, self.gindexes, self.positions, self.kprefactors,
+                self.eikr, self.cosfacs, self.sinfacs, self.deltacosfacs,
+                self.deltasinfacs)
+        return e/self.dielectric
+
+    def compute_potentials(self, pos):
+        '''
+        Compute the energy of inserting a unit charge at each of the given
+        positions, due to the atoms described by the current structure
+        factors. All positions are treated in one pass over the k-vectors.
+
+            **Arguments:**
+
+            pos
+                [Nx3] NumPy array specifying the coordinates
+
+            **Returns:** a [N] NumPy array with the potentials.
+        '''
+        with timer.section('Ew.reci.pot.'):
+            if not np.all(self.cell.rvecs==self.rvecs0):
+                if log.do_medium:
+                    with log.section('EWALDI'):
+                        log('Cell change detected, reinitializing')
+                self.initialize()
+            if self.eikr.shape[1] != len(pos):
+                self.eikr = np.zeros((self.eikr.shape[0], len(pos), 2))
+            potentials = np.zeros(len(pos))
+            compute_ewald_potential_ktable(pos, self.cell, self.gmax,
+                self.gindexes, self.positions, self.kprefactors, self.eikr,
+                self.cosfacs, self.sinfacs, potentials)
+        return potentials/self.dielectric
+
+    def accept_move(self):
+        '''Add the change in structure factors of the last call to
+           ``move_energy`` to the current structure factors'''
+        self.cosfacs.reshape(-1)[self.positions] += self.deltacosfacs
+        self.sinfacs.reshape(-1)[self.positions] += self.deltasinfacs
+
     def _internal_compute(self, gpos, vtens):
         return 0.0
 
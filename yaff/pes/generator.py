@@ -39,11 +39,11 @@ from itertools import permutations
 from yaff.log import log
 from yaff.pes.ext import PairPotEI, PairPotLJ, PairPotMM3, PairPotMM3CAP, PairPotExpRep, \
     PairPotQMDFFRep, PairPotDampDisp, PairPotDisp68BJDamp, Switch3, PairPotEIDip, \
-    PairPotLJCross
-from yaff.pes.ff import ForcePartPair, ForcePartValence, \
+    PairPotLJCross, PairPotTabulated
+from yaff.pes.ff import ForcePartPair, ForcePartPairMulti, ForcePartValence, \
     ForcePartEwaldReciprocal, ForcePartEwaldCorrection, \
     ForcePartEwaldNeutralizing, ForcePartTailCorrection, \
-    ForcePartEwaldReciprocalInteraction
+    ForcePartEwaldReciprocalInteraction, ForcePartEwaldReciprocalPME
 from yaff.pes.iclist import Bond, BendAngle, BendCos, \
     UreyBradley, DihedAngle, DihedCos, OopAngle, OopMeanAngle, OopCos, \
     OopMeanCos, OopDist, SqOopDist, DihedCos2, DihedCos3, DihedCos4, DihedCos6
@@ -89,7 +89,10 @@ class FFArgs(object):
     '''
     def __init__(self, rcut=18.89726133921252, tr=Switch3(7.558904535685008),
                  alpha_scale=3.5, gcut_scale=1.1, skin=0, smooth_ei=False,
-                 reci_ei='ewald', nlow=0, nhigh=-1, tailcorrections=False):
+                 reci_ei='ewald', nlow=0, nhigh=-1, tailcorrections=False,
+                 pme_order=6, pme_oversampling=2.0, adaptive_skin=False,
+                 tabulate=False, tabulate_rmin=1.0*angstrom, tabulate_npoint=4096,
+                 fuse_pairs=False):
         """
            **Optional arguments:**
 
@@ -118,17 +121,26 @@ class FFArgs(object):
            skin
                 The skin parameter for the neighborlist.
 
+           adaptive_skin
+                When True, the skin of the neighborlist is tuned on the fly,
+                starting from the skin parameter. See
+                :class:`yaff.pes.nlist.NeighborList`.
+
            smooth_ei
                 Flag for smooth truncations for the electrostatic interactions.
 
            reci_ei
                 The method to be used for the reciprocal contribution to the
                 electrostatic interactions in the case of periodic systems. This
-                must be one of 'ignore' or 'ewald' or 'ewald_interaction'.
-                The options starting with 'ewald' are only supported for 3D
-                periodic systems. If 'ewald_interaction' is chosen, the
-                reciprocal contribution will not be included and it should be
-                accounted for by using the :class:`EwaldReciprocalInteraction`
+                must be one of 'ignore', 'ewald', 'ewald_interaction' or 'pme'.
+                The options 'ewald', 'ewald_interaction' and 'pme' are only
+                supported for 3D periodic systems. If 'ewald_interaction' is
+                chosen, the reciprocal contribution will not be included and it
+                should be accounted for by using the
+                :class:`EwaldReciprocalInteraction`. If 'pme' is chosen, the
+                reciprocal contribution is computed with the smooth
+                particle-mesh Ewald method, see
+                :class:`yaff.pes.ff.ForcePartEwaldReciprocalPME`.
 
            nlow
                 Interactions between atom pairs are only included if at least
@@ -151,6 +163,28 @@ class FFArgs(object):
                 pair potentials assuming the system is homogeneous in the
                 region where the truncation modifies the pair potential
 
+           pme_order, pme_oversampling
+                The spline order and the grid oversampling used when
+                reci_ei='pme'. Increasing either of them reduces the deviation
+                from the conventional Ewald summation with the same gcut.
+
+           tabulate
+                When True, all pair potentials are replaced by cubic spline
+                tables, see :class:`yaff.pes.ext.PairPotTabulated`. Pair
+                potentials that can not be tabulated are left untouched. A list
+                of names, e.g. ['dampdisp', 'mm3'], restricts the tabulation to
+                the pair potentials with these names. In this case, an error is
+                raised when one of them can not be tabulated.
+
+           tabulate_rmin, tabulate_npoint
+                The shortest tabulated distance and the number of grid points
+                in the tables of the pair potentials.
+
+           fuse_pairs
+                When True, all pair potentials are computed in a single pass
+                over the neighbor list, see
+                :class:`yaff.pes.ff.ForcePartPairMulti`.
+
            The actual value of gcut, which depends on both gcut_scale and
            alpha_scale, determines the computational cost of the reciprocal term
            in the Ewald summation. The default values are just examples. An
@@ -159,15 +193,22 @@ class FFArgs(object):
            that the numerical errors do not depend too much on the real space
            cutoff and the system size.
         """
-        if reci_ei not in ['ignore', 'ewald', 'ewald_interaction']:
-            raise ValueError('The reci_ei option must be one of \'ignore\' or \'ewald\' or \'ewald_interaction\'.')
+        if reci_ei not in ['ignore', 'ewald', 'ewald_interaction', 'pme']:
+            raise ValueError('The reci_ei option must be one of \'ignore\', \'ewald\', \'ewald_interaction\' or \'pme\'.')
         self.rcut = rcut
         self.tr = tr
         self.alpha_scale = alpha_scale
         self.gcut_scale = gcut_scale
         self.skin = skin
+        self.adaptive_skin = adaptive_skin
         self.smooth_ei = smooth_ei
         self.reci_ei = reci_ei
+        self.pme_order = pme_order
+        self.pme_oversampling = pme_oversampling
+        self.tabulate = tabulate
+        self.tabulate_rmin = tabulate_rmin
+        self.tabulate_npoint = tabulate_npoint
+        self.fuse_pairs = fuse_pairs
         # arguments for the ForceField constructor
         self.parts = []
         self.nlist = None
@@ -178,7 +219,7 @@ class FFArgs(object):
     def get_nlist(self, system):
         if self.nlist is None:
             self.nlist = NeighborList(system, skin=self.skin, nlow=self.nlow,
-                            nhigh=self.nhigh)
+                            nhigh=self.nhigh, adaptive_skin=self.adaptive_skin)
         return self.nlist
 
     def get_part(self, ForcePartClass):
@@ -220,13 +261,19 @@ class FFArgs(object):
         if self.reci_ei == 'ignore':
             # Nothing to do
             pass
-        elif self.reci_ei.startswith('ewald'):
+        elif self.reci_ei.startswith('ewald') or self.reci_ei == 'pme':
             if system.cell.nvec == 3:
                 if self.reci_ei == 'ewald_interaction':
                     part_ewald_reci = ForcePartEwaldReciprocalInteraction(system.cell, alpha, self.gcut_scale*alpha, dielectric=dielectric)
                 elif self.reci_ei == 'ewald':
                     # Reciprocal-space electrostatics
                     part_ewald_reci = ForcePartEwaldReciprocal(system, alpha, self.gcut_scale*alpha, dielectric, self.nlow, self.nhigh)
+                elif self.reci_ei == 'pme':
+                    # Reciprocal-space electrostatics with particle-mesh Ewald
+                    part_ewald_reci = ForcePartEwaldReciprocalPME(
+                        system, alpha, self.gcut_scale*alpha, dielectric,
+                        self.nlow, self.nhigh, self.pme_order,
+                        self.pme_oversampling)
                 else: raise NotImplementedError
                 self.parts.append(part_ewald_reci)
                 # Ewald corrections
@@ -2209,6 +2256,41 @@ def apply_generators(system, parameters, ff_args):
         else:
             raise ValueError('Tail corrections not available for 1-D and 2-D periodic systems')
 
+    # If requested, replace the pair potentials by cubic spline tables. This is
+    # done after the tail corrections, which are computed with the original
+    # pair potentials.
+    if ff_args.tabulate:
+        for part in ff_args.parts:
+            if not isinstance(part, ForcePartPair):
+                continue
+            name = part.pair_pot.name
+            if ff_args.tabulate is not True and name not in ff_args.tabulate:
+                continue
+            try:
+                part.pair_pot = PairPotTabulated(
+                    part.pair_pot, system.ffatype_ids, ff_args.tabulate_rmin,
+                    ff_args.tabulate_npoint
+                )
+            except ValueError as e:
+                if ff_args.tabulate is not True:
+                    raise
+                if log.do_warning:
+                    log.warn('Not tabulating the %s pair potential: %s' % (name, e))
+                continue
+            if log.do_medium:
+                log('Tabulated the %s pair potential. Max. energy error: %s' % (
+                    name, log.energy(part.pair_pot.energy_errors.max())))
+
+    # If requested, replace all pair parts by one part that computes them in a
+    # single pass over the neighbor list.
+    if ff_args.fuse_pairs:
+        parts_pair = [part for part in ff_args.parts if isinstance(part, ForcePartPair)]
+        if len(parts_pair) > 1:
+            part_multi = ForcePartPairMulti(system, ff_args.nlist, parts_pair)
+            ipart = ff_args.parts.index(parts_pair[0])
+            ff_args.parts = [part for part in ff_args.parts if not isinstance(part, ForcePartPair)]
+            ff_args.parts.insert(ipart, part_multi)
+
     part_valence = ff_args.get_part(ForcePartValence)
     if part_valence is not None and log.do_warning:
         # Basic check for missing terms
@@ -73,3 +73,90 @@ double compute_grid3d(double* center, cell_type *cell, double* egrid, size_t* sh
     /* 100 */  (egrid[offset(1,0,0)]*frac[0] +
     /* 000 */   egrid[offset(0,0,0)]*(1-frac[0]))*(1-frac[1]))*(1-frac[2]);
 }
+
+
+static void grid_weights(double t, long cubic, double *w, double *dw) {
+    // Interpolation weights and their derivatives towards t for the grid
+    // points -1,0,1,2 (cubic) or 0,1 (linear) relative to the lower corner.
+    double t2;
+    if (cubic) {
+        // Catmull-Rom spline, continuous first derivatives.
+        t2 = t*t;
+        w[0] = 0.5*((2.0 - t)*t - 1.0)*t;
+        w[1] = 0.5*((3.0*t - 5.0)*t2 + 2.0);
+        w[2] = 0.5*(((4.0 - 3.0*t)*t + 1.0)*t);
+        w[3] = 0.5*(t - 1.0)*t2;
+        dw[0] = 0.5*((4.0 - 3.0*t)*t - 1.0);
+        dw[1] = 0.5*(9.0*t - 10.0)*t;
+        dw[2] = 0.5*((8.0 - 9.0*t)*t + 1.0);
+        dw[3] = 0.5*(3.0*t - 2.0)*t;
+    } else {
+        w[0] = 1.0 - t;
+        w[1] = t;
+        dw[0] = -1.0;
+        dw[1] = 1.0;
+    }
+}
+
+
+double compute_grid3d_atoms(double* pos, long* iatoms, long natom,
+                            cell_type *cell, double* egrid, size_t* shape,
+                            long cubic, double* gpos, double* energies) {
+    double frac[3], w[3][4], dw[3][4], energy, e, e0, e1, e2, de[3], x;
+    long indexes[3][4];
+    long n, i, a, j, j0, j1, j2, npoint, shift;
+    double *center;
+
+    npoint = cubic?4:2;
+    shift = cubic?1:0;
+    energy = 0.0;
+    for (n=0; n<natom; n++) {
+        i = iatoms[n];
+        center = pos + 3*i;
+        cell_to_frac(cell, center, frac);
+        for (a=0; a<3; a++) {
+            // Move to ranges [0,1[ and convert to grid indexes
+            frac[a] -= floor(frac[a]);
+            frac[a] *= shape[a];
+            j = (long)floor(frac[a]);
+            grid_weights(frac[a] - j, cubic, w[a], dw[a]);
+            for (j0=0; j0<npoint; j0++) {
+                indexes[a][j0] = (j + j0 - shift + shape[a]) % shape[a];
+            }
+        }
+        e = 0.0;
+        de[0] = 0.0;
+        de[1] = 0.0;
+        de[2] = 0.0;
+        for (j0=0; j0<npoint; j0++) {
+            for (j1=0; j1<npoint; j1++) {
+                e1 = 0.0;
+                e2 = 0.0;
+                for (j2=0; j2<npoint; j2++) {
+                    x = egrid[(indexes[0][j0]*shape[1] + indexes[1][j1])*shape[2] + indexes[2][j2]];
+                    e1 += w[2][j2]*x;
+                    e2 += dw[2][j2]*x;
+                }
+                e0 = w[0][j0]*w[1][j1];
+                e += e0*e1;
+                de[0] += dw[0][j0]*w[1][j1]*e1;
+                de[1] += w[0][j0]*dw[1][j1]*e1;
+                de[2] += e0*e2;
+            }
+        }
+        energy += e;
+        if (energies != NULL) {
+            energies[n] = e;
+        }
+        if (gpos != NULL) {
+            // Chain rule for the fractional grid coordinates
+            for (a=0; a<3; a++) {
+                x = de[a]*shape[a];
+                gpos[3*i] += x*(*cell).gvecs[3*a];
+                gpos[3*i+1] += x*(*cell).gvecs[3*a+1];
+                gpos[3*i+2] += x*(*cell).gvecs[3*a+2];
+            }
+        }
+    }
+    return energy;
+}
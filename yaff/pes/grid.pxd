@@ -26,3 +26,6 @@ cimport cell
 
 cdef extern from "grid.h":
     double compute_grid3d(double* center, cell.cell_type *cell, double* egrid, size_t* shape)
+    double compute_grid3d_atoms(double* pos, long* iatoms, long natom,
+                                cell.cell_type *cell, double* egrid, size_t* shape,
+                                long cubic, double* gpos, double* energies)
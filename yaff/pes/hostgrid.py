@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+'''Energy grids of guest atoms in a rigid host
+
+   In adsorption simulations with a rigid host (framework), the host-guest
+   interaction is a sum of contributions of the individual guest atoms. The
+   contribution of a guest atom only depends on its position and its atom type
+   (and its charge). It can therefore be tabulated once on a grid for every
+   guest atom type, after which host-guest energies are obtained by
+   interpolation, at a cost that does not depend on the size of the host.
+'''
+
+
+from __future__ import division
+
+import numpy as np
+
+from molmod.units import angstrom, kjmol
+
+from yaff.log import log, timer
+from yaff.pes.ext import Cell, pair_pot_compute_points
+from yaff.pes.ff import ForceField, ForcePartGrid, ForcePartPair, \
+    ForcePartEwaldReciprocalInteraction
+from yaff.pes.nlist import NeighborList
+from yaff.pes.generator import FixedChargeGenerator
+from yaff.pes.parameters import Parameters
+from yaff.system import System
+
+
+__all__ = ['compute_host_grids', 'make_grid_forcefield']
+
+
+def compute_host_grids(host, guest, parameters, spacing=0.2*angstrom,
+                       shape=None, emax=100*kjmol, **kwargs):
+    '''Tabulate the interaction of each guest atom type with a rigid host
+
+       **Arguments:**
+
+       host
+            A System instance of the host, with three cell vectors.
+
+       guest
+            A System instance of one guest molecule. Its atom types determine
+            for which atom types a grid is computed and its bonds are used to
+            assign the charges of the guest atoms.
+
+       parameters
+            Force-field parameters describing the host-guest interaction. The
+            same types are accepted as in :meth:`yaff.pes.ff.ForceField.generate`.
+
+       **Optional arguments:**
+
+       spacing
+            The approximate distance between grid points.
+
+       shape
+            The number of grid points along each cell vector. When given,
+            ``spacing`` is ignored.
+
+       emax
+            Grid energies larger than emax (typically close to host atoms)
+            are set to emax. This avoids huge values that would spoil the
+            interpolation in neighboring grid cells.
+
+       All other keyword arguments are passed to
+       :meth:`yaff.pes.ff.ForceField.generate`. The reciprocal Ewald sum is
+       always computed with the Ewald method, unless ``reci_ei='ignore'``.
+
+       **Returns:** a dictionary with (ffatype, grid) items. The grid point with
+       indexes (i0,i1,i2) is located at the fractional coordinates
+       (i0/n0,i1/n1,i2/n2), as expected by
+       :class:`yaff.pes.ff.ForcePartGrid`.
+
+       The van der Waals part is computed with a probe atom of each guest atom
+       type, the electrostatic part with a unit point charge (or a Gaussian
+       charge with the radius of the guest atom). The grid points are treated
+       in blocks: their neighbors are searched with the linked-cell neighbor
+       list of the host atoms and the reciprocal Ewald potential is computed
+       for a whole block in one pass over the k-vectors.
+    '''
+    if host.cell.nvec != 3:
+        raise ValueError('The host must be 3D periodic.')
+    if not isinstance(parameters, Parameters):
+        parameters = Parameters.from_file(parameters)
+    if kwargs.pop('reci_ei', 'ewald') != 'ignore':
+        kwargs['reci_ei'] = 'ewald_interaction'
+    else:
+        kwargs['reci_ei'] = 'ignore'
+    kwargs.pop('nlow', None)
+    kwargs.pop('nhigh', None)
+    if shape is None:
+        lengths = np.sqrt((host.cell.rvecs**2).sum(axis=1))
+        shape = np.ceil(lengths/spacing).astype(int)
+    shape = tuple(int(n) for n in shape)
+    if len(shape) != 3 or min(shape) < 1:
+        raise ValueError('The grid shape must consist of three positive integers.')
+
+    # The charges and radii of the guest atoms, as they are assigned when
+    # generating a force field for the guest.
+    probes = _get_probes(host, guest, parameters)
+
+    # Positions of the grid points
+    frac = np.indices(shape, dtype=float).reshape(3, -1).T/shape
+    points = np.dot(frac, host.cell.rvecs)
+
+    with log.section('HGRID'), timer.section('Host grids'):
+        if log.do_medium:
+            log('Computing host grids with shape %i x %i x %i for %s' % (
+                shape + (', '.join(sorted(probes)),)))
+        # van der Waals (and other non-electrostatic) interactions
+        pars_vdw = parameters.copy()
+        pars_vdw.sections.pop('FIXQ', None)
+        grids = {}
+        for ffatype, (number, charge, radius) in sorted(probes.items()):
+            grids[ffatype] = _compute_probe_grid(host, number, ffatype,
+                pars_vdw, points, **kwargs)
+        # Electrostatic potentials, one per guest radius
+        if 'FIXQ' in parameters.sections:
+            potentials = {}
+            for ffatype, (number, charge, radius) in sorted(probes.items()):
+                if charge == 0.0:
+                    continue
+                if radius not in potentials:
+                    pars_ei = _get_unit_charge_parameters(parameters, radius)
+                    potentials[radius] = _compute_probe_grid(host, number,
+                        'GRIDPROBE', pars_ei, points, **kwargs)
+                grids[ffatype] += charge*potentials[radius]
+    for ffatype in grids:
+        grid = grids[ffatype]
+        grid[~(grid < emax)] = emax
+        grids[ffatype] = grid.reshape(shape)
+    return grids
+
+
+def _get_probes(host, guest, parameters):
+    '''Return (number, charge, radius) for each guest atom type'''
+    guest = guest.subsystem(np.arange(guest.natom))
+    guest.cell = Cell(host.cell.rvecs)
+    if 'FIXQ' in parameters.sections:
+        pars_fixq = Parameters({'FIXQ': parameters.sections['FIXQ']})
+        ForceField.generate(guest, pars_fixq, reci_ei='ignore')
+        charges = guest.charges
+        radii = guest.radii
+    else:
+        charges = np.zeros(guest.natom)
+        radii = np.zeros(guest.natom)
+    probes = {}
+    for i in range(guest.natom):
+        ffatype = guest.get_ffatype(i)
+        probe = (guest.numbers[i], charges[i], radii[i])
+        if ffatype in probes:
+            other = probes[ffatype]
+            if abs(other[1] - probe[1]) > 1e-10 or abs(other[2] - probe[2]) > 1e-10:
+                raise ValueError('Guest atoms of type %s have different charges or radii.' % ffatype)
+        else:
+            probes[ffatype] = probe
+    return probes
+
+
+def _get_unit_charge_parameters(parameters, radius):
+    '''Parameters with only the FIXQ section and a unit charge of type GRIDPROBE'''
+    section = parameters.sections['FIXQ'].copy()
+    conversions = FixedChargeGenerator().process_units(section['UNIT'])
+    section.definitions['ATOM'] = section['ATOM']
+    section['ATOM'].lines.append((-1, 'GRIDPROBE %.15e %.15e' % (
+        1.0/conversions['Q0'], radius/conversions['R'])))
+    return Parameters({'FIXQ': section})
+
+
+def _compute_probe_grid(host, number, ffatype, parameters, points,
+                        block_size=4096, **kwargs):
+    '''Interaction energy of a single probe atom with the host at all points
+
+       The pair interactions are computed for blocks of points at once: the
+       points of a block are appended to the host atoms and their neighbors
+       are found with the linked-cell neighbor list. The reciprocal Ewald
+       interaction is computed for all points of a block in one pass over the
+       k-vectors.
+    '''
+    probe = System(
+        numbers=np.array([number]), pos=np.zeros((1, 3)), ffatypes=[ffatype],
+        bonds=np.zeros((0, 2), int), rvecs=host.cell.rvecs,
+    )
+    system = host.merge(probe)
+    system.charges = None
+    system.radii = None
+    nhost = host.natom
+    iatom = system.natom - 1
+    ff = ForceField.generate(system, parameters, nlow=nhost, nhigh=nhost, **kwargs)
+    pair_pots = []
+    others = []
+    ewald_reci = None
+    for part in ff.iter_contribs():
+        if isinstance(part, ForcePartPair):
+            pair_pots.append(part.pair_pot)
+        elif isinstance(part, ForcePartEwaldReciprocalInteraction):
+            # The reciprocal Ewald interaction with the host is computed with
+            # the structure factors of the host, which are fixed.
+            ewald_reci = part
+            ewald_reci.compute_structurefactors(system.pos[:nhost],
+                system.charges[:nhost], ewald_reci.cosfacs, ewald_reci.sinfacs)
+        else:
+            others.append(part)
+    energies = np.zeros(len(points))
+    if len(points) == 0:
+        return energies
+    # The remaining parts, e.g. the Ewald self-interaction and tail
+    # corrections, do not depend on the position of the probe.
+    pos = system.pos.copy()
+    pos[-1] = points[0]
+    ff.update_pos(pos)
+    energies[:] = sum(part.compute() for part in others)
+    if len(pair_pots) > 0:
+        # The host atoms followed by the points of one block. Only pairs of
+        # a host atom and a point are included in the neighbor list.
+        size = min(block_size, len(points))
+        block_system = System(
+            numbers=np.concatenate([host.numbers, np.full(size, number)]),
+            pos=np.concatenate([system.pos[:nhost], np.zeros((size, 3))]),
+            rvecs=host.cell.rvecs,
+        )
+        nlist = NeighborList(block_system, nlow=nhost, nhigh=nhost, binned=True)
+        nlist.request_rcut(max(pair_pot.rcut for pair_pot in pair_pots))
+        block_energies = np.zeros(size)
+    for begin in range(0, len(points), block_size):
+        end = min(begin + block_size, len(points))
+        block = np.ascontiguousarray(points[begin:end], dtype=float)
+        if len(pair_pots) > 0:
+            # The unused slots of the last block repeat its last point.
+            block_system.pos[nhost:] = block[-1]
+            block_system.pos[nhost:nhost + end - begin] = block
+            nlist.update()
+            block_energies[:] = 0.0
+            pair_pot_compute_points(pair_pots, nlist.neighs, nlist.nneigh,
+                nhost, iatom, block_energies)
+            energies[begin:end] += block_energies[:end - begin]
+        if ewald_reci is not None:
+            energies[begin:end] += system.charges[-1]*ewald_reci.compute_potentials(block)
+    return energies
+
+
+def make_grid_forcefield(guest, grids, interpolation='cubic'):
+    '''Return a force field for one guest molecule in a tabulated host
+
+       **Arguments:**
+
+       guest
+            A System instance of one guest molecule, with the cell of the host.
+
+       grids
+            A dictionary with (ffatype, grid) items, e.g. obtained with
+            :func:`compute_host_grids`.
+
+       **Optional arguments:**
+
+       interpolation
+            Passed on to :class:`yaff.pes.ff.ForcePartGrid`.
+
+       The result can be used as the ``external_potential`` of the MC
+       simulations in :mod:`yaff.sampling.mc`.
+    '''
+    system = guest.subsystem(np.arange(guest.natom))
+    system.cell = Cell(guest.cell.rvecs)
+    part = ForcePartGrid(system, grids, interpolation)
+    return ForceField(system, [part])
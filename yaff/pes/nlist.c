@@ -23,6 +23,7 @@
 
 
 #include <math.h>
+#include <stdlib.h>
 #include "nlist.h"
 #include "cell.h"
 
@@ -134,6 +135,314 @@ int nlist_build_low(double *pos, double rcut, long *rmax,
 
 
 
+int nlist_row_cmp(const void *row0, const void *row1) {
+  // Order the rows of one (central) atom in the same way as they are
+  // generated by nlist_build_low: first by the other atom, then by periodic
+  // image (in the order of nlist_inc_r) and finally by sign.
+  long lo0, lo1;
+  neigh_row_type *n0, *n1;
+  n0 = (neigh_row_type*) row0;
+  n1 = (neigh_row_type*) row1;
+  lo0 = ((*n0).a < (*n0).b) ? (*n0).a : (*n0).b;
+  lo1 = ((*n1).a < (*n1).b) ? (*n1).a : (*n1).b;
+  if (lo0 != lo1) return (lo0 < lo1) ? -1 : 1;
+  if ((*n0).r2 != (*n1).r2) return ((*n0).r2 < (*n1).r2) ? -1 : 1;
+  if ((*n0).r1 != (*n1).r1) return ((*n0).r1 < (*n1).r1) ? -1 : 1;
+  if ((*n0).r0 != (*n1).r0) return ((*n0).r0 < (*n1).r0) ? -1 : 1;
+  // The row with a > b (sign=+1) comes first.
+  if ((*n0).a != (*n1).a) return ((*n0).a > (*n1).a) ? -1 : 1;
+  return 0;
+}
+
+
+static int nlist_binned_pair(double *pos, double rcut, double rcut_margin,
+                             long *rmax, cell_type *unitcell, long a, long b,
+                             long *shift_a, long *shift_b, long *shift,
+                             neigh_row_type *neigh) {
+  // Test whether atom b in a bin, displaced by the cell vector shift with
+  // respect to the bins around central atom a, gives a row in the neighbor
+  // list. shift_a and shift_b are the cell vectors that bring atoms a and b
+  // into the bins. The arguments rcut and rcut_margin are squared distances.
+  // Returns 1 and fills in neigh when the pair is within the cutoff.
+  long i, sign;
+  long u[3], r[3];
+  double delta0[3], delta[3], dist, dfrac;
+  double *gvecs;
+  gvecs = (*unitcell).gvecs;
+  // Cheap test to skip most of the candidates. The margin makes sure
+  // that round-off errors do not affect the result.
+  for (i=0; i<3; i++) {
+    u[i] = shift_b[i] - shift_a[i] + shift[i];
+  }
+  delta[0] = pos[3*b  ] - pos[3*a  ];
+  delta[1] = pos[3*b+1] - pos[3*a+1];
+  delta[2] = pos[3*b+2] - pos[3*a+2];
+  cell_add_vec(delta, unitcell, u);
+  dist = delta[0]*delta[0] + delta[1]*delta[1] + delta[2]*delta[2];
+  if (dist > rcut_margin) return 0;
+  // Compute the relative vector in the same way as nlist_build_low.
+  delta0[0] = pos[3*b  ] - pos[3*a  ];
+  delta0[1] = pos[3*b+1] - pos[3*a+1];
+  delta0[2] = pos[3*b+2] - pos[3*a+2];
+  // The cell vector subtracted by the minimum image convention, u, is
+  // needed to translate the bin shift into a periodic image index.
+  delta[0] = delta0[0];
+  delta[1] = delta0[1];
+  delta[2] = delta0[2];
+  cell_mic(delta0, unitcell);
+  for (i=0; i<3; i++) {
+    dfrac = gvecs[3*i  ]*(delta0[0] - delta[0]) +
+            gvecs[3*i+1]*(delta0[1] - delta[1]) +
+            gvecs[3*i+2]*(delta0[2] - delta[2]);
+    u[i] = (long) floor(dfrac + 0.5);
+    r[i] = shift_b[i] - shift_a[i] + shift[i] - u[i];
+  }
+  // Only the central image and half of the other images are stored
+  // with this sign. The other half is stored as (b, a, -r).
+  if ((r[0] == 0) && (r[1] == 0) && (r[2] == 0)) {
+    if (b == a) return 0;
+    sign = 1;
+  } else if ((r[2] > 0) || ((r[2] == 0) && ((r[1] > 0) || ((r[1] == 0) && (r[0] > 0))))) {
+    sign = 1;
+  } else {
+    if (b == a) return 0;
+    sign = -1;
+    r[0] = -r[0];
+    r[1] = -r[1];
+    r[2] = -r[2];
+  }
+  if ((labs(r[0]) > rmax[0]) || (labs(r[1]) > rmax[1]) || (labs(r[2]) > rmax[2])) return 0;
+  delta[0] = sign*delta0[0];
+  delta[1] = sign*delta0[1];
+  delta[2] = sign*delta0[2];
+  cell_add_vec(delta, unitcell, r);
+  dist = delta[0]*delta[0] + delta[1]*delta[1] + delta[2]*delta[2];
+  if (dist >= rcut) return 0;
+  if (sign > 0) {
+    (*neigh).a = a;
+    (*neigh).b = b;
+  } else {
+    (*neigh).a = b;
+    (*neigh).b = a;
+  }
+  (*neigh).d = sqrt(dist);
+  (*neigh).dx = delta[0];
+  (*neigh).dy = delta[1];
+  (*neigh).dz = delta[2];
+  (*neigh).r0 = r[0];
+  (*neigh).r1 = r[1];
+  (*neigh).r2 = r[2];
+  return 1;
+}
+
+
+int nlist_build_binned_low(double *pos, double rcut, long *rmax,
+                           cell_type *unitcell, long *status,
+                           neigh_row_type *neighs, long natom, long nlow,
+                           long nhigh, long nneigh, long *nbins,
+                           long *bin_start, long *bin_atoms, long *atom_bins,
+                           long *atom_shifts) {
+
+  long a, b, i, k, row, row_begin, ibin;
+  long srange[3], d[3], jbin[3], shift[3];
+  double rcut_margin;
+  neigh_row_type neigh;
+
+  // This routine produces exactly the same rows as nlist_build_low, in the
+  // same order, but the candidate pairs are taken from a linked-cell
+  // structure in fractional coordinates instead of looping over all pairs.
+  // The central atom, a, of a pair is always the one with the highest index.
+  // When the neighs array is too small to hold all rows of one central atom,
+  // the partial result for that atom is discarded and the status array is
+  // set such that the next call resumes at the same central atom.
+  rcut *= rcut;
+  rcut_margin = rcut*(1.0 + 1e-8);
+  // Compute the number of neighboring bins to scan along each cell vector.
+  for (i=0; i<3; i++) {
+    srange[i] = (long) ceil(sqrt(rcut)*nbins[i]/(*unitcell).rspacings[i]);
+  }
+
+  a = status[3];
+  row = 0;
+  while (a < natom) {
+    row_begin = row;
+    for (d[0]=-srange[0]; d[0]<=srange[0]; d[0]++) {
+    for (d[1]=-srange[1]; d[1]<=srange[1]; d[1]++) {
+    for (d[2]=-srange[2]; d[2]<=srange[2]; d[2]++) {
+      // Wrap the neighboring bin back into the cell and keep track of the
+      // corresponding cell vector.
+      for (i=0; i<3; i++) {
+        jbin[i] = atom_bins[3*a+i] + d[i];
+        shift[i] = (long) floor(((double) jbin[i])/nbins[i]);
+        jbin[i] -= shift[i]*nbins[i];
+      }
+      ibin = (jbin[0]*nbins[1] + jbin[1])*nbins[2] + jbin[2];
+      for (k=bin_start[ibin]; k<bin_start[ibin+1]; k++) {
+        b = bin_atoms[k];
+        if (b > a) continue;
+        if (!((a>=nlow && b<nhigh) || (b>=nlow && a<nhigh))) continue;
+        if (!nlist_binned_pair(pos, rcut, rcut_margin, rmax, unitcell, a, b,
+                               atom_shifts + 3*a, atom_shifts + 3*b, shift,
+                               &neigh)) continue;
+        if (row >= nneigh) {
+          // Not enough space. Resume at this central atom in the next call.
+          status[3] = a;
+          status[6] += row_begin;
+          return 0;
+        }
+        neighs[row] = neigh;
+        row++;
+      }
+    }
+    }
+    }
+    // Restore the ordering of nlist_build_low, which is assumed by the
+    // lookup of the scalings in pair_pot_compute.
+    qsort(neighs + row_begin, row - row_begin, sizeof(neigh_row_type), nlist_row_cmp);
+    a++;
+  }
+  // Completely done.
+  status[3] = a;
+  status[6] += row;
+  return 1;
+}
+
+
+static void nlist_cells_locate(double *p, cell_type *unitcell, long *nbins,
+                               long *bin, long *shift) {
+  // Find the bin of an atom at position p and the cell vector that brings
+  // the atom into the bins, in the same way as NeighborList._compute_bins.
+  long i;
+  double frac;
+  double *gvecs;
+  gvecs = (*unitcell).gvecs;
+  for (i=0; i<3; i++) {
+    frac = gvecs[3*i]*p[0] + gvecs[3*i+1]*p[1] + gvecs[3*i+2]*p[2];
+    shift[i] = -((long) floor(frac));
+    bin[i] = (long) floor((frac + shift[i])*nbins[i]);
+    // Protect against round-off errors for atoms on the cell boundary.
+    if (bin[i] < 0) bin[i] = 0;
+    if (bin[i] >= nbins[i]) bin[i] = nbins[i] - 1;
+  }
+}
+
+
+void nlist_cells_insert_low(double *pos, cell_type *unitcell, long *nbins,
+                            long *bin_head, long *atom_next, long *atom_prev,
+                            long *atom_ibins, long *atom_shifts,
+                            double *atom_wpos, long begin, long end) {
+  // Put the atoms begin to end-1 at the head of the lists of their bins. The
+  // positions of the atoms translated into the bins are stored in atom_wpos.
+  long a, ibin;
+  long bin[3];
+  for (a=begin; a<end; a++) {
+    nlist_cells_locate(pos + 3*a, unitcell, nbins, bin, atom_shifts + 3*a);
+    atom_wpos[3*a  ] = pos[3*a  ];
+    atom_wpos[3*a+1] = pos[3*a+1];
+    atom_wpos[3*a+2] = pos[3*a+2];
+    cell_add_vec(atom_wpos + 3*a, unitcell, atom_shifts + 3*a);
+    ibin = (bin[0]*nbins[1] + bin[1])*nbins[2] + bin[2];
+    atom_ibins[a] = ibin;
+    atom_next[a] = bin_head[ibin];
+    atom_prev[a] = -1;
+    if (bin_head[ibin] >= 0) atom_prev[bin_head[ibin]] = a;
+    bin_head[ibin] = a;
+  }
+}
+
+
+void nlist_cells_remove_low(long *bin_head, long *atom_next, long *atom_prev,
+                            long *atom_ibins, long begin, long end) {
+  // Take the atoms begin to end-1 out of the lists of their bins.
+  long a;
+  for (a=begin; a<end; a++) {
+    if (atom_prev[a] >= 0) {
+      atom_next[atom_prev[a]] = atom_next[a];
+    } else {
+      bin_head[atom_ibins[a]] = atom_next[a];
+    }
+    if (atom_next[a] >= 0) atom_prev[atom_next[a]] = atom_prev[a];
+  }
+}
+
+
+long nlist_build_cells_low(double *pos, double rcut, long *rmax,
+                           cell_type *unitcell, neigh_row_type *neighs,
+                           long natom, long nlow, long nneigh, long *nbins,
+                           long *bin_head, long *atom_next, long *atom_shifts,
+                           double *atom_wpos, double *dmin) {
+
+  long a, b, i, row, ibin;
+  long srange[3], d[3], jbin[3], shift[3], bin_a[3], shift_a[3];
+  double rcut_margin, dist;
+  double offset[3], delta[3];
+  neigh_row_type neigh;
+
+  // This routine produces the rows of the central atoms nlow to natom-1 with
+  // all atoms in a linked-cell structure that have an index below nlow. The
+  // result is the same as with nlist_build_low for nlow=nhigh. Unlike in
+  // nlist_build_binned_low, the bins are stored as linked lists, such that
+  // atoms can be added and removed without sorting all atoms again: bin_head
+  // contains the first atom of each bin and atom_next the next atom in the
+  // same bin. Both are -1 at the end of a list. Only the shifts and the
+  // translated positions of the atoms in the bins are read from atom_shifts
+  // and atom_wpos. The rows of a central atom are not sorted. The shortest
+  // distance of all rows is stored in dmin, or rcut if there are none. The
+  // number of rows is returned, or -1 if the neighs array is too small.
+  rcut *= rcut;
+  rcut_margin = rcut*(1.0 + 1e-8);
+  for (i=0; i<3; i++) {
+    srange[i] = (long) ceil(sqrt(rcut)*nbins[i]/(*unitcell).rspacings[i]);
+  }
+  *dmin = sqrt(rcut);
+
+  row = 0;
+  for (a=nlow; a<natom; a++) {
+    nlist_cells_locate(pos + 3*a, unitcell, nbins, bin_a, shift_a);
+    for (d[0]=-srange[0]; d[0]<=srange[0]; d[0]++) {
+    for (d[1]=-srange[1]; d[1]<=srange[1]; d[1]++) {
+    for (d[2]=-srange[2]; d[2]<=srange[2]; d[2]++) {
+      for (i=0; i<3; i++) {
+        jbin[i] = bin_a[i] + d[i];
+        shift[i] = (long) floor(((double) jbin[i])/nbins[i]);
+        jbin[i] -= shift[i]*nbins[i];
+      }
+      ibin = (jbin[0]*nbins[1] + jbin[1])*nbins[2] + jbin[2];
+      // The relative vector of a candidate is its translated position plus
+      // this offset, which is the same for all atoms in the bin.
+      offset[0] = -pos[3*a  ];
+      offset[1] = -pos[3*a+1];
+      offset[2] = -pos[3*a+2];
+      for (i=0; i<3; i++) {
+        shift[i] -= shift_a[i];
+      }
+      cell_add_vec(offset, unitcell, shift);
+      for (i=0; i<3; i++) {
+        shift[i] += shift_a[i];
+      }
+      for (b=bin_head[ibin]; b>=0; b=atom_next[b]) {
+        if (b >= nlow) continue;
+        delta[0] = atom_wpos[3*b  ] + offset[0];
+        delta[1] = atom_wpos[3*b+1] + offset[1];
+        delta[2] = atom_wpos[3*b+2] + offset[2];
+        dist = delta[0]*delta[0] + delta[1]*delta[1] + delta[2]*delta[2];
+        if (dist > rcut_margin) continue;
+        if (!nlist_binned_pair(pos, rcut, rcut_margin, rmax, unitcell, a, b,
+                               shift_a, atom_shifts + 3*b, shift,
+                               &neigh)) continue;
+        if (row >= nneigh) return -1;
+        neighs[row] = neigh;
+        if (neigh.d < *dmin) *dmin = neigh.d;
+        row++;
+      }
+    }
+    }
+    }
+  }
+  return row;
+}
+
+
 int nlist_inc_r(cell_type *unitcell, long *r, long *rmax) {
   // increment the counters for the periodic images.
   // returns 1 when the counters were incremented successfully.
@@ -180,12 +489,35 @@ endloop:
 }
 
 
+static void nlist_mic_center(double *delta, cell_type* unitcell, long *center) {
+  // Determine the cell vectors that cell_mic would subtract from delta. This
+  // is not done with cell_to_center because the latter may round differently
+  // for relative vectors at the boundary of the minimum image convention.
+  int i;
+  double mic[3];
+  mic[0] = delta[0];
+  mic[1] = delta[1];
+  mic[2] = delta[2];
+  cell_mic(mic, unitcell);
+  mic[0] -= delta[0];
+  mic[1] -= delta[1];
+  mic[2] -= delta[2];
+  for (i=0; i<(*unitcell).nvec; i++) {
+    center[i] = lround(
+      (*unitcell).gvecs[3*i  ]*mic[0] +
+      (*unitcell).gvecs[3*i+1]*mic[1] +
+      (*unitcell).gvecs[3*i+2]*mic[2]
+    );
+  }
+}
+
+
 void nlist_recompute_low(double *pos, double *pos_old, cell_type* unitcell,
                          neigh_row_type *neighs, long nneigh) {
-  long i, a, b;
+  long i, a, b, i0, i1;
   int update_delta0;
   long center[3];
-  double delta0[3], delta[3], d;
+  double delta0[3], delta[3], d, sign;
 
   update_delta0 = 1;
   a = -1;
@@ -200,18 +532,35 @@ void nlist_recompute_low(double *pos, double *pos_old, cell_type* unitcell,
     if (update_delta0) {
       a = (*neighs).a;
       b = (*neighs).b;
+      // The relative vector is computed in the same way as in nlist_build:
+      // from the atom with the highest index to the other one, followed by a
+      // change of sign if needed. Otherwise, the minimum image convention may
+      // pick a different image for atoms that are exactly half a cell vector
+      // apart.
+      if (a >= b) {
+        i0 = a;
+        i1 = b;
+        sign = 1.0;
+      } else {
+        i0 = b;
+        i1 = a;
+        sign = -1.0;
+      }
       // Compute the old relative vector.
-      delta0[0] = pos_old[3*b  ] - pos_old[3*a  ];
-      delta0[1] = pos_old[3*b+1] - pos_old[3*a+1];
-      delta0[2] = pos_old[3*b+2] - pos_old[3*a+2];
+      delta0[0] = pos_old[3*i1  ] - pos_old[3*i0  ];
+      delta0[1] = pos_old[3*i1+1] - pos_old[3*i0+1];
+      delta0[2] = pos_old[3*i1+2] - pos_old[3*i0+2];
       // Compute the cell vectors to be subtracted to bring the old to the MIC
-      cell_to_center(delta0, unitcell, center);
+      nlist_mic_center(delta0, unitcell, center);
       // Compute the new relative vector.
-      delta0[0] = pos[3*b  ] - pos[3*a  ];
-      delta0[1] = pos[3*b+1] - pos[3*a+1];
-      delta0[2] = pos[3*b+2] - pos[3*a+2];
+      delta0[0] = pos[3*i1  ] - pos[3*i0  ];
+      delta0[1] = pos[3*i1+1] - pos[3*i0+1];
+      delta0[2] = pos[3*i1+2] - pos[3*i0+2];
       // Apply the same cell displacement to the new relative vector
       cell_add_vec(delta0, unitcell, center);
+      delta0[0] *= sign;
+      delta0[1] *= sign;
+      delta0[2] *= sign;
       // Done updating delta0.
       update_delta0 = 0;
     }
@@ -36,6 +36,26 @@ cdef extern from "nlist.h":
                          cell.cell_type* cell, long *nlist_status,
                          neigh_row_type *neighs, long pos_size, long nlow, long nhigh, long nneigh)
 
+    bint nlist_build_binned_low(double *pos, double rcut, long *rmax,
+                                cell.cell_type* cell, long *nlist_status,
+                                neigh_row_type *neighs, long pos_size, long nlow, long nhigh, long nneigh,
+                                long *nbins, long *bin_start, long *bin_atoms,
+                                long *atom_bins, long *atom_shifts)
+
+    void nlist_cells_insert_low(double *pos, cell.cell_type* cell, long *nbins,
+                                long *bin_head, long *atom_next, long *atom_prev,
+                                long *atom_ibins, long *atom_shifts,
+                                double *atom_wpos, long begin, long end)
+
+    void nlist_cells_remove_low(long *bin_head, long *atom_next, long *atom_prev,
+                                long *atom_ibins, long begin, long end)
+
+    long nlist_build_cells_low(double *pos, double rcut, long *rmax,
+                               cell.cell_type* cell, neigh_row_type *neighs,
+                               long pos_size, long nlow, long nneigh, long *nbins,
+                               long *bin_head, long *atom_next, long *atom_shifts,
+                               double *atom_wpos, double *dmin)
+
     void nlist_recompute_low(double *pos, double *pos_old, cell.cell_type*
                              unitcell, neigh_row_type *neighs, long nneigh)
 
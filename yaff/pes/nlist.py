@@ -35,17 +35,30 @@
 
    The ``NeighborList`` object contains algorithms to detect whether a full rebuild
    of the neighbor list is required, or whether a recomputation of the distances
-   and relative vectors is sufficient.
+   and relative vectors is sufficient. A rebuild is needed as soon as the sum of
+   the two largest atomic displacements since the last rebuild exceeds the skin.
+   Optionally, the skin is tuned on the fly to minimize the time spent on the
+   neighbor list per update. The number of rebuilds and recomputations and the
+   time spent on them are recorded, such that they can be reported afterwards.
+
+   For large 3D periodic systems, a full rebuild makes use of a linked-cell
+   algorithm: the atoms are sorted into bins in fractional coordinates and only
+   atoms in neighboring bins are considered as candidate pairs. This reduces
+   the cost of a rebuild from quadratic to linear in the number of atoms. The
+   resulting neighbor list is identical to the one obtained with the simple
+   loop over all pairs.
 '''
 
 
 from __future__ import division
 
+import time
+
 import numpy as np
 
 from yaff.log import log, timer
 from yaff.pes.ext import neigh_dtype, nlist_status_init,\
-        nlist_status_finish, nlist_build, nlist_recompute
+        nlist_status_finish, nlist_build, nlist_build_binned, nlist_recompute
 
 
 __all__ = ['NeighborList','BondedNeighborList']
@@ -54,7 +67,23 @@ __all__ = ['NeighborList','BondedNeighborList']
 class NeighborList(object):
     '''Algorithms to keep track of all pair distances below a given rcut
     '''
-    def __init__(self, system, skin=0, nlow=0, nhigh=-1):
+    # The minimum number of atoms for which the linked-cell algorithm is used
+    # by default.
+    binned_natom = 500
+    # The initial skin, as a fraction of rcut, used by the adaptive skin
+    # algorithm when no skin is given.
+    adaptive_skin_init = 0.1
+    # The range of skins, as a fraction of rcut, considered by the adaptive
+    # skin algorithm.
+    adaptive_skin_range = (0.01, 0.5)
+    # The names of the items in the array returned by get_stats.
+    stats_names = (
+        'nrebuild', 'nrecompute', 'nneigh', 'skin', 'time_rebuild',
+        'time_recompute',
+    )
+
+    def __init__(self, system, skin=0, nlow=0, nhigh=-1, binned=None,
+                 adaptive_skin=False):
         """
            **Arguments:**
 
@@ -89,6 +118,22 @@ class NeighborList(object):
                 pairs involving one atom of each part will be included. This is
                 useful to calculate interaction energies in Monte Carlo
                 simulations
+
+            binned
+                When True, the neighbor list is rebuilt with the linked-cell
+                algorithm. When False, all atom pairs are considered in a
+                rebuild. The default, None, selects the linked-cell algorithm
+                for systems with at least ``binned_natom`` atoms. Only 3D
+                periodic systems can make use of the linked-cell algorithm.
+                The resulting neighbor list does not depend on this option.
+
+            adaptive_skin
+                When True, the skin is adjusted after every rebuild that is
+                caused by atomic displacements. The new skin minimizes the
+                estimated time per update, based on the measured cost of
+                rebuilds and recomputations and the rate at which the atoms
+                move. The skin argument is used as initial value. When it is
+                zero, ``adaptive_skin_init*rcut`` is used instead.
         """
         if skin < 0:
             raise ValueError('The skin parameter must be positive.')
@@ -107,15 +152,44 @@ class NeighborList(object):
         if nhigh < self.nlow:
             raise ValueError('nhigh must not be smaller than nlow, received %d.'%nhigh)
         self.nhigh = nhigh
+        if binned is None:
+            binned = system.natom >= self.binned_natom
+        self.binned = binned and system.cell.nvec == 3
         # for skin algorithm:
         self._pos_old = None
         self.rebuild_next = False
+        self.adaptive_skin = adaptive_skin
+        # statistics
+        self.reset_stats()
 
     def request_rcut(self, rcut):
         """Make sure the internal rcut parameter is at least is high as rcut."""
         self.rcut = max(self.rcut, rcut)
         self.update_rmax()
 
+    def set_bounds(self, nlow, nhigh):
+        '''Change the atom pairs that are included in the neighbor list
+
+           **Arguments:**
+
+           nlow, nhigh
+                Atom pairs are only included if one atom index is higher than
+                or equal to nlow and the other atom index is smaller than
+                nhigh, see the constructor. Unlike in the constructor, nhigh
+                may be smaller than nlow. Then the atoms with indexes from
+                nhigh up to nlow are excluded completely, which is used to
+                deactivate guest molecules in Monte Carlo simulations.
+
+           The neighbor list is rebuilt at the next update.
+        '''
+        if nlow < 0 or nlow > self.system.natom:
+            raise ValueError('nlow must be in the range [0, %d], received %d.' % (self.system.natom, nlow))
+        if nhigh < 0 or nhigh > self.system.natom:
+            raise ValueError('nhigh must be in the range [0, %d], received %d.' % (self.system.natom, nhigh))
+        self.nlow = nlow
+        self.nhigh = nhigh
+        self.rebuild_next = True
+
     def update_rmax(self):
         """Recompute the ``rmax`` attribute.
 
@@ -155,7 +229,14 @@ class NeighborList(object):
         with log.section('NLIST'), timer.section('Nlists'):
             assert self.rcut > 0
 
+            if self.adaptive_skin and self.skin == 0:
+                self.skin = self.adaptive_skin_init*self.rcut
+                self.update_rmax()
+
+            time0 = time.time()
             if self._need_rebuild():
+                if self.adaptive_skin and not self.rebuild_next and self._pos_old is not None:
+                    self._tune_skin()
                 # *rebuild* the entire neighborlist
                 if self.system.cell.volume != 0:
                     if self.system.natom/self.system.cell.volume > 10:
@@ -167,12 +248,23 @@ class NeighborList(object):
                 # for excluded atom pairs in the neighbourlist build
                 status[3] = self.nlow
                 # 2) a loop of consecutive update/allocate calls
+                if self.binned:
+                    bins = self._compute_bins()
                 last_start = 0
                 while True:
-                    done = nlist_build(
-                        self.system.pos, self.rcut + self.skin, self.rmax,
-                        self.system.cell, status, self.neighs[last_start:], self.nlow, self.nhigh
-                    )
+                    if self.binned:
+                        # Rows of a partially processed atom are discarded.
+                        last_start = nlist_status_finish(status)
+                        done = nlist_build_binned(
+                            self.system.pos, self.rcut + self.skin, self.rmax,
+                            self.system.cell, status, self.neighs[last_start:],
+                            self.nlow, self.nhigh, *bins
+                        )
+                    else:
+                        done = nlist_build(
+                            self.system.pos, self.rcut + self.skin, self.rmax,
+                            self.system.cell, status, self.neighs[last_start:], self.nlow, self.nhigh
+                        )
                     if done:
                         break
                     last_start = len(self.neighs)
@@ -188,12 +280,48 @@ class NeighborList(object):
                 #    need to do a rebuild or a recompute.
                 self._checkpoint()
                 self.rebuild_next = False
+                self.nrebuild += 1
+                self._last_rebuild = time.time() - time0
+                self.time_rebuild += self._last_rebuild
+                self._cycle_nrecompute = 0
+                self._cycle_time_recompute = 0.0
             else:
                 # just *recompute* the deltas and the distance in the
                 # neighborlist
                 nlist_recompute(self.system.pos, self._pos_old, self.system.cell, self.neighs[:self.nneigh])
                 if log.do_debug:
                     log('Recomputed')
+                elapsed = time.time() - time0
+                self.nrecompute += 1
+                self.time_recompute += elapsed
+                self._cycle_nrecompute += 1
+                self._cycle_time_recompute += elapsed
+
+    def _compute_bins(self):
+        '''Internal method that sorts the atoms into bins for the linked-cell
+           algorithm.
+
+           The bins are a regular grid in fractional coordinates. Along each
+           cell vector, the bins are at least as wide (measured orthogonal to
+           the cell planes) as the cutoff including the skin. Hence, triclinic
+           cells are treated in the same way as orthorhombic ones.
+        '''
+        cell = self.system.cell
+        rcut = self.rcut + self.skin
+        nbins = np.maximum(np.floor(2*cell.rspacings/rcut), 1).astype(int)
+        frac = np.dot(self.system.pos, cell.gvecs.T)
+        atom_shifts = -np.floor(frac).astype(int)
+        frac += atom_shifts
+        atom_bins = np.floor(frac*nbins).astype(int)
+        # Protect against round-off errors for atoms on the cell boundary.
+        np.clip(atom_bins, 0, nbins-1, out=atom_bins)
+        ibins = (atom_bins[:,0]*nbins[1] + atom_bins[:,1])*nbins[2] + atom_bins[:,2]
+        bin_atoms = np.argsort(ibins, kind='mergesort')
+        bin_start = np.zeros(nbins.prod()+1, int)
+        np.cumsum(np.bincount(ibins, minlength=nbins.prod()), out=bin_start[1:])
+        if log.do_debug:
+            log('Linked cells a,b,c = %i,%i,%i' % tuple(nbins))
+        return nbins, bin_start, bin_atoms, atom_bins, atom_shifts
 
     def _checkpoint(self):
         '''Internal method called after a neighborlist rebuild.'''
@@ -209,14 +337,85 @@ class NeighborList(object):
         if self.skin <= 0 or self._pos_old is None or self.rebuild_next:
             return True
         else:
-            # Compute an upper bound for the maximum relative displacement.
-            disp = np.sqrt(((self.system.pos - self._pos_old)**2).sum(axis=1).max())
-            disp *= 2*(self.rmax.max()+1)
+            # The distance between two atoms (or their periodic images)
+            # changes at most by the sum of their displacements, so the sum of
+            # the two largest displacements is an upper bound for the change
+            # of any distance since the last rebuild.
+            disp = np.sqrt(((self.system.pos - self._pos_old)**2).sum(axis=1))
+            if len(disp) > 1:
+                disp = disp[np.argpartition(disp, -2)[-2:]].sum()
+            else:
+                disp = 2*disp.sum()
             if log.do_debug:
                 log('Maximum relative displacement %s      Skin %s' % (log.length(disp), log.length(self.skin)))
+            self._last_disp = disp
             # Compare with skin parameter
             return disp >= self.skin
 
+    def _tune_skin(self):
+        '''Internal method that adjusts the skin before a rebuild.
+
+           The time per update is modeled as follows. The costs of a rebuild
+           and a recomputation are proportional to the number of pairs, i.e.
+           to ``(rcut+skin)**3``. The number of updates between two rebuilds
+           is proportional to the skin, using the rate at which the
+           displacements grew in the last cycle. The skin that minimizes the
+           model, within a factor of two of the current skin, is selected.
+        '''
+        nupdate = self._cycle_nrecompute + 1
+        if self._cycle_nrecompute == 0:
+            # No timing of recomputations available, just increase the skin.
+            skin = 2*self.skin
+        else:
+            time_recompute = self._cycle_time_recompute/self._cycle_nrecompute
+            rate = self._last_disp/nupdate
+            skins = self.skin*np.exp(np.linspace(-np.log(2), np.log(2), 21))
+            nupdates = np.maximum(skins/rate, 1)
+            costs = (self._last_rebuild + (nupdates - 1)*time_recompute)/nupdates
+            costs *= ((self.rcut + skins)/(self.rcut + self.skin))**3
+            skin = skins[costs.argmin()]
+        skin_min, skin_max = self.adaptive_skin_range
+        skin = np.clip(skin, skin_min*self.rcut, skin_max*self.rcut)
+        if skin != self.skin:
+            if log.do_high:
+                log('Skin changed from %s to %s after %i updates' % (
+                    log.length(self.skin), log.length(skin), nupdate
+                ))
+            self.skin = skin
+            self.update_rmax()
+
+    def reset_stats(self):
+        '''Reset the counters of rebuilds and recomputations and their timings.'''
+        self.nrebuild = 0
+        self.nrecompute = 0
+        self.time_rebuild = 0.0
+        self.time_recompute = 0.0
+        self._last_rebuild = 0.0
+        self._last_disp = 0.0
+        self._cycle_nrecompute = 0
+        self._cycle_time_recompute = 0.0
+
+    def get_stats(self):
+        '''Return an array with statistics of the neighbor list updates.
+
+           The items in the array are described by the ``stats_names``
+           attribute: the number of rebuilds, the number of recomputations,
+           the current number of pairs, the current skin, the total time spent
+           on rebuilds and the total time spent on recomputations.
+        '''
+        return np.array([
+            self.nrebuild, self.nrecompute, self.nneigh, self.skin,
+            self.time_rebuild, self.time_recompute,
+        ], dtype=float)
+
+    def log_stats(self):
+        '''Write the statistics of the neighbor list updates to the screen.'''
+        if log.do_medium:
+            with log.section('NLIST'):
+                log('Rebuilds:             %10i   Time [s]: %10.3f' % (self.nrebuild, self.time_rebuild))
+                log('Recomputations:       %10i   Time [s]: %10.3f' % (self.nrecompute, self.time_recompute))
+                log('Pairs:                %10i   Skin:     %s' % (self.nneigh, log.length(self.skin)))
+
 
     def to_dictionary(self):
         """Transform current neighbor list into a dictionary.
@@ -395,6 +594,8 @@ class BondedNeighborList(NeighborList):
         self.neighs = np.sort(neighs, order=['a','b']).copy()
         del neighs, selected, pairs
         self._pos_old = system.pos.copy()
+        self.skin = 0.0
+        self.reset_stats()
 
     def request_rcut(self, rcut):
         # Nothing to do...
@@ -406,5 +607,8 @@ class BondedNeighborList(NeighborList):
 
     def update(self):
         # Simply recompute distances, no need to rebuild
+        time0 = time.time()
         nlist_recompute(self.system.pos, self._pos_old, self.system.cell, self.neighs[:self.nneigh])
         self._pos_old[:] = self.system.pos
+        self.nrecompute += 1
+        self.time_recompute += time.time() - time0
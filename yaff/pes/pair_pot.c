@@ -24,12 +24,33 @@
 
 #include <math.h>
 #include <stdlib.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 #include "constants.h"
 #include "pair_pot.h"
 #include "slater.h"
 #include "tailcorr.h"
 
 
+// The number of threads used by pair_pot_compute. Zero means that the
+// default of OpenMP is used, e.g. as set by the OMP_NUM_THREADS variable.
+static long pair_pot_nthread = 0;
+
+void pair_pot_set_nthread(long nthread) {
+  pair_pot_nthread = (nthread > 0) ? nthread : 0;
+}
+
+long pair_pot_get_nthread(void) {
+#ifdef _OPENMP
+  if (pair_pot_nthread > 0) return pair_pot_nthread;
+  return omp_get_max_threads();
+#else
+  return 1;
+#endif
+}
+
+
 pair_pot_type* pair_pot_new(void) {
   pair_pot_type* result;
   result = malloc(sizeof(pair_pot_type));
@@ -62,119 +83,321 @@ void pair_pot_set_trunc_scheme(pair_pot_type *pair_pot, trunc_scheme_type *trunc
   (*pair_pot).trunc_scheme = trunc_scheme;
 }
 
-double get_scaling(scaling_row_type *stab, long a, long b, long *row, long size) {
-  if (*row >= size) return 1.0;
-  while (stab[*row].a < a) {
-    (*row)++;
-    if (*row >= size) return 1.0;
-  }
-  if (stab[*row].a != a) return 1.0;
-  while (stab[*row].b < b) {
-    (*row)++;
-    if (*row >= size) return 1.0;
-    if (stab[*row].a != a) return 1.0;
-  }
-  if ((stab[*row].b == b) && (stab[*row].a == a)) {
-    return stab[*row].scale;
+double get_scaling(scaling_row_type *partners, long *offsets, long a, long b) {
+  /*
+  Look up the scaling of the pair (a, b) in the per-atom index of scaled
+  partners. The rows offsets[a] to offsets[a+1] contain the partners of atom
+  a, sorted by the index of the partner. This is independent of the order in
+  which the pairs are visited.
+  */
+  long row, end;
+  end = offsets[a+1];
+  for (row=offsets[a]; row<end; row++) {
+    if (partners[row].b >= b) {
+      if (partners[row].b == b) return partners[row].scale;
+      break;
+    }
   }
   return 1.0;
 }
 
 
-double pair_pot_compute(neigh_row_type *neighs,
-                        long nneigh, scaling_row_type *stab,
-                        long nstab, pair_pot_type *pair_pot,
-                        double *gpos, double* vtens) {
-  long i, srow, center_index, other_index;
-  double s, energy, v, vg, h, hg;
+static double pair_pot_compute_row(neigh_row_type *neigh, double s,
+                                   pair_pot_type *pair_pot, double *gpos,
+                                   double* vtens) {
+  long center_index, other_index;
+  double v, vg, h, hg;
   double delta[3], vg_cart[3];
-  energy = 0.0;
-  // Reset the row counter for the scaling.
-  srow = 0;
+  center_index = (*neigh).a;
+  other_index = (*neigh).b;
+  //Construct vector of distances, needed for some pair potentials
+  delta[0] = (*neigh).dx;
+  delta[1] = (*neigh).dy;
+  delta[2] = (*neigh).dz;
+  if ((gpos==NULL) && (vtens==NULL)) {
+    // Call the potential function without g argument.
+    v = (*pair_pot).pair_fn((*pair_pot).pair_data, center_index, other_index, (*neigh).d, delta, NULL, NULL);
+    // If a truncation scheme is defined, apply it.
+    if (((*pair_pot).trunc_scheme!=NULL) && (v!=0.0)) {
+      v *= (*(*pair_pot).trunc_scheme).trunc_fn((*neigh).d, (*pair_pot).rcut, (*(*pair_pot).trunc_scheme).par, NULL);
+    }
+  } else {
+    // Call the potential function with vg argument.
+    // vg_cart contains the (partial) derivatives of the pair potential to
+    // cartesian coordinates. Implicit dependence (through d) of the
+    // pair potential on cartesian coordinates is captured by vg.
+    vg_cart[0] = 0.0; //vg_cart is reset here because not all pair_fn set it.
+    vg_cart[1] = 0.0;
+    vg_cart[2] = 0.0;
+    // vg is the derivative of the pair potential to d divided by the distance.
+    v = (*pair_pot).pair_fn((*pair_pot).pair_data, center_index, other_index, (*neigh).d, delta, &vg, vg_cart);
+    // If a truncation scheme is defined, apply it.
+    // TODO: include vg_cart (not necessary as long as the truncation scheme only depends on distance)
+    if (((*pair_pot).trunc_scheme!=NULL) && ((v!=0.0) || (vg!=0.0))) {
+      // hg is (a pointer to) the derivative of the truncation function.
+      h = (*(*pair_pot).trunc_scheme).trunc_fn((*neigh).d,    (*pair_pot).rcut, (*(*pair_pot).trunc_scheme).par, &hg);
+      // chain rule:
+      vg = vg*h + v*hg/(*neigh).d;
+      vg_cart[0] = vg_cart[0]*h;
+      vg_cart[1] = vg_cart[1]*h;
+      vg_cart[2] = vg_cart[2]*h;
+      v *= h;
+    }
+    vg *= s;
+    vg_cart[0] *= s;
+    vg_cart[1] *= s;
+    vg_cart[2] *= s;
+    if (gpos!=NULL) {
+      h = (*neigh).dx*vg;
+      gpos[3*other_index  ] += h + vg_cart[0];
+      gpos[3*center_index   ] -= h + vg_cart[0];
+      h = (*neigh).dy*vg;
+      gpos[3*other_index+1] += h + vg_cart[1];
+      gpos[3*center_index +1] -= h + vg_cart[1];
+      h = (*neigh).dz*vg;
+      gpos[3*other_index+2] += h + vg_cart[2];
+      gpos[3*center_index +2] -= h + vg_cart[2];
+    }
+    if (vtens!=NULL) {
+      vtens[0] += (*neigh).dx*((*neigh).dx*vg+vg_cart[0]);
+      vtens[4] += (*neigh).dy*((*neigh).dy*vg+vg_cart[1]);
+      vtens[8] += (*neigh).dz*((*neigh).dz*vg+vg_cart[2]);
+      vtens[1] += (*neigh).dx*((*neigh).dy*vg+vg_cart[1]);
+      vtens[3] += (*neigh).dy*((*neigh).dx*vg+vg_cart[0]);
+      vtens[2] += (*neigh).dx*((*neigh).dz*vg+vg_cart[2]);
+      vtens[6] += (*neigh).dz*((*neigh).dx*vg+vg_cart[0]);
+      vtens[5] += (*neigh).dy*((*neigh).dz*vg+vg_cart[2]);
+      vtens[7] += (*neigh).dz*((*neigh).dy*vg+vg_cart[1]);
+    }
+  }
+  return s*v;
+}
+
+
+static void pair_pot_compute_range(neigh_row_type *neighs,
+                                   long begin, long end,
+                                   scaling_row_type **partners, long **offsets,
+                                   pair_pot_type **pair_pots, long npot,
+                                   double *gpos, double* vtens,
+                                   double *energies) {
+  /*
+  Compute the interactions of npot pair potentials in one pass over the rows
+  begin to end of the neighbor list. Pair potentials with the same scaling
+  index share the lookup of the scaling factor. The energy of each pair
+  potential is stored in energies.
+  */
+  long i, k, l;
+  long itabs[PAIR_POT_MAX_MULTI];
+  double rcut, s;
+  double rcuts[PAIR_POT_MAX_MULTI], scales[PAIR_POT_MAX_MULTI];
+  // For each pair potential, find the first one with the same scaling index.
+  rcut = 0.0;
+  for (k=0; k<npot; k++) {
+    energies[k] = 0.0;
+    rcuts[k] = 0.0;
+    for (l=0; l<=k; l++) {
+      if (partners[l] == partners[k]) break;
+    }
+    itabs[k] = l;
+    // The largest cutoff of all potentials that share a scaling index.
+    if ((*pair_pots[k]).rcut > rcuts[l]) rcuts[l] = (*pair_pots[k]).rcut;
+    if ((*pair_pots[k]).rcut > rcut) rcut = (*pair_pots[k]).rcut;
+  }
   // Compute the interactions.
-  for (i=0; i<nneigh; i++) {
-    // Find the scale
-    if (neighs[i].d < (*pair_pot).rcut) {
-      center_index = neighs[i].a;
-      other_index = neighs[i].b;
-      if ((neighs[i].r0 == 0) && (neighs[i].r1 == 0) && (neighs[i].r2 == 0)) {
-        s = get_scaling(stab, center_index, other_index, &srow, nstab);
+  for (i=begin; i<end; i++) {
+    if (neighs[i].d >= rcut) continue;
+    // Find the scales, once for each scaling index.
+    for (k=0; k<npot; k++) {
+      if (itabs[k] != k) continue;
+      if ((neighs[i].d < rcuts[k]) && (neighs[i].r0 == 0) && (neighs[i].r1 == 0) && (neighs[i].r2 == 0)) {
+        scales[k] = get_scaling(partners[k], offsets[k], neighs[i].a, neighs[i].b);
       } else {
-        s = 1.0;
+        scales[k] = 1.0;
       }
+    }
+    for (k=0; k<npot; k++) {
+      if (neighs[i].d >= (*pair_pots[k]).rcut) continue;
+      s = scales[itabs[k]];
       // If the scale is non-zero, compute the contribution.
       if (s != 0.0) {
-        //Construct vector of distances, needed for some pair potentials
-        delta[0] = neighs[i].dx;
-        delta[1] = neighs[i].dy;
-        delta[2] = neighs[i].dz;
-        if ((gpos==NULL) && (vtens==NULL)) {
-          // Call the potential function without g argument.
-          v = (*pair_pot).pair_fn((*pair_pot).pair_data, center_index, other_index, neighs[i].d, delta, NULL, NULL);
-          // If a truncation scheme is defined, apply it.
-          if (((*pair_pot).trunc_scheme!=NULL) && (v!=0.0)) {
-            v *= (*(*pair_pot).trunc_scheme).trunc_fn(neighs[i].d, (*pair_pot).rcut, (*(*pair_pot).trunc_scheme).par, NULL);
-          }
-        } else {
-          // Call the potential function with vg argument.
-          // vg_cart contains the (partial) derivatives of the pair potential to
-          // cartesian coordinates. Implicit dependence (through d) of the
-          // pair potential on cartesian coordinates is captured by vg.
-          vg_cart[0] = 0.0; //vg_cart is reset here because not all pair_fn set it.
-          vg_cart[1] = 0.0;
-          vg_cart[2] = 0.0;
-          // vg is the derivative of the pair potential to d divided by the distance.
-          v = (*pair_pot).pair_fn((*pair_pot).pair_data, center_index, other_index, neighs[i].d, delta, &vg, vg_cart);
-          // If a truncation scheme is defined, apply it.
-          // TODO: include vg_cart (not necessary as long as the truncation scheme only depends on distance)
-          if (((*pair_pot).trunc_scheme!=NULL) && ((v!=0.0) || (vg!=0.0))) {
-            // hg is (a pointer to) the derivative of the truncation function.
-            h = (*(*pair_pot).trunc_scheme).trunc_fn(neighs[i].d,    (*pair_pot).rcut, (*(*pair_pot).trunc_scheme).par, &hg);
-            // chain rule:
-            vg = vg*h + v*hg/neighs[i].d;
-            vg_cart[0] = vg_cart[0]*h;
-            vg_cart[1] = vg_cart[1]*h;
-            vg_cart[2] = vg_cart[2]*h;
-            v *= h;
-          }
-          //printf("C %3i %3i (% 3i % 3i % 3i) %10.7f %3.1f %10.3e\n", center_index, other_index, neighs[i].r0, neighs[i].r1, neighs[i].r2, neighs[i].d, s, s*v);
-          vg *= s;
-          vg_cart[0] *= s;
-          vg_cart[1] *= s;
-          vg_cart[2] *= s;
-          if (gpos!=NULL) {
-            h = neighs[i].dx*vg;
-            gpos[3*other_index  ] += h + vg_cart[0];
-            gpos[3*center_index   ] -= h + vg_cart[0];
-            h = neighs[i].dy*vg;
-            gpos[3*other_index+1] += h + vg_cart[1];
-            gpos[3*center_index +1] -= h + vg_cart[1];
-            h = neighs[i].dz*vg;
-            gpos[3*other_index+2] += h + vg_cart[2];
-            gpos[3*center_index +2] -= h + vg_cart[2];
+        energies[k] += pair_pot_compute_row(&neighs[i], s, pair_pots[k], gpos, vtens);
+      }
+    }
+  }
+}
+
+void pair_pot_compute_multi(neigh_row_type *neighs,
+                           long nneigh, scaling_row_type **partners,
+                           long **offsets, pair_pot_type **pair_pots, long npot,
+                           double *gpos, double* vtens, long natom,
+                           double *energies) {
+#ifdef _OPENMP
+  long i, k, ithread, nthread, nactive;
+  double *energies_work, *gpos_work, *vtens_work;
+  nthread = pair_pot_get_nthread();
+  if ((nthread > 1) && (nneigh >= PAIR_POT_MIN_ROWS_THREAD*nthread)) {
+    // Allocate thread-private output arrays. The first thread adds its
+    // contribution to gpos directly.
+    energies_work = malloc(npot*nthread*sizeof(double));
+    if (vtens != NULL) {
+      vtens_work = calloc(9*nthread, sizeof(double));
+    } else {
+      vtens_work = NULL;
+    }
+    if (gpos != NULL) {
+      gpos_work = calloc(3*natom*(nthread-1), sizeof(double));
+    } else {
+      gpos_work = NULL;
+    }
+    if ((energies_work != NULL) && ((vtens == NULL) || (vtens_work != NULL)) &&
+        ((gpos == NULL) || (gpos_work != NULL))) {
+      nactive = 1;
+      #pragma omp parallel num_threads(nthread) private(ithread)
+      {
+        // The number of threads may be lower than requested.
+        #pragma omp single
+        nactive = omp_get_num_threads();
+        ithread = omp_get_thread_num();
+        // Each thread takes a contiguous block of rows. The scalings are
+        // looked up per pair, so any split of the neighbor list works.
+        pair_pot_compute_range(
+          neighs, (nneigh*ithread)/nactive, (nneigh*(ithread+1))/nactive,
+          partners, offsets, pair_pots, npot,
+          (gpos == NULL) ? NULL : ((ithread == 0) ? gpos : gpos_work + 3*natom*(ithread-1)),
+          (vtens == NULL) ? NULL : vtens_work + 9*ithread,
+          energies_work + npot*ithread
+        );
+        // Reduce the thread-private gradients, always in the same order.
+        if (gpos != NULL) {
+          #pragma omp barrier
+          #pragma omp for
+          for (i=0; i<3*natom; i++) {
+            long jthread;
+            for (jthread=1; jthread<nactive; jthread++) {
+              gpos[i] += gpos_work[3*natom*(jthread-1) + i];
+            }
           }
-          if (vtens!=NULL) {
-            vtens[0] += neighs[i].dx*(neighs[i].dx*vg+vg_cart[0]);
-            vtens[4] += neighs[i].dy*(neighs[i].dy*vg+vg_cart[1]);
-            vtens[8] += neighs[i].dz*(neighs[i].dz*vg+vg_cart[2]);
-            //h = neighs[i].dx*(neighs[i].dy*vg+vg_cart[1]);
-            vtens[1] += neighs[i].dx*(neighs[i].dy*vg+vg_cart[1]);
-            vtens[3] += neighs[i].dy*(neighs[i].dx*vg+vg_cart[0]);
-            //h = neighs[i].dx*(neighs[i].dz*vg+vg_cart[2]);
-            vtens[2] += neighs[i].dx*(neighs[i].dz*vg+vg_cart[2]);
-            vtens[6] += neighs[i].dz*(neighs[i].dx*vg+vg_cart[0]);
-            //h = neighs[i].dy*(neighs[i].dz*vg+vg_cart[2]);
-            vtens[5] += neighs[i].dy*(neighs[i].dz*vg+vg_cart[2]);
-            vtens[7] += neighs[i].dz*(neighs[i].dy*vg+vg_cart[1]);
+        }
+      }
+      // Reduce the energies and the virial tensor, always in the same order.
+      for (k=0; k<npot; k++) {
+        energies[k] = 0.0;
+      }
+      for (ithread=0; ithread<nactive; ithread++) {
+        for (k=0; k<npot; k++) {
+          energies[k] += energies_work[npot*ithread + k];
+        }
+        if (vtens != NULL) {
+          for (i=0; i<9; i++) {
+            vtens[i] += vtens_work[9*ithread + i];
           }
         }
-        energy += s*v;
       }
+      free(energies_work);
+      free(vtens_work);
+      free(gpos_work);
+      return;
     }
+    // Not enough memory for the thread-private arrays, fall back to the
+    // serial algorithm.
+    free(energies_work);
+    free(vtens_work);
+    free(gpos_work);
   }
+#endif
+  pair_pot_compute_range(neighs, 0, nneigh, partners, offsets, pair_pots, npot, gpos, vtens, energies);
+}
+
+double pair_pot_compute(neigh_row_type *neighs,
+                        long nneigh, scaling_row_type *partners,
+                        long *offsets, pair_pot_type *pair_pot,
+                        double *gpos, double* vtens, long natom) {
+  double energy;
+  pair_pot_compute_multi(neighs, nneigh, &partners, &offsets, &pair_pot, 1, gpos, vtens, natom, &energy);
   return energy;
 }
 
+void pair_pot_compute_points(neigh_row_type *neighs, long nneigh,
+                             pair_pot_type **pair_pots, long npot, long nlow,
+                             long iatom, double *energies) {
+  /*
+  Compute the interaction of a probe atom iatom, placed at several points,
+  with the atoms below nlow. In the neighbor list, the points have indexes
+  nlow, nlow+1, ... The energy of each point is added to energies. The
+  interactions between probe and host are never scaled.
+  */
+  long i, k, ipoint;
+  neigh_row_type row;
+  for (i=0; i<nneigh; i++) {
+    row = neighs[i];
+    if (row.a >= nlow) {
+      ipoint = row.a - nlow;
+      row.a = iatom;
+    } else {
+      ipoint = row.b - nlow;
+      row.b = iatom;
+    }
+    if (ipoint < 0) continue;
+    for (k=0; k<npot; k++) {
+      if (row.d >= (*pair_pots[k]).rcut) continue;
+      energies[ipoint] += pair_pot_compute_row(&row, 1.0, pair_pots[k], NULL, NULL);
+    }
+  }
+}
+
+double pair_pot_eval(pair_pot_type *pair_pot, long center_index, long other_index,
+                     double d, double *delta, double *g) {
+  /*
+  Evaluate a single pair interaction, including the truncation scheme. When g
+  is not NULL, it will contain the derivative of the energy towards d,
+  divided by d. The partial derivatives towards Cartesian coordinates (of
+  e.g. the dipole interactions) are not supported.
+  */
+  double v, h, hg;
+  double vg_cart[3];
+  vg_cart[0] = 0.0;
+  vg_cart[1] = 0.0;
+  vg_cart[2] = 0.0;
+  if (g == NULL) {
+    v = (*pair_pot).pair_fn((*pair_pot).pair_data, center_index, other_index, d, delta, NULL, NULL);
+    if ((*pair_pot).trunc_scheme != NULL) {
+      v *= (*(*pair_pot).trunc_scheme).trunc_fn(d, (*pair_pot).rcut, (*(*pair_pot).trunc_scheme).par, NULL);
+    }
+  } else {
+    *g = 0.0;
+    v = (*pair_pot).pair_fn((*pair_pot).pair_data, center_index, other_index, d, delta, g, vg_cart);
+    if ((*pair_pot).trunc_scheme != NULL) {
+      h = (*(*pair_pot).trunc_scheme).trunc_fn(d, (*pair_pot).rcut, (*(*pair_pot).trunc_scheme).par, &hg);
+      *g = (*g)*h + v*hg/d;
+      v *= h;
+    }
+  }
+  return v;
+}
+
+void pair_pot_sample(pair_pot_type *pair_pot, long n, long *centers, long *others,
+                     double *ds, double *vs, double *dvs) {
+  /*
+  Evaluate the pair potential for n pairs of atoms at the given distances,
+  without scaling. The energies are stored in vs and, if dvs is not NULL, the
+  derivatives towards the distance are stored in dvs.
+  */
+  long i;
+  double g;
+  double delta[3];
+  for (i=0; i<n; i++) {
+    delta[0] = ds[i];
+    delta[1] = 0.0;
+    delta[2] = 0.0;
+    if (dvs == NULL) {
+      vs[i] = pair_pot_eval(pair_pot, centers[i], others[i], ds[i], delta, NULL);
+    } else {
+      vs[i] = pair_pot_eval(pair_pot, centers[i], others[i], ds[i], delta, &g);
+      dvs[i] = g*ds[i];
+    }
+  }
+}
+
 void pair_pot_tailcorr_cut(double *corrs, long natom, long nlow, long nhigh, pair_pot_type *pair_pot) {
   /*
   The first element of ``corrs'' will contain
@@ -1110,3 +1333,48 @@ double pair_data_chargetransferslater1s1s_get_ct_scale(pair_pot_type *pair_pot)
 double pair_data_chargetransferslater1s1s_get_width_power(pair_pot_type *pair_pot) {
   return (*(pair_data_chargetransferslater1s1s_type*)((*pair_pot).pair_data)).width_power;
 }
+
+
+
+void pair_data_tabulated_init(pair_pot_type *pair_pot, long nffatype, long* ffatype_ids, long *pair_ids, long npoint, double rmin, double dr, double *coeffs, pair_pot_type *source) {
+  pair_data_tabulated_type *pair_data;
+  pair_data = malloc(sizeof(pair_data_tabulated_type));
+  (*pair_pot).pair_data = pair_data;
+  if (pair_data != NULL) {
+    (*pair_pot).pair_fn = pair_fn_tabulated;
+    (*pair_data).nffatype = nffatype;
+    (*pair_data).ffatype_ids = ffatype_ids;
+    (*pair_data).pair_ids = pair_ids;
+    (*pair_data).npoint = npoint;
+    (*pair_data).rmin = rmin;
+    (*pair_data).inv_dr = 1.0/dr;
+    (*pair_data).coeffs = coeffs;
+    (*pair_data).source = source;
+  }
+}
+
+double pair_fn_tabulated(void *pair_data, long center_index, long other_index, double d, double *delta, double *g, double *g_cart) {
+  long k, ipair;
+  double t, *c;
+  pair_data_tabulated_type *pd;
+  pd = (pair_data_tabulated_type*)pair_data;
+  // Short distances are not covered by the table.
+  if (d < (*pd).rmin) {
+    return pair_pot_eval((*pd).source, center_index, other_index, d, delta, g);
+  }
+  ipair = (*pd).pair_ids[(*pd).ffatype_ids[center_index]*(*pd).nffatype + (*pd).ffatype_ids[other_index]];
+  if (ipair < 0) {
+    if (g != NULL) *g = 0.0;
+    return 0.0;
+  }
+  // Locate the interval and the reduced coordinate t in [0, 1].
+  t = (d - (*pd).rmin)*(*pd).inv_dr;
+  k = (long)t;
+  if (k > (*pd).npoint-2) k = (*pd).npoint-2;
+  t -= k;
+  c = (*pd).coeffs + 4*(ipair*((*pd).npoint-1) + k);
+  if (g != NULL) {
+    *g = (c[1] + t*(2.0*c[2] + 3.0*t*c[3]))*(*pd).inv_dr/d;
+  }
+  return c[0] + t*(c[1] + t*(c[2] + t*c[3]));
+}
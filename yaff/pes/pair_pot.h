@@ -58,10 +58,36 @@ void pair_pot_set_rcut(pair_pot_type *pair_pot, double rcut);
 void pair_pot_set_trunc_scheme(pair_pot_type *pair_pot, trunc_scheme_type *trunc_sceme);
 void pair_data_free(pair_pot_type *pair_pot);
 
+// Below this number of neighbor rows per thread, the pair potential is
+// computed serially.
+#define PAIR_POT_MIN_ROWS_THREAD 1024
+
+// The maximal number of pair potentials in pair_pot_compute_multi.
+#define PAIR_POT_MAX_MULTI 32
+
+double get_scaling(scaling_row_type *partners, long *offsets, long a, long b);
+
+void pair_pot_set_nthread(long nthread);
+long pair_pot_get_nthread(void);
+
 double pair_pot_compute(neigh_row_type *neighs,
-                        long nneigh, scaling_row_type *scaling,
-                        long scaling_size, pair_pot_type *pair_pot,
-                        double *gpos, double* vtens);
+                        long nneigh, scaling_row_type *partners,
+                        long *offsets, pair_pot_type *pair_pot,
+                        double *gpos, double* vtens, long natom);
+void pair_pot_compute_multi(neigh_row_type *neighs,
+                            long nneigh, scaling_row_type **partners,
+                            long **offsets, pair_pot_type **pair_pots, long npot,
+                            double *gpos, double* vtens, long natom,
+                            double *energies);
+
+void pair_pot_compute_points(neigh_row_type *neighs, long nneigh,
+                             pair_pot_type **pair_pots, long npot, long nlow,
+                             long iatom, double *energies);
+
+double pair_pot_eval(pair_pot_type *pair_pot, long center_index, long other_index,
+                     double d, double *delta, double *g);
+void pair_pot_sample(pair_pot_type *pair_pot, long n, long *centers, long *others,
+                     double *ds, double *vs, double *dvs);
 
 void pair_pot_tailcorr_cut(double *corrs, long natom, long nlow, long nhigh, pair_pot_type *pair_pot);
 void pair_pot_tailcorr_switch3(double *corrs, long natom, long nlow, long nhigh, pair_pot_type *pair_pot);
@@ -239,4 +265,19 @@ void pair_data_chargetransferslater1s1s_init(pair_pot_type *pair_pot, double *sl
 double pair_fn_chargetransferslater1s1s(void *pair_data, long center_index, long other_index, double d, double *delta, double *g, double *g_cart);
 double pair_data_chargetransferslater1s1s_get_ct_scale(pair_pot_type *pair_pot);
 double pair_data_chargetransferslater1s1s_get_width_power(pair_pot_type *pair_pot);
+
+
+typedef struct {
+  long nffatype;
+  long *ffatype_ids;
+  long *pair_ids;
+  long npoint;
+  double rmin;
+  double inv_dr;
+  double *coeffs;
+  pair_pot_type *source;
+} pair_data_tabulated_type;
+
+void pair_data_tabulated_init(pair_pot_type *pair_pot, long nffatype, long* ffatype_ids, long *pair_ids, long npoint, double rmin, double dr, double *coeffs, pair_pot_type *source);
+double pair_fn_tabulated(void *pair_data, long center_index, long other_index, double d, double *delta, double *g, double *g_cart);
 #endif
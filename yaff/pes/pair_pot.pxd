@@ -45,10 +45,31 @@ cdef extern from "pair_pot.h":
     void pair_pot_set_trunc_scheme(pair_pot_type *pair_pot, truncation.trunc_scheme_type *trunc_sceme)
     void pair_data_free(pair_pot_type *pair_pot)
 
+    long PAIR_POT_MAX_MULTI
+
+    double get_scaling(scaling_row_type* partners, long* offsets, long a, long b)
+
+    void pair_pot_set_nthread(long nthread)
+    long pair_pot_get_nthread()
+
     double pair_pot_compute(nlist.neigh_row_type* neighs, long nneigh,
-                            scaling_row_type* scaling, long scaling_size,
+                            scaling_row_type* partners, long* offsets,
                             pair_pot_type* pair_pot, double *gpos,
-                            double* vtens)
+                            double* vtens, long natom) nogil
+
+    void pair_pot_compute_multi(nlist.neigh_row_type* neighs, long nneigh,
+                                scaling_row_type** partners, long** offsets,
+                                pair_pot_type** pair_pots, long npot,
+                                double *gpos, double* vtens, long natom,
+                                double* energies) nogil
+
+    void pair_pot_compute_points(nlist.neigh_row_type* neighs, long nneigh,
+                                 pair_pot_type** pair_pots, long npot,
+                                 long nlow, long iatom,
+                                 double* energies) nogil
+
+    double pair_pot_eval(pair_pot_type *pair_pot, long center_index, long other_index, double d, double *delta, double *g)
+    void pair_pot_sample(pair_pot_type *pair_pot, long n, long *centers, long *others, double *ds, double *vs, double *dvs)
 
     void pair_pot_tailcorr_cut(double *corrs, long natom, long nlow, long nhigh, pair_pot_type *pair_pot)
     void pair_pot_tailcorr_switch3(double *corrs, long natom, long nlow, long nhigh, pair_pot_type *pair_pot)
@@ -95,3 +116,5 @@ cdef extern from "pair_pot.h":
     void pair_data_chargetransferslater1s1s_init(pair_pot_type *pair_pot, double *slater1s_widths, double *slater1s_N, double ct_scale, double width_power)
     double pair_data_chargetransferslater1s1s_get_ct_scale(pair_pot_type *pair_pot)
     double pair_data_chargetransferslater1s1s_get_width_power(pair_pot_type *pair_pot)
+
+    void pair_data_tabulated_init(pair_pot_type *pair_pot, long nffatype, long* ffatype_ids, long *pair_ids, long npoint, double rmin, double dr, double *coeffs, pair_pot_type *source)
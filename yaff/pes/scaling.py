@@ -102,8 +102,43 @@ class Scalings(object):
                         stab.append((i0, i4, scale4, 4))
         stab.sort()
         self.stab = np.array(stab, dtype=scaling_dtype)
+        self._init_partners(system.natom)
         self.check_mic(system)
 
+    def _init_partners(self, natom):
+        '''Construct the per-atom index of scaled pairs from ``stab``
+
+           The pairs in ``stab`` are only included once, with a > b. The
+           attribute ``partners`` contains every pair twice, once for each
+           atom, and is sorted by (a, b). The scaled partners of atom ``i``
+           are ``partners[offsets[i]:offsets[i+1]]``. With this compressed
+           sparse row index, the scaling of any pair of atoms is found without
+           searching the entire table, irrespective of the order in which the
+           pairs are visited.
+        '''
+        npair = len(self.stab)
+        partners = np.zeros(2*npair, dtype=scaling_dtype)
+        partners[:npair] = self.stab
+        partners[npair:] = self.stab
+        partners['a'][npair:] = self.stab['b']
+        partners['b'][npair:] = self.stab['a']
+        # A stable sort keeps the order of duplicate pairs in stab.
+        self.partners = partners[np.lexsort((partners['b'], partners['a']))]
+        self.offsets = np.zeros(natom+1, int)
+        np.cumsum(np.bincount(self.partners['a'], minlength=natom), out=self.offsets[1:])
+
+    def get_scale(self, i0, i1):
+        '''Return the scaling of the interaction between atoms i0 and i1
+
+           The result is 1.0 for pairs that are not scaled.
+        '''
+        begin = self.offsets[i0]
+        end = self.offsets[i0+1]
+        irow = begin + np.searchsorted(self.partners['b'][begin:end], i1)
+        if irow < end and self.partners['b'][irow] == i1:
+            return self.partners['scale'][irow]
+        return 1.0
+
     def check_mic(self, system):
         '''Check if each scale2 and scale3 are uniquely defined.
 
@@ -339,3 +339,179 @@ def test_ewaldreciprocalinteraction_water32():
             cosfacs, sinfacs)
         e = ewald_interaction.compute_deltae(cosfacs, sinfacs)
         assert np.abs(e-eref)<1e-12
+
+
+def test_ewaldreciprocalinteraction_move_water32():
+    alpha = 0.1
+    dielectric = 1.3
+    system = get_system_water32()
+    ewald_interaction = ForcePartEwaldReciprocalInteraction(system.cell, alpha,
+         2.0*alpha, pos=system.pos, charges=system.charges,
+         dielectric=dielectric)
+    np.random.seed(1)
+    for imove in range(5):
+        # move the last molecule
+        oldpos = system.pos[-3:].copy()
+        newpos = oldpos + np.random.normal(0.0, 2.0, 3)
+        charges = system.charges[-3:]
+        # reference: deletion followed by insertion
+        cosfacs0 = ewald_interaction.cosfacs.copy()
+        sinfacs0 = ewald_interaction.sinfacs.copy()
+        eref = ewald_interaction.insertion_energy(oldpos, charges, sign=-1)
+        eref += ewald_interaction.insertion_energy(newpos, charges)
+        ewald_interaction.cosfacs[:] = cosfacs0
+        ewald_interaction.sinfacs[:] = sinfacs0
+        e = ewald_interaction.move_energy(oldpos, newpos, charges)
+        assert np.abs(e-eref)<1e-12
+        # the structure factors only change after accepting the move
+        assert (ewald_interaction.cosfacs==cosfacs0).all()
+        assert (ewald_interaction.sinfacs==sinfacs0).all()
+        ewald_interaction.accept_move()
+        system.pos[-3:] = newpos
+        shape = ewald_interaction.cosfacs.shape
+        cosfacs, sinfacs = np.zeros(shape), np.zeros(shape)
+        ewald_interaction.compute_structurefactors(system.pos, system.charges,
+            cosfacs, sinfacs)
+        assert abs(ewald_interaction.cosfacs - cosfacs).max() < 1e-10
+        assert abs(ewald_interaction.sinfacs - sinfacs).max() < 1e-10
+
+
+def check_ewald_ktable(system, alpha, gcut, dielectric=1.0, nlow=0, nhigh=-1):
+    from yaff.pes.ext import compute_ewald_reci
+    part = ForcePartEwaldReciprocal(system, alpha, gcut=gcut,
+        dielectric=dielectric, nlow=nlow, nhigh=nhigh)
+    gpos = np.zeros(system.pos.shape)
+    vtens = np.zeros((3, 3))
+    energy = part.compute(gpos, vtens)
+    # direct evaluation with cos and sin for every k-vector and atom
+    gpos_ref = np.zeros(system.pos.shape)
+    vtens_ref = np.zeros((3, 3))
+    energy_ref = compute_ewald_reci(system.pos, system.charges, system.cell,
+        alpha, part.gmax, gcut, dielectric, gpos_ref, part.work, vtens_ref,
+        part.nlow, part.nhigh)
+    assert abs(energy - energy_ref) < 1e-10*abs(energy_ref)
+    assert abs(gpos - gpos_ref).max() < 1e-10*abs(gpos_ref).max()
+    assert abs(vtens - vtens_ref).max() < 1e-10*abs(vtens_ref).max()
+    # the energy-only evaluation gives the same energy
+    assert abs(part.compute() - energy_ref) < 1e-10*abs(energy_ref)
+
+
+def test_ewald_ktable_water32():
+    system = get_system_water32()
+    check_ewald_ktable(system, 0.35, 0.7)
+    check_ewald_ktable(system, 0.1, 0.3, dielectric=1.4)
+    check_ewald_ktable(system, 0.35, 0.7, nlow=15, nhigh=33)
+
+
+def test_ewald_ktable_quartz():
+    system = get_system_quartz()
+    check_ewald_ktable(system, 0.2, 0.8)
+    check_ewald_ktable(system, 0.5, 1.0, nlow=3, nhigh=6)
+
+
+def test_ewald_ktable_cellchange_quartz():
+    system = get_system_quartz()
+    part = ForcePartEwaldReciprocal(system, 0.2, gcut=0.8)
+    gmax = part.gmax.copy()
+    part.compute()
+    # change the cell without calling update_rvecs on the part
+    system.cell.update_rvecs(system.cell.rvecs*1.05)
+    check_ewald_ktable(system, 0.2, 0.8)
+    energy = part.compute()
+    assert (part.gmax == gmax).all()
+    assert (part.rvecs0 == system.cell.rvecs).all()
+    assert abs(energy - ForcePartEwaldReciprocal(system, 0.2, gcut=0.8).compute()) < 1e-10*abs(energy)
+
+
+def test_ewald_structurefactors_ktable_water32():
+    from yaff.pes.ext import compute_ewald_structurefactors, \
+        compute_ewald_structurefactors_ktable, compute_ewald_ktable
+    system = get_system_water32()
+    alpha, gcut = 0.2, 0.6
+    part = ForcePartEwaldReciprocal(system, alpha, gcut=gcut)
+    gmax = part.gmax
+    gindexes, kvecs, prefactors, positions = compute_ewald_ktable(
+        system.cell, alpha, gmax, gcut)
+    assert len(gindexes) > 0
+    # the tabulated prefactors and positions match compute_ewald_prefactors
+    shape = (2*gmax[0]+1, 2*gmax[1]+1, gmax[2]+1)
+    prefactors_ref = np.zeros(shape)
+    compute_ewald_prefactors(system.cell, alpha, gmax, gcut, prefactors_ref)
+    assert (prefactors_ref.ravel()[positions] == prefactors).all()
+    assert np.count_nonzero(prefactors_ref) == len(positions)
+    # structure factors of a subset of the atoms
+    pos = system.pos[:9].copy()
+    charges = system.charges[:9].copy()
+    cosfacs, sinfacs = np.zeros(shape), np.zeros(shape)
+    compute_ewald_structurefactors(pos, charges, system.cell, alpha, gmax,
+        gcut, cosfacs, sinfacs)
+    eikr = np.zeros((2*gmax[:2].sum() + gmax[2] + 4, len(pos), 2))
+    cosfacs_table, sinfacs_table = np.zeros(shape), np.zeros(shape)
+    compute_ewald_structurefactors_ktable(pos, charges, system.cell, gmax,
+        gindexes, positions, eikr, cosfacs_table, sinfacs_table)
+    assert abs(cosfacs - cosfacs_table).max() < 1e-12
+    assert abs(sinfacs - sinfacs_table).max() < 1e-12
+
+
+def check_ewald_pme(system, alpha, gcut, threshold, **kwargs):
+    part_ewald = ForcePartEwaldReciprocal(system, alpha, gcut=gcut)
+    gpos0 = np.zeros(system.pos.shape)
+    vtens0 = np.zeros((3, 3))
+    energy0 = part_ewald.compute(gpos0, vtens0)
+    part_pme = ForcePartEwaldReciprocalPME(system, alpha, gcut=gcut, **kwargs)
+    gpos1 = np.zeros(system.pos.shape)
+    vtens1 = np.zeros((3, 3))
+    energy1 = part_pme.compute(gpos1, vtens1)
+    assert abs(energy1 - energy0) < threshold*abs(energy0)
+    assert abs(gpos1 - gpos0).max() < threshold*abs(gpos0).max()
+    assert abs(vtens1 - vtens0).max() < threshold*abs(vtens0).max()
+
+
+def test_ewald_pme_water32():
+    system = get_system_water32()
+    check_ewald_pme(system, 0.2, 0.3, 1e-3, order=4)
+    check_ewald_pme(system, 0.2, 0.3, 1e-5)
+    check_ewald_pme(system, 0.2, 0.3, 1e-7, order=8, oversampling=2.5)
+
+
+def test_ewald_pme_quartz():
+    system = get_system_quartz().supercell(2, 2, 2)
+    check_ewald_pme(system, 0.2, 0.4, 1e-4)
+    check_ewald_pme(system, 0.2, 0.4, 1e-6, order=8, ngrids=[24, 20, 20])
+
+
+def test_ewald_pme_ngrids():
+    system = get_system_water32()
+    part_pme = ForcePartEwaldReciprocalPME(system, 0.2, ngrids=[10, 12, 15])
+    assert (part_pme.ngrids == [10, 12, 15]).all()
+    system.cell.update_rvecs(system.cell.rvecs*1.1)
+    part_pme.update_rvecs(system.cell.rvecs)
+    assert (part_pme.ngrids == [10, 12, 15]).all()
+
+
+def test_ewald_gpos_vtens_reci_pme_water32():
+    system = get_system_water32()
+    for alpha in 0.05, 0.1, 0.2:
+        part_pme = ForcePartEwaldReciprocalPME(system, alpha, gcut=alpha/0.75, dielectric=1.2)
+        check_gpos_part(system, part_pme)
+        check_vtens_part(system, part_pme)
+
+
+def test_ewald_gpos_vtens_reci_pme_quartz():
+    system = get_system_quartz()
+    for alpha in 0.1, 0.2, 0.5:
+        part_pme = ForcePartEwaldReciprocalPME(system, alpha, gcut=alpha/0.5)
+        check_gpos_part(system, part_pme)
+        check_vtens_part(system, part_pme)
+
+
+def test_ewald_reci_pme_water32_exclusion():
+    system = get_system_water32()
+    alpha = 0.35
+    gcut = 2.0*alpha
+    def part_generator(system, **kwargs):
+        alpha = kwargs.pop('alpha')
+        gcut = kwargs.pop('gcut')
+        return ForcePartEwaldReciprocalPME(system, alpha, gcut=gcut, **kwargs)
+    for nlow, nhigh in [(15,33),(0,12),(81,96)]:
+        check_nlow_nhigh_part(system, part_generator, nlow, nhigh, alpha=alpha, gcut=gcut)
@@ -735,6 +735,24 @@ def test_generator_water32_fixq():
     assert abs(energy - energy2) < 1e-3
 
 
+def test_generator_water32_fixq_pme():
+    system = get_system_water32()
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water_fixq.txt')
+    ff = ForceField.generate(system, fn_pars)
+    ff_pme = ForceField.generate(system, fn_pars, reci_ei='pme', pme_order=8)
+    assert len(ff_pme.parts) == 4
+    part_ewald_reci = ff_pme.part_ewald_reci
+    assert isinstance(part_ewald_reci, ForcePartEwaldReciprocalPME)
+    assert part_ewald_reci.alpha == ff_pme.part_pair_ei.pair_pot.alpha
+    assert part_ewald_reci.order == 8
+    gpos = np.zeros(system.pos.shape)
+    energy = ff.compute(gpos)
+    gpos_pme = np.zeros(system.pos.shape)
+    energy_pme = ff_pme.compute(gpos_pme)
+    assert abs(energy - energy_pme) < 1e-5*abs(energy)
+    assert abs(gpos - gpos_pme).max() < 1e-5*abs(gpos).max()
+
+
 def test_generator_glycine_fixq():
     system = get_system_glycine()
     fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_glycine_fixq.txt')
@@ -853,6 +871,37 @@ def test_add_part():
     assert ff.compute() == ff.part_valence.energy + ff.part_press.energy
 
 
+def test_compute_energy_water32():
+    system = get_system_water32()
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water.txt')
+    ff = ForceField.generate(system, fn_pars, reci_ei='pme')
+    gpos = np.zeros(system.pos.shape)
+    vtens = np.zeros((3, 3))
+    energy0 = ff.compute(gpos, vtens)
+    assert not np.isnan(ff.gpos).any()
+    # Energy-only evaluation after a change of the positions
+    pos = system.pos + np.random.normal(0, 0.01, system.pos.shape)
+    ff.update_pos(pos)
+    assert np.isnan(ff.gpos).all()
+    assert np.isnan(ff.vtens).all()
+    energy1 = ff.compute_energy()
+    assert energy1 != energy0
+    assert ff.energy == energy1
+    assert ff.compute() == energy1
+    assert np.isnan(ff.gpos).all()
+    assert np.isnan(ff.vtens).all()
+    for part in ff.parts:
+        assert not np.isnan(part.energy)
+    # The full evaluation gives the same energy.
+    gpos[:] = 0.0
+    vtens[:] = 0.0
+    energy2 = ff.compute(gpos, vtens)
+    assert abs(energy1 - energy2) < 1e-10*abs(energy2)
+    assert not np.isnan(ff.gpos).any()
+    ff.update_pos(system.pos)
+    assert np.isnan(ff.gpos).all()
+
+
 def test_generator_formaldehyde_oopangle():
     system = get_system_formaldehyde()
     fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_formaldehyde_inversion.txt')
@@ -866,3 +915,55 @@ def test_generator_formaldehyde_oopangle():
     assert (part_valence.vlist.vtab['kind'][0:3] == 5).all()
     assert abs(part_valence.vlist.vtab['par0'] - 1.0*kjmol).all() < 1e-10
     assert part_valence.vlist.nv == 3
+
+
+def test_generator_water32_tabulate():
+    system = get_system_water32()
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water.txt')
+    ff = ForceField.generate(system, fn_pars, tailcorrections=True)
+    ff_tab = ForceField.generate(system, fn_pars, tailcorrections=True, tabulate=True)
+    assert [part.name for part in ff.parts] == [part.name for part in ff_tab.parts]
+    # Tail corrections are computed with the original pair potentials.
+    assert ff_tab.part_tailcorr_pair_exprep.ecorr == ff.part_tailcorr_pair_exprep.ecorr
+    ff.nlist.update()
+    ff_tab.nlist.update()
+    for name in 'dampdisp', 'exprep', 'ei':
+        part = getattr(ff, 'part_pair_%s' % name)
+        part_tab = getattr(ff_tab, 'part_pair_%s' % name)
+        assert isinstance(part_tab.pair_pot, PairPotTabulated)
+        assert part_tab.pair_pot.source.name == name
+        assert part_tab.pair_pot.npoint == 4096
+        gpos = np.zeros(system.pos.shape)
+        energy = part.compute(gpos)
+        gpos_tab = np.zeros(system.pos.shape)
+        energy_tab = part_tab.compute(gpos_tab)
+        assert abs(energy - energy_tab) < 1e-8*abs(energy)
+        assert abs(gpos - gpos_tab).max() < 1e-6*abs(gpos).max()
+    # Only tabulate one pair potential
+    ff_tab = ForceField.generate(system, fn_pars, tabulate=['dampdisp'], tabulate_npoint=1024)
+    assert isinstance(ff_tab.part_pair_dampdisp.pair_pot, PairPotTabulated)
+    assert ff_tab.part_pair_dampdisp.pair_pot.npoint == 1024
+    assert isinstance(ff_tab.part_pair_exprep.pair_pot, PairPotExpRep)
+    assert isinstance(ff_tab.part_pair_ei.pair_pot, PairPotEI)
+
+
+def test_generator_water32_fuse_pairs():
+    system = get_system_water32()
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water.txt')
+    ff = ForceField.generate(system, fn_pars)
+    ff_multi = ForceField.generate(system, fn_pars, fuse_pairs=True)
+    assert [part.name for part in ff_multi.parts] == ['valence', 'pair_multi',
+        'ewald_reci', 'ewald_cor', 'ewald_neut']
+    assert [part.name for part in ff_multi.iter_contribs()] == ['valence',
+        'pair_ei', 'pair_dampdisp', 'pair_exprep', 'ewald_reci', 'ewald_cor',
+        'ewald_neut']
+    assert ff_multi.part_pair_ei is ff_multi.part_pair_multi.parts[0]
+    gpos = np.zeros(system.pos.shape)
+    energy = ff.compute(gpos)
+    gpos_multi = np.zeros(system.pos.shape)
+    energy_multi = ff_multi.compute(gpos_multi)
+    assert abs(energy - energy_multi) < 1e-10*abs(energy)
+    assert abs(gpos - gpos_multi).max() < 1e-10*abs(gpos).max()
+    for part in ff.iter_contribs():
+        part_multi = getattr(ff_multi, 'part_%s' % part.name)
+        assert abs(part.energy - part_multi.energy) <= 1e-10*abs(part.energy)
@@ -26,6 +26,8 @@
 from __future__ import division
 
 import numpy as np
+from nose.tools import assert_raises
+
 from yaff import *
 
 
@@ -107,3 +109,100 @@ def test_grid_conincide():
         ff.update_pos(pos)
         e1 = ff.compute()
         assert abs(e0-e1) < 1e-10
+
+
+def get_system_ne_h():
+    return System(
+        numbers=np.array([10, 1, 10]),
+        pos=np.array([[0.3, 1.2, 4.5], [5.1, 7.3, 2.2], [8.8, 0.4, 9.7]]),
+        ffatypes=['Ne', 'H', 'Ne'],
+        rvecs=np.array([[10.0, 0.0, 0.0], [1.0, 9.0, 0.0], [0.5, -1.0, 11.0]]),
+    )
+
+
+def get_smooth_grids(system, shape):
+    # Periodic functions that can be tabulated accurately
+    frac = np.indices(shape, dtype=float)/np.array(shape).reshape(3, 1, 1, 1)
+    x = 2*np.pi*frac
+    return {
+        'Ne': np.cos(x[0]) + np.sin(x[1])*np.cos(x[2]),
+        'H': np.sin(x[0] + x[1]) - 0.5*np.cos(2*x[2]),
+    }
+
+
+def get_smooth_energy(system):
+    x = 2*np.pi*np.dot(system.pos, system.cell.gvecs.T)
+    result = 0.0
+    for i in range(system.natom):
+        if system.get_ffatype(i) == 'Ne':
+            result += np.cos(x[i,0]) + np.sin(x[i,1])*np.cos(x[i,2])
+        else:
+            result += np.sin(x[i,0] + x[i,1]) - 0.5*np.cos(2*x[i,2])
+    return result
+
+
+def test_grid_cubic_coincide():
+    s = get_system_ne()
+    grids = {'Ne': np.random.uniform(0, 1, (5, 4, 6))}
+    ff = ForceField(s, [ForcePartGrid(s, grids, 'cubic')])
+    for i in range(100):
+        indexes = np.random.randint(-30, 50, 3)
+        e0 = grids['Ne'][tuple(indexes%[5, 4, 6])]
+        ff.update_pos(np.array([indexes*[2.0, 2.5, 10.0/6]]))
+        assert abs(e0 - ff.compute()) < 1e-10
+
+
+def test_grid_cubic_accuracy():
+    s = get_system_ne_h()
+    grids = get_smooth_grids(s, (20, 20, 20))
+    fp_linear = ForcePartGrid(s, grids, 'linear')
+    fp_cubic = ForcePartGrid(s, grids, 'cubic')
+    error_linear = 0.0
+    error_cubic = 0.0
+    for i in range(20):
+        s.pos[:] = np.random.uniform(-10, 20, (3, 3))
+        eref = get_smooth_energy(s)
+        error_linear = max(error_linear, abs(fp_linear.compute() - eref))
+        error_cubic = max(error_cubic, abs(fp_cubic.compute() - eref))
+    assert error_cubic < 1e-2
+    assert error_cubic < 0.2*error_linear
+
+
+def test_grid_gpos():
+    from yaff.pes.test.common import check_gpos_part
+    s = get_system_ne_h()
+    grids = dict((key, np.random.uniform(0, 1, (7, 8, 9))) for key in ['Ne', 'H'])
+    for interpolation in 'linear', 'cubic':
+        fp = ForcePartGrid(s, grids, interpolation)
+        check_gpos_part(s, fp)
+        # also with positions outside the cell
+        s.pos[0] += s.cell.rvecs[0] - 2*s.cell.rvecs[2]
+        check_gpos_part(s, fp)
+
+
+def test_grid_batch():
+    s = get_system_ne_h()
+    grids = dict((key, np.random.uniform(0, 1, (7, 8, 9))) for key in ['Ne', 'H'])
+    pos = np.random.uniform(-10, 20, (5, 3, 3))
+    for interpolation in 'linear', 'cubic':
+        fp = ForcePartGrid(s, grids, interpolation)
+        energies = fp.compute_batch(pos)
+        assert energies.shape == (5,)
+        for i in range(5):
+            s.pos[:] = pos[i]
+            assert abs(energies[i] - fp.compute()) < 1e-12
+    with assert_raises(TypeError):
+        fp.compute_batch(pos[:,:2])
+
+
+def test_grid_errors():
+    s = get_system_ne_h()
+    grids = {'Ne': np.zeros((2, 2, 2))}
+    with assert_raises(ValueError):
+        ForcePartGrid(s, grids)
+    grids['H'] = np.zeros((2, 2, 2))
+    with assert_raises(ValueError):
+        ForcePartGrid(s, grids, 'quintic')
+    fp = ForcePartGrid(s, grids)
+    with assert_raises(NotImplementedError):
+        fp.compute(vtens=np.zeros((3, 3)))
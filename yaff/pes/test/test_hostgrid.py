@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+from __future__ import division
+
+import numpy as np
+import pkg_resources
+
+from molmod.units import kjmol
+
+from yaff import *
+
+
+def get_cau13_xylene():
+    fn_host = pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk')
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_CAU-13_xylene.txt')
+    fn_guest = pkg_resources.resource_filename(__name__, '../../data/test/xylene.chk')
+    return System.from_file(fn_host), System.from_file(fn_guest), fn_pars
+
+
+def test_host_grids_cau13_xylene():
+    host, guest, fn_pars = get_cau13_xylene()
+    shape = (4, 5, 3)
+    grids = compute_host_grids(host, guest, fn_pars, shape=shape, emax=1e10)
+    assert sorted(grids) == sorted(set(guest.ffatypes))
+    # Move one guest atom of each type between two grid points in the full
+    # host-guest force field. The energy difference only depends on the
+    # interactions of that atom with the host.
+    hostguest = host.merge(guest)
+    ff = ForceField.generate(hostguest, fn_pars, nlow=host.natom,
+                             nhigh=host.natom)
+    for ffatype, grid in grids.items():
+        assert grid.shape == shape
+        iatom = host.natom + [guest.get_ffatype(i) for i in range(guest.natom)].index(ffatype)
+        pos = hostguest.pos.copy()
+        energies = []
+        nodes = [(1, 2, 0), (3, 1, 2), (0, 4, 1)]
+        for node in nodes:
+            pos[iatom] = np.dot(np.array(node)/shape, host.cell.rvecs)
+            ff.update_pos(pos)
+            energies.append(ff.compute())
+        for i in 1, 2:
+            delta = grid[nodes[i]] - grid[nodes[0]]
+            assert abs(delta - (energies[i] - energies[0])) < 1e-10
+
+
+def test_probe_grid_blocks():
+    from yaff.pes.hostgrid import _compute_probe_grid
+    host, guest, fn_pars = get_cau13_xylene()
+    pars = Parameters.from_file(fn_pars)
+    frac = np.random.uniform(0, 1, (50, 3))
+    points = np.dot(frac, host.cell.rvecs)
+    ffatype = guest.get_ffatype(0)
+    energies = _compute_probe_grid(host, guest.numbers[0], ffatype, pars,
+        points, reci_ei='ewald_interaction')
+    # Blocks of a few points give the same result.
+    energies_blocks = _compute_probe_grid(host, guest.numbers[0], ffatype,
+        pars, points, block_size=7, reci_ei='ewald_interaction')
+    assert abs(energies - energies_blocks).max() < 1e-10
+    # Compare with the host-probe force field, up to a constant.
+    probe = guest.subsystem([0])
+    system = host.merge(probe)
+    system.charges = None
+    system.radii = None
+    ff = ForceField.generate(system, pars, nlow=host.natom, nhigh=host.natom)
+    pos = system.pos.copy()
+    reference = []
+    for point in points[:5]:
+        pos[-1] = point
+        ff.update_pos(pos)
+        reference.append(ff.compute())
+    delta = energies[:5] - np.array(reference)
+    assert abs(delta - delta[0]).max() < 1e-10
+
+
+def test_host_grids_emax():
+    host, guest, fn_pars = get_cau13_xylene()
+    guest = guest.subsystem([0, 1])
+    emax = 10*kjmol
+    grids0 = compute_host_grids(host, guest, fn_pars, shape=(3, 3, 3), emax=1e10)
+    grids1 = compute_host_grids(host, guest, fn_pars, shape=(3, 3, 3), emax=emax)
+    for ffatype in grids0:
+        assert grids0[ffatype].max() > emax
+        assert (grids1[ffatype] == np.minimum(grids0[ffatype], emax)).all()
+
+
+def test_make_grid_forcefield():
+    host, guest, fn_pars = get_cau13_xylene()
+    guest.cell = Cell(host.cell.rvecs)
+    grids = dict((ffatype, np.random.uniform(0, 1, (3, 4, 5))) for ffatype in guest.ffatypes)
+    ff = make_grid_forcefield(guest, grids)
+    assert ff.system.natom == guest.natom
+    assert ff.system is not guest
+    assert ff.parts[0].interpolation == 'cubic'
+    gpos = np.zeros(guest.pos.shape)
+    e = ff.compute(gpos)
+    assert np.isfinite(e)
+    assert abs(e - ff.compute_energy()) < 1e-12
@@ -28,11 +28,13 @@ from __future__ import division
 import random
 import numpy as np
 from nose.plugins.skip import SkipTest
+from nose.tools import assert_raises
 
 from molmod import angstrom
 
 from yaff.test.common import get_system_water32, get_system_graphene8, \
-    get_system_polyethylene4, get_system_quartz, get_system_glycine
+    get_system_polyethylene4, get_system_quartz, get_system_glycine, \
+    get_system_mil53
 
 from yaff import *
 
@@ -270,7 +272,7 @@ def check_nlist_skin(system, rcut, skin):
     # Displace all atoms with a random vector the rebuild is not triggered
     for i in range(system.natom):
         vec = np.random.normal(-1, 1, 3)
-        vec *= 0.45/(nlist1.rmax.max()+1)*skin/np.linalg.norm(vec)
+        vec *= 0.45*skin/np.linalg.norm(vec)
         system.pos[i] += vec
     assert not nlist1._need_rebuild()
     nlist1.update()
@@ -299,9 +301,11 @@ def check_nlist_skin(system, rcut, skin):
     # Displace all atoms with a random vector the rebuild is triggered.
     for i in range(system.natom):
         vec = np.random.normal(-1, 1, 3)
-        vec *= 0.55/(nlist1.rmax.max()+1)*skin/np.linalg.norm(vec)
-        system.pos[i] += vec
+        vec *= 0.55*skin/np.linalg.norm(vec)
+        system.pos[i] = nlist1._pos_old[i] + vec
     assert nlist1._need_rebuild()
+    assert nlist1.nrebuild == 1
+    assert nlist1.nrecompute == 1
 
 
 def test_nlist_quartz_6A_skin3A():
@@ -317,3 +321,215 @@ def test_nlist_water32_6A_skin3A():
 def test_nlist_water32_10A_skin2A():
     system = get_system_water32()
     check_nlist_skin(system, 10*angstrom, 2*angstrom)
+
+
+def check_nlist_binned(system, rcut, skin=0, nlow=0, nhigh=-1):
+    nlist1 = NeighborList(system, skin, nlow, nhigh, binned=False)
+    nlist1.request_rcut(rcut)
+    nlist1.update()
+    nlist2 = NeighborList(system, skin, nlow, nhigh, binned=True)
+    assert nlist2.binned
+    nlist2.request_rcut(rcut)
+    nlist2.update()
+    # The binned algorithm must reproduce the same rows in the same order.
+    assert nlist1.nneigh == nlist2.nneigh
+    assert (nlist1.neighs[:nlist1.nneigh] == nlist2.neighs[:nlist2.nneigh]).all()
+
+
+def test_nlist_binned_water32_4A():
+    system = get_system_water32()
+    check_nlist_binned(system, 4*angstrom)
+
+
+def test_nlist_binned_water32_9A():
+    system = get_system_water32()
+    check_nlist_binned(system, 9*angstrom)
+
+
+def test_nlist_binned_water32_4A_nlow_nhigh():
+    system = get_system_water32()
+    check_nlist_binned(system, 4*angstrom, nlow=30, nhigh=60)
+    check_nlist_binned(system, 4*angstrom, nlow=48, nhigh=48)
+
+
+def test_nlist_set_bounds_water32_4A():
+    system = get_system_water32()
+    nlist = NeighborList(system, nlow=48, nhigh=48)
+    nlist.request_rcut(4*angstrom)
+    nlist.update()
+    # Exclude atoms 30 to 47 completely.
+    nlist.set_bounds(48, 30)
+    assert nlist.rebuild_next
+    nlist.update()
+    neighs = nlist.neighs[:nlist.nneigh]
+    assert nlist.nneigh > 0
+    assert (neighs['a'] >= 48).all()
+    assert (neighs['b'] < 30).all()
+    # Compare with the pairs of a neighbor list without exclusions.
+    nlist_all = NeighborList(system)
+    nlist_all.request_rcut(4*angstrom)
+    nlist_all.update()
+    neighs_all = nlist_all.neighs[:nlist_all.nneigh]
+    mask = (neighs_all['a'] >= 48) & (neighs_all['b'] < 30)
+    assert (neighs_all[mask] == neighs).all()
+    # The binned algorithm supports the same exclusions.
+    nlist_binned = NeighborList(system, binned=True)
+    nlist_binned.set_bounds(48, 30)
+    nlist_binned.request_rcut(4*angstrom)
+    nlist_binned.update()
+    assert (nlist_binned.neighs[:nlist_binned.nneigh] == neighs).all()
+    # Invalid bounds
+    with assert_raises(ValueError):
+        nlist.set_bounds(-1, 30)
+    with assert_raises(ValueError):
+        nlist.set_bounds(48, system.natom+1)
+
+
+def test_nlist_binned_quartz_9A():
+    system = get_system_quartz()
+    check_nlist_binned(system, 9*angstrom)
+
+
+def test_nlist_binned_quartz_20A_skin2A():
+    system = get_system_quartz()
+    check_nlist_binned(system, 20*angstrom, 2*angstrom)
+
+
+def test_nlist_binned_mil53_5A():
+    system = get_system_mil53()
+    # Make the positions less regular to test atoms outside the cell.
+    system.pos[:] += np.random.normal(0, 3*angstrom, system.pos.shape)
+    check_nlist_binned(system, 5*angstrom)
+    check_nlist_binned(system, 5*angstrom, nlow=20, nhigh=50)
+
+
+def test_nlist_binned_default():
+    assert not NeighborList(get_system_water32()).binned
+    assert NeighborList(get_system_water32(), binned=True).binned
+    # Only 3D periodic systems can be binned
+    assert not NeighborList(get_system_graphene8(), binned=True).binned
+    assert not NeighborList(get_system_glycine(), binned=True).binned
+
+
+def check_nlist_cells(system, rcut, nlow, nbins):
+    # Reference: the pairs of atoms below and above nlow.
+    nlist = NeighborList(system, nlow=nlow, nhigh=nlow)
+    nlist.request_rcut(rcut)
+    nlist.update()
+    # Linked cells with the atoms below nlow. All atoms are first added and
+    # the last ones are removed again, to test the removal.
+    natom = system.natom
+    bin_head = -np.ones(np.prod(nbins), int)
+    atom_next = np.zeros(natom, int)
+    atom_prev = np.zeros(natom, int)
+    atom_ibins = np.zeros(natom, int)
+    atom_shifts = np.zeros((natom, 3), int)
+    atom_wpos = np.zeros((natom, 3))
+    nlist_cells_insert(system.pos, system.cell, nbins, bin_head, atom_next,
+        atom_prev, atom_ibins, atom_shifts, atom_wpos, 0, natom)
+    assert (atom_ibins >= 0).all()
+    assert (atom_ibins < np.prod(nbins)).all()
+    frac = np.dot(atom_wpos, system.cell.gvecs.T)
+    assert (frac > -1e-10).all()
+    assert (frac < 1+1e-10).all()
+    nlist_cells_remove(bin_head, atom_next, atom_prev, atom_ibins, nlow, natom)
+    if nlist.nneigh > 10:
+        neighs = np.empty(10, dtype=neigh_dtype)
+        nneigh, dmin = nlist_build_cells(system.pos, rcut, nlist.rmax, system.cell,
+            neighs, nlow, nbins, bin_head, atom_next, atom_shifts, atom_wpos)
+        assert nneigh == -1
+    neighs = np.empty(nlist.nneigh+1, dtype=neigh_dtype)
+    nneigh, dmin = nlist_build_cells(system.pos, rcut, nlist.rmax, system.cell,
+        neighs, nlow, nbins, bin_head, atom_next, atom_shifts, atom_wpos)
+    # The same rows, except for their order.
+    assert nneigh == nlist.nneigh
+    order = ['a', 'b', 'r0', 'r1', 'r2']
+    assert (np.sort(neighs[:nneigh], order=order) ==
+            np.sort(nlist.neighs[:nlist.nneigh], order=order)).all()
+    if nneigh > 0:
+        assert dmin == nlist.neighs['d'][:nlist.nneigh].min()
+    else:
+        assert dmin == rcut
+
+
+def test_nlist_cells_water32_9A():
+    system = get_system_water32()
+    check_nlist_cells(system, 9*angstrom, 93, np.array([2, 2, 2]))
+    check_nlist_cells(system, 9*angstrom, 90, np.array([1, 3, 5]))
+
+
+def test_nlist_cells_quartz_20A():
+    system = get_system_quartz()
+    check_nlist_cells(system, 20*angstrom, 6, np.array([1, 1, 1]))
+    check_nlist_cells(system, 20*angstrom, 3, np.array([2, 2, 3]))
+
+
+def test_nlist_cells_mil53_5A():
+    system = get_system_mil53()
+    system.pos[:] += np.random.normal(0, 3*angstrom, system.pos.shape)
+    check_nlist_cells(system, 5*angstrom, 70, np.array([3, 2, 4]))
+    check_nlist_cells(system, 5*angstrom, 0, np.array([3, 2, 4]))
+
+
+def check_nlist_adaptive_skin(system, rcut, nstep):
+    nlist = NeighborList(system, adaptive_skin=True)
+    nlist.request_rcut(rcut)
+    nlist.update()
+    assert abs(nlist.skin - nlist.adaptive_skin_init*rcut) < 1e-10
+    skins = set([nlist.skin])
+    vel = np.random.normal(0, 0.02*angstrom, system.pos.shape)
+    for istep in range(nstep):
+        system.pos += vel
+        nlist.update()
+        skins.add(nlist.skin)
+        # Compare with a neighbor list built from scratch. The labels of the
+        # periodic images may differ, so only the distances are compared.
+        nlist_ref = NeighborList(system)
+        nlist_ref.request_rcut(rcut)
+        nlist_ref.update()
+        d = nlist.neighs['d'][:nlist.nneigh]
+        d_ref = nlist_ref.neighs['d'][:nlist_ref.nneigh]
+        d = np.sort(d[d < rcut])
+        d_ref = np.sort(d_ref[d_ref < rcut])
+        assert d.shape == d_ref.shape
+        assert abs(d - d_ref).max() < 1e-8
+    skin_min, skin_max = nlist.adaptive_skin_range
+    assert min(skins) >= skin_min*rcut
+    assert max(skins) <= skin_max*rcut
+    assert len(skins) > 1
+    assert nlist.nrebuild > 1
+    assert nlist.nrebuild + nlist.nrecompute == nstep + 1
+    stats = nlist.get_stats()
+    assert len(stats) == len(nlist.stats_names)
+    assert stats[0] == nlist.nrebuild
+    assert stats[1] == nlist.nrecompute
+    assert stats[2] == nlist.nneigh
+    assert stats[3] == nlist.skin
+    assert stats[4] > 0
+    assert stats[5] > 0
+
+
+def test_nlist_adaptive_skin_water32_9A():
+    system = get_system_water32()
+    check_nlist_adaptive_skin(system, 9*angstrom, 100)
+
+
+def test_nlist_adaptive_skin_quartz_6A():
+    system = get_system_quartz().supercell(2, 2, 2)
+    check_nlist_adaptive_skin(system, 6*angstrom, 100)
+
+
+def test_nlist_stats():
+    system = get_system_water32()
+    nlist = NeighborList(system, 2*angstrom)
+    nlist.request_rcut(6*angstrom)
+    for i in range(5):
+        nlist.update()
+    assert nlist.nrebuild == 1
+    assert nlist.nrecompute == 4
+    nlist.log_stats()
+    nlist.reset_stats()
+    assert nlist.nrebuild == 0
+    assert nlist.nrecompute == 0
+    assert nlist.time_rebuild == 0.0
+    assert nlist.time_recompute == 0.0
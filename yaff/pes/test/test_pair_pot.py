@@ -1475,3 +1475,248 @@ def test_pair_pot_eislater1sp1spcorr():
     # Check gradient and virial tensor
     check_gpos_part(system, part_pair, nlist)
     check_vtens_part(system, part_pair, nlist, symm_vtens=False)
+
+
+#
+# Multithreading
+#
+
+
+def check_pair_pot_nthread(system, nlist, part_pair):
+    nlist.update()
+    nthread_orig = pair_pot_get_nthread()
+    try:
+        pair_pot_set_nthread(1)
+        gpos1 = np.zeros(system.pos.shape)
+        vtens1 = np.zeros((3, 3))
+        energy1 = part_pair.compute(gpos1, vtens1)
+        for nthread in 2, 3, 4:
+            pair_pot_set_nthread(nthread)
+            gpos2 = np.zeros(system.pos.shape)
+            vtens2 = np.zeros((3, 3))
+            energy2 = part_pair.compute(gpos2, vtens2)
+            assert abs(energy1 - energy2) < 1e-10*abs(energy1)
+            assert abs(gpos1 - gpos2).max() < 1e-10*abs(gpos1).max()
+            assert abs(vtens1 - vtens2).max() < 1e-10*abs(vtens1).max()
+            # The reduction over threads must be deterministic.
+            gpos3 = np.zeros(system.pos.shape)
+            vtens3 = np.zeros((3, 3))
+            energy3 = part_pair.compute(gpos3, vtens3)
+            assert energy2 == energy3
+            assert (gpos2 == gpos3).all()
+            assert (vtens2 == vtens3).all()
+            assert part_pair.compute() == energy2
+    finally:
+        pair_pot_set_nthread(nthread_orig)
+
+
+def test_pair_pot_nthread_lj_water32_9A():
+    system, nlist, scalings, part_pair, pair_fn = get_part_water32_9A_lj()
+    check_pair_pot_nthread(system, nlist, part_pair)
+
+
+def test_pair_pot_nthread_ei_water32_14A():
+    system, nlist, scalings, part_pair, pair_fn = get_part_water32_14A_ei()
+    check_pair_pot_nthread(system, nlist, part_pair)
+
+
+def test_pair_pot_nthread_settings():
+    nthread_orig = pair_pot_get_nthread()
+    try:
+        pair_pot_set_nthread(3)
+        assert pair_pot_get_nthread() in [1, 3]
+        with assert_raises(ValueError):
+            pair_pot_set_nthread(-1)
+    finally:
+        pair_pot_set_nthread(nthread_orig)
+
+
+#
+# Tests for tabulated pair potentials
+#
+
+
+def check_pair_pot_tabulated(system, nlist, scalings, part_pair, eps, npoint=4096,
+                             rmin=1.0*angstrom, ffatype_ids=None):
+    if ffatype_ids is None:
+        ffatype_ids = system.ffatype_ids
+    pair_pot_tab = PairPotTabulated(part_pair.pair_pot, ffatype_ids, rmin, npoint)
+    assert pair_pot_tab.name == part_pair.pair_pot.name
+    assert pair_pot_tab.rcut == part_pair.pair_pot.rcut
+    assert pair_pot_tab.get_truncation() is part_pair.pair_pot.get_truncation()
+    part_pair_tab = ForcePartPair(system, nlist, scalings, pair_pot_tab)
+    assert part_pair_tab.name == part_pair.name
+    nlist.update()
+    gpos = np.zeros(system.pos.shape)
+    vtens = np.zeros((3, 3))
+    energy = part_pair.compute(gpos, vtens)
+    gpos_tab = np.zeros(system.pos.shape)
+    vtens_tab = np.zeros((3, 3))
+    energy_tab = part_pair_tab.compute(gpos_tab, vtens_tab)
+    assert abs(energy - energy_tab) < eps*abs(energy)
+    assert abs(gpos - gpos_tab).max() < 10*eps*abs(gpos).max()
+    assert abs(vtens - vtens_tab).max() < 10*eps*abs(vtens).max()
+    # The spline derivatives are consistent with the spline energies
+    check_gpos_part(system, part_pair_tab, nlist)
+    check_vtens_part(system, part_pair_tab, nlist)
+
+
+def test_pair_pot_tabulated_water32_9A_mm3():
+    system, nlist, scalings, part_pair, pair_fn = get_part_water32_9A_mm3()
+    check_pair_pot_tabulated(system, nlist, scalings, part_pair, 1e-8)
+
+
+def test_pair_pot_tabulated_water32_14A_ei():
+    system, nlist, scalings, part_pair, pair_fn = get_part_water32_14A_ei()
+    check_pair_pot_tabulated(system, nlist, scalings, part_pair, 1e-8)
+
+
+def test_pair_pot_tabulated_caffeine_dampdisp_9A():
+    system, nlist, scalings, part_pair, pair_fn = get_part_caffeine_dampdisp_9A()
+    check_pair_pot_tabulated(system, nlist, scalings, part_pair, 1e-8)
+    check_pair_pot_tabulated(system, nlist, scalings, part_pair, 1e-6, npoint=1024)
+
+
+def test_pair_pot_tabulated_caffeine_mm3cap_15A():
+    system, nlist, scalings, part_pair, pair_fn = get_part_caffeine_mm3cap_15A()
+    check_pair_pot_tabulated(system, nlist, scalings, part_pair, 1e-8)
+
+
+def test_pair_pot_tabulated_4113_01WaterWater_olpslater1s1s():
+    # The Slater widths differ for all atoms, so each atom gets its own table.
+    # The steep correction factor is only tabulated beyond 2 angstrom.
+    system, nlist, scalings, part_pair, pair_fn = get_part_4113_01WaterWater_olpslater1s1s()
+    check_pair_pot_tabulated(system, nlist, scalings, part_pair, 1e-6,
+                             rmin=2*angstrom, ffatype_ids=np.arange(system.natom))
+
+
+def test_pair_pot_tabulated_source():
+    system, nlist, scalings, part_pair, pair_fn = get_part_caffeine_lj_15A()
+    pair_pot = part_pair.pair_pot
+    pair_pot_tab = PairPotTabulated(pair_pot, system.ffatype_ids, rmin=2*angstrom, npoint=100)
+    assert pair_pot_tab.source is pair_pot
+    assert pair_pot_tab.npoint == 100
+    assert pair_pot_tab.rmin == 2*angstrom
+    assert abs(pair_pot_tab.dr*99 - (pair_pot.rcut - 2*angstrom)) < 1e-10
+    assert (pair_pot_tab.sigmas == pair_pot.sigmas).all()
+    assert pair_pot_tab.energy_errors.shape == (system.nffatype, system.nffatype)
+    assert (pair_pot_tab.energy_errors == pair_pot_tab.energy_errors.T).all()
+    assert pair_pot_tab.prepare_tailcorrections(system.natom) == \
+        pair_pot.prepare_tailcorrections(system.natom)
+
+
+def test_pair_pot_tabulated_short_range():
+    # Pairs closer than rmin are computed with the original pair potential.
+    system, nlist, scalings, part_pair, pair_fn = get_part_water32_9A_mm3()
+    pair_pot_tab = PairPotTabulated(part_pair.pair_pot, system.ffatype_ids, rmin=8*angstrom)
+    part_pair_tab = ForcePartPair(system, nlist, scalings, pair_pot_tab)
+    nlist.update()
+    energy = part_pair.compute()
+    energy_tab = part_pair_tab.compute()
+    assert abs(energy - energy_tab) < 1e-12*abs(energy)
+
+
+def test_pair_pot_tabulated_errors():
+    # Different charges for atoms with the same atom type
+    system, nlist, scalings, part_pair, pair_fn = get_part_caffeine_ei1_10A()
+    with assert_raises(ValueError):
+        PairPotTabulated(part_pair.pair_pot, system.ffatype_ids)
+    # Dipoles can not be tabulated
+    system, nlist, scalings, part_pair, pair_fn = get_part_water32_14A_eidip()
+    with assert_raises(ValueError):
+        PairPotTabulated(part_pair.pair_pot, system.ffatype_ids)
+    # Invalid grid
+    system, nlist, scalings, part_pair, pair_fn = get_part_water32_9A_mm3()
+    with assert_raises(ValueError):
+        PairPotTabulated(part_pair.pair_pot, system.ffatype_ids, rmin=10*angstrom)
+    with assert_raises(ValueError):
+        PairPotTabulated(part_pair.pair_pot, system.ffatype_ids, npoint=1)
+    pair_pot_tab = PairPotTabulated(part_pair.pair_pot, system.ffatype_ids)
+    with assert_raises(ValueError):
+        PairPotTabulated(pair_pot_tab, system.ffatype_ids)
+
+
+#
+# Tests for the fused computation of several pair potentials
+#
+
+
+def get_part_water32_9A_multi():
+    system, nlist, scalings, part_mm3, pair_fn = get_part_water32_9A_mm3()
+    pair_pot_lj = get_part_water32_9A_lj()[3].pair_pot
+    part_lj = ForcePartPair(system, nlist, Scalings(system), pair_pot_lj)
+    # Different cutoff and scalings for the electrostatics
+    charges = np.where(system.numbers == 8, -0.8, 0.4)
+    scalings_ei = Scalings(system, 0.5, 1.0, 1.0)
+    pair_pot_ei = PairPotEI(charges, 0.0, 7*angstrom, Switch3(2*angstrom))
+    part_ei = ForcePartPair(system, nlist, scalings_ei, pair_pot_ei)
+    parts = [part_mm3, part_ei, part_lj]
+    part_multi = ForcePartPairMulti(system, nlist, parts)
+    return system, nlist, parts, part_multi
+
+
+def test_pair_pot_shuffled_neighs_water32_9A():
+    # The scalings must not depend on the order of the neighbor list.
+    system, nlist, parts, part_multi = get_part_water32_9A_multi()
+    nlist.update()
+    gpos0 = np.zeros(system.pos.shape)
+    vtens0 = np.zeros((3, 3))
+    energy0 = part_multi.compute(gpos0, vtens0)
+    energies0 = [part.energy for part in parts]
+    # Shuffle the rows and swap the atoms in half of them.
+    neighs = nlist.neighs[:nlist.nneigh].copy()
+    np.random.seed(7)
+    neighs = neighs[np.random.permutation(len(neighs))]
+    swap = np.random.uniform(0, 1, len(neighs)) < 0.5
+    a = neighs['a'][swap].copy()
+    neighs['a'][swap] = neighs['b'][swap]
+    neighs['b'][swap] = a
+    for key in 'dx', 'dy', 'dz':
+        neighs[key][swap] *= -1
+    for key in 'r0', 'r1', 'r2':
+        neighs[key][swap] *= -1
+    nlist.neighs[:nlist.nneigh] = neighs
+    gpos1 = np.zeros(system.pos.shape)
+    vtens1 = np.zeros((3, 3))
+    energy1 = part_multi.compute(gpos1, vtens1)
+    assert abs(energy0 - energy1) < 1e-10*abs(energy0)
+    for part, energy in zip(parts, energies0):
+        assert abs(part.energy - energy) < 1e-10*abs(energy)
+    assert abs(gpos0 - gpos1).max() < 1e-10*abs(gpos0).max()
+    assert abs(vtens0 - vtens1).max() < 1e-10*abs(vtens0).max()
+    for part, energy in zip(parts, energies0):
+        assert abs(part.compute() - energy) < 1e-10*abs(energy)
+
+
+def test_pair_pot_multi_water32_9A():
+    system, nlist, parts, part_multi = get_part_water32_9A_multi()
+    assert part_multi.name == 'pair_multi'
+    # The mm3 and lj parts share the same scaling table.
+    assert part_multi.scalings[0] is part_multi.scalings[2]
+    assert part_multi.scalings[1] is not part_multi.scalings[0]
+    nlist.update()
+    gpos = np.zeros(system.pos.shape)
+    vtens = np.zeros((3, 3))
+    energies = [part.compute(gpos, vtens) for part in parts]
+    gpos_multi = np.zeros(system.pos.shape)
+    vtens_multi = np.zeros((3, 3))
+    energy_multi = part_multi.compute(gpos_multi, vtens_multi)
+    assert abs(energy_multi - sum(energies)) < 1e-12*abs(sum(energies))
+    for part, energy in zip(parts, energies):
+        assert abs(part.energy - energy) < 1e-12*abs(energy)
+    assert abs(gpos - gpos_multi).max() < 1e-12*abs(gpos).max()
+    assert abs(vtens - vtens_multi).max() < 1e-12*abs(vtens).max()
+
+
+def test_gpos_vtens_pair_pot_multi_water32_9A():
+    system, nlist, parts, part_multi = get_part_water32_9A_multi()
+    check_gpos_part(system, part_multi, nlist)
+    check_vtens_part(system, part_multi, nlist)
+
+
+def test_pair_pot_multi_errors():
+    system, nlist, parts, part_multi = get_part_water32_9A_multi()
+    with assert_raises(TypeError):
+        ForcePartPairMulti(system, nlist, parts + [part_multi])
+    with assert_raises(ValueError):
+        ForcePartPairMulti(system, NeighborList(system), parts)
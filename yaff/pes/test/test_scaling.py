@@ -75,6 +75,47 @@ def test_scaling_quartz():
         assert nbond == 1 or nbond == 2
 
 
+def check_scaling_partners(system, scalings):
+    partners = scalings.partners
+    offsets = scalings.offsets
+    assert len(partners) == 2*len(scalings.stab)
+    assert offsets.shape == (system.natom+1,)
+    assert offsets[0] == 0
+    assert offsets[-1] == len(partners)
+    for i in range(system.natom):
+        rows = partners[offsets[i]:offsets[i+1]]
+        assert (rows['a'] == i).all()
+        assert (rows['b'][1:] > rows['b'][:-1]).all()
+    for i0, i1, scale, nbond in scalings.stab:
+        assert scalings.get_scale(i0, i1) == scale
+        assert scalings.get_scale(i1, i0) == scale
+        rows = partners[offsets[i1]:offsets[i1+1]]
+        assert rows['nbond'][rows['b'] == i0] == nbond
+    # Unscaled pairs
+    for i0 in range(system.natom):
+        for i1 in range(system.natom):
+            if i1 not in partners['b'][offsets[i0]:offsets[i0+1]]:
+                assert scalings.get_scale(i0, i1) == 1.0
+
+
+def test_scaling_partners_glycine():
+    system = get_system_glycine()
+    check_scaling_partners(system, Scalings(system, 0.0, 0.5, 0.2))
+
+
+def test_scaling_partners_quartz():
+    system = get_system_quartz().supercell(2, 2, 2)
+    check_scaling_partners(system, Scalings(system))
+
+
+def test_scaling_partners_empty():
+    system = get_system_water32()
+    scalings = Scalings(system, 1.0, 1.0, 1.0)
+    assert len(scalings.partners) == 0
+    assert (scalings.offsets == 0).all()
+    assert scalings.get_scale(0, 1) == 1.0
+
+
 def test_iter_paths1():
     system = get_system_caffeine()
     paths = set(iter_paths(system, 2, 8, 3))
@@ -27,14 +27,20 @@
 from yaff.sampling.dof import *
 from yaff.sampling.enhanced import *
 from yaff.sampling.harmonic import *
+from yaff.sampling.hostcache import *
 from yaff.sampling.io import *
 from yaff.sampling.iterative import *
 from yaff.sampling.mc import *
+from yaff.sampling.mcenergy import *
 from yaff.sampling.mcutils import *
 from yaff.sampling.mctrials import *
 from yaff.sampling.npt import *
 from yaff.sampling.opt import *
+from yaff.sampling.respa import *
 from yaff.sampling.utils import *
 from yaff.sampling.verlet import *
 from yaff.sampling.nvt import *
 from yaff.sampling.trajectory import *
+from yaff.sampling.widom import *
+from yaff.sampling.cbmc import *
+from yaff.sampling.replica import *
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+r'''Configurational-bias growth of flexible guest molecules
+
+   Inserting a flexible chain molecule at a random position with a random
+   conformation almost always results in an overlap in a dense host. In
+   configurational-bias Monte Carlo (CBMC), the molecule is grown atom by
+   atom instead. For every atom, ``ntrial`` trial positions are generated at
+   the (fixed) bond length from the atom it is bonded to, and one of them is
+   selected with a probability proportional to its Boltzmann factor. The bias
+   is removed in the acceptance rules with the Rosenbluth weight:
+
+   .. math:: W = \prod_{s} \frac{1}{k} \sum_{j=1}^{k} w_s(j) e^{-\beta u_s(j)}
+
+   where :math:`u_s(j)` is the energy of trial :math:`j` of growth step
+   :math:`s`: the intramolecular pair interactions with the atoms that are
+   already placed and the pair interactions with the other guests and the
+   host. Stiff bends and torsions are handled with nested trials (Vlugt et
+   al., Mol. Phys. 94, 727 (1998)): each trial position is selected from
+   ``ninternal`` random directions with a probability proportional to the
+   Boltzmann factor of the valence terms that are completed by this atom,
+   and :math:`w_s(j)` is the average of these Boltzmann factors. The valence
+   terms are cheap compared to the interactions with the environment. The
+   first atom gets trial positions in the entire cell. For an old
+   conformation, the same weight is computed with the actual position as the
+   first of the trials.
+
+   The intramolecular energy is taken from a ForceField of an isolated guest,
+   from its ``ForcePartValence`` and ``ForcePartPair`` parts.
+
+   See Frenkel and Smit, Understanding Molecular Simulation, Chapter 13.
+'''
+
+
+from __future__ import division
+
+import numpy as np
+
+from yaff.log import log
+from yaff.pes.ext import neigh_dtype, pair_pot_compute_multi
+from yaff.pes.ff import ForcePartPair, ForcePartValence
+from yaff.sampling.mcutils import RandomBuffer
+
+
+__all__ = ['CBMCGrowth']
+
+
+class CBMCGrowth(object):
+    '''Configurational-bias growth of a flexible guest molecule'''
+    def __init__(self, guest, ff_intra, ntrial=10, ninternal=10, random=None):
+        '''
+           **Arguments:**
+
+           guest
+                A System instance of the guest molecule, with bonds and a 3D
+                periodic cell. The bond lengths are taken from its
+                positions and are kept fixed.
+
+           ff_intra
+                A ForceField instance for the intramolecular interactions of
+                an isolated guest, i.e. without periodic cell. Only
+                ``ForcePartValence`` and ``ForcePartPair`` parts are
+                supported.
+
+           **Optional arguments:**
+
+           ntrial
+                The number of trial positions for each atom.
+
+           ninternal
+                The number of random directions from which each trial
+                position is selected with the valence terms.
+
+           random
+                A :class:`yaff.sampling.mcutils.RandomBuffer` from which all
+                random numbers are drawn, e.g. the one of an MC simulation.
+                When not given, a new one is created.
+        '''
+        if guest.bonds is None and guest.natom > 1:
+            raise ValueError('The guest must have bonds for CBMC.')
+        if ff_intra.system.natom != guest.natom:
+            raise TypeError('The intramolecular force field must be for one guest.')
+        if ff_intra.system.cell.nvec != 0:
+            raise TypeError('The intramolecular force field must be for an isolated guest.')
+        self.guest = guest
+        self.ff_intra = ff_intra
+        self.ntrial = ntrial
+        self.ninternal = ninternal
+        if random is None:
+            random = RandomBuffer()
+        self.random = random
+        self._init_order()
+        self._init_parts()
+        self._log_ideal_weights = {}
+        # Statistics of the Rosenbluth weights, relative to an ideal chain,
+        # for each kind of trial: (number of growths, sum of the weights)
+        self.stats = {}
+
+    def _init_order(self):
+        '''Grow the molecule breadth-first along its bonds, starting from the
+           first atom'''
+        natom = self.guest.natom
+        self.order = [0]
+        self.parents = [-1]
+        for atom in self.order:
+            if natom == 1:
+                break
+            for other in sorted(self.guest.neighs1[atom]):
+                if other not in self.order:
+                    self.order.append(other)
+                    self.parents.append(atom)
+        if len(self.order) != natom:
+            raise ValueError('The bonds of the guest must connect all atoms.')
+        self.order = np.array(self.order)
+        self.parents = np.array(self.parents)
+        self.ranks = np.zeros(natom, int)
+        self.ranks[self.order] = np.arange(natom)
+        pos = self.guest.pos
+        self.bond_lengths = np.zeros(natom)
+        self.bond_lengths[1:] = np.linalg.norm(pos[self.order[1:]] - pos[self.parents[1:]], axis=1)
+
+    def _init_parts(self):
+        '''Assign each valence term to the growth step that completes it'''
+        natom = self.guest.natom
+        self.valence = []
+        self.nvalence = np.zeros(natom, int)
+        # Steps with valence terms that depend on the direction of the bond
+        # with the parent, i.e. with more than two atoms
+        self.angular = np.zeros(natom, bool)
+        self.pair_pots, self.partners, self.offsets = [], [], []
+        for part in self.ff_intra.parts:
+            if isinstance(part, ForcePartValence):
+                vtab = part.vlist.vtab[:part.vlist.nv]
+                ictab = part.iclist.ictab
+                deltas = part.dlist.deltas
+                steps = np.zeros(len(vtab), int)
+                for iterm, term in enumerate(vtab):
+                    atoms = set()
+                    for ic in term['ic0'], term['ic1']:
+                        if ic < 0:
+                            continue
+                        for i in range(4):
+                            row = ictab[ic]['i%i' % i]
+                            if row >= 0:
+                                atoms.add(deltas[row]['i'])
+                                atoms.add(deltas[row]['j'])
+                    steps[iterm] = self.ranks[list(atoms)].max()
+                    if len(atoms) > 2:
+                        self.angular[steps[iterm]] = True
+                terms = [(steps == step).nonzero()[0] for step in range(natom)]
+                self.valence.append((part, terms))
+                self.nvalence += [len(t) for t in terms]
+            elif isinstance(part, ForcePartPair):
+                self.pair_pots.append(part.pair_pot)
+                self.partners.append(part.scalings.partners)
+                self.offsets.append(part.scalings.offsets)
+            else:
+                raise TypeError('The part %s is not supported in the intramolecular force field of CBMC.' % part.name)
+
+    def compute_intra(self, pos):
+        '''Return the intramolecular energy of the guest with positions pos'''
+        self.ff_intra.update_pos(pos)
+        return self.ff_intra.compute_energy()
+
+    def _valence_energies(self, step, trials):
+        '''Energies of the valence terms completed by the atom of a growth
+           step, for each of its trial positions'''
+        atom = self.order[step]
+        pos = self.ff_intra.system.pos
+        ntrial = len(trials)
+        energies = np.zeros(ntrial)
+        for part, terms in self.valence:
+            if len(terms[step]) == 0:
+                continue
+            for itrial in range(ntrial):
+                pos[atom] = trials[itrial]
+                part.dlist.forward()
+                part.iclist.forward()
+                part.vlist.forward()
+                energies[itrial] += part.vlist.vtab['energy'][terms[step]].sum()
+        return energies
+
+    def _pair_energies(self, step, trials):
+        '''Intramolecular pair interactions of the trial positions of the atom
+           of a growth step with the atoms of the previous steps'''
+        atom = self.order[step]
+        pos = self.ff_intra.system.pos
+        ntrial = len(trials)
+        energies = np.zeros(ntrial)
+        if len(self.pair_pots) > 0 and step > 0:
+            others = self.order[:step]
+            neighs = np.zeros(ntrial*step, neigh_dtype)
+            neighs['a'] = atom
+            neighs['b'] = np.tile(others, ntrial)
+            deltas = (pos[others] - trials[:,None]).reshape(-1, 3)
+            neighs['dx'] = deltas[:,0]
+            neighs['dy'] = deltas[:,1]
+            neighs['dz'] = deltas[:,2]
+            neighs['d'] = np.linalg.norm(deltas, axis=1)
+            for itrial in range(ntrial):
+                energies[itrial] += pair_pot_compute_multi(self.pair_pots,
+                    neighs[itrial*step:(itrial+1)*step], self.partners,
+                    self.offsets, None, None, step).sum()
+        return energies
+
+    def _get_trials(self, step, ntrial, beta, actual=None):
+        '''Random trial positions for the atom of a growth step
+
+           **Returns:** the trial positions, their valence energies and the
+           logarithms of the averaged Boltzmann factors of the valence terms.
+           When actual is given, it is the first trial position.
+        '''
+        if step == 0:
+            trials = np.dot(self.random.uniform((ntrial, 3)) - 0.5, self.guest.cell.rvecs)
+            if actual is not None:
+                trials[0] = actual
+            return trials, np.zeros(ntrial), np.zeros(ntrial)
+        # Candidates uniformly distributed on a sphere around the parent
+        ninternal = self.ninternal if self.angular[step] else 1
+        directions = self.random.normal((ntrial*ninternal, 3))
+        directions /= np.linalg.norm(directions, axis=1)[:,None]
+        center = self.ff_intra.system.pos[self.parents[step]]
+        candidates = center + self.bond_lengths[step]*directions
+        if actual is not None:
+            candidates[0] = actual
+        if self.nvalence[step] == 0:
+            return candidates, np.zeros(ntrial), np.zeros(ntrial)
+        energies = self._valence_energies(step, candidates).reshape(ntrial, ninternal)
+        emin = energies.min(axis=1)
+        factors = np.exp(-beta*(energies - emin[:,None]))
+        sums = factors.sum(axis=1)
+        # Select one candidate for each trial position
+        icandidates = (self.random.rand(ntrial)[:,None]*sums[:,None] >
+                       np.cumsum(factors, axis=1)).sum(axis=1)
+        icandidates = np.minimum(icandidates, ninternal - 1)
+        if actual is not None:
+            icandidates[0] = 0
+        itrials = np.arange(ntrial)
+        trials = candidates.reshape(ntrial, ninternal, 3)[itrials, icandidates]
+        return trials, energies[itrials, icandidates], np.log(sums/ninternal) - beta*emin
+
+    def grow(self, beta, compute_external=None, pos=None, first=None):
+        '''Grow a guest molecule, or compute the Rosenbluth weight of an
+           existing conformation
+
+           **Arguments:**
+
+           beta
+                The inverse temperature.
+
+           **Optional arguments:**
+
+           compute_external
+                A function that returns the energies of an atom at trial
+                positions due to the environment of the guest. It is called
+                with the index of the atom in the guest and an array with the
+                trial positions. When not given, the guest is grown in
+                vacuum.
+
+           pos
+                The positions of an existing conformation. When given, it is
+                retraced, i.e. the actual position of each atom is the first
+                of the trial positions.
+
+           first
+                The position of the first atom, when it is not grown.
+
+           **Returns:** the positions of the (new) conformation, the
+           logarithm of its Rosenbluth weight and the sum of the energies of
+           the selected trials. When all trials of a step have an infinite
+           energy, the growth is aborted and (None, -inf, inf) is returned.
+
+           The intramolecular force field is used as workspace, it contains
+           the positions of the grown conformation afterwards.
+        '''
+        natom = self.guest.natom
+        workpos = self.ff_intra.system.pos
+        log_weight = 0.0
+        energy = 0.0
+        start = 0
+        if first is not None:
+            workpos[self.order[0]] = first
+            start = 1
+        for step in range(start, natom):
+            atom = self.order[step]
+            actual = None if pos is None else pos[atom]
+            trials, evalence, log_internal = self._get_trials(step,
+                self.ntrial, beta, actual)
+            energies = self._pair_energies(step, trials)
+            if compute_external is not None:
+                energies += compute_external(atom, trials)
+            # Combine the Boltzmann factors of the pair interactions with the
+            # averaged Boltzmann factors of the valence terms
+            log_factors = log_internal - beta*energies
+            lmax = log_factors.max()
+            if lmax == -np.inf:
+                return None, -np.inf, np.inf
+            factors = np.exp(log_factors - lmax)
+            log_weight += np.log(factors.sum()/self.ntrial) + lmax
+            if pos is None:
+                cumsum = np.cumsum(factors)
+                itrial = min(np.searchsorted(cumsum, self.random.next()*cumsum[-1],
+                    side='right'), self.ntrial - 1)
+            else:
+                itrial = 0
+            workpos[atom] = trials[itrial]
+            energy += energies[itrial] + evalence[itrial]
+        return workpos.copy(), log_weight, energy
+
+    def get_log_ideal_weight(self, beta, nsample=1000):
+        '''The logarithm of the average Rosenbluth weight of a guest in vacuum
+
+           **Arguments:**
+
+           beta
+                The inverse temperature.
+
+           **Optional arguments:**
+
+           nsample
+                The number of guests that are grown to compute the average.
+                The result is reused for the same beta.
+
+           This weight relates the chemical potential of the flexible guest
+           in the ideal gas reservoir to the acceptance rules of the
+           insertions and deletions.
+        '''
+        result = self._log_ideal_weights.get(beta)
+        if result is None:
+            log_weights = np.array([self.grow(beta)[1] for isample in range(nsample)])
+            wmax = log_weights.max()
+            result = wmax + np.log(np.exp(log_weights - wmax).mean())
+            self._log_ideal_weights[beta] = result
+            if log.do_medium:
+                log('CBMC ideal-gas Rosenbluth weight: %.5e' % np.exp(result))
+        return result
+
+    def record(self, name, log_weight, beta):
+        '''Keep track of the Rosenbluth weights of a kind of trial'''
+        count, total = self.stats.get(name, (0, 0.0))
+        ratio = np.exp(min(log_weight - self.get_log_ideal_weight(beta), 700.0))
+        self.stats[name] = (count + 1, total + ratio)
+
+    def log(self):
+        '''Print the average Rosenbluth weights of each kind of trial'''
+        for name, (count, total) in sorted(self.stats.items()):
+            log('%-12s average Rosenbluth weight (ideal chain = 1): %.5e' % (name, total/count))
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+'''On-disk cache of precomputed data of a rigid host
+
+   Adsorption simulations in a rigid host (framework) start with an expensive
+   precomputation that only depends on the host and the force-field settings:
+   energy grids (see :mod:`yaff.pes.hostgrid`), the Ewald structure factors of
+   the host atoms and the linked cells with the host atoms (see
+   :class:`yaff.sampling.mcenergy.MCInteraction`). The :class:`HostCache`
+   stores these arrays as ``.npy`` files, with a name derived from a hash of
+   all input that determines their content. Repeated simulations with the same
+   host load the arrays instead of computing them.
+
+   The files are opened as copy-on-write memory maps, such that simulations
+   running concurrently on the same machine, e.g. the workers of
+   :class:`yaff.sampling.replica.ReplicaExchangeMC`, share the pages with the
+   grids. New files are written under a temporary name and renamed when
+   complete, so a partially written file is never loaded.
+'''
+
+
+from __future__ import division
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from yaff.log import log
+from yaff.pes.ext import Cell, Hammer, Switch3
+from yaff.pes.hostgrid import compute_host_grids
+from yaff.pes.parameters import Parameters
+from yaff.system import System
+
+
+__all__ = ['HostCache']
+
+
+class HostCache(object):
+    '''Arrays derived from a rigid host, stored in a directory'''
+    # The arrays of MCInteraction that describe the linked cells
+    bin_arrays = ['bin_head', 'atom_next', 'atom_prev', 'atom_ibins',
+                  'atom_shifts', 'atom_wpos']
+
+    def __init__(self, directory):
+        '''
+           **Arguments:**
+
+           directory
+                The directory with the cached arrays. It is created when it
+                does not exist yet.
+        '''
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+
+    def get_key(self, *items):
+        '''Return a hexadecimal hash of the given items
+
+           Items can be System, Parameters, Cell or truncation (Switch3,
+           Hammer) instances, numpy arrays, numbers, strings, None, or lists,
+           tuples and dictionaries of these. A TypeError is raised for other
+           objects, because their representation may differ between runs.
+        '''
+        h = hashlib.sha1()
+        for item in items:
+            _update_hash(h, item)
+        return h.hexdigest()
+
+    def _get_filename(self, key, name):
+        return os.path.join(self.directory, '%s_%s.npy' % (key, name))
+
+    def load(self, key, name):
+        '''Return the array with the given key and name, None when absent'''
+        fn = self._get_filename(key, name)
+        if not os.path.isfile(fn):
+            return None
+        return np.load(fn, mmap_mode='c')
+
+    def store(self, key, name, array):
+        '''Store an array with the given key and name
+
+           **Returns:** the stored array, loaded as a memory map.
+        '''
+        fd, fn_tmp = tempfile.mkstemp(suffix='.npy', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.rename(fn_tmp, self._get_filename(key, name))
+        except:
+            os.remove(fn_tmp)
+            raise
+        return self.load(key, name)
+
+    def get_host_grids(self, host, guest, parameters, **kwargs):
+        '''Return energy grids of the guest atom types in the host
+
+           The arguments are those of
+           :func:`yaff.pes.hostgrid.compute_host_grids`. The grids are only
+           computed when they are not present in the cache.
+        '''
+        if not isinstance(parameters, Parameters):
+            parameters = Parameters.from_file(parameters)
+        ffatypes = sorted(set(guest.get_ffatype(i) for i in range(guest.natom)))
+        key = self.get_key('grids', host, guest, parameters, kwargs)
+        grids = self.load(key, 'grids')
+        if grids is None:
+            result = compute_host_grids(host, guest, parameters, **kwargs)
+            grids = self.store(key, 'grids',
+                np.array([result[ffatype] for ffatype in ffatypes]))
+        elif log.do_medium:
+            with log.section('HCACHE'):
+                log('Loaded host grids %s' % key)
+        return dict(zip(ffatypes, grids))
+
+    def get_structure_factors(self, ewald_reci, pos, charges):
+        '''Return the structure factors of the host atoms
+
+           **Arguments:**
+
+           ewald_reci
+                A ForcePartEwaldReciprocalInteraction instance.
+
+           pos, charges
+                The positions and charges of the host atoms.
+
+           **Returns:** cosfacs and sinfacs, arrays with the shape of the
+           structure factors of ewald_reci.
+        '''
+        key = self.get_key('structure_factors', pos, charges,
+            ewald_reci.cell.rvecs, ewald_reci.alpha, ewald_reci.gcut)
+        facs = self.load(key, 'facs')
+        if facs is None:
+            facs = np.zeros((2,) + ewald_reci.cosfacs.shape)
+            ewald_reci.compute_structurefactors(pos, charges, facs[0], facs[1])
+            facs = self.store(key, 'facs', facs)
+        return facs[0], facs[1]
+
+    def reset_bins(self, interaction, pos, natom):
+        '''Put the host atoms in the linked cells of an MCInteraction
+
+           This is equivalent to ``interaction.reset(pos, natom)``, but the
+           linked cells are only constructed when they are not present in the
+           cache. No atoms can be added to the linked cells afterwards.
+        '''
+        key = self.get_key('bins', pos[:natom], interaction.cell.rvecs,
+            interaction.rcut, interaction.nbins)
+        arrays = [self.load(key, name) for name in self.bin_arrays]
+        if any(array is None for array in arrays):
+            interaction.reset(pos, natom)
+            arrays = [self.store(key, name, getattr(interaction, name))
+                      for name in self.bin_arrays]
+        for name, array in zip(self.bin_arrays, arrays):
+            setattr(interaction, name, array)
+        interaction.natom = natom
+
+
+def _update_hash(h, item):
+    '''Add an item to a hashlib object, see :meth:`HostCache.get_key`'''
+    if isinstance(item, System):
+        _update_hash(h, ['System', item.numbers, item.pos, item.cell.rvecs,
+            item.ffatypes, item.ffatype_ids, item.bonds, item.charges,
+            item.radii])
+    elif isinstance(item, Parameters):
+        sections = []
+        for prefix, section in sorted(item.sections.items()):
+            for suffix, definition in sorted(section.definitions.items()):
+                sections.append('%s:%s' % (prefix, suffix))
+                sections.extend(data for counter, data in definition.lines)
+        _update_hash(h, ['Parameters'] + sections)
+    elif isinstance(item, Cell):
+        _update_hash(h, ['Cell', item.rvecs])
+    elif isinstance(item, Switch3):
+        _update_hash(h, ['Switch3', item.width])
+    elif isinstance(item, Hammer):
+        _update_hash(h, ['Hammer', item.tau])
+    elif isinstance(item, np.ndarray):
+        item = np.ascontiguousarray(item)
+        _update_hash(h, ['ndarray', item.dtype.str, item.shape])
+        h.update(item.tobytes())
+    elif isinstance(item, dict):
+        _update_hash(h, ['dict'] + sorted(item.items()))
+    elif isinstance(item, (list, tuple)):
+        h.update(('%s %i\n' % (type(item).__name__, len(item))).encode())
+        for child in item:
+            _update_hash(h, child)
+    elif item is None or isinstance(item, (bool, int, float, str, np.number, np.bool_)):
+        h.update(('%s %r\n' % (type(item).__name__, item)).encode())
+    else:
+        raise TypeError('Cannot derive a cache key from an instance of %s.' % type(item).__name__)
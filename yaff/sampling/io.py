@@ -26,17 +26,135 @@
 
 from __future__ import division
 
+import os
+import queue
+import threading
+
+import numpy as np
+import h5py as h5
+
 from yaff.sampling.iterative import Hook, AttributeStateItem, PosStateItem, CellStateItem, ConsErrStateItem
 from yaff.sampling.nvt import NHCThermostat, NHCAttributeStateItem
 from yaff.sampling.npt import MTKBarostat, MTKAttributeStateItem, TBCombination
 from yaff.sampling.mc import MC
+from yaff.sampling.enhanced import MTDHook
+from yaff.pes.ext import Cell
+from yaff.system import System
+
+
+__all__ = [
+    'AsyncWriter', 'HDF5Writer', 'MCHDF5Writer', 'MCSnapshots', 'XYZWriter',
+    'RestartWriter', 'CheckpointWriter',
+]
+
+
+class AsyncWriter(Hook):
+    '''Base class for writers that can write their output in a background thread
+
+       Subclasses implement ``init``, which is called at the first call and
+       prepares the output, ``snapshot``, which copies the data to be written
+       from the iterative algorithm, and ``write``, which writes a snapshot.
+       When ``queue_size`` is larger than zero, the snapshots are passed to a
+       background thread through a queue with at most ``queue_size`` waiting
+       snapshots, such that the simulation continues while the output is
+       written. When the queue is full, the simulation waits until a snapshot
+       has been written. ``flush`` waits until all snapshots are written,
+       stops the background thread and raises its exceptions.
+    '''
+    def __init__(self, start=0, step=1, queue_size=0):
+        """
+           **Optional arguments:**
 
+           start
+                The first iteration at which this hook should be called.
 
-__all__ = ['HDF5Writer', 'MCHDF5Writer', 'XYZWriter', 'RestartWriter']
+           step
+                The hook will be called every `step` iterations.
+
+           queue_size
+                The maximum number of snapshots waiting to be written by the
+                background thread. When zero, the output is written
+                immediately and no thread is used.
+        """
+        self.queue_size = queue_size
+        self.initialized = False
+        self._queue = None
+        self._thread = None
+        self._error = None
+        Hook.__init__(self, start, step)
 
+    # Put in the queue to stop the background thread
+    _stop = object()
 
-class BaseHDF5Writer(Hook):
-    def __init__(self, f, start=0, step=1):
+    def __call__(self, iterative):
+        if not self.initialized:
+            self.init(iterative)
+            self.initialized = True
+        snapshot = self.snapshot(iterative)
+        if self.queue_size <= 0:
+            self.write(snapshot)
+            return
+        self._raise_error()
+        if self._thread is None:
+            self._queue = queue.Queue(self.queue_size)
+            self._thread = threading.Thread(target=self._work)
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put(snapshot)
+
+    def _work(self):
+        while True:
+            snapshot = self._queue.get()
+            if snapshot is self._stop:
+                self._queue.task_done()
+                break
+            try:
+                # After a failure, the remaining snapshots are discarded.
+                if self._error is None:
+                    self.write(snapshot)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def flush(self):
+        """Write all pending output"""
+        if self._thread is not None:
+            # The thread stops after writing the snapshots in the queue. A new
+            # one is started by the next call.
+            self._queue.put(self._stop)
+            self._thread.join()
+            self._queue = None
+            self._thread = None
+            self._raise_error()
+        self.write_pending()
+
+    def init(self, iterative):
+        pass
+
+    def snapshot(self, iterative):
+        raise NotImplementedError
+
+    def write(self, snapshot):
+        raise NotImplementedError
+
+    def write_pending(self):
+        """Write output that the writer keeps in memory itself"""
+        pass
+
+
+class BaseHDF5Writer(AsyncWriter):
+    # Atomic arrays stored in single precision when requested
+    single_precision_keys = ['pos', 'vel', 'gpos']
+
+    def __init__(self, f, start=0, step=1, buffer_size=1, chunk_size=None,
+                 compression=None, compression_opts=None, shuffle=False,
+                 single_precision=False, queue_size=0):
         """
            **Argument:**
 
@@ -50,33 +168,109 @@ class BaseHDF5Writer(Hook):
 
            step
                 The hook will be called every `step` iterations.
+
+           queue_size
+                When larger than zero, the trajectory is written by a
+                background thread, see :class:`AsyncWriter`. The file should
+                not be accessed otherwise until ``flush`` is called, which
+                happens at the end of a run.
+
+           buffer_size
+                The number of frames that are kept in memory before they are
+                written to the file in one block. By default, every frame is
+                written immediately. Buffered frames are written at the end
+                of a run, or when ``flush`` is called.
+
+           chunk_size
+                The number of frames in an HDF5 chunk. By default, this is
+                the buffer size, such that every block write fills whole
+                chunks. When neither is given, h5py chooses the chunks.
+
+           compression, compression_opts, shuffle
+                The compression filter ('gzip' or 'lzf'), its options and
+                whether the shuffle filter is applied, see
+                ``h5py.Group.create_dataset``.
+
+           single_precision
+                When True, the positions, velocities and gradients are stored
+                in single precision.
+
+           The frames are written such that a partially written frame, e.g.
+           after a crash during a write, is overwritten by the next one,
+           also when the writer is resumed with the same file.
         """
         self.f = f
-        Hook.__init__(self, start, step)
-
-    def __call__(self, iterative):
+        self.buffer_size = max(buffer_size, 1)
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.shuffle = shuffle
+        self.single_precision = single_precision
+        # Frames in memory, each a list of (key, value) pairs
+        self.frames = []
+        self.keys = None
+        AsyncWriter.__init__(self, start, step, queue_size)
+
+    def init(self, iterative):
         if 'trajectory' not in self.f:
             self.init_trajectory(iterative)
-        tgrp = self.f['trajectory']
-        # determine the row to write the current iteration to. If a previous
-        # iterations was not completely written, then the last row is reused.
-        row = min(tgrp[key].shape[0] for key in iterative.state if key in tgrp.keys())
+        self.keys = list(iterative.state.keys())
+
+    def snapshot(self, iterative):
+        frame = []
         for key, item in iterative.state.items():
             if item.value is None:
                 continue
             if len(item.shape) > 0 and min(item.shape) == 0:
                 continue
+            frame.append((key, np.copy(item.value)))
+        return frame
+
+    def write(self, frame):
+        self.frames.append(frame)
+        if len(self.frames) >= self.buffer_size:
+            self.write_pending()
+
+    def write_pending(self):
+        """Write the frames in memory to the file"""
+        if len(self.frames) == 0:
+            return
+        tgrp = self.f['trajectory']
+        # determine the row to write the first frame to. If a previous
+        # iterations was not completely written, then the last row is reused.
+        keys = [key for key in self.keys if key in tgrp.keys()]
+        row = min(tgrp[key].shape[0] for key in keys)
+        end = row + len(self.frames)
+        # The rows of each key are stacked by frame index. A key without a
+        # value in some frames keeps the fill value of the dataset in those
+        # rows, such that all datasets have the same number of rows.
+        values = {}
+        for iframe, frame in enumerate(self.frames):
+            for key, value in frame:
+                values.setdefault(key, []).append((iframe, value))
+        for key in keys:
             ds = tgrp[key]
-            if ds.shape[0] <= row:
-                # do not over-allocate. hdf5 works with chunks internally.
-                ds.resize(row+1, axis=0)
-            ds[row] = item.value
+            if ds.shape[0] < end:
+                # all rows of the block are allocated at once
+                ds.resize(end, axis=0)
+            rows = values.get(key, [])
+            if len(rows) == 1:
+                ds[row + rows[0][0]] = rows[0][1]
+            elif len(rows) == len(self.frames):
+                ds[row:end] = np.array([value for iframe, value in rows])
+            else:
+                for iframe, value in rows:
+                    ds[row + iframe] = value
+        self.frames = []
 
     def dump_system(self, system, grp):
         system.to_hdf5(grp)
 
     def init_trajectory(self, iterative):
         tgrp = self.f.create_group('trajectory')
+        chunk_size = self.chunk_size
+        if chunk_size is None and self.buffer_size > 1:
+            chunk_size = self.buffer_size
         for key, item in iterative.state.items():
             if len(item.shape) > 0 and min(item.shape) == 0:
                 continue
@@ -84,34 +278,266 @@ class BaseHDF5Writer(Hook):
                 continue
             maxshape = (None,) + item.shape
             shape = (0,) + item.shape
-            dset = tgrp.create_dataset(key, shape, maxshape=maxshape, dtype=item.dtype)
+            dtype = item.dtype
+            if self.single_precision and key in self.single_precision_keys:
+                dtype = np.float32
+            if chunk_size is None:
+                chunks = None
+            else:
+                chunks = (chunk_size,) + item.shape
+            dset = tgrp.create_dataset(key, shape, maxshape=maxshape, dtype=dtype,
+                chunks=chunks, compression=self.compression,
+                compression_opts=self.compression_opts, shuffle=self.shuffle)
             for name, value in item.iter_attrs(iterative):
                tgrp.attrs[name] = value
 
 
 class HDF5Writer(BaseHDF5Writer):
-    def __call__(self, iterative):
+    def init(self, iterative):
         if 'system' not in self.f:
             self.dump_system(iterative.ff.system, self.f)
-        BaseHDF5Writer.__call__(self, iterative)
+        BaseHDF5Writer.init(self, iterative)
 
 
 class MCHDF5Writer(BaseHDF5Writer):
-    """Write output to hdf5 file during Monte Carlo simulations"""
-    def __call__(self, mc):
+    """Write output to hdf5 file during Monte Carlo simulations
+
+       Besides the usual trajectory group, the configurations of the guests
+       are written to the ``snapshots`` group. Because the number of guests
+       is not necessarily fixed during a simulation, the positions of all
+       snapshots are concatenated in one ``pos`` dataset. The first row of
+       each snapshot in ``pos`` and its number of atoms are stored in the
+       ``offset`` and ``natom`` datasets, together with the ``counter`` and
+       the cell vectors (``rvecs``) of every snapshot. The topology of a
+       single guest is stored once, in ``snapshots/system``. Use
+       :class:`MCSnapshots` to read the snapshots.
+    """
+    def __init__(self, f, start=0, step=1, buffer_size=1, chunk_size=None,
+                 compression=None, compression_opts=None, shuffle=False,
+                 single_precision=False, queue_size=0):
+        # Snapshots in memory, each a tuple (counter, pos, rvecs)
+        self.snapshots = []
+        BaseHDF5Writer.__init__(self, f, start, step, buffer_size, chunk_size,
+            compression, compression_opts, shuffle, single_precision,
+            queue_size)
+
+    def init(self, iterative):
+        assert isinstance(iterative, MC)
+        if 'snapshots' not in self.f:
+            self.init_snapshots(iterative)
+        elif 'counter' not in self.f['snapshots']:
+            raise ValueError('The HDF5 file contains snapshots in the old layout, with one group per snapshot, which can not be extended.')
+        BaseHDF5Writer.init(self, iterative)
+
+    def init_snapshots(self, mc):
+        sgrp = self.f.create_group('snapshots')
+        self.dump_system(mc.guest, sgrp)
+        for key in 'counter', 'offset', 'natom':
+            self.create_snapshot_dataset(key, (), int)
+        # The positions are chunked by atoms, not by snapshots.
+        dtype = np.float32 if self.single_precision else float
+        self.create_snapshot_dataset('pos', (3,), dtype, max(mc.guest.natom, 1))
+
+    def create_snapshot_dataset(self, key, shape, dtype, nrow=1):
+        chunk_size = self.chunk_size
+        if chunk_size is None and self.buffer_size > 1:
+            chunk_size = self.buffer_size
+        chunks = None if chunk_size is None else (chunk_size*nrow,) + shape
+        self.f['snapshots'].create_dataset(key, (0,) + shape,
+            maxshape=(None,) + shape, dtype=dtype, chunks=chunks,
+            compression=self.compression, compression_opts=self.compression_opts,
+            shuffle=self.shuffle)
+
+    def snapshot(self, mc):
         assert isinstance(mc, MC)
-        # Dump the current configuration; the number of particles is not
-        # necessarily fixed during a simulation, so we can't just dump all
-        # positions in a giant array as done during MD simulations
-        if mc.current_configuration is not None:
-            grp = self.f.require_group("snapshots/%012d"%mc.counter)
-            self.dump_system(mc.current_configuration, grp)
+        guest_ff = getattr(mc, 'guest_ff', None)
+        if guest_ff is not None:
+            # GCMC: the positions are copied from the guest-guest force field,
+            # without constructing a System.
+            if not mc.started:
+                snapshot = None
+            else:
+                if guest_ff.nguest > 0:
+                    pos = np.concatenate([guest_ff.get_other_pos(),
+                                          guest_ff.get_last_pos()])
+                else:
+                    pos = np.zeros((0, 3))
+                snapshot = (mc.counter, pos, guest_ff.ff.system.cell.rvecs.copy())
+        else:
+            system = mc.current_configuration
+            if system is None:
+                snapshot = None
+            else:
+                snapshot = (mc.counter, system.pos.copy(), system.cell.rvecs.copy())
+        return snapshot, BaseHDF5Writer.snapshot(self, mc)
+
+    def write(self, snapshot):
+        snapshot, frame = snapshot
+        if snapshot is not None:
+            self.snapshots.append(snapshot)
         # The standard way of dumping simulation info to the trajectory group
-        BaseHDF5Writer.__call__(self, mc)
+        BaseHDF5Writer.write(self, frame)
+
+    def write_pending(self):
+        """Write the snapshots and frames in memory to the file"""
+        if len(self.snapshots) > 0:
+            sgrp = self.f['snapshots']
+            nvec = len(self.snapshots[0][2])
+            if 'rvecs' not in sgrp and nvec > 0:
+                # The number of cell vectors is known from the first snapshot.
+                self.create_snapshot_dataset('rvecs', (nvec, 3), float)
+            # The positions are written before the index, such that a
+            # partially written snapshot is overwritten by the next one.
+            keys = [key for key in MCSnapshots.index_keys if key in sgrp]
+            row = min(sgrp[key].shape[0] for key in keys)
+            if row == 0:
+                atom = 0
+            else:
+                atom = sgrp['offset'][row-1] + sgrp['natom'][row-1]
+            natoms = np.array([len(pos) for counter, pos, rvecs in self.snapshots])
+            end = row + len(self.snapshots)
+            atom_end = atom + natoms.sum()
+            sgrp['pos'].resize(atom_end, axis=0)
+            if atom_end > atom:
+                sgrp['pos'][atom:atom_end] = np.concatenate(
+                    [pos for counter, pos, rvecs in self.snapshots])
+            for key in keys:
+                sgrp[key].resize(end, axis=0)
+            sgrp['counter'][row:end] = [counter for counter, pos, rvecs in self.snapshots]
+            sgrp['offset'][row:end] = atom + np.cumsum(natoms) - natoms
+            sgrp['natom'][row:end] = natoms
+            if nvec > 0:
+                sgrp['rvecs'][row:end] = [rvecs for counter, pos, rvecs in self.snapshots]
+            self.snapshots = []
+        BaseHDF5Writer.write_pending(self)
+
+
+class MCSnapshots(object):
+    """Read the snapshots written by an :class:`MCHDF5Writer`
+
+       A snapshot ``k`` is read without loading the other snapshots, and
+       ``iter_pos`` reads the positions of consecutive snapshots in blocks.
+       Files with one group per snapshot, as written by older versions of
+       Yaff, can also be read.
+    """
+    # Datasets with one row per snapshot
+    index_keys = ['counter', 'offset', 'natom', 'rvecs']
+
+    def __init__(self, f):
+        """
+           **Arguments:**
+
+           f
+                An h5.File object or group with a ``snapshots`` group.
+        """
+        self.sgrp = f['snapshots']
+        if 'counter' in self.sgrp:
+            self.guest = System.from_hdf5(self.sgrp)
+            nsnapshot = min(self.sgrp[key].shape[0] for key in self.index_keys
+                            if key in self.sgrp)
+            self.counter = self.sgrp['counter'][:nsnapshot]
+            self.offset = self.sgrp['offset'][:nsnapshot]
+            self.natom = self.sgrp['natom'][:nsnapshot]
+            self.names = None
+        else:
+            self.guest = None
+            self.names = sorted(self.sgrp)
+            self.counter = np.array([int(name) for name in self.names])
+
+    def __len__(self):
+        return len(self.counter)
+
+    def get_pos(self, k):
+        """Return the atomic positions of snapshot k"""
+        if self.names is not None:
+            return self.sgrp[self.names[k]]['system/pos'][:]
+        return self.sgrp['pos'][self.offset[k]:self.offset[k]+self.natom[k]]
+
+    def get_rvecs(self, k):
+        """Return the cell vectors of snapshot k"""
+        if self.names is not None:
+            sgrp = self.sgrp[self.names[k]]['system']
+            if 'rvecs' in sgrp:
+                return sgrp['rvecs'][:]
+        elif 'rvecs' in self.sgrp:
+            return self.sgrp['rvecs'][k]
+        return np.zeros((0, 3), float)
+
+    def __getitem__(self, k):
+        """Return a System with the guests of snapshot k"""
+        if self.names is not None:
+            return System.from_hdf5(self.sgrp[self.names[k]])
+        return _repeat_guest(self.guest, self.get_pos(k), self.get_rvecs(k))
+
+    def iter_pos(self, start=0, end=None, step=1, block_size=1000):
+        """Iterate over the counter, positions and cell vectors of snapshots
+
+           **Optional arguments:**
 
+           start, end, step
+                Only the snapshots ``start:end:step`` are included.
 
-class XYZWriter(Hook):
-    def __init__(self, fn_xyz, select=None, start=0, step=1):
+           block_size
+                The number of consecutive snapshots that are read at once.
+        """
+        indexes = np.arange(len(self))[start:end:step]
+        if self.names is not None:
+            for k in indexes:
+                yield self.counter[k], self.get_pos(k), self.get_rvecs(k)
+            return
+        ds_rvecs = self.sgrp.get('rvecs')
+        for i0 in range(0, len(indexes), block_size):
+            block = indexes[i0:i0+block_size]
+            k0 = block[0]
+            k1 = block[-1] + 1
+            atom0 = self.offset[k0]
+            pos = self.sgrp['pos'][atom0:self.offset[k1-1]+self.natom[k1-1]]
+            if ds_rvecs is None:
+                rvecs = np.zeros((k1-k0, 0, 3), float)
+            else:
+                rvecs = ds_rvecs[k0:k1]
+            for k in block:
+                begin = self.offset[k] - atom0
+                yield self.counter[k], pos[begin:begin+self.natom[k]], rvecs[k-k0]
+
+    def __iter__(self):
+        """Iterate over Systems with the guests of all snapshots"""
+        if self.names is not None:
+            for k in range(len(self)):
+                yield self[k]
+        else:
+            for counter, pos, rvecs in self.iter_pos():
+                yield _repeat_guest(self.guest, pos, rvecs)
+
+
+def _repeat_guest(guest, pos, rvecs):
+    '''Return a System with copies of the guest at the given positions'''
+    nguest = len(pos)//guest.natom
+    assert nguest*guest.natom == len(pos)
+    if nguest == 0:
+        system = System.create_empty()
+        system.cell = Cell(rvecs)
+        return system
+    kwargs = {'pos': pos, 'rvecs': rvecs}
+    if guest.ffatypes is not None:
+        kwargs['ffatypes'] = guest.ffatypes.copy()
+    if guest.scopes is not None:
+        kwargs['scopes'] = guest.scopes.copy()
+    for attrname in 'numbers', 'ffatype_ids', 'scope_ids', 'charges', \
+                    'radii', 'valence_charges', 'radii2', 'masses':
+        value = getattr(guest, attrname)
+        if value is not None:
+            kwargs[attrname] = np.tile(value, nguest)
+    if guest.dipoles is not None:
+        kwargs['dipoles'] = np.tile(guest.dipoles, (nguest, 1))
+    if guest.bonds is not None:
+        offsets = guest.natom*np.arange(nguest)
+        kwargs['bonds'] = (guest.bonds + offsets[:,None,None]).reshape(-1, 2)
+    return System(**kwargs)
+
+
+class XYZWriter(AsyncWriter):
+    def __init__(self, fn_xyz, select=None, start=0, step=1, queue_size=0):
         """
            **Argument:**
 
@@ -129,14 +555,17 @@ class XYZWriter(Hook):
 
            step
                 The hook will be called every `step` iterations.
+
+           queue_size
+                When larger than zero, the trajectory is written by a
+                background thread, see :class:`AsyncWriter`.
         """
         self.fn_xyz = fn_xyz
         self.select = select
         self.xyz_writer = None
-        Hook.__init__(self, start, step)
+        AsyncWriter.__init__(self, start, step, queue_size)
 
-    def __call__(self, iterative):
-        from molmod import angstrom
+    def init(self, iterative):
         if self.xyz_writer is None:
             from molmod.periodic import periodic
             from molmod.io import XYZWriter
@@ -146,18 +575,25 @@ class XYZWriter(Hook):
             else:
                 symbols = [periodic[numbers[i]].symbol for i in self.select]
             self.xyz_writer = XYZWriter(self.fn_xyz, symbols)
+
+    def snapshot(self, iterative):
+        from molmod import angstrom
         rvecs = iterative.ff.system.cell.rvecs.copy()
         rvecs_string = " ".join([str(x[0]/angstrom) for x in rvecs.reshape((-1,1))])
         title = '%7i E_pot = %.10f    %s' % (iterative.counter, iterative.epot, rvecs_string)
         if self.select is None:
-            pos = iterative.ff.system.pos
+            pos = iterative.ff.system.pos.copy()
         else:
             pos = iterative.ff.system.pos[self.select]
+        return title, pos
+
+    def write(self, snapshot):
+        title, pos = snapshot
         self.xyz_writer.dump(title, pos)
 
 
-class RestartWriter(Hook):
-    def __init__(self, f, start=0, step=1000):
+class RestartWriter(AsyncWriter):
+    def __init__(self, f, start=0, step=1000, queue_size=0):
         """
             **Argument:**
 
@@ -171,11 +607,15 @@ class RestartWriter(Hook):
 
             step
                 The hook will be called every `step` iterations.
+
+            queue_size
+                When larger than zero, the restart information is written by
+                a background thread, see :class:`AsyncWriter`.
         """
         self.f = f
         self.state = None
         self.default_state = None
-        Hook.__init__(self, start, step)
+        AsyncWriter.__init__(self, start, step, queue_size)
 
     def init_state(self, iterative):
         # Basic properties needed for the restart
@@ -226,27 +666,33 @@ class RestartWriter(Hook):
         self.state = dict((item.key, item) for item in self.state_list)
 
 
-    def __call__(self, iterative):
+    def init(self, iterative):
         if 'system' not in self.f:
             self.dump_system(iterative.ff.system)
         if 'trajectory' not in self.f:
             self.init_trajectory(iterative)
-        tgrp = self.f['trajectory']
-        # determine the row to write the current iteration to. If a previous
-        # iterations was not completely written, then the last row is reused.
-        row = min(tgrp[key].shape[0] for key in self.state if key in tgrp.keys())
+
+    def snapshot(self, iterative):
+        values = []
         for key, item in self.state.items():
             if item.value is None:
                 continue
             if len(item.shape) > 0 and min(item.shape) == 0:
                 continue
-            if item.value is None:
-                continue
+            values.append((key, np.copy(item.value)))
+        return values
+
+    def write(self, values):
+        tgrp = self.f['trajectory']
+        # determine the row to write the current iteration to. If a previous
+        # iterations was not completely written, then the last row is reused.
+        row = min(tgrp[key].shape[0] for key in self.state if key in tgrp.keys())
+        for key, value in values:
             ds = tgrp[key]
             if ds.shape[0] <= row:
                 # do not over-allocate. hdf5 works with chunks internally.
                 ds.resize(row+1, axis=0)
-            ds[row] = item.value
+            ds[row] = value
 
     def dump_system(self, system):
         system.to_hdf5(self.f)
@@ -285,3 +731,83 @@ class RestartWriter(Hook):
                 # Dump the barostat thermostat properties
                 rgrp.create_dataset('baro_chain_temp', data = hook.baro_thermo.temp)
                 rgrp.create_dataset('baro_chain_timecon', data = hook.baro_thermo.chain.timecon)
+
+
+class CheckpointWriter(RestartWriter):
+    def __init__(self, fn, start=0, step=1000, queue_size=0):
+        """
+            **Argument:**
+
+            fn
+                The name of the HDF5 checkpoint file.
+
+            **Optional arguments:**
+
+            start
+                The first iteration at which this hook should be called.
+
+            step
+                The hook will be called every `step` iterations.
+
+            queue_size
+                When larger than zero, the checkpoints are written by a
+                background thread, see :class:`AsyncWriter`.
+
+            Unlike the :class:`RestartWriter`, which appends the state to a
+            growing trajectory, the checkpoint file only contains the last
+            state. Each checkpoint is written to a temporary file, which
+            then replaces the previous checkpoint, such that a crash during
+            a write never destroys the last complete checkpoint. The file
+            has the same layout as the output of the RestartWriter and can be
+            passed as ``restart_h5`` to the VerletIntegrator. The Gaussian
+            hills of an :class:`yaff.sampling.enhanced.MTDHook` are also
+            included and can be read with its ``restart_file`` argument. At
+            most one MTDHook is supported.
+        """
+        self.fn = fn
+        # The system and restart groups are prepared in memory once and
+        # copied into every checkpoint.
+        f = h5.File('%s.template' % fn, mode='w', driver='core', backing_store=False)
+        RestartWriter.__init__(self, f, start, step, queue_size)
+
+    def init(self, iterative):
+        if sum(isinstance(hook, MTDHook) for hook in iterative.hooks) > 1:
+            raise ValueError('The CheckpointWriter supports at most one MTDHook.')
+        if 'system' not in self.f:
+            self.dump_system(iterative.ff.system)
+
+    def snapshot(self, iterative):
+        # All arrays are copied, because they may change before a background
+        # thread writes them.
+        hills = None
+        for hook in iterative.hooks:
+            if isinstance(hook, MTDHook):
+                periodicities = hook.hills.periodicities
+                if periodicities is not None:
+                    periodicities = np.copy(periodicities)
+                hills = (np.copy(hook.hills.sigmas), hook.hills.q0s.copy(),
+                    hook.hills.Ks.copy(), hook.tempering, periodicities)
+        return RestartWriter.snapshot(self, iterative), hills
+
+    def write(self, snapshot):
+        values, hills = snapshot
+        fn_tmp = '%s.tmp' % self.fn
+        # The file is assembled in memory and written to disk at once.
+        with h5.File(fn_tmp, mode='w', driver='core', backing_store=True) as f:
+            for name in 'system', 'restart':
+                self.f.copy(name, f)
+            tgrp = f.create_group('trajectory')
+            for key, value in values:
+                tgrp.create_dataset(key, data=value[None], maxshape=(None,) + value.shape)
+            if hills is not None:
+                sigmas, q0s, Ks, tempering, periodicities = hills
+                hgrp = f.create_group('hills')
+                hgrp.create_dataset('sigma', data=sigmas)
+                hgrp.create_dataset('q0', data=q0s, maxshape=(None, q0s.shape[1]))
+                hgrp.create_dataset('K', data=Ks, maxshape=(None,))
+                hgrp.attrs['tempering'] = tempering
+                if periodicities is not None:
+                    hgrp.create_dataset('periodicities', data=periodicities)
+        with open(fn_tmp, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(fn_tmp, self.fn)
@@ -41,7 +41,8 @@ __all__ = [
     'Iterative', 'StateItem', 'AttributeStateItem', 'PosStateItem',
     'DipoleStateItem', 'DipoleVelStateItem', 'VolumeStateItem', 'CellStateItem',
     'EPotContribStateItem', 'EpotBondsStateItem', 'EpotBendsStateItem',
-    'EpotDihedsStateItem', 'CVStateItem', 'BiasStateItem', 'Hook',
+    'EpotDihedsStateItem', 'CVStateItem', 'BiasStateItem',
+    'NeighborListStateItem', 'Hook',
 ]
 
 
@@ -119,15 +120,29 @@ class Iterative(object):
 
     def run(self, nstep=None):
         with log.section(self.log_name), timer.section(self.log_name):
-            if nstep is None:
-                while True:
-                    if self.propagate():
-                        break
-            else:
-                for i in range(nstep):
-                    if self.propagate():
-                        break
-            self.finalize()
+            try:
+                if nstep is None:
+                    while True:
+                        if self.propagate():
+                            break
+                else:
+                    for i in range(nstep):
+                        if self.propagate():
+                            break
+                self.finalize()
+            except BaseException:
+                # Pending output of the hooks is also written when the run
+                # is interrupted by an exception, but an error while writing
+                # does not replace the original exception.
+                for hook in self.hooks:
+                    try:
+                        hook.flush()
+                    except Exception as e:
+                        if log.do_warning:
+                            log.warn('Could not flush the output of %s: %s' % (hook, e))
+                raise
+            for hook in self.hooks:
+                hook.flush()
 
     def propagate(self):
         self.counter += 1
@@ -229,10 +244,10 @@ class EPotContribStateItem(StateItem):
         StateItem.__init__(self, 'epot_contribs')
 
     def get_value(self, iterative):
-        return np.array([part.energy for part in iterative.ff.parts])
+        return np.array([part.energy for part in iterative.ff.iter_contribs()])
 
     def iter_attrs(self, iterative):
-        yield 'epot_contrib_names', np.array([part.name for part in iterative.ff.parts], dtype='S')
+        yield 'epot_contrib_names', np.array([part.name for part in iterative.ff.iter_contribs()], dtype='S')
 
 
 class EpotBondsStateItem(StateItem):
@@ -416,6 +431,21 @@ class BiasStateItem(StateItem):
         return self.part_bias.get_term_energies()
 
 
+class NeighborListStateItem(StateItem):
+    """Keeps track of the neighbor list statistics, see
+       :meth:`yaff.pes.nlist.NeighborList.get_stats`."""
+    def __init__(self):
+        StateItem.__init__(self, 'nlist_stats')
+
+    def get_value(self, iterative):
+        if iterative.ff.nlist is not None:
+            return iterative.ff.nlist.get_stats()
+
+    def iter_attrs(self, iterative):
+        if iterative.ff.nlist is not None:
+            yield 'nlist_stats_names', np.array(iterative.ff.nlist.stats_names, dtype='S')
+
+
 class Hook(object):
     name = None
     kind = None
@@ -438,3 +468,7 @@ class Hook(object):
 
     def __call__(self, iterative):
         raise NotImplementedError
+
+    def flush(self):
+        """Write output that is kept in memory, called at the end of a run"""
+        pass
@@ -40,12 +40,13 @@
         * Complete NPT MC simulator
         * Variable cell shape simulations?
         * Hybrid MD/MC
-        * Tabulating the external potential
 '''
 
 
 from __future__ import division
 
+import bisect
+
 import numpy as np
 
 from molmod import boltzmann, femtosecond, angstrom, kelvin, bar
@@ -54,7 +55,11 @@ from yaff.log import log, timer
 from yaff.pes.ff import ForceField, \
     ForcePartEwaldReciprocalInteraction
 from yaff.pes.ext import Cell
+from yaff.sampling.mcenergy import MCInteraction, HostOccupancy, \
+    GCMCForceField, make_external_potential
 from yaff.sampling.mcutils import *
+from yaff.sampling.cbmc import CBMCGrowth
+from yaff.sampling.hostcache import HostCache
 from yaff.sampling import mctrials
 from yaff.sampling.iterative import AttributeStateItem
 from yaff.system import System
@@ -70,6 +75,10 @@ class MC(object):
     allowed_trials = []
     default_trials = {}
     default_state = []
+    # A HostCache with the precomputed data of a rigid host, if any
+    host_cache = None
+    # A HostOccupancy with the blocked regions of a rigid host, if any
+    host_occupancy = None
 
     def __init__(self, state):
         """
@@ -81,6 +90,10 @@ class MC(object):
                 MC algorithm.
         """
         self.counter = 0
+        self.guest_interaction = None
+        self.host_interaction = None
+        self.cbmc = None
+        self.random = RandomBuffer()
         if state is None:
             self.state_list = [state_item.copy() for state_item in self.default_state]
         else:
@@ -90,7 +103,9 @@ class MC(object):
         self.call_hooks()
 
     def call_hooks(self):
-        # Initialize hooks
+        # Avoid the overhead of the timer when no hook needs to be called
+        if not any(hook.expects_call(self.counter) for hook in self.hooks):
+            return
         with timer.section('%s hooks' % self.log_name):
             state_updated = False
             for hook in self.hooks:
@@ -104,7 +119,8 @@ class MC(object):
     def run(self, nsteps, mc_moves=None, initial=None, einit=0,
                 translation_stepsize=1.0*angstrom,
                 volumechange_stepsize=10.0*angstrom**3,
-                close_contact=0.4*angstrom):
+                close_contact=0.4*angstrom, cbmc_ntrial=10, counter=0,
+                seed=None, random_block=4096, timer_step=1):
         """
            Perform Monte-Carlo steps
 
@@ -136,6 +152,30 @@ class MC(object):
            close_contact
                 Automatically reject TrialMove if atoms are placed shorter
                 than this distance apart
+
+           cbmc_ntrial
+                The number of trial positions for each atom in the
+                configurational-bias moves (cbmc_insertion, cbmc_deletion and
+                cbmc_regrowth), see :class:`yaff.sampling.cbmc.CBMCGrowth`.
+
+           counter
+                The value of the step counter at the start. A nonzero value
+                continues a previous run: the running averages are not reset
+                and the hooks are not called for the initial state, such
+                that the output of the hooks is simply extended.
+
+           seed
+                The seed for the random numbers of the trial moves, see
+                :class:`yaff.sampling.mcutils.RandomBuffer`. When not given,
+                it is drawn from the global random state of numpy.
+
+           random_block
+                The number of random numbers that is generated at once.
+
+           timer_step
+                Only every timer_step-th trial move is timed, which reduces
+                the overhead of the timer for cheap trial moves. The timings
+                of the trial moves then only cover a fraction of the trials.
         """
         if log.do_warning:
             log.warn("Currently, Yaff does not consider interactions of a guest molecule "
@@ -147,18 +187,11 @@ class MC(object):
             self.translation_stepsize = translation_stepsize
             self.volumechange_stepsize = volumechange_stepsize
             self.close_contact = close_contact
+            self.random = RandomBuffer(seed, random_block)
             if initial is not None:
-                self.N = initial.natom//self.guest.natom
-                assert self.guest.natom*self.N==initial.natom, ("Initial configuration does not contain correct number of atoms")
-                self.current_configuration = initial
-                self.get_ff(self.N).system.pos[:] = initial.pos
-                if self.ewald_reci is not None:
-                    self.ewald_reci.compute_structurefactors(
-                        initial.pos,
-                        initial.charges,
-                        self.ewald_reci.cosfacs, self.ewald_reci.sinfacs)
-            else:
-                self.current_configuration = self.get_ff(self.N).system
+                self.set_configuration(initial.pos)
+            self.started = True
+            self.initialize_interactions()
             self.energy = einit
             if not self.conditions_set:
                 raise ValueError("External conditions have not been set!")
@@ -169,49 +202,161 @@ class MC(object):
             for t in sorted(mc_moves.keys()):
                 if not t in self.allowed_trials:
                     raise ValueError("Trial move %s not allowed!"%t)
-                trial = getattr(mctrials,"Trial"+t.capitalize(),None)
+                name = "".join(word.capitalize() for word in t.split('_'))
+                trial = getattr(mctrials,"Trial"+name,None)
                 if trial is None:
                     raise NotImplementedError("The requested trial move %s is not implemented"%(t))
                 # Trials is a list containing instances of Trial classes from the mctrials module
                 trials.append(trial(self))
                 probabilities.append(mc_moves[t])
+            if any(t.startswith('cbmc_') for t in mc_moves):
+                self.initialize_cbmc(cbmc_ntrial)
             probabilities = np.asarray(probabilities)
             probabilities /= np.sum(probabilities)
             assert np.all(probabilities>=0.0), "Negative probabilities are not allowed!"
             # Take the cumulative sum, makes it a bit easier to determine which MC move is selected
-            probabilities = np.cumsum(probabilities)
+            probabilities = np.cumsum(probabilities).tolist()
+            probabilities[-1] = 1.0
             # Array to keep track of accepted (1st column) and tried (2nd column)
             # moves, with rows corresponding to different possible moves
             acceptance = np.zeros((len(trials),2), dtype=int)
             # Start performing MC moves
-            self.Nmean = self.N
-            self.emean = self.energy
-            self.Vmean = self.current_configuration.cell.volume
-            self.counter = 0
-            self.call_hooks()
-            for istep in range(nsteps):
-                switch = np.random.rand()
-                # Select one of the possible MC moves
-                imove = np.where(switch<probabilities)[0][0]
-                # Call the corresponding method
-                accepted = trials[imove]()
-                # Update records with accepted and tried MC moves
-                acceptance[imove,1] += 1
-                if accepted: acceptance[imove,0] += 1
-                self.counter += 1
-                self.Nmean += (self.N-self.Nmean)/self.counter
-                self.emean += (self.energy-self.emean)/self.counter
-                self.Vmean += (self.current_configuration.cell.volume-self.Vmean)/self.counter
+            cell = self.get_ff(self.N).system.cell
+            if counter == 0:
+                self.Nmean = self.N
+                self.emean = self.energy
+                self.Vmean = cell.volume
+            self.counter = counter
+            if counter == 0:
                 self.call_hooks()
+            random = self.random
+            try:
+                for istep in range(nsteps):
+                    switch = random.next()
+                    # Select one of the possible MC moves
+                    imove = bisect.bisect_right(probabilities, switch)
+                    # Call the corresponding method, with a timer when requested
+                    if istep % timer_step == 0:
+                        accepted = trials[imove]()
+                    else:
+                        accepted = trials[imove].step()
+                    # Update records with accepted and tried MC moves
+                    acceptance[imove,1] += 1
+                    if accepted: acceptance[imove,0] += 1
+                    self.counter += 1
+                    self.Nmean += (self.N-self.Nmean)/self.counter
+                    self.emean += (self.energy-self.emean)/self.counter
+                    self.Vmean += (cell.volume-self.Vmean)/self.counter
+                    self.call_hooks()
+            except BaseException:
+                # Pending output of the hooks is also written when the run
+                # is interrupted by an exception, but an error while writing
+                # does not replace the original exception.
+                for hook in self.hooks:
+                    try:
+                        hook.flush()
+                    except Exception as e:
+                        if log.do_warning:
+                            log.warn('Could not flush the output of %s: %s' % (hook, e))
+                raise
+            for hook in self.hooks:
+                hook.flush()
+            if log.do_medium:
+                for t, (naccepted, ntried) in zip(sorted(mc_moves.keys()), acceptance):
+                    if ntried > 0:
+                        log('%-16s accepted %8d of %8d trials (%6.2f %%)' % (
+                            t, naccepted, ntried, naccepted*100.0/ntried))
+                if self.cbmc is not None:
+                    self.cbmc.log()
             return acceptance
 
+    def set_configuration(self, pos):
+        """Replace the current guests by guests with the given positions
+
+           **Arguments:**
+
+           pos
+                A numpy array with the positions of all guests, such that the
+                number of rows is a multiple of the number of atoms in a
+                guest.
+
+           The Ewald structure factors are recomputed for the host and the
+           new guests.
+        """
+        self.N = len(pos)//self.guest.natom
+        assert self.guest.natom*self.N==len(pos), ("Initial configuration does not contain correct number of atoms")
+        self.set_positions(pos)
+        if self.ewald_reci is not None:
+            self.ewald_reci.cosfacs[:] = self.cosfacs_host
+            self.ewald_reci.sinfacs[:] = self.sinfacs_host
+            if self.N > 0:
+                self.ewald_reci.compute_structurefactors(pos,
+                    np.tile(self.guest.charges, self.N),
+                    self.ewald_reci.cosfacs, self.ewald_reci.sinfacs)
+
     def reorder_guests(self, system, iguest):
-        """Reorder guests so the one with index iguest becomes the last one"""
-        idx0 = np.concatenate((np.arange(iguest*self.guest.natom,(iguest+1)*self.guest.natom),
-                               np.arange((self.N-1)*self.guest.natom,self.N*self.guest.natom)))
-        idx1 = np.concatenate((np.arange((self.N-1)*self.guest.natom,self.N*self.guest.natom),
-                               np.arange(iguest*self.guest.natom,(iguest+1)*self.guest.natom)))
+        """Reorder guests so the one with index iguest becomes the last one
+
+           The last guest is stored in the last slot of the System, the other
+           guests in the first slots.
+        """
+        if iguest==self.N-1:
+            return
+        natom = self.guest.natom
+        idx0 = np.concatenate((np.arange(iguest*natom,(iguest+1)*natom),
+                               np.arange(system.natom-natom,system.natom)))
+        idx1 = np.concatenate((np.arange(system.natom-natom,system.natom),
+                               np.arange(iguest*natom,(iguest+1)*natom)))
         system.pos[idx1] = system.pos[idx0]
+        if self.guest_interaction is not None:
+            self.guest_interaction.move(system.pos, iguest*natom, (iguest+1)*natom)
+
+    def initialize_interactions(self):
+        """Efficient computation of the interactions of a single guest
+
+           The interactions of the guest that is moved in a trial with the
+           other guests and with the host are computed with
+           :class:`yaff.sampling.mcenergy.MCInteraction`, which keeps the
+           other atoms in linked cells. This is only done for 3D periodic
+           systems and force fields with a neighbor list. In all other cases,
+           the force fields are simply evaluated.
+        """
+        self.guest_interaction = None
+        self.host_interaction = None
+        ff = self.get_ff(self.N)
+        if ff.system.cell.nvec != 3:
+            return
+        if ff.nlist is not None:
+            # Only the other guests are put in the bins, not the last one.
+            self.guest_interaction = MCInteraction(ff.system.cell,
+                max(ff.nlist.rcut, self.close_contact))
+            self.guest_interaction.reset(ff.system.pos,
+                max(self.N-1, 0)*self.guest.natom)
+        extpot = self.external_potential
+        if extpot is not None and extpot.nlist is not None:
+            self.host_interaction = MCInteraction(extpot.system.cell,
+                max(extpot.nlist.rcut, self.close_contact))
+            nhost = extpot.system.natom - self.guest.natom
+            if self.host_cache is None:
+                self.host_interaction.reset(extpot.system.pos, nhost)
+            else:
+                self.host_cache.reset_bins(self.host_interaction,
+                    extpot.system.pos, nhost)
+
+    def initialize_cbmc(self, ntrial):
+        """Setup the configurational-bias growth of flexible guests"""
+        if getattr(self, 'ff_intra', None) is None:
+            raise ValueError('Configurational-bias moves require a force '
+                             'field for the intramolecular interactions of a guest.')
+        if self.guest_interaction is None or (self.external_potential is not None
+                and self.host_interaction is None):
+            raise TypeError('Configurational-bias moves require 3D '
+                'periodic force fields with pair interactions only, grids are '
+                'not supported.')
+        if self.cbmc is None or self.cbmc.ntrial != ntrial:
+            self.cbmc = CBMCGrowth(self.guest, self.ff_intra, ntrial)
+        # All random numbers come from the seeded generator of the run.
+        self.cbmc.random = self.random
 
     def initialize_structure_factors(self, ff):
         """Efficient treatment of reciprocal Ewald summation"""
@@ -226,10 +371,20 @@ class MC(object):
                 self.sinfacs_del = np.zeros(self.ewald_reci.cosfacs.shape)
         if self.ewald_reci is not None and self.external_potential is not None:
             nfw = self.external_potential.system.natom-self.guest.natom
-            self.ewald_reci.compute_structurefactors(
-                    self.external_potential.system.pos[:nfw],
-                    self.external_potential.system.charges[:nfw],
+            pos = self.external_potential.system.pos[:nfw]
+            charges = self.external_potential.system.charges[:nfw]
+            if self.host_cache is None or nfw == 0:
+                self.ewald_reci.compute_structurefactors(pos, charges,
                     self.ewald_reci.cosfacs, self.ewald_reci.sinfacs)
+            else:
+                cosfacs, sinfacs = self.host_cache.get_structure_factors(
+                    self.ewald_reci, pos, charges)
+                self.ewald_reci.cosfacs[:] += cosfacs
+                self.ewald_reci.sinfacs[:] += sinfacs
+        if self.ewald_reci is not None:
+            # Structure factors without guests
+            self.cosfacs_host = self.ewald_reci.cosfacs.copy()
+            self.sinfacs_host = self.ewald_reci.sinfacs.copy()
 
 
 class FixedNMC(MC):
@@ -259,6 +414,9 @@ class FixedNMC(MC):
         assert nguests == self.N
         return self.ff
 
+    def set_positions(self, pos):
+        self.ff.system.pos[:] = pos
+
 
 class CanonicalMC(FixedNMC):
     """Canonical Monte-Carlo simulations for rigid molecules (referred to
@@ -311,7 +469,6 @@ class CanonicalMC(FixedNMC):
                 that take or derive a property from the current state of the
                 MC algorithm.
         """
-        self.set_conditions(T)
         super(CanonicalMC, self).__init__(guest, ff,
             external_potential=external_potential, eguest=0.0, hooks=hooks,
             state=state)
@@ -413,7 +570,8 @@ class GCMC(MC):
        as guests), optionally subjected to an external potential (for instance
        by adsorpion in a rigid framework).
     """
-    allowed_trials = ['insertion','deletion','translation','rotation']
+    allowed_trials = ['insertion','deletion','translation','rotation',
+                      'cbmc_insertion','cbmc_deletion','cbmc_regrowth']
     default_trials = {'insertion':0.25, 'deletion':0.25,
                       'translation': 0.25, 'rotation':0.25}
     log_name = 'GCMC'
@@ -426,7 +584,8 @@ class GCMC(MC):
     ]
 
     def __init__(self, guest, ff_generator, external_potential=None, eguest=0.0,
-                 hooks=[], nguests=10, state=None):
+                 hooks=[], nguests=10, state=None, ff_intra=None,
+                 host_cache=None, host_occupancy=None):
         """
            **Arguments:**
 
@@ -435,9 +594,12 @@ class GCMC(MC):
 
            ff_generator
                 A method that return a ForceField instance describing
-                guest-guest interactions. As the number of guests varies during
-                a simulation, we need to be able to generate force fields for
-                different numbers of guests.
+                guest-guest interactions. It is called with a System
+                containing several guests and the guest System as arguments.
+                Only the interactions of the last guest with all other atoms
+                have to be included. The same force field is used for any
+                number of guests, see
+                :class:`yaff.sampling.mcenergy.GCMCForceField`.
 
            **Optional Arguments:**
 
@@ -462,30 +624,51 @@ class GCMC(MC):
 
             nguests
                 An initial estimate for the number of adsorbed guests. This is
-                only used to initialize the force fields before the start of
-                the simulation. If more than nguests are adsorbed, additional
-                force fields will be generated on the fly.
+                the initial capacity of the guest-guest force field, see
+                :class:`yaff.sampling.mcenergy.GCMCForceField`. If more than
+                nguests are adsorbed, the force field is generated again with
+                a larger capacity.
 
             state
                 A list with state items. State items are simple objects
                 that take or derive a property from the current state of the
                 MC algorithm.
+
+            ff_intra
+                A ForceField instance describing the intramolecular
+                interactions of one isolated guest. This is only needed for
+                the configurational-bias moves of flexible guests, see
+                :class:`yaff.sampling.cbmc.CBMCGrowth`.
+
+            host_cache
+                A :class:`yaff.sampling.hostcache.HostCache` instance. When
+                given, the structure factors and the linked cells of the host
+                atoms in the external potential are loaded from this cache
+                when possible.
+
+            host_occupancy
+                A :class:`yaff.sampling.mcenergy.HostOccupancy` instance.
+                Insertions and moves that put a guest atom in a blocked
+                region of the host are rejected before any energy is
+                computed.
         """
         # Initialization
         if guest.cell.nvec==0:
             raise TypeError('The system must be periodic for GCMC simulations')
+        self.ff_intra = ff_intra
+        self.host_cache = host_cache
+        self.host_occupancy = host_occupancy
         self.guest = guest
         self.ff_generator = ff_generator
         self.conditions_set = False
         self.eguest = eguest
         self.hooks = hooks
-        # Generate some guest-guest force fields;
-        self._ffs = []
-        self._generate_ffs(nguests)
+        # A single guest-guest force field, resized when guests are inserted
+        # or deleted
+        self.guest_ff = GCMCForceField(guest, ff_generator, nguests)
         self.external_potential = external_potential
-        self.initialize_structure_factors(self.get_ff(1))
-        # The System describing the current configuration of guest molecules
-        self.current_configuration = None
+        self.initialize_structure_factors(self.guest_ff.ff)
+        self.started = False
         self.N = 0
         self.Nmean = 0.0
         self.energy = 0.0
@@ -525,25 +708,35 @@ class GCMC(MC):
         return '%10d %10.6f %s %s' % ( self.N, self.Nmean,
                 log.energy(self.energy), log.energy(self.emean))
 
-    def _generate_ffs(self, nguests):
-        for iguest in range(len(self._ffs),nguests):
-            if len(self._ffs)==0:
-                # The very first force field, no guests
-                system = System.create_empty()
-                system.cell = Cell(self.guest.cell.rvecs)
-            elif len(self._ffs)==1:
-                # The first real force field, a single guest
-                system = self.guest
-            else:
-                # Take the system of the lastly generated force field (N-1) guests
-                # and add an additional guest
-                system = self._ffs[-1].system.merge(self.guest)
-            self._ffs.append(self.ff_generator(system, self.guest))
+    @property
+    def current_configuration(self):
+        """A System with the current guests, None before the first run
+
+           This System is created when requested, changing it does not affect
+           the simulation.
+        """
+        if not self.started:
+            return None
+        return self.guest_ff.get_system()
 
     def get_ff(self, nguests):
-        if nguests>=len(self._ffs):
-            self._generate_ffs(nguests+1)
-        return self._ffs[nguests]
+        """Return the guest-guest force field, resized for nguests guests
+
+           The system of the returned force field has room for
+           ``self.guest_ff.capacity`` guests, not only nguests. The last guest
+           is stored in the last slot and the other guests in the first slots.
+           The remaining slots are inactive: their charges are zero and they
+           are excluded from the neighbor list, but their positions are
+           meaningless. Use ``self.guest_ff.get_system()`` to obtain a System
+           with only the current guests.
+        """
+        if nguests!=self.guest_ff.nguest:
+            self.guest_ff.resize(nguests)
+        return self.guest_ff.ff
+
+    def set_positions(self, pos):
+        self.get_ff(self.N)
+        self.guest_ff.set_pos(pos)
 
     @classmethod
     def from_files(cls, guest, parameters, **kwargs):
@@ -573,6 +766,38 @@ class GCMC(MC):
                 Two types are accepted: (i) the filename of a system file
                 describing the host system, (ii) a System instance of the host
 
+           grid_spacing
+                When given, the host-guest interactions are tabulated on grids
+                with this spacing, see
+                :func:`yaff.pes.hostgrid.compute_host_grids`, and the external
+                potential is interpolated on these grids. This is only
+                appropriate for a rigid host.
+
+           flexible
+                When True, a force field for the intramolecular interactions
+                of an isolated guest is generated from the parameters, which
+                enables the configurational-bias moves. The bond lengths of
+                the guest are kept fixed at those of the given guest System.
+
+           host_cache
+                A directory name or a
+                :class:`yaff.sampling.hostcache.HostCache` instance. The
+                grids, the structure factors and the linked cells of the
+                host are stored in this cache and loaded from it in later
+                simulations with the same host and parameters.
+
+           occupancy_radius
+                When given, insertions and moves that bring a guest atom
+                closer than this distance to a host atom are rejected before
+                any energy is computed, see
+                :class:`yaff.sampling.mcenergy.HostOccupancy`.
+
+           blocked_pockets
+                The filename of a RASPA .block file, or a tuple with the
+                fractional coordinates of the centers and the radii of
+                spherical pockets in the host that are inaccessible for the
+                guests.
+
            All other keyword arguments are passed to the ForceField constructor
            See the constructor of the :class:`yaff.pes.generator.FFArgs` class
            for the available optional arguments.
@@ -592,6 +817,14 @@ class GCMC(MC):
         host = kwargs.pop('host', None)
         # Extract the hooks
         hooks = kwargs.pop('hooks', [])
+        grid_spacing = kwargs.pop('grid_spacing', None)
+        flexible = kwargs.pop('flexible', False)
+        host_cache = kwargs.pop('host_cache', None)
+        if isinstance(host_cache, str):
+            host_cache = HostCache(host_cache)
+        occupancy_radius = kwargs.pop('occupancy_radius', None)
+        blocked_pockets = kwargs.pop('blocked_pockets', None)
+        host_occupancy = None
         # Efficient treatment of reciprocal ewald contribution
         if not 'reci_ei' in kwargs.keys():
             kwargs['reci_ei'] = 'ewald_interaction'
@@ -603,11 +836,14 @@ class GCMC(MC):
             # it in the same periodic box as the host
             if guest.cell is None or guest.cell.nvec==0:
                 guest.cell = Cell(host.cell.rvecs)
-            # Construct a complex of host and one guest and the corresponding
-            # force field excluding host-host interactions
-            hostguest = host.merge(guest)
-            external_potential = ForceField.generate(hostguest, parameters,
-                 nlow=host.natom, nhigh=host.natom, **kwargs)
+            external_potential = make_external_potential(host, guest,
+                parameters, grid_spacing, host_cache, **kwargs)
+            if occupancy_radius is not None or blocked_pockets is not None:
+                if isinstance(blocked_pockets, str):
+                    from yaff.conversion.raspa import read_raspa_block
+                    blocked_pockets = read_raspa_block(blocked_pockets)
+                host_occupancy = HostOccupancy(host.cell, host.pos,
+                    occupancy_radius or 0.0, pockets=blocked_pockets)
         else:
             external_potential = None
 #        # Compare the energy of the guest, once isolated, once in a periodic box
@@ -629,6 +865,15 @@ class GCMC(MC):
 #                         "images will however NOT be taken into account in this simulation. "
 #                         "If the energy difference is large compared to k_bT, you should "
 #                         "consider using a supercell." % (log.energy(e_isolated-e_periodic)))
+        if flexible:
+            # The intramolecular interactions of an isolated guest
+            guest_isolated = guest.subsystem(np.arange(guest.natom))
+            guest_isolated.cell = Cell(np.zeros((0,3)))
+            optional_arguments = dict((key, value) for key, value in kwargs.items()
+                if key not in ['reci_ei', 'tailcorrections'])
+            ff_intra = ForceField.generate(guest_isolated, parameters, **optional_arguments)
+        else:
+            ff_intra = None
         # By making use of nlow=nhigh, we automatically discard intramolecular energies
         eguest = 0.0
         # Generator of guest-guest force fields, excluding interactions
@@ -636,4 +881,5 @@ class GCMC(MC):
         def ff_generator(system, guest):
             return ForceField.generate(system, parameters, nlow=max(0,system.natom-guest.natom), nhigh=max(0,system.natom-guest.natom), **kwargs)
         return cls(guest, ff_generator, external_potential=external_potential,
-             eguest=eguest, hooks=hooks, nguests=nguests)
+             eguest=eguest, hooks=hooks, nguests=nguests, ff_intra=ff_intra,
+             host_cache=host_cache, host_occupancy=host_occupancy)
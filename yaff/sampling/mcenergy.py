@@ -0,0 +1,650 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+'''Interaction energies of a single molecule in Monte-Carlo simulations
+
+   A trial move of a Monte-Carlo simulation only changes the position of one
+   guest molecule, which is always the last one in the System of the force
+   field. Only the interactions of this molecule with all other atoms are
+   needed. Instead of rebuilding the neighbor list of the force field for
+   every trial, the other atoms are kept in a linked-cell structure that is
+   updated incrementally when a trial is accepted. Only the neighbors of the
+   moved molecule are searched in this structure and the shortest distance to
+   another atom is obtained in the same pass, which replaces the separate test
+   for close contacts.
+
+   The guest-guest interactions in GCMC simulations are computed with a single
+   force field for a varying number of guests, see :class:`GCMCForceField`.
+
+   Insertions and moves that bring a guest atom too close to a rigid host, or
+   into a blocked pocket, are rejected before any energy is computed by
+   looking up the guest atoms in a bitmap, see :class:`HostOccupancy`.
+'''
+
+
+from __future__ import division
+
+import weakref
+
+import numpy as np
+
+from molmod.units import angstrom
+
+from yaff.log import log, timer
+from yaff.pes.ext import Cell, neigh_dtype, nlist_cells_insert, \
+    nlist_cells_remove, nlist_build_cells, pair_pot_compute_multi
+from yaff.pes.ff import ForceField, ForcePartPair, \
+    ForcePartEwaldNeutralizing, ForcePartTailCorrection
+from yaff.pes.hostgrid import compute_host_grids, make_grid_forcefield
+from yaff.system import System
+
+
+__all__ = ['MCInteraction', 'HostOccupancy', 'GCMCForceField',
+           'make_external_potential']
+
+
+class MCInteraction(object):
+    '''Interaction of the last molecule in a System with the other atoms
+
+       The other atoms (e.g. the other guests, or a rigid host) are stored in
+       bins in fractional coordinates, as in the linked-cell algorithm of
+       :class:`yaff.pes.nlist.NeighborList`. The atoms in the bins are those
+       with indexes ``0`` to ``natom-1``, where ``natom`` is increased and
+       decreased by the methods that add and remove atoms. Each bin is a
+       doubly linked list, such that atoms can be added and removed at a cost
+       that does not depend on the number of atoms.
+
+       The positions of the atoms in the bins are only stored for a cheap
+       prescreening of candidate neighbors. The relative vectors are computed
+       with the System of the force field passed to ``compute``, which must
+       be consistent with the positions passed to the other methods.
+    '''
+    # The number of bins along a cell vector per cutoff distance.
+    bins_per_rcut = 2
+
+    def __init__(self, cell, rcut):
+        '''
+           **Arguments:**
+
+           cell
+                A 3D periodic Cell instance.
+
+           rcut
+                The cutoff for the neighbor search. This must be at least the
+                cutoff of the neighbor lists of the force fields passed to
+                ``compute`` and the largest close-contact distance of interest.
+        '''
+        if cell.nvec != 3:
+            raise ValueError('MCInteraction requires a 3D periodic cell.')
+        self.cell = cell
+        self.rcut = rcut
+        self.rmax = np.ceil(rcut/cell.rspacings-0.5).astype(int)
+        self.nbins = np.maximum(np.floor(self.bins_per_rcut*cell.rspacings/rcut), 1).astype(int)
+        self.bin_head = np.zeros(self.nbins.prod(), int)
+        self.neighs = np.empty(100, dtype=neigh_dtype)
+        self._allocate(0)
+        # Cached information on the force fields passed to compute
+        self._ffs = weakref.WeakKeyDictionary()
+
+    def _allocate(self, size):
+        '''Reset the bins and allocate space for size atoms'''
+        self.natom = 0
+        self.bin_head[:] = -1
+        self.atom_next = -np.ones(size, int)
+        self.atom_prev = -np.ones(size, int)
+        self.atom_ibins = np.zeros(size, int)
+        self.atom_shifts = np.zeros((size, 3), int)
+        self.atom_wpos = np.zeros((size, 3))
+
+    def _grow(self, size):
+        '''Make room for at least size atoms without changing the bins'''
+        if size <= len(self.atom_next):
+            return
+        size = max(size, 2*len(self.atom_next))
+        old = len(self.atom_next)
+        for name in 'atom_next', 'atom_prev', 'atom_ibins', 'atom_shifts', 'atom_wpos':
+            array = getattr(self, name)
+            new = np.zeros((size,) + array.shape[1:], array.dtype)
+            new[:old] = array
+            setattr(self, name, new)
+
+    def reset(self, pos, natom):
+        '''Put the atoms with indexes 0 to natom-1 in the bins
+
+           **Arguments:**
+
+           pos
+                An array with (at least) the positions of these atoms.
+
+           natom
+                The number of atoms in the bins.
+        '''
+        self._allocate(max(natom, 1))
+        self.add(pos, 0, natom)
+
+    def add(self, pos, begin, end):
+        '''Add the atoms with indexes begin to end-1 to the bins
+
+           Only atoms directly after the ones already present can be added,
+           i.e. begin must be equal to the ``natom`` attribute.
+        '''
+        assert begin == self.natom
+        self._grow(end)
+        self.natom = end
+        self._insert(pos, begin, end)
+
+    def remove(self, begin, end):
+        '''Remove the atoms with indexes begin to end-1 from the bins
+
+           Only the last atoms can be removed, i.e. end must be equal to the
+           ``natom`` attribute.
+        '''
+        assert end == self.natom
+        self._delete(begin, end)
+        self.natom = begin
+
+    def move(self, pos, begin, end):
+        '''Update the bins of the atoms with indexes begin to end-1
+
+           This must be called when these atoms have been moved or when atoms
+           have been reordered, e.g. by :meth:`yaff.sampling.mc.MC.reorder_guests`.
+        '''
+        assert end <= self.natom
+        self._delete(begin, end)
+        self._insert(pos, begin, end)
+
+    def _insert(self, pos, begin, end):
+        nlist_cells_insert(pos, self.cell, self.nbins, self.bin_head,
+            self.atom_next, self.atom_prev, self.atom_ibins, self.atom_shifts,
+            self.atom_wpos, begin, end)
+
+    def _delete(self, begin, end):
+        nlist_cells_remove(self.bin_head, self.atom_next, self.atom_prev,
+            self.atom_ibins, begin, end)
+
+    def _get_parts(self, ff):
+        '''Split the parts of a force field into pair potentials and others'''
+        result = self._ffs.get(ff)
+        if result is None:
+            pair_pots, partners, offsets, others = [], [], [], []
+            for part in ff.iter_contribs():
+                if isinstance(part, ForcePartPair):
+                    if part.pair_pot.rcut > self.rcut:
+                        raise ValueError('The cutoff of %s exceeds the cutoff '
+                            'of MCInteraction.' % part.name)
+                    pair_pots.append(part.pair_pot)
+                    # Pair potentials with identical scalings share the
+                    # same scaling index.
+                    scalings = part.scalings
+                    for other_partners, other_offsets in zip(partners, offsets):
+                        if np.array_equal(scalings.partners, other_partners):
+                            partners.append(other_partners)
+                            offsets.append(other_offsets)
+                            break
+                    else:
+                        partners.append(scalings.partners)
+                        offsets.append(scalings.offsets)
+                else:
+                    others.append(part)
+            result = (pair_pots, partners, offsets, others)
+            self._ffs[ff] = result
+        return result
+
+    def compute(self, ff, nmol, close_contact=-1.0):
+        '''Compute the interaction of the last molecule with the atoms in the bins
+
+           **Arguments:**
+
+           ff
+                A ForceField instance generated with nlow=nhigh equal to the
+                number of atoms before the last molecule. Its System contains
+                the positions of all atoms in the bins and of the molecule.
+                Atoms of the System that are not in the bins, other than the
+                molecule, are ignored.
+
+           nmol
+                The number of atoms in the last molecule.
+
+           **Optional arguments:**
+
+           close_contact
+                When the shortest distance between an atom of the molecule and
+                an atom in the bins is below this value, no energy is
+                computed.
+
+           **Returns:** the energy, or None in case of a close contact, and
+           the shortest distance, which is ``rcut`` if there are no atoms
+           within the cutoff.
+
+           The pair parts of the force field are computed with the neighbors
+           found in the bins. All other parts, e.g. tail corrections, are
+           computed as usual.
+        '''
+        pos = ff.system.pos
+        nlow = ff.system.natom - nmol
+        assert self.natom <= nlow
+        with timer.section('MC interaction'):
+            while True:
+                nneigh, dmin = nlist_build_cells(pos, self.rcut, self.rmax,
+                    self.cell, self.neighs, nlow, self.nbins, self.bin_head,
+                    self.atom_next, self.atom_shifts, self.atom_wpos)
+                if nneigh >= 0:
+                    break
+                self.neighs = np.empty((len(self.neighs)*3)//2, dtype=neigh_dtype)
+            if dmin < close_contact:
+                return None, dmin
+            pair_pots, partners, offsets, others = self._get_parts(ff)
+            energy = 0.0
+            if len(pair_pots) > 0:
+                energy += pair_pot_compute_multi(pair_pots, self.neighs,
+                    partners, offsets, None, None, nneigh).sum()
+            for part in others:
+                part.update_pos(pos)
+                energy += part.compute_energy()
+        if log.do_debug:
+            log('MC interaction with %i neighbors, dmin = %s' % (nneigh, log.length(dmin)))
+        return energy, dmin
+
+    def compute_trials(self, ff, iatom, trials, close_contact=-1.0):
+        '''Compute the interactions of one atom at several trial positions with
+           the atoms in the bins
+
+           **Arguments:**
+
+           ff
+                A ForceField instance, as for ``compute``.
+
+           iatom
+                The index of the atom in the System of the force field, which
+                determines the parameters of the pair potentials.
+
+           trials
+                A numpy array with shape (ntrial, 3) with trial positions for
+                this atom.
+
+           **Optional arguments:**
+
+           close_contact
+                Trial positions closer than this distance to an atom in the
+                bins get an infinite energy.
+
+           **Returns:** an array with the energy for each trial position.
+
+           Only the pair parts of the force field are included, e.g. for the
+           configurational-bias growth of a molecule atom by atom.
+        '''
+        ntrial = len(trials)
+        # The trial positions are appended to the atoms in the bins, such
+        # that their neighbors are found in one call.
+        pos = np.zeros((self.natom + ntrial, 3))
+        pos[:self.natom] = ff.system.pos[:self.natom]
+        pos[self.natom:] = trials
+        energies = np.zeros(ntrial)
+        with timer.section('MC interaction'):
+            while True:
+                nneigh, dmin = nlist_build_cells(pos, self.rcut, self.rmax,
+                    self.cell, self.neighs, self.natom, self.nbins,
+                    self.bin_head, self.atom_next, self.atom_shifts,
+                    self.atom_wpos)
+                if nneigh >= 0:
+                    break
+                self.neighs = np.empty((len(self.neighs)*3)//2, dtype=neigh_dtype)
+            neighs = self.neighs[:nneigh]
+            # The rows of each trial position are contiguous. The trial
+            # positions get the index of the atom in the force field.
+            itrials = np.maximum(neighs['a'], neighs['b']) - self.natom
+            bounds = np.searchsorted(itrials, np.arange(ntrial + 1))
+            neighs['a'][neighs['a'] >= self.natom] = iatom
+            neighs['b'][neighs['b'] >= self.natom] = iatom
+            pair_pots, partners, offsets, others = self._get_parts(ff)
+            for itrial in range(ntrial):
+                begin, end = bounds[itrial], bounds[itrial+1]
+                if begin == end:
+                    continue
+                if neighs['d'][begin:end].min() < close_contact:
+                    energies[itrial] = np.inf
+                elif len(pair_pots) > 0:
+                    energies[itrial] = pair_pot_compute_multi(pair_pots,
+                        neighs[begin:end], partners, offsets, None, None,
+                        end - begin).sum()
+        return energies
+
+
+class HostOccupancy(object):
+    '''Bitmap of the regions in a rigid host that are blocked for guest atoms
+
+       The cell is divided in voxels by a regular grid in fractional
+       coordinates. A voxel is blocked when it lies entirely within a distance
+       ``radius`` of a host atom or entirely within a blocked pocket. Voxels
+       that are only partially covered by a pocket are marked as such, and
+       positions in these voxels are compared with the pockets explicitly. A
+       position is therefore only considered blocked when it is closer than
+       ``radius`` to a host atom or inside a pocket, such that the blocked
+       positions can be rejected before any energy is computed, at a cost
+       proportional to the number of guest atoms.
+    '''
+    # Values in the bitmap, the largest value takes precedence
+    free = 0
+    pocket = 1
+    blocked = 2
+
+    def __init__(self, cell, pos, radius, spacing=0.2*angstrom, pockets=None):
+        '''
+           **Arguments:**
+
+           cell
+                A 3D periodic Cell instance of the host.
+
+           pos
+                An array with the positions of the host atoms.
+
+           radius
+                The close-contact distance to the host atoms. When it does not
+                exceed the ``close_contact`` argument of
+                :meth:`yaff.sampling.mc.MC.run`, the bitmap only rejects trials
+                that would be rejected anyway. Use zero to only block pockets.
+
+           **Optional arguments:**
+
+           spacing
+                The approximate distance between grid points. Smaller values
+                block a larger fraction of the regions close to host atoms.
+
+           pockets
+                A tuple with the fractional coordinates of the centers of
+                spherical pockets that are inaccessible for the guests and
+                their radii, e.g. obtained with
+                :func:`yaff.conversion.raspa.read_raspa_block`.
+        '''
+        if cell.nvec != 3:
+            raise ValueError('HostOccupancy requires a 3D periodic cell.')
+        self.cell = cell
+        self.radius = radius
+        lengths = np.sqrt((cell.rvecs**2).sum(axis=1))
+        self.shape = np.maximum(np.ceil(lengths/spacing), 1).astype(int)
+        # Half of the longest diagonal of a voxel
+        corners = np.indices((2, 2, 2)).reshape(3, -1).T - 0.5
+        self.halfdiag = np.sqrt((np.dot(corners/self.shape, cell.rvecs)**2).sum(axis=1)).max()
+        self.bitmap = np.zeros(self.shape, np.uint8)
+        with timer.section('Host occupancy'):
+            if radius > 0.0:
+                for center in np.dot(pos, cell.gvecs.T):
+                    self._mark(center, radius, False)
+            if pockets is None:
+                self.pocket_centers = np.zeros((0, 3))
+                self.pocket_radii = np.zeros(0)
+            else:
+                self.pocket_centers = np.array(pockets[0], dtype=float).reshape(-1, 3)
+                self.pocket_radii = np.array(pockets[1], dtype=float).reshape(-1)
+                for center, pocket_radius in zip(self.pocket_centers, self.pocket_radii):
+                    self._mark(center, pocket_radius, True)
+        if log.do_medium:
+            with log.section('HOCC'):
+                log('Host occupancy grid %i x %i x %i, %.1f %% blocked, %i pockets' % (
+                    tuple(self.shape) + ((self.bitmap==self.blocked).mean()*100,
+                    len(self.pocket_radii))))
+
+    def _mark(self, center, radius, partial):
+        '''Mark the voxels within radius of center (fractional coordinates)
+
+           When partial is True, voxels that are only partially within the
+           radius are marked as pocket voxels.
+        '''
+        width = (radius + self.halfdiag)/self.cell.rspacings
+        ranges = [np.arange(np.floor((c - w)*n), np.floor((c + w)*n) + 1, dtype=int)
+                  for c, w, n in zip(center, width, self.shape)]
+        indexes = np.meshgrid(*ranges, indexing='ij')
+        # Vectors from the center to the centers of the voxels, without
+        # wrapping the voxels in the cell.
+        frac = np.array([(i + 0.5)/n - c for i, n, c in zip(indexes, self.shape, center)])
+        distances = np.sqrt((np.einsum('a...,ab->...b', frac, self.cell.rvecs)**2).sum(axis=-1))
+        values = np.where(distances + self.halfdiag <= radius, self.blocked, self.free)
+        if partial:
+            values[(values == self.free) & (distances - self.halfdiag < radius)] = self.pocket
+        # Voxels may be visited more than once, e.g. when the sphere is larger
+        # than the cell.
+        wrapped = tuple(i % n for i, n in zip(indexes, self.shape))
+        np.maximum.at(self.bitmap, wrapped, values.astype(np.uint8))
+
+    def compute_blocked(self, pos):
+        '''Return a boolean array that is True for blocked positions
+
+           **Arguments:**
+
+           pos
+                An array with shape (n, 3) with Cartesian positions.
+        '''
+        frac = np.dot(pos, self.cell.gvecs.T)
+        indexes = np.floor(frac*self.shape).astype(int) % self.shape
+        states = self.bitmap[indexes[:,0], indexes[:,1], indexes[:,2]]
+        result = states == self.blocked
+        check = states == self.pocket
+        if check.any():
+            delta = frac[check][:,None,:] - self.pocket_centers
+            delta -= np.round(delta)
+            distances = np.sqrt((np.dot(delta, self.cell.rvecs)**2).sum(axis=-1))
+            result[check] = (distances < self.pocket_radii).any(axis=1)
+        return result
+
+    def is_blocked(self, pos):
+        '''Return True when any of the given positions is blocked'''
+        return self.compute_blocked(pos).any()
+
+
+class GCMCForceField(object):
+    '''Guest-guest force field for a varying number of guests
+
+       A single ForceField is generated for a System with room for
+       ``capacity`` guests. The last guest, i.e. the one whose interactions
+       are computed in a trial, is always stored in the last slot of this
+       System. The other guests occupy the first slots and the remaining slots
+       are inactive. Changing the number of guests only changes a few ranges
+       in place: the inactive slots are excluded from the neighbor list, their
+       charges are set to zero and the tail corrections are rescaled. Only
+       when there is no room left, the force field is generated again with
+       twice the capacity.
+
+       The force field is assumed to include only interactions of the last
+       guest with the other atoms, as obtained with nlow=nhigh equal to the
+       number of atoms before the last guest.
+    '''
+    def __init__(self, guest, ff_generator, capacity=10):
+        '''
+           **Arguments:**
+
+           guest
+                A System instance with one guest molecule.
+
+           ff_generator
+                A function that takes a System and the guest as arguments and
+                returns the ForceField for the last guest in that System, see
+                :class:`yaff.sampling.mc.GCMC`.
+
+           **Optional arguments:**
+
+           capacity
+                The initial number of guests for which there is room. At least
+                two slots are allocated.
+        '''
+        self.guest = guest
+        self.ff_generator = ff_generator
+        self.ff = None
+        self.capacity = 0
+        self.nguest = 0
+        self._generate(max(capacity, 2))
+
+    def _generate(self, capacity):
+        '''Generate the force field for a System with capacity guests'''
+        system = self.guest
+        for iguest in range(1, capacity):
+            system = system.merge(self.guest)
+        ff = self.ff_generator(system, self.guest)
+        natom = self.guest.natom
+        if self.ff is not None:
+            nother = max(self.nguest-1, 0)
+            system.pos[:nother*natom] = self.ff.system.pos[:nother*natom]
+            system.pos[-natom:] = self.ff.system.pos[-natom:]
+        self.ff = ff
+        self._tailcorrs = [
+            (part, part.ecorr, part.wcorr) for part in ff.parts
+            if isinstance(part, ForcePartTailCorrection)
+        ]
+        self._neutralizing = [
+            part for part in ff.parts
+            if isinstance(part, ForcePartEwaldNeutralizing) and not part.fluctuating_charges
+        ]
+        # All slots are active in a newly generated force field.
+        nguest = self.nguest
+        self.capacity = capacity
+        self.nguest = capacity
+        self.resize(nguest)
+
+    def resize(self, nguest):
+        '''Change the number of guests
+
+           The positions of the other guests and the last guest are not
+           changed. When the number of guests increases, the positions of the
+           new guests must be set afterwards.
+        '''
+        if nguest > self.capacity:
+            self._generate(max(nguest, 2*self.capacity))
+        natom = self.guest.natom
+        nother_old = max(self.nguest-1, 0)
+        nother = max(nguest-1, 0)
+        system = self.ff.system
+        if system.charges is not None:
+            charges = system.charges.reshape(self.capacity, natom)
+            if nother > nother_old:
+                charges[nother_old:nother] = self.guest.charges
+            else:
+                charges[nother:nother_old] = 0.0
+            charges[-1] = self.guest.charges if nguest > 0 else 0.0
+            for part in self._neutralizing:
+                part.update_prefactor()
+        if self.ff.nlist is not None:
+            # Pairs are only included if one atom is in the last slot and the
+            # other one is in the first nother slots.
+            self.ff.nlist.set_bounds(system.natom - natom, nother*natom)
+        # The tail corrections are proportional to the number of other guests.
+        for part, ecorr, wcorr in self._tailcorrs:
+            part.ecorr = ecorr*nother/(self.capacity-1)
+            part.wcorr = wcorr*nother/(self.capacity-1)
+        self.nguest = nguest
+
+    def get_other_pos(self):
+        '''Return the positions of the other guests, i.e. not the last one'''
+        return self.ff.system.pos[:max(self.nguest-1, 0)*self.guest.natom]
+
+    def get_last_pos(self):
+        '''Return the positions of the last guest'''
+        return self.ff.system.pos[-self.guest.natom:]
+
+    def set_pos(self, pos):
+        '''Set the positions of all guests, the last one is put in the last slot'''
+        natom = self.guest.natom
+        assert pos.shape == (self.nguest*natom, 3)
+        if self.nguest > 0:
+            self.get_other_pos()[:] = pos[:-natom]
+            self.get_last_pos()[:] = pos[-natom:]
+
+    def get_system(self):
+        '''Return a new System with only the current guests'''
+        if self.nguest == 0:
+            system = System.create_empty()
+            system.cell = Cell(self.ff.system.cell.rvecs)
+            return system
+        natom = self.guest.natom
+        system = self.ff.system
+        indexes = np.concatenate([
+            np.arange((self.nguest-1)*natom),
+            np.arange(system.natom-natom, system.natom)
+        ])
+        def select(array):
+            if array is None:
+                return None
+            return array[indexes]
+        # The bonds of the first guests are also those of the last guest
+        # after it is moved to the slot after the other guests.
+        bonds = system.bonds
+        if bonds is not None:
+            bonds = bonds[:len(self.guest.bonds)*self.nguest]
+        return System(
+            numbers=select(system.numbers),
+            pos=select(system.pos),
+            scopes=system.scopes,
+            scope_ids=select(system.scope_ids),
+            ffatypes=system.ffatypes,
+            ffatype_ids=select(system.ffatype_ids),
+            bonds=bonds,
+            rvecs=system.cell.rvecs,
+            charges=select(system.charges),
+            radii=select(system.radii),
+            valence_charges=select(system.valence_charges),
+            dipoles=select(system.dipoles),
+            radii2=select(system.radii2),
+            masses=select(system.masses),
+        )
+
+
+def make_external_potential(host, guest, parameters, grid_spacing=None,
+                            host_cache=None, **kwargs):
+    '''Return a force field for the interactions of one guest with a rigid host
+
+       **Arguments:**
+
+       host
+            A System instance of the host.
+
+       guest
+            A System instance of one guest molecule, with the cell of the host.
+
+       parameters
+            Force-field parameters, see
+            :meth:`yaff.pes.ff.ForceField.generate`.
+
+       **Optional arguments:**
+
+       grid_spacing
+            When given, the host-guest interactions are tabulated on grids
+            with this spacing, see :func:`yaff.pes.hostgrid.compute_host_grids`.
+
+       host_cache
+            A :class:`yaff.sampling.hostcache.HostCache` instance. When given,
+            the grids are loaded from this cache when possible.
+
+       All other keyword arguments are passed to the ForceField constructor.
+
+       Without grids, the System of the force field contains the host atoms
+       followed by the guest and host-host interactions are excluded.
+    '''
+    if grid_spacing is None:
+        hostguest = host.merge(guest)
+        return ForceField.generate(hostguest, parameters, nlow=host.natom,
+            nhigh=host.natom, **kwargs)
+    if host_cache is None:
+        grids = compute_host_grids(host, guest, parameters,
+            spacing=grid_spacing, **kwargs)
+    else:
+        grids = host_cache.get_host_grids(host, guest, parameters,
+            spacing=grid_spacing, **kwargs)
+    return make_grid_forcefield(guest, grids)
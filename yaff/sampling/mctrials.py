@@ -35,7 +35,8 @@ from molmod.units import kjmol
 
 
 __all__ = ['Trial','TrialInsertion','TrialDeletion','TrialRotation',
-    'TrialTranslation','TrialVolumechange']
+    'TrialTranslation','TrialVolumechange','TrialCbmcInsertion',
+    'TrialCbmcDeletion','TrialCbmcRegrowth']
 
 
 class Trial(object):
@@ -52,65 +53,42 @@ class Trial(object):
         MC simulation accordingly
         """
         with timer.section("MC %s move" % self.log_name):
-            e = self.compute()
-            p = self.probability(e)
-            if np.random.rand()>p:
-                accepted = False
-                self.reject()
-            else:
-                accepted = True
-                self.mc.energy += e
-                self.accept()
+            return self.step()
+
+    def step(self):
+        """Perform the trial move without timer, see __call__"""
+        e = self.compute()
+        p = self.probability(e)
+        if self.mc.random.next()>p:
+            accepted = False
+            self.reject()
+        else:
+            accepted = True
+            self.mc.energy += e
+            self.accept()
         if log.do_debug:
             log("MC %s: N = %d energy difference = %s acceptance probability = %6.2f %% accepted = %s"
                 % (self.__class__.__name__, self.mc.N, log.energy(e), p*100.0, accepted))
         return accepted
 
-    def insertion_energy(self, ff, sign=1):
+    def insertion_energy(self, ff, sign=1, ewald=True):
         """Compute U(N+1)-U(N), assuming the inserted guest is positioned
-        last."""
+        last. When ewald is False, the reciprocal Ewald contribution is left
+        out, see move_energy."""
         assert sign in [-1,1]
         # Calculate the energy difference for guest-guest interactions
-        ff.update_pos(ff.system.pos)
-        # Check for close contact distance to other guest atoms
-        if self.mc.close_contact>=0.0:
-            ndists = (ff.system.natom-self.mc.guest.natom)*self.mc.guest.natom
-            if ndists>0:
-                distances = np.zeros((ndists,))
-                ff.system.cell.compute_distances(distances, ff.system.pos[-self.mc.guest.natom:],
-                    pos1=ff.system.pos[:-self.mc.guest.natom])
-                dmin = np.amin(distances)
-            else: dmin = self.mc.close_contact+1
-        else: dmin = self.mc.close_contact+1
-        # Only do computation if there is no close contact
-        if dmin>=self.mc.close_contact:
-            e = ff.compute() - self.mc.eguest
-        else:
-            e = 1e10
+        e = self.interaction_energy(ff, self.mc.guest_interaction,
+            (self.mc.N-1)*self.mc.guest.natom)
         # Calculate the energy difference for guest-host interactions
         extpot = self.mc.external_potential
         if extpot is not None:
-            # Check for close contact to guest atoms
-            if self.mc.close_contact>=0.0:
-                ndists = (extpot.system.natom-self.mc.guest.natom)*self.mc.guest.natom
-                if ndists>0:
-                    distances = np.zeros((ndists,))
-                    ff.system.cell.compute_distances(distances, ff.system.pos[-self.mc.guest.natom:],
-                        pos1=extpot.system.pos[:-self.mc.guest.natom])
-                    dmin_host = np.amin(distances)
-            else: dmin_host = self.mc.close_contact+1
-            # Only do computation if there is no close contact
-            if dmin_host>=self.mc.close_contact:
-                extpot.system.pos[-self.mc.guest.natom:] = ff.system.pos[-self.mc.guest.natom:]
-                extpot.update_pos(extpot.system.pos)
-                e += extpot.compute() - self.mc.eguest
-            else:
-                e += 1e10
+            extpot.system.pos[-self.mc.guest.natom:] = ff.system.pos[-self.mc.guest.natom:]
+            e += self.interaction_energy(extpot, self.mc.host_interaction)
         # Energy difference for reciprocal Ewald (guest-guest and guest-host)
         # This is done even if there is a close contact detected, the reason
         # being that we cannot alter the bookkeeping of the mc.cosfacs and
         # mc.sinfacs here without repercussion on other parts of the code.
-        if self.mc.ewald_reci is not None:
+        if self.mc.ewald_reci is not None and ewald:
             if sign==1:
                 cosfacs = self.mc.cosfacs_ins
                 sinfacs = self.mc.sinfacs_ins
@@ -125,6 +103,73 @@ class Trial(object):
                      cosfacs=cosfacs, sinfacs=sinfacs, sign=sign)
         return sign*e
 
+    def is_blocked(self, pos):
+        """Return True when one of the given guest atom positions lies in a
+        region of the host that is blocked according to mc.host_occupancy.
+        This is checked before any energy is computed."""
+        occupancy = self.mc.host_occupancy
+        return occupancy is not None and occupancy.is_blocked(pos)
+
+    def move_energy(self, ff, oldpos):
+        """Compute the reciprocal Ewald contribution to the energy
+        difference when the last guest is moved from oldpos to its current
+        positions. The structure factors are only updated after accept_move
+        of the Ewald part is called."""
+        if self.mc.ewald_reci is None:
+            return 0.0
+        natom = self.mc.guest.natom
+        return self.mc.ewald_reci.move_energy(oldpos, ff.system.pos[-natom:],
+            ff.system.charges[-natom:])
+
+    def interaction_energy(self, ff, interaction=None, nother=None):
+        """Compute the interaction of the last guest with all other atoms of
+        the force field, or 1e10 in case of a close contact. When given, the
+        interaction is computed with an MCInteraction instance. The other
+        atoms are the first nother atoms of the System, by default all atoms
+        except the last guest."""
+        natom = self.mc.guest.natom
+        if interaction is not None:
+            e, dmin = interaction.compute(ff, natom, self.mc.close_contact)
+            if e is None:
+                return 1e10
+            return e - self.mc.eguest
+        if nother is None:
+            nother = ff.system.natom - natom
+        ff.update_pos(ff.system.pos)
+        # Check for close contact distance to other atoms
+        if self.mc.close_contact>=0.0 and nother>0:
+            distances = np.zeros((nother*natom,))
+            ff.system.cell.compute_distances(distances, ff.system.pos[-natom:],
+                pos1=ff.system.pos[:nother])
+            if np.amin(distances)<self.mc.close_contact:
+                return 1e10
+        return ff.compute_energy() - self.mc.eguest
+
+    def atom_energies(self, ff, iatom, trials):
+        """Compute the pair interactions of atom iatom of the last guest at
+        several trial positions with the other guests and the host, used for
+        the configurational-bias growth of the last guest. Trial positions in
+        a blocked region of the host get an infinite energy."""
+        occupancy = self.mc.host_occupancy
+        if occupancy is not None:
+            free = ~occupancy.compute_blocked(trials)
+            e = np.full(len(trials), np.inf)
+            if free.any():
+                e[free] = self._atom_energies(ff, iatom, trials[free])
+            return e
+        return self._atom_energies(ff, iatom, trials)
+
+    def _atom_energies(self, ff, iatom, trials):
+        natom = self.mc.guest.natom
+        e = self.mc.guest_interaction.compute_trials(ff,
+            ff.system.natom - natom + iatom, trials, self.mc.close_contact)
+        extpot = self.mc.external_potential
+        if extpot is not None:
+            e += self.mc.host_interaction.compute_trials(extpot,
+                extpot.system.natom - natom + iatom, trials,
+                self.mc.close_contact)
+        return e
+
     def compute(self):
         # Subclasses implement their code here.
         raise NotImplementedError
@@ -151,20 +196,25 @@ class TrialCartesian(Trial):
             # energy to nan as it should not matter
             e = np.nan
         else:
-            iguest = np.random.randint(self.mc.N)
+            iguest = self.mc.random.randint(self.mc.N)
             # Select the guest-guest force field with correct number of guests
             ff = self.mc.get_ff(self.mc.N)
             # Reorder positions so the selected guest ends up last
             self.mc.reorder_guests(ff.system, iguest)
             self.oldpos = ff.system.pos[-self.mc.guest.natom:].copy()
+            # Move the selected molecule in Cartesian space, moves into a
+            # blocked region of the host are rejected right away
+            self.newpos = self.cartesian_move(self.oldpos)
+            if self.is_blocked(self.newpos):
+                return 1e10
             # A translation/rotation can be considered as a deletion of a guest
             # at the original positions, followed by an insertion at the new
-            # positions
-            e = self.insertion_energy(ff, sign=-1)
-            # Move the selected molecule in Cartesian space
-            self.newpos = self.cartesian_move(self.oldpos)
+            # positions. The reciprocal Ewald contribution is computed for
+            # both at once.
+            e = self.insertion_energy(ff, sign=-1, ewald=False)
             ff.system.pos[-self.mc.guest.natom:] = self.newpos
-            e += self.insertion_energy(ff, sign=1)
+            e += self.insertion_energy(ff, sign=1, ewald=False)
+            e += self.move_energy(ff, self.oldpos)
         return e
 
     def probability(self, e):
@@ -177,18 +227,14 @@ class TrialCartesian(Trial):
     def accept(self):
         # Update the structure factors
         if self.mc.ewald_reci is not None and self.mc.N>0:
-            self.mc.ewald_reci.cosfacs[:] += self.mc.cosfacs_ins
-            self.mc.ewald_reci.sinfacs[:] += self.mc.sinfacs_ins
+            self.mc.ewald_reci.accept_move()
 
     def reject(self):
         if self.mc.N>0:
-            # Undo the Cartesian move
+            # Undo the Cartesian move, the Ewald structure factors were not
+            # modified
             ff = self.mc.get_ff(self.mc.N)
             ff.system.pos[-self.mc.guest.natom:] = self.oldpos
-            # Reset the Ewald structure factors
-            if self.mc.ewald_reci is not None:
-                self.mc.ewald_reci.cosfacs[:] += self.mc.cosfacs_del
-                self.mc.ewald_reci.sinfacs[:] += self.mc.sinfacs_del
 
     def cartesian_move(self, guestpos):
         # Subclasses implement their code here.
@@ -203,7 +249,7 @@ class TrialRotation(TrialCartesian):
         center = np.mean(guestpos, axis=0)
         newpos = guestpos-center
         # Rotate randomly
-        M = get_random_rotation_matrix()
+        M = get_random_rotation_matrix(randnums=self.mc.random.rand(3))
         newpos = np.einsum('ib,ab->ia', newpos, M)
         # Move center to where it was originally
         return newpos + center
@@ -213,7 +259,7 @@ class TrialTranslation(TrialCartesian):
     log_name = 'trans.'
     """Random translation of a randomly selected guest"""
     def cartesian_move(self, guestpos):
-        translation = self.mc.translation_stepsize*(np.random.rand(3)-0.5)
+        translation = self.mc.translation_stepsize*(self.mc.random.rand(3)-0.5)
         return guestpos+translation
 
 
@@ -233,7 +279,7 @@ class TrialVolumechange(Trial):
         ff = self.mc.ff_full
         ff.system.pos[:] = self.mc.current_configuration.pos
         ff.update_pos(ff.system.pos)
-        e = -ff.compute()
+        e = -ff.compute_energy()
         self.oldrvecs = ff.system.cell.rvecs.copy()
         self.oldV = ff.system.cell.volume
         self.oldpos = ff.system.pos.copy()
@@ -244,13 +290,13 @@ class TrialVolumechange(Trial):
                  1.0/3.0) - 1.0
         assert scale>0.0
         assert scale<1.0
-        self.newrvecs = self.oldrvecs*(1.0 + 2.0*scale*(np.random.rand()-0.5))
+        self.newrvecs = self.oldrvecs*(1.0 + 2.0*scale*(self.mc.random.next()-0.5))
         ff.update_rvecs(self.newrvecs)
         self.newV = ff.system.cell.volume
         # Compute cartesian coordinates from fractional coordinates
         self.newpos = np.einsum('ab,ib->ia',ff.system.cell.rvecs,frac)
         ff.update_pos(self.newpos)
-        e += ff.compute()
+        e += ff.compute_energy()
         return e
 
     def probability(self, e):
@@ -260,6 +306,8 @@ class TrialVolumechange(Trial):
     def accept(self):
         self.mc.current_configuration.pos[:] = self.newpos
         self.mc.current_configuration.cell.update_rvecs(self.newrvecs)
+        # The linked cells depend on the cell vectors
+        self.mc.initialize_interactions()
 
     def reject(self):
         self.mc.current_configuration.pos[:] = self.oldpos
@@ -272,13 +320,24 @@ class TrialInsertion(Trial):
     def compute(self):
         # e contains U(N+1) - U(N)
         self.mc.N += 1
-        # Select the guest-guest force field with correct number of guests
+        # Resize the guest-guest force field for the new number of guests
         ff = self.mc.get_ff(self.mc.N)
-        # Set the positions of all other guests based on the current state
+        natom = self.mc.guest.natom
         if self.mc.N>1:
-            ff.system.pos[:(self.mc.N-1)*self.mc.guest.natom] = self.mc.current_configuration.pos
+            # The last guest becomes one of the other guests
+            begin, end = (self.mc.N-2)*natom, (self.mc.N-1)*natom
+            ff.system.pos[begin:end] = ff.system.pos[-natom:]
+            if self.mc.guest_interaction is not None:
+                self.mc.guest_interaction.add(ff.system.pos, begin, end)
+        return self.insert(ff)
+
+    def insert(self, ff):
         # Generate random guest configuration for the last (inserted) guest
-        ff.system.pos[(self.mc.N-1)*self.mc.guest.natom:] = random_insertion(self.mc.guest)
+        pos = random_insertion(self.mc.guest, random_state=self.mc.random)
+        ff.system.pos[-self.mc.guest.natom:] = pos
+        # Insertions that overlap with the host are rejected right away
+        if self.is_blocked(pos):
+            return 1e10
         return self.insertion_energy(ff)
 
     def probability(self, e):
@@ -286,8 +345,6 @@ class TrialInsertion(Trial):
         return min(1.0, self.mc.guest.cell.volume*self.mc.beta*self.mc.fugacity/self.mc.N*np.exp(-self.mc.beta*e))
 
     def accept(self):
-        # Set state to the system including the inserted guest
-        self.mc.current_configuration = self.mc.get_ff(self.mc.N).system
         # Update the Ewald structure factors
         if self.mc.ewald_reci is not None:
             self.mc.ewald_reci.cosfacs[:] += self.mc.cosfacs_ins
@@ -296,8 +353,16 @@ class TrialInsertion(Trial):
             self.mc.sinfacs_ins[:] = 0.0
 
     def reject(self):
-        # Reset number of guest molecules
+        # Restore the last guest and reset number of guest molecules
+        ff = self.mc.get_ff(self.mc.N)
+        natom = self.mc.guest.natom
+        if self.mc.N>1:
+            begin, end = (self.mc.N-2)*natom, (self.mc.N-1)*natom
+            ff.system.pos[-natom:] = ff.system.pos[begin:end]
+            if self.mc.guest_interaction is not None:
+                self.mc.guest_interaction.remove(begin, end)
         self.mc.N -= 1
+        self.mc.get_ff(self.mc.N)
 
 
 class TrialDeletion(Trial):
@@ -308,7 +373,7 @@ class TrialDeletion(Trial):
             return 0.0
         else:
             # e contains U(N) - U(N-1)
-            iguest = np.random.randint(self.mc.N)
+            iguest = self.mc.random.randint(self.mc.N)
             # Select the guest-guest force field with correct number of guests
             ff = self.mc.get_ff(self.mc.N)
             # Reorder positions so the selected guest ends up last
@@ -326,13 +391,105 @@ class TrialDeletion(Trial):
     def accept(self):
         # Update number of guests
         self.mc.N -= 1
-        # Set the state to the system without the deleted guest
+        # The last of the other guests replaces the deleted guest
         ff = self.mc.get_ff(self.mc.N)
-        ff.system.pos[:] = self.mc.get_ff(self.mc.N+1).system.pos[:self.mc.N*self.mc.guest.natom]
-        self.mc.current_configuration = ff.system
+        natom = self.mc.guest.natom
+        if self.mc.N>0:
+            begin, end = (self.mc.N-1)*natom, self.mc.N*natom
+            ff.system.pos[-natom:] = ff.system.pos[begin:end]
+            if self.mc.guest_interaction is not None:
+                self.mc.guest_interaction.remove(begin, end)
 
     def reject(self):
         # Reset the Ewald structure factors
         if self.mc.ewald_reci is not None and self.mc.N>0:
             self.mc.ewald_reci.cosfacs[:] += self.mc.cosfacs_del
             self.mc.ewald_reci.sinfacs[:] += self.mc.sinfacs_del
+
+
+class TrialCbmcInsertion(TrialInsertion):
+    log_name = 'cbmc ins.'
+    """Insert a flexible guest, grown with configurational bias"""
+    def insert(self, ff):
+        natom = self.mc.guest.natom
+        cbmc = self.mc.cbmc
+        pos, self.log_weight, self.egrow = cbmc.grow(self.mc.beta,
+            lambda iatom, trials: self.atom_energies(ff, iatom, trials))
+        if pos is None:
+            return np.inf
+        cbmc.record(self.log_name, self.log_weight, self.mc.beta)
+        ff.system.pos[-natom:] = pos
+        return self.insertion_energy(ff) + cbmc.compute_intra(pos)
+
+    def probability(self, e):
+        if self.log_weight == -np.inf:
+            return 0.0
+        # The Rosenbluth weight replaces the Boltzmann factor of the grown
+        # interactions. The other contributions, e.g. the reciprocal Ewald
+        # sum, are still included with their Boltzmann factor.
+        x = self.log_weight - self.mc.cbmc.get_log_ideal_weight(self.mc.beta) - \
+            self.mc.beta*(e - self.egrow)
+        return min(1.0, self.mc.guest.cell.volume*self.mc.beta*self.mc.fugacity/self.mc.N*np.exp(min(x, 700.0)))
+
+
+class TrialCbmcDeletion(TrialDeletion):
+    log_name = 'cbmc del.'
+    def compute(self):
+        """Delete a randomly selected flexible guest"""
+        if self.mc.N==0:
+            return 0.0
+        iguest = self.mc.random.randint(self.mc.N)
+        ff = self.mc.get_ff(self.mc.N)
+        self.mc.reorder_guests(ff.system, iguest)
+        pos = ff.system.pos[-self.mc.guest.natom:].copy()
+        # Rosenbluth weight of the current conformation
+        cbmc = self.mc.cbmc
+        pos, self.log_weight, self.egrow = cbmc.grow(self.mc.beta,
+            lambda iatom, trials: self.atom_energies(ff, iatom, trials), pos=pos)
+        cbmc.record(self.log_name, self.log_weight, self.mc.beta)
+        return self.insertion_energy(ff, sign=-1) - cbmc.compute_intra(pos)
+
+    def probability(self, e):
+        if self.mc.N==0:
+            return 0.0
+        # Reverse of the acceptance rule of TrialCbmcInsertion, note that
+        # e=U(N-1)-U(N)
+        x = self.mc.cbmc.get_log_ideal_weight(self.mc.beta) - self.log_weight - \
+            self.mc.beta*(e + self.egrow)
+        return min(1.0, self.mc.N/(self.mc.guest.cell.volume*self.mc.beta*self.mc.fugacity)*np.exp(min(x, 700.0)))
+
+
+class TrialCbmcRegrowth(TrialCartesian):
+    log_name = 'cbmc regr.'
+    """Regrow a randomly selected flexible guest, keeping its first atom"""
+    def compute(self):
+        if self.mc.N==0:
+            return np.nan
+        iguest = self.mc.random.randint(self.mc.N)
+        ff = self.mc.get_ff(self.mc.N)
+        self.mc.reorder_guests(ff.system, iguest)
+        natom = self.mc.guest.natom
+        self.oldpos = ff.system.pos[-natom:].copy()
+        e = self.insertion_energy(ff, sign=-1, ewald=False)
+        cbmc = self.mc.cbmc
+        atom_energies = lambda iatom, trials: self.atom_energies(ff, iatom, trials)
+        first = self.oldpos[cbmc.order[0]]
+        pos, log_weight_old, egrow_old = cbmc.grow(self.mc.beta,
+            atom_energies, pos=self.oldpos, first=first)
+        eintra_old = cbmc.compute_intra(self.oldpos)
+        self.newpos, log_weight_new, egrow_new = cbmc.grow(self.mc.beta,
+            atom_energies, first=first)
+        self.log_ratio = log_weight_new - log_weight_old
+        if self.newpos is None:
+            return np.inf
+        cbmc.record(self.log_name, log_weight_new, self.mc.beta)
+        self.egrow = egrow_new - egrow_old
+        ff.system.pos[-natom:] = self.newpos
+        e += self.insertion_energy(ff, sign=1, ewald=False)
+        e += self.move_energy(ff, self.oldpos)
+        return e + cbmc.compute_intra(self.newpos) - eintra_old
+
+    def probability(self, e):
+        if self.mc.N==0 or self.newpos is None:
+            return 0.0
+        return min(1.0, np.exp(min(self.log_ratio - self.mc.beta*(e - self.egrow), 700.0)))
@@ -34,7 +34,7 @@ from yaff.system import System
 from yaff.log import log, timer
 
 
-__all__ = ['get_random_rotation_matrix', 'random_insertion',
+__all__ = ['get_random_rotation_matrix', 'random_insertion', 'RandomBuffer',
            'MCScreenLog', 'MCVolumeStateItem',
           ]
 
@@ -46,12 +46,14 @@ def get_random_rotation_matrix(deflection=1.0, randnums=None):
     deflection: the magnitude of the rotation. For 0, no rotation; for 1, competely random
     rotation. Small deflection => small perturbation.
     randnums: 3 random numbers in the range [0, 1]. If `None`, they will be auto-generated.
+    An array with shape (n, 3) can be given instead, to obtain an array with n
+    rotation matrices.
     """
     # from http://www.realtimerendering.com/resources/GraphicsGems/gemsiii/rand_rotation.c
     if randnums is None:
         randnums = np.random.uniform(size=(3,))
 
-    theta, phi, z = randnums
+    theta, phi, z = np.moveaxis(randnums, -1, 0)
 
     theta = theta * 2.0*deflection*np.pi  # Rotation about the pole (Z).
     phi = phi * 2.0*np.pi  # For direction of pole deflection.
@@ -64,24 +66,29 @@ def get_random_rotation_matrix(deflection=1.0, randnums=None):
     # has length sqrt(2) to eliminate the 2 in the Householder matrix.
 
     r = np.sqrt(z)
-    Vx, Vy, Vz = V = (
+    V = np.stack((
         np.sin(phi) * r,
         np.cos(phi) * r,
         np.sqrt(2.0 - z)
-        )
+        ), axis=-1)
 
     st = np.sin(theta)
     ct = np.cos(theta)
 
-    R = np.array(((ct, st, 0), (-st, ct, 0), (0, 0, 1)))
+    R = np.zeros(np.shape(theta) + (3, 3))
+    R[...,0,0] = ct
+    R[...,0,1] = st
+    R[...,1,0] = -st
+    R[...,1,1] = ct
+    R[...,2,2] = 1
 
     # Construct the rotation matrix  ( V Transpose(V) - I ) R.
 
-    M = (np.outer(V, V) - np.eye(3)).dot(R)
-    return M
+    M = V[...,:,None]*V[...,None,:] - np.eye(3)
+    return np.matmul(M, R)
 
 
-def random_insertion(guest):
+def random_insertion(guest, ninsert=None, random_state=None):
     """
     Place a guest molecule at a random position with a random orientation
 
@@ -89,18 +96,114 @@ def random_insertion(guest):
 
         guest
             A System instance that is 3D periodic
+
+    **Optional arguments:**
+
+        ninsert
+            When given, an array with shape (ninsert, natom, 3) is returned
+            with the positions of ninsert independent random insertions.
+
+        random_state
+            A numpy RandomState instance. By default the global random state
+            of numpy is used.
     """
     # Only 3D periodic systems supported for now
     assert guest.cell.nvec==3
+    if random_state is None:
+        random_state = np.random
     # Center at origin
     pos = guest.pos.copy()
     pos -= np.average(pos, axis=0)
-    # Perform rotation
-    M = get_random_rotation_matrix()
-    pos = np.einsum('ib,ab->ia', pos, M)
-    # Perform translation
-    translation = np.dot(guest.cell.rvecs.T, np.random.rand(3)-0.5)
-    return pos+translation
+    if ninsert is None:
+        # Perform rotation
+        M = get_random_rotation_matrix(randnums=random_state.uniform(size=(3,)))
+        pos = np.einsum('ib,ab->ia', pos, M)
+        # Perform translation
+        translation = np.dot(guest.cell.rvecs.T, random_state.rand(3)-0.5)
+        return pos+translation
+    M = get_random_rotation_matrix(randnums=random_state.uniform(size=(ninsert, 3)))
+    pos = np.einsum('ib,nab->nia', pos, M)
+    translations = np.dot(random_state.rand(ninsert, 3)-0.5, guest.cell.rvecs)
+    return pos+translations[:,None,:]
+
+
+class RandomBuffer(object):
+    '''Uniform random numbers in [0, 1), generated in large blocks
+
+       An MC step only needs a few random numbers. Drawing them one by one
+       from numpy has a large overhead compared to cheap trial moves, so they
+       are taken from a block that is generated at once with a
+       ``numpy.random.Generator``.
+    '''
+    def __init__(self, seed=None, size=4096):
+        '''
+           **Optional arguments:**
+
+           seed
+                The seed of the generator. When not given, the seed is drawn
+                from the global random state of numpy when the first block is
+                generated.
+
+           size
+                The number of random numbers in a block.
+        '''
+        assert size > 0
+        self.seed = seed
+        self.size = size
+        self.generator = None
+        self._block = np.zeros(0)
+        self._values = []
+        self._index = 0
+
+    def _fill(self):
+        if self.generator is None:
+            if self.seed is None:
+                self.seed = np.random.randint(2**31)
+            self.generator = np.random.default_rng(self.seed)
+        self._block = self.generator.random(self.size)
+        # Indexing a list of Python floats is faster than indexing an array.
+        self._values = self._block.tolist()
+        self._index = 0
+
+    def next(self):
+        '''Return a single random number'''
+        if self._index >= len(self._values):
+            self._fill()
+        value = self._values[self._index]
+        self._index += 1
+        return value
+
+    def rand(self, n=None):
+        '''Return a random number, or an array with n random numbers'''
+        if n is None:
+            return self.next()
+        if n > self.size:
+            if self.generator is None:
+                self._fill()
+            return self.generator.random(n)
+        if self._index + n > len(self._values):
+            self._fill()
+        result = self._block[self._index:self._index + n]
+        self._index += n
+        return result
+
+    def uniform(self, size=None):
+        '''Return random numbers with the given shape, as with
+           ``numpy.random.uniform``'''
+        if size is None:
+            return self.next()
+        return self.rand(int(np.prod(size))).reshape(size)
+
+    def randint(self, high):
+        '''Return a random integer in [0, high)'''
+        return min(int(self.next()*high), high - 1)
+
+    def normal(self, size=None):
+        '''Return standard normal random numbers with the given shape, drawn
+           from the same generator'''
+        if self.generator is None:
+            self._fill()
+        return self.generator.standard_normal(size)
 
 
 class MCScreenLog(Hook):
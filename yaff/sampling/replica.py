@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+r'''Monte-Carlo simulations of several replicas in parallel
+
+   Adsorption isotherms require GCMC simulations at many temperatures and
+   fugacities. These replicas are independent, except for optional swaps of
+   the configurations of replicas with neighboring conditions (parallel
+   tempering, or hyper-parallel tempering when the fugacities differ). The
+   swap of the configurations of replicas :math:`i` and :math:`j` is accepted
+   with probability
+
+   .. math:: \min\left(1, \exp\left[(\beta_i - \beta_j)(U_i - U_j)
+             + (N_j - N_i)\ln\frac{\beta_i f_i}{\beta_j f_j}\right]\right)
+
+   where the last term vanishes for canonical replicas.
+
+   The replicas are distributed over worker processes that are forked after
+   the replicas are constructed, such that data that is only read, e.g. the
+   energy grids and the host atoms of a common external potential, is shared
+   between the workers instead of copied into each of them.
+'''
+
+
+from __future__ import division
+
+import multiprocessing
+import traceback
+
+import h5py as h5
+import numpy as np
+
+from molmod import bar
+
+from yaff.log import log, timer
+from yaff.sampling.mc import CanonicalMC, GCMC
+from yaff.sampling.io import MCHDF5Writer
+
+
+__all__ = ['ReplicaExchangeMC']
+
+
+class ReplicaExchangeMC(object):
+    '''Parallel MC simulations of replicas with different conditions'''
+    log_name = 'REPMC'
+
+    def __init__(self, replicas, einit=None):
+        '''
+           **Arguments:**
+
+           replicas
+                A list of GCMC or CanonicalMC instances with the same guest
+                and force field, for which the external conditions are set.
+                Configurations are only swapped between consecutive replicas
+                in this list, so they should be ordered by temperature and/or
+                fugacity.
+
+           **Optional arguments:**
+
+           einit
+                A list with the energy of the initial configuration of each
+                replica. By default, these are zero, which is correct for
+                GCMC replicas that start without guests. Only with consistent
+                energies, the swaps are sampled correctly.
+
+           The state of the replicas is kept by this driver, because the
+           replicas may be simulated in other processes: the positions of
+           the guests, the energies, the counters and the running averages
+           of the number of guests and of the energy.
+        '''
+        if len(replicas) == 0:
+            raise ValueError('At least one replica is needed.')
+        for replica in replicas:
+            if not isinstance(replica, (GCMC, CanonicalMC)):
+                raise TypeError('Only GCMC and CanonicalMC replicas are supported.')
+            if type(replica) is not type(replicas[0]):
+                raise TypeError('All replicas must be of the same kind.')
+            if replica.guest.natom != replicas[0].guest.natom:
+                raise TypeError('All replicas must have the same guest.')
+            if not replica.conditions_set:
+                raise ValueError('External conditions have not been set!')
+        self.replicas = replicas
+        nreplica = len(replicas)
+        if einit is None:
+            einit = np.zeros(nreplica)
+        self.energies = np.array(einit, float)
+        assert self.energies.shape == (nreplica,)
+        # None means that a replica starts from its own initial guests.
+        self.positions = [None]*nreplica
+        self.nguests = np.array([replica.N for replica in replicas])
+        self.counters = np.zeros(nreplica, int)
+        self.Nmeans = self.nguests.astype(float)
+        self.emeans = self.energies.copy()
+        self.ncycle = 0
+        # Accepted and tried swaps between replicas i and i+1
+        self.swaps = np.zeros((nreplica - 1, 2), int)
+        self.acceptance = None
+
+    @classmethod
+    def from_files(cls, guest, parameters, conditions, **kwargs):
+        '''Automated setup of GCMC replicas with a common external potential
+
+           **Arguments:**
+
+           guest
+                The filename of a system file describing one guest molecule,
+                or a System instance of one guest molecule.
+
+           parameters
+                Force-field parameters, see
+                :meth:`yaff.sampling.mc.GCMC.from_files`.
+
+           conditions
+                A list with a (temperature, fugacity) pair for each replica,
+                ordered by temperature and/or fugacity.
+
+           All keyword arguments, except hooks, are passed to
+           :meth:`yaff.sampling.mc.GCMC.from_files`. The external potential,
+           which may consist of energy grids, is only constructed once and
+           used by all replicas. Hooks cannot be shared by the replicas, use
+           the fn_h5 argument of :meth:`run` to write their output.
+        '''
+        if kwargs.get('hooks'):
+            raise ValueError('Hooks cannot be shared by the replicas, use the '
+                             'fn_h5 argument of the run method instead.')
+        kwargs.pop('hooks', None)
+        nguests = kwargs.get('nguests', 10)
+        first = GCMC.from_files(guest, parameters, **kwargs)
+        replicas = [first]
+        for icondition in range(1, len(conditions)):
+            replicas.append(GCMC(first.guest, first.ff_generator,
+                external_potential=first.external_potential,
+                eguest=first.eguest, hooks=[], nguests=nguests,
+                ff_intra=first.ff_intra, host_cache=first.host_cache,
+                host_occupancy=first.host_occupancy))
+        for replica, (T, fugacity) in zip(replicas, conditions):
+            replica.set_external_conditions(T, fugacity)
+        return cls(replicas)
+
+    def run(self, ncycle, nsteps, swap=True, nproc=1, seed=None,
+            fn_h5=None, h5_step=1, **kwargs):
+        '''Perform Monte-Carlo steps for all replicas
+
+           **Arguments:**
+
+           ncycle
+                The number of cycles. After each cycle, swaps between
+                neighboring replicas are attempted.
+
+           nsteps
+                The number of MC steps of each replica in a cycle.
+
+           **Optional arguments:**
+
+           swap
+                When False, the replicas are simulated independently.
+
+           nproc
+                The number of worker processes. The replicas are assigned to
+                the workers in a round-robin fashion. The workers are forked
+                at the start of the run, such that the replicas do not need
+                to be pickled.
+
+           seed
+                The seed for the random numbers. Each replica gets its own
+                seed in each cycle, such that the results do not depend on
+                the number of processes. When not given, the seed is drawn
+                from the global random state of numpy.
+
+           fn_h5
+                A filename with a placeholder for the index of the replica,
+                e.g. ``'replica_%03i.h5'``. When given, the output of each
+                replica is written to its own HDF5 file with an
+                :class:`yaff.sampling.io.MCHDF5Writer`. The files are
+                overwritten in the first run and extended in later runs.
+
+           h5_step
+                The HDF5 output is written every h5_step MC steps.
+
+           All other keyword arguments are passed to
+           :meth:`yaff.sampling.mc.MC.run`.
+
+           The numbers of accepted and tried trials of each kind are added
+           to the attribute ``acceptance``, with shape (nreplica, ntrial,
+           2), the numbers of accepted and tried swaps between replicas i
+           and i+1 to the attribute ``swaps``. The running averages of the
+           number of guests and of the energy are stored in the attributes
+           ``Nmeans`` and ``emeans``.
+        '''
+        nreplica = len(self.replicas)
+        if seed is None:
+            seed = np.random.randint(2**31)
+        random_state = np.random.RandomState(seed)
+        seeds = random_state.randint(2**31, size=(ncycle, nreplica))
+        nproc = min(nproc, nreplica)
+        h5_mode = 'w' if self.ncycle == 0 else 'a'
+        with log.section(self.log_name), timer.section(self.log_name):
+            workers = []
+            if nproc == 1:
+                writers = _add_writers(self.replicas, range(nreplica), fn_h5,
+                    h5_mode, h5_step)
+            else:
+                context = multiprocessing.get_context('fork')
+                for iproc in range(nproc):
+                    conn, child_conn = context.Pipe()
+                    process = context.Process(target=_work, args=(
+                        self.replicas, child_conn, fn_h5, h5_mode, h5_step))
+                    process.start()
+                    child_conn.close()
+                    workers.append((process, conn))
+            try:
+                for icycle in range(ncycle):
+                    tasks = [(ireplica, seeds[icycle, ireplica],
+                              self.positions[ireplica], self.energies[ireplica],
+                              self.counters[ireplica], self.Nmeans[ireplica],
+                              self.emeans[ireplica])
+                             for ireplica in range(nreplica)]
+                    if nproc == 1:
+                        results = _run_tasks(self.replicas, tasks, nsteps, kwargs)
+                    else:
+                        for iproc, (process, conn) in enumerate(workers):
+                            conn.send((tasks[iproc::nproc], nsteps, kwargs))
+                        results = []
+                        for process, conn in workers:
+                            result = conn.recv()
+                            if isinstance(result, tuple):
+                                # An error in the worker, with its traceback
+                                error, tb = result
+                                raise error from RuntimeError(
+                                    'Traceback of the worker process:\n%s' % tb)
+                            results.extend(result)
+                    for ireplica, N, energy, counter, Nmean, emean, acceptance, pos in results:
+                        self.nguests[ireplica] = N
+                        self.energies[ireplica] = energy
+                        self.counters[ireplica] = counter
+                        self.Nmeans[ireplica] = Nmean
+                        self.emeans[ireplica] = emean
+                        self.positions[ireplica] = pos
+                        if self.acceptance is None:
+                            self.acceptance = np.zeros((nreplica,) + acceptance.shape, int)
+                        self.acceptance[ireplica] += acceptance
+                    if swap:
+                        self._swap(random_state)
+                    self.ncycle += 1
+            finally:
+                if nproc == 1:
+                    _remove_writers(writers)
+                for process, conn in workers:
+                    conn.send(None)
+                    conn.close()
+                for process, conn in workers:
+                    process.join()
+            self._log()
+
+    def _swap(self, random_state):
+        '''Attempt swaps between the pairs of neighboring replicas that start
+           at an even (odd) index in even (odd) cycles'''
+        for i in range(self.ncycle % 2, len(self.replicas) - 1, 2):
+            j = i + 1
+            ri, rj = self.replicas[i], self.replicas[j]
+            x = (ri.beta - rj.beta)*(self.energies[i] - self.energies[j])
+            if isinstance(ri, GCMC) and self.nguests[i] != self.nguests[j]:
+                x += (self.nguests[j] - self.nguests[i])*np.log(
+                    ri.beta*ri.fugacity/(rj.beta*rj.fugacity))
+            self.swaps[i, 1] += 1
+            if random_state.rand() < np.exp(min(x, 0.0)):
+                self.swaps[i, 0] += 1
+                self.positions[i], self.positions[j] = self.positions[j], self.positions[i]
+                self.energies[[i, j]] = self.energies[[j, i]]
+                self.nguests[[i, j]] = self.nguests[[j, i]]
+
+    def _log(self):
+        if log.do_medium:
+            log('%i replicas after %i cycles' % (len(self.replicas), self.ncycle))
+            log.hline()
+            log('Replica    Temperature   Fugacity [bar]      <N>          <E>    Swaps [%]')
+            log.hline()
+            for ireplica, replica in enumerate(self.replicas):
+                if ireplica < len(self.swaps) and self.swaps[ireplica, 1] > 0:
+                    swaps = '%12.2f' % (self.swaps[ireplica, 0]*100.0/self.swaps[ireplica, 1])
+                else:
+                    swaps = '%12s' % '-'
+                if isinstance(replica, GCMC):
+                    fugacity = '%16.6f' % (replica.fugacity/bar)
+                else:
+                    fugacity = '%16s' % '-'
+                log('%7i %s %s %8.3f %s %s' % (ireplica,
+                    log.temperature(replica.T), fugacity, self.Nmeans[ireplica],
+                    log.energy(self.emeans[ireplica]), swaps))
+            log.hline()
+
+
+def _add_writers(replicas, indexes, fn_h5, mode, step):
+    '''Add an MCHDF5Writer to the hooks of the given replicas
+
+       **Returns:** a list with the opened file, the replica and its original
+       hooks, to be passed to ``_remove_writers``.
+    '''
+    writers = []
+    if fn_h5 is not None:
+        for ireplica in indexes:
+            replica = replicas[ireplica]
+            f = h5.File(fn_h5 % ireplica, mode)
+            writers.append((f, replica, replica.hooks))
+            # A new list, the default list of hooks may be shared by replicas.
+            replica.hooks = replica.hooks + [MCHDF5Writer(f, step=step)]
+    return writers
+
+
+def _remove_writers(writers):
+    '''Restore the hooks of the replicas and close the files'''
+    for f, replica, hooks in writers:
+        replica.hooks = hooks
+        f.close()
+
+
+def _run_tasks(replicas, tasks, nsteps, kwargs):
+    '''Run one cycle of the given replicas
+
+       Each task consists of the index of the replica, the seed for the
+       random numbers, the positions of the guests (None to start from the
+       initial guests of the replica), the energy, the counter and the
+       running averages of the number of guests and of the energy.
+    '''
+    results = []
+    for ireplica, seed, pos, energy, counter, Nmean, emean in tasks:
+        replica = replicas[ireplica]
+        np.random.seed(seed)
+        if pos is not None:
+            replica.set_configuration(pos)
+        if counter > 0:
+            # Continue the running averages, the volume is fixed
+            replica.Nmean = Nmean
+            replica.emean = emean
+            replica.Vmean = replica.get_ff(replica.N).system.cell.volume
+        acceptance = replica.run(nsteps, einit=energy, counter=counter, **kwargs)
+        results.append((ireplica, replica.N, replica.energy, replica.counter,
+            replica.Nmean, replica.emean, acceptance,
+            replica.current_configuration.pos.copy()))
+    return results
+
+
+def _work(replicas, conn, fn_h5, mode, step):
+    '''Main loop of a forked worker process'''
+    writers = None
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            tasks, nsteps, kwargs = message
+            if writers is None:
+                writers = _add_writers(replicas, [task[0] for task in tasks],
+                    fn_h5, mode, step)
+            try:
+                conn.send(_run_tasks(replicas, tasks, nsteps, kwargs))
+            except Exception as e:
+                conn.send((e, traceback.format_exc()))
+    finally:
+        _remove_writers(writers or [])
+        conn.close()
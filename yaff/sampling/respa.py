@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+'''Multiple time step (RESPA) Verlet integrator'''
+
+
+from __future__ import division
+
+import numpy as np
+
+from yaff.log import log
+from yaff.pes.ff import ForcePart, ForceField
+from yaff.sampling.iterative import Iterative
+from yaff.sampling.verlet import VerletIntegrator
+
+
+__all__ = ['RESPAIntegrator']
+
+
+class RESPAIntegrator(VerletIntegrator):
+    '''Reversible reference system propagator algorithm (RESPA)
+
+       The force field is split into a fast group of parts (typically the
+       cheap and stiff valence terms) and a slow group (the expensive pair
+       potentials and Ewald parts). The fast group is integrated with an inner
+       time step that is ``nsub`` times smaller than the (outer) time step.
+       The slow forces are applied as impulses of half an outer time step at
+       the start and the end of each step, such that the slow group is only
+       computed once per outer step. [TZB1992]_
+
+       The Verlet hooks (thermostats and barostats) act on the outer time
+       step, in the same way as for the ``VerletIntegrator``. The potential
+       energy, the gradient and the virial tensor of the iterative are those of
+       the complete force field, such that the conserved quantity ``econs`` is
+       still reported.
+
+       .. [TZB1992] M. Tuckerman, B. J. Berne and G. J. Martyna, J. Chem.
+          Phys. 97, 1990 (1992).
+    '''
+    log_name = 'RESPA'
+
+    def __init__(self, ff, timestep=None, fast_parts=None, nsub=4, state=None,
+                 hooks=None, vel0=None, temp0=300, scalevel0=True, time0=None,
+                 ndof=None, counter0=None, restart_h5=None):
+        """
+            **Arguments:**
+
+            ff
+                A ForceField instance
+
+            **Optional arguments:**
+
+            timestep
+                The outer integration time step (in atomic units), used for
+                the slow parts of the force field.
+
+            fast_parts
+                A list of parts of ff, or their names, that are integrated with
+                the inner time step. By default, the valence part is the only
+                fast part. All other parts are slow.
+
+            nsub
+                The number of inner time steps in one outer time step.
+
+            All other arguments are documented in ``VerletIntegrator``.
+        """
+        if fast_parts is None:
+            fast_parts = ['valence']
+        if nsub < 1:
+            raise ValueError('The number of inner time steps must be at least one.')
+        self.nsub = nsub
+        fast, slow = self._split_parts(ff, fast_parts)
+        self.ff_fast = self._make_ff(ff, fast)
+        self.ff_slow = self._make_ff(ff, slow)
+        natom = ff.system.natom
+        self.gpos_fast = np.zeros((natom, 3), float)
+        self.gpos_slow = np.zeros((natom, 3), float)
+        self.vtens_fast = np.zeros((3, 3), float)
+        self.vtens_slow = np.zeros((3, 3), float)
+        self.epot_fast = 0.0
+        self.epot_slow = 0.0
+        # The positions and cell vectors at which gpos_fast and gpos_slow
+        # were computed. Hooks may change both, e.g. barostats.
+        self._pos_split = None
+        self._rvecs_split = None
+        if log.do_medium:
+            with log.section('RESPA'):
+                log('Inner time steps:    %i' % nsub)
+                log('Fast parts:          %s' % ', '.join(part.name for part in fast))
+                log('Slow parts:          %s' % ', '.join(part.name for part in slow))
+        VerletIntegrator.__init__(self, ff, timestep, state, hooks, vel0,
+            temp0, scalevel0, time0, ndof, counter0, restart_h5)
+
+    def _split_parts(self, ff, fast_parts):
+        fast = []
+        for part in fast_parts:
+            if not isinstance(part, ForcePart):
+                name = part
+                part = getattr(ff, 'part_%s' % name, None)
+                if part is None:
+                    raise ValueError('The force field has no part %s.' % name)
+            if part not in ff.parts:
+                raise ValueError('The fast part %s is not a part of the force field.' % part.name)
+            if part not in fast:
+                fast.append(part)
+        slow = [part for part in ff.parts if part not in fast]
+        return fast, slow
+
+    def _make_ff(self, ff, parts):
+        # A sub force field only needs the neighbor list if one of its parts
+        # uses it.
+        if any(getattr(part, 'nlist', None) is not None for part in parts):
+            nlist = ff.nlist
+        else:
+            nlist = None
+        return ForceField(ff.system, parts, nlist)
+
+    def _compute_fast(self, vtens=True):
+        self.ff_fast.update_pos(self.pos)
+        self.gpos_fast[:] = 0.0
+        self.vtens_fast[:] = 0.0
+        if vtens:
+            self.epot_fast = self.ff_fast.compute(self.gpos_fast, self.vtens_fast)
+        else:
+            self.epot_fast = self.ff_fast.compute(self.gpos_fast)
+
+    def _compute_slow(self):
+        self.ff_slow.update_pos(self.pos)
+        self.gpos_slow[:] = 0.0
+        self.vtens_slow[:] = 0.0
+        self.epot_slow = self.ff_slow.compute(self.gpos_slow, self.vtens_slow)
+
+    def _combine(self):
+        '''Store the results of the complete force field in the iterative'''
+        self.epot = self.epot_fast + self.epot_slow
+        self.gpos[:] = self.gpos_fast + self.gpos_slow
+        self.vtens[:] = self.vtens_fast + self.vtens_slow
+        self._pos_split = self.pos.copy()
+        self._rvecs_split = self.ff.system.cell.rvecs.copy()
+        # Keep the complete force field in sync, in case hooks use it.
+        self.ff.update_pos(self.pos)
+
+    def _check_split(self):
+        '''Recompute the fast and slow forces if the hooks moved the atoms'''
+        if (self._pos_split is None or
+            (self.pos != self._pos_split).any() or
+            (self.ff.system.cell.rvecs != self._rvecs_split).any()):
+            self._compute_fast()
+            self._compute_slow()
+            self._combine()
+
+    def initialize(self):
+        self.ff.update_pos(self.pos)
+        self._compute_fast()
+        self._compute_slow()
+        self._combine()
+        self.acc = -self.gpos/self.masses.reshape(-1,1)
+        self.posoud = self.pos.copy()
+
+        # Allow for specialized initializations by the Verlet hooks.
+        self.call_verlet_hooks('init')
+
+        # Configure the number of degrees of freedom if needed
+        if self.ndof is None:
+            self.ndof = self.pos.size
+
+        # Common post-processing of the initialization
+        self.compute_properties(self.restart_h5)
+        Iterative.initialize(self) # Includes calls to conventional hooks
+
+    def propagate(self):
+        # Allow specialized hooks to modify the state before the regular
+        # RESPA step.
+        self.call_verlet_hooks('pre')
+        self._check_split()
+
+        # Half a kick with the slow forces.
+        masses = self.masses.reshape(-1,1)
+        self.vel -= (0.5*self.timestep)*self.gpos_slow/masses
+        # Velocity Verlet with the fast forces and the inner time step.
+        timestep_fast = self.timestep/self.nsub
+        for isub in range(self.nsub):
+            self.vel -= (0.5*timestep_fast)*self.gpos_fast/masses
+            self.pos += timestep_fast*self.vel
+            # The virial of the fast parts is only needed at the end.
+            self._compute_fast(isub == self.nsub-1)
+            self.vel -= (0.5*timestep_fast)*self.gpos_fast/masses
+        # Half a kick with the slow forces at the new positions.
+        self._compute_slow()
+        self.vel -= (0.5*self.timestep)*self.gpos_slow/masses
+        self._combine()
+        self.acc = -self.gpos/masses
+        self.ekin = self._compute_ekin()
+
+        # Allow specialized verlet hooks to modify the state after the step
+        self.call_verlet_hooks('post')
+
+        # Calculate the total position change
+        self.posnieuw = self.pos.copy()
+        self.delta[:] = self.posnieuw-self.posoud
+        self.posoud[:] = self.posnieuw
+
+        # Common post-processing of a single step
+        self.time += self.timestep
+        self.compute_properties()
+        Iterative.propagate(self) # Includes call to conventional hooks
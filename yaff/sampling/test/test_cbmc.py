@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+from __future__ import division
+
+import numpy as np
+import pkg_resources
+from nose.tools import assert_raises
+
+from yaff import *
+from molmod.units import angstrom, bar, kelvin, deg
+from molmod.constants import boltzmann
+
+
+def get_pentane(L=30*angstrom):
+    # United-atom pentane in a zigzag conformation
+    bond, angle = 1.54*angstrom, 114.0*deg
+    pos = np.zeros((5, 3))
+    pos[:,0] = np.arange(5)*bond*np.sin(0.5*angle)
+    pos[1::2,1] = bond*np.cos(0.5*angle)
+    return System(np.full(5, 6), pos, ffatypes=['CH3', 'CH2', 'CH2', 'CH2', 'CH3'],
+        bonds=np.array([[0, 1], [1, 2], [2, 3], [3, 4]]), rvecs=np.identity(3)*L)
+
+
+def get_pars():
+    return pkg_resources.resource_filename(__name__, '../../data/test/parameters_alkane_ua.txt')
+
+
+def get_ff_intra(guest):
+    guest_isolated = guest.subsystem(np.arange(guest.natom))
+    guest_isolated.cell = Cell(np.zeros((0, 3)))
+    return ForceField.generate(guest_isolated, get_pars())
+
+
+def test_cbmc_grow_vacuum():
+    guest = get_pentane()
+    cbmc = CBMCGrowth(guest, get_ff_intra(guest), ntrial=5,
+                      random=RandomBuffer(1))
+    assert (cbmc.order == np.arange(5)).all()
+    beta = 1.0/(boltzmann*300*kelvin)
+    for irep in range(5):
+        pos, log_weight, energy = cbmc.grow(beta)
+        # The bond lengths are fixed
+        bonds = np.linalg.norm(pos[1:] - pos[:-1], axis=1)
+        assert abs(bonds - 1.54*angstrom).max() < 1e-10
+        # The energies of the selected trials add up to the intramolecular energy
+        assert abs(energy - cbmc.compute_intra(pos)) < 1e-10
+        # Retracing gives the same energy
+        pos1, log_weight1, energy1 = cbmc.grow(beta, pos=pos)
+        assert abs(pos1 - pos).max() < 1e-15
+        assert abs(energy1 - energy) < 1e-10
+        assert np.isfinite(log_weight1)
+        # Keeping the first atom fixed
+        pos2 = cbmc.grow(beta, first=pos[0])[0]
+        assert (pos2[0] == pos[0]).all()
+    assert np.isfinite(cbmc.get_log_ideal_weight(beta, nsample=10))
+    # The same seed gives the same conformation
+    cbmc0 = CBMCGrowth(guest, get_ff_intra(guest), ntrial=5, random=RandomBuffer(2))
+    cbmc1 = CBMCGrowth(guest, get_ff_intra(guest), ntrial=5, random=RandomBuffer(2))
+    assert (cbmc0.grow(beta)[0] == cbmc1.grow(beta)[0]).all()
+
+
+def test_cbmc_compute_trials():
+    guest = get_pentane()
+    gcmc = GCMC.from_files(guest, get_pars(), flexible=True)
+    gcmc.set_external_conditions(300*kelvin, 10*bar)
+    np.random.seed(2)
+    gcmc.run(100, mc_moves={'cbmc_insertion': 1.0}, close_contact=1.0*angstrom)
+    assert gcmc.N > 2
+    # The pair interactions of the last guest are the sum of those of its atoms
+    ff = gcmc.get_ff(gcmc.N)
+    natom = guest.natom
+    eref, dmin = gcmc.guest_interaction.compute(ff, natom)
+    e = 0.0
+    for i in range(natom):
+        iatom = ff.system.natom - natom + i
+        trials = np.array([ff.system.pos[iatom], ff.system.pos[iatom] + 0.1])
+        energies = gcmc.guest_interaction.compute_trials(ff, iatom, trials, 1e-3)
+        assert np.isfinite(energies).all()
+        e += energies[0]
+    assert abs(e - eref) < 1e-10*max(1.0, abs(eref))
+    # Close contacts get an infinite energy
+    energies = gcmc.guest_interaction.compute_trials(ff, ff.system.natom - natom,
+        ff.system.pos[:1], 1.0*angstrom)
+    assert energies[0] == np.inf
+
+
+def test_gcmc_cbmc():
+    guest = get_pentane()
+    gcmc = GCMC.from_files(guest, get_pars(), flexible=True)
+    gcmc.set_external_conditions(300*kelvin, 10*bar)
+    np.random.seed(3)
+    acceptance = gcmc.run(400, mc_moves={'cbmc_insertion': 1.0,
+        'cbmc_deletion': 1.0, 'cbmc_regrowth': 1.0, 'translation': 1.0},
+        close_contact=1.0*angstrom, cbmc_ntrial=8)
+    assert (acceptance[:,0] > 0).all()
+    assert gcmc.N > 0
+    assert set(gcmc.cbmc.stats.keys()) == set(['cbmc ins.', 'cbmc del.', 'cbmc regr.'])
+    # The energy, including the intramolecular energies, is consistent with
+    # a full evaluation of the force field
+    system = gcmc.current_configuration
+    assert system.natom == gcmc.N*guest.natom
+    ff = ForceField.generate(system, get_pars())
+    e = ff.compute_energy()
+    assert abs(e - gcmc.energy) < 1e-8*max(1.0, abs(e))
+
+
+def test_gcmc_cbmc_seed():
+    # With a seed, the growth of the guests is reproducible
+    guest = get_pentane()
+    results = []
+    for irep in range(2):
+        gcmc = GCMC.from_files(guest, get_pars(), flexible=True)
+        gcmc.set_external_conditions(300*kelvin, 10*bar)
+        gcmc.run(100, mc_moves={'cbmc_insertion': 1.0, 'cbmc_regrowth': 1.0},
+            close_contact=1.0*angstrom, cbmc_ntrial=4, seed=5)
+        results.append((gcmc.N, gcmc.energy))
+    assert results[0] == results[1]
+
+
+def test_cbmc_errors():
+    guest = get_pentane()
+    # No intramolecular force field
+    gcmc = GCMC.from_files(guest, get_pars())
+    gcmc.set_external_conditions(300*kelvin, 1*bar)
+    with assert_raises(ValueError):
+        gcmc.run(10, mc_moves={'cbmc_insertion': 1.0})
+    # The intramolecular force field must be that of an isolated guest
+    with assert_raises(TypeError):
+        CBMCGrowth(guest, ForceField.generate(guest, get_pars()))
+    # Only valence and pair terms are supported
+    ff_intra = get_ff_intra(guest)
+    with assert_raises(TypeError):
+        CBMCGrowth(guest, ForceField(ff_intra.system, [ForcePartBias(ff_intra.system)]))
+    # The guest needs bonds
+    guest_nobonds = System(guest.numbers, guest.pos, ffatypes=guest.ffatypes,
+        ffatype_ids=guest.ffatype_ids, rvecs=guest.cell.rvecs)
+    with assert_raises(ValueError):
+        CBMCGrowth(guest_nobonds, get_ff_intra(guest))
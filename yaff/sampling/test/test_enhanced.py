@@ -35,6 +35,7 @@ import os
 from yaff import *
 from yaff.test.common import get_alaninedipeptide_amber99ff
 from molmod.test.common import tmpdir
+from nose.tools import assert_raises
 
 
 def test_mtd_alanine():
@@ -157,3 +158,42 @@ def test_mtd_restart():
             assert np.all(f1['hills/K'][:]==mtd_restart.hills.Ks)
             assert f1['hills/sigma'].shape[0]==1
             assert f1['hills/sigma'][0]==sigma
+
+
+def test_mtd_checkpoint():
+    # MTD settings
+    sigma = 0.35*rad
+    pace = 4
+    K = 1.2*kjmol
+    ff = get_alaninedipeptide_amber99ff()
+    cv = CVInternalCoordinate(ff.system, DihedAngle(4,6,8,14))
+    with tmpdir(__name__, 'test_mtd_checkpoint') as dn:
+        fn_ckpt = os.path.join(dn, 'checkpoint.h5')
+        mtd = MTDHook(ff, cv, sigma, K, start=pace, step=pace, periodicities=2*np.pi)
+        nvt = VerletIntegrator(ff, 1.0*femtosecond,
+            hooks=[mtd, CheckpointWriter(fn_ckpt, step=pace)])
+        nvt.run(12)
+        with h5.File(fn_ckpt, 'r') as f:
+            assert f['trajectory/counter'][-1] == 12
+            assert np.all(f['hills/q0'][:]==mtd.hills.q0s)
+            assert np.all(f['hills/K'][:]==mtd.hills.Ks)
+            # The checkpoint can be used to restart the metadynamics
+            ff = get_alaninedipeptide_amber99ff()
+            mtd_restart = MTDHook(ff, cv, sigma, K, start=pace, step=pace,
+                restart_file=f, periodicities=2*np.pi)
+            assert np.all(mtd_restart.hills.q0s==mtd.hills.q0s)
+
+
+def test_mtd_checkpoint_two_hooks():
+    sigma = 0.35*rad
+    K = 1.2*kjmol
+    ff = get_alaninedipeptide_amber99ff()
+    cv0 = CVInternalCoordinate(ff.system, DihedAngle(4,6,8,14))
+    cv1 = CVInternalCoordinate(ff.system, DihedAngle(1,4,6,8))
+    with tmpdir(__name__, 'test_mtd_checkpoint_two_hooks') as dn:
+        fn_ckpt = os.path.join(dn, 'checkpoint.h5')
+        hooks = [MTDHook(ff, cv0, sigma, K, start=2, step=2),
+            MTDHook(ff, cv1, sigma, K, start=2, step=2),
+            CheckpointWriter(fn_ckpt, step=2)]
+        nvt = VerletIntegrator(ff, 1.0*femtosecond, hooks=hooks)
+        assert_raises(ValueError, nvt.run, 4)
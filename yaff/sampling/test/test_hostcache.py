@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+
+from __future__ import division
+
+import os
+
+import numpy as np
+import pkg_resources
+
+from molmod.units import angstrom, kelvin, bar
+from molmod.test.common import tmpdir
+from nose.tools import assert_raises
+
+from yaff import *
+
+
+def get_cau13_files():
+    fn_host = pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk')
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_CAU-13_xylene.txt')
+    fn_guest = pkg_resources.resource_filename(__name__, '../../data/test/xylene.chk')
+    return fn_host, fn_pars, fn_guest
+
+
+def test_host_cache_key():
+    fn_host, fn_pars, fn_guest = get_cau13_files()
+    host = System.from_file(fn_host)
+    parameters = Parameters.from_file(fn_pars)
+    with tmpdir(__name__, 'test_host_cache_key') as dn:
+        cache = HostCache(dn)
+        key = cache.get_key(host, parameters, {'rcut': 12.0*angstrom})
+        assert key == cache.get_key(host, parameters.copy(), {'rcut': 12.0*angstrom})
+        assert key != cache.get_key(host, parameters, {'rcut': 10.0*angstrom})
+        host.pos[0, 0] += 0.01
+        assert key != cache.get_key(host, parameters, {'rcut': 12.0*angstrom})
+        # Truncation schemes are hashed by their parameters
+        key = cache.get_key({'tr': Switch3(2.0*angstrom)})
+        assert key == cache.get_key({'tr': Switch3(2.0*angstrom)})
+        assert key != cache.get_key({'tr': Switch3(3.0*angstrom)})
+        assert key != cache.get_key({'tr': Hammer(2.0*angstrom)})
+        # Other objects are refused
+        with assert_raises(TypeError):
+            cache.get_key({'tr': object()})
+
+
+def test_host_cache_gcmc():
+    fn_host, fn_pars, fn_guest = get_cau13_files()
+    with tmpdir(__name__, 'test_host_cache_gcmc') as dn:
+        acceptances, energies = [], []
+        for irun in range(2):
+            gcmc = GCMC.from_files(fn_guest, fn_pars, host=fn_host,
+                grid_spacing=4.0*angstrom, host_cache=dn)
+            assert isinstance(gcmc.host_cache, HostCache)
+            # Only the grids are stored, the first run computes them and the
+            # second one loads them.
+            assert len(os.listdir(dn)) == 1
+            gcmc.set_external_conditions(200*kelvin, 1000*bar)
+            acceptances.append(gcmc.run(50, mc_moves={'insertion':1.0,
+                'deletion':1.0}, seed=3))
+            energies.append(gcmc.energy)
+        assert (acceptances[0] == acceptances[1]).all()
+        assert abs(energies[0] - energies[1]) < 1e-10
+
+
+def test_host_cache_widom():
+    fn_host, fn_pars, fn_guest = get_cau13_files()
+    with tmpdir(__name__, 'test_host_cache_widom') as dn:
+        widom0 = WidomInsertion.from_files(fn_guest, fn_pars, fn_host,
+            rcut=8*angstrom, host_cache=dn)
+        # The structure factors and the linked cells of the host
+        assert len(os.listdir(dn)) == 1 + len(HostCache.bin_arrays)
+        widom1 = WidomInsertion.from_files(fn_guest, fn_pars, fn_host,
+            rcut=8*angstrom, host_cache=dn)
+        assert len(os.listdir(dn)) == 1 + len(HostCache.bin_arrays)
+        assert (widom0.ewald_reci.cosfacs == widom1.ewald_reci.cosfacs).all()
+        assert (widom0.ewald_reci.sinfacs == widom1.ewald_reci.sinfacs).all()
+        for name in HostCache.bin_arrays:
+            assert (getattr(widom0.host_interaction, name) ==
+                    getattr(widom1.host_interaction, name)).all()
+        pos = random_insertion(widom0.guest, 5)
+        assert (widom0.compute_energies(pos) == widom1.compute_energies(pos)).all()
@@ -28,6 +28,7 @@ from __future__ import division
 import numpy as np
 import h5py as h5
 import pkg_resources
+from nose.tools import assert_raises
 
 from yaff import *
 from molmod.units import angstrom, bar, kelvin, kcalmol
@@ -59,9 +60,21 @@ def setup_gcmc_lj(L):
 
 def test_gcmc_ff_generation():
     gcmc = setup_gcmc_lj(20.0*angstrom)
-    assert len(gcmc._ffs)==10
-    for iff in range(len(gcmc._ffs)):
-        assert gcmc._ffs[iff].system.natom==iff
+    guest_ff = gcmc.guest_ff
+    assert guest_ff.capacity==10
+    assert guest_ff.nguest==0
+    ff = gcmc.get_ff(4)
+    assert ff.system.natom==10
+    assert ff.nlist.nlow==9
+    assert ff.nlist.nhigh==3
+    # The same force field is used for any number of guests up to the capacity
+    assert gcmc.get_ff(10) is ff
+    assert ff.nlist.nhigh==9
+    ff = gcmc.get_ff(11)
+    assert guest_ff.capacity==20
+    assert ff.system.natom==20
+    assert ff.nlist.nlow==19
+    assert ff.nlist.nhigh==10
 
 
 def test_gcmc_lj():
@@ -106,6 +119,34 @@ def test_gcmc_probabilities():
         assert np.abs(p/ptotal-float(acceptance[i,1])/nsteps)<5e-2
 
 
+def test_random_buffer():
+    random = RandomBuffer(seed=5, size=16)
+    values = np.array([random.next() for i in range(40)])
+    assert ((values>=0.0) & (values<1.0)).all()
+    # Blocks of random numbers are reproducible for a given seed
+    ref = RandomBuffer(seed=5, size=16)
+    assert (np.concatenate([ref.rand(8) for i in range(5)])==values).all()
+    assert RandomBuffer(seed=5, size=16).uniform((4,2)).shape == (4,2)
+    assert all(0 <= random.randint(3) < 3 for i in range(100))
+
+
+def test_gcmc_seed():
+    mc_moves = {'insertion':1.0, 'deletion':1.0, 'translation':1.0}
+    results = []
+    for timer_step in [1, 10]:
+        gcmc = setup_gcmc_lj(20.0*angstrom)
+        gcmc.set_external_conditions(200.0,10.0*bar)
+        acceptance = gcmc.run(500, mc_moves=mc_moves, seed=3,
+            random_block=64, timer_step=timer_step)
+        results.append((acceptance, gcmc.N, gcmc.Nmean))
+    # The Markov chain is fully determined by the seed and does not depend on
+    # how often the trials are timed
+    (acc0, N0, Nmean0), (acc1, N1, Nmean1) = results
+    assert N0 == N1
+    assert Nmean0 == Nmean1
+    assert (acc0==acc1).all()
+
+
 def test_gcmc_hdf5writer():
     fn_host = pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk')
     fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_CAU-13_xylene.txt')
@@ -122,3 +163,71 @@ def test_gcmc_hdf5writer():
         assert 'emean' in f['trajectory']
         assert 'N' in f['trajectory']
         assert 'Nmean' in f['trajectory']
+        # The snapshots are stored in one concatenated array
+        snapshots = MCSnapshots(f)
+        assert (snapshots.counter == f['trajectory/counter'][-len(snapshots):]).all()
+        assert snapshots.natom[-1] == gcmc.N*gcmc.guest.natom
+        assert snapshots.offset[-1] + snapshots.natom[-1] == f['snapshots/pos'].shape[0]
+        assert (snapshots.get_pos(-1) == gcmc.current_configuration.pos).all()
+        system = snapshots[-1]
+        assert system.natom == gcmc.N*gcmc.guest.natom
+        assert (system.numbers == np.tile(gcmc.guest.numbers, gcmc.N)).all()
+        for k, (counter, pos, rvecs) in enumerate(snapshots.iter_pos(block_size=3)):
+            assert counter == snapshots.counter[k]
+            assert (pos == snapshots.get_pos(k)).all()
+            assert (rvecs == snapshots.get_rvecs(k)).all()
+        assert len(list(snapshots)) == len(snapshots)
+
+
+def test_gcmc_hdf5writer_buffered():
+    fn_host = pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk')
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_CAU-13_xylene.txt')
+    fn_guest = pkg_resources.resource_filename(__name__, '../../data/test/xylene.chk')
+    with h5.File('yaff.sampling.test.test_mc.test_gcmc_hdf5writer_ref.h5', driver='core', backing_store=False) as fref, \
+         h5.File('yaff.sampling.test.test_mc.test_gcmc_hdf5writer_buffered.h5', driver='core', backing_store=False) as f:
+        hdf5s = [MCHDF5Writer(fref), MCHDF5Writer(f, buffer_size=4, queue_size=2)]
+        gcmc = GCMC.from_files(fn_guest, fn_pars, host=fn_host, hooks=hdf5s)
+        gcmc.set_external_conditions(200*kelvin, 1000*bar)
+        np.random.seed(2)
+        gcmc.run(10, mc_moves={'insertion':1.0, 'deletion':0.2})
+        for key in 'counter', 'offset', 'natom', 'rvecs', 'pos':
+            assert (f['snapshots'][key][:] == fref['snapshots'][key][:]).all()
+
+
+def test_mc_snapshots_old_layout():
+    fn_guest = pkg_resources.resource_filename(__name__, '../../data/test/xylene.chk')
+    guest = System.from_file(fn_guest)
+    with h5.File('yaff.sampling.test.test_mc.test_mc_snapshots_old_layout.h5', driver='core', backing_store=False) as f:
+        for counter in 10, 20:
+            guest.to_hdf5(f.create_group('snapshots/%012d' % counter))
+        snapshots = MCSnapshots(f)
+        assert len(snapshots) == 2
+        assert (snapshots.counter == [10, 20]).all()
+        assert (snapshots.get_pos(1) == guest.pos).all()
+        assert snapshots[0].natom == guest.natom
+        assert [counter for counter, pos, rvecs in snapshots.iter_pos()] == [10, 20]
+        # The old layout can not be extended
+        gcmc = GCMC.from_files(fn_guest, pkg_resources.resource_filename(__name__,
+            '../../data/test/parameters_CAU-13_xylene.txt'),
+            host=pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk'),
+            hooks=MCHDF5Writer(f))
+        gcmc.set_external_conditions(200*kelvin, 1000*bar)
+        with assert_raises(ValueError):
+            gcmc.run(1)
+
+
+def test_gcmc_grid():
+    fn_host = pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk')
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_CAU-13_xylene.txt')
+    fn_guest = pkg_resources.resource_filename(__name__, '../../data/test/xylene.chk')
+    gcmc = GCMC.from_files(fn_guest, fn_pars, host=fn_host,
+        grid_spacing=4.0*angstrom)
+    extpot = gcmc.external_potential
+    assert extpot.system.natom == gcmc.guest.natom
+    assert isinstance(extpot.parts[0], ForcePartGrid)
+    assert extpot.parts[0].interpolation == 'cubic'
+    gcmc.set_external_conditions(200*kelvin, 1000*bar)
+    np.random.seed(3)
+    acceptance = gcmc.run(50, mc_moves={'insertion':1.0, 'deletion':1.0})
+    assert acceptance[:,1].sum() == 50
+    assert np.isfinite(gcmc.energy)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+from __future__ import division
+
+import numpy as np
+import pkg_resources
+from nose.tools import assert_raises
+
+from yaff import *
+from molmod.units import angstrom, bar, kelvin
+
+from yaff.sampling.test.test_mc import setup_gcmc_lj
+
+
+def get_gcmc_cau13():
+    fn_host = pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk')
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_CAU-13_xylene.txt')
+    fn_guest = pkg_resources.resource_filename(__name__, '../../data/test/xylene.chk')
+    return GCMC.from_files(fn_guest, fn_pars, host=fn_host, rcut=8*angstrom)
+
+
+def check_interaction(interaction, ff, nmol):
+    e, dmin = interaction.compute(ff, nmol)
+    ff.update_pos(ff.system.pos)
+    eref = ff.compute_energy()
+    assert abs(e - eref) < 1e-10*max(1.0, abs(eref))
+    # The shortest distance of the molecule to all atoms in the bins
+    if interaction.natom > 0:
+        distances = np.zeros(interaction.natom*nmol)
+        ff.system.cell.compute_distances(distances, ff.system.pos[-nmol:],
+            pos1=ff.system.pos[:interaction.natom])
+        dref = min(distances.min(), interaction.rcut)
+    else:
+        dref = interaction.rcut
+    assert abs(dmin - dref) < 1e-10
+
+
+def test_mcinteraction_guests():
+    gcmc = get_gcmc_cau13()
+    guest = gcmc.guest
+    natom = guest.natom
+    ff = gcmc.get_ff(4)
+    gcmc.guest_ff.set_pos(np.concatenate([random_insertion(guest) for iguest in range(4)]))
+    interaction = MCInteraction(ff.system.cell, ff.nlist.rcut)
+    # Only the other guests are in the bins.
+    interaction.reset(ff.system.pos, 3*natom)
+    check_interaction(interaction, ff, natom)
+    # Moving the last guest does not require an update of the bins.
+    ff.system.pos[-natom:] = random_insertion(guest)
+    check_interaction(interaction, ff, natom)
+    # Swap the first and the last guest
+    pos = ff.system.pos.copy()
+    ff.system.pos[:natom] = pos[-natom:]
+    ff.system.pos[-natom:] = pos[:natom]
+    interaction.move(ff.system.pos, 0, natom)
+    check_interaction(interaction, ff, natom)
+    # Remove one of the other guests
+    interaction.remove(2*natom, 3*natom)
+    ff = gcmc.get_ff(3)
+    check_interaction(interaction, ff, natom)
+    # Add two guests
+    ff = gcmc.get_ff(5)
+    ff.system.pos[2*natom:4*natom] = np.concatenate([random_insertion(guest), random_insertion(guest)])
+    interaction.add(ff.system.pos, 2*natom, 4*natom)
+    check_interaction(interaction, ff, natom)
+    assert interaction.natom == 4*natom
+    with assert_raises(AssertionError):
+        interaction.add(ff.system.pos, 0, natom)
+
+
+def test_mcinteraction_host():
+    gcmc = get_gcmc_cau13()
+    guest = gcmc.guest
+    extpot = gcmc.external_potential
+    nhost = extpot.system.natom - guest.natom
+    interaction = MCInteraction(extpot.system.cell, extpot.nlist.rcut)
+    interaction.reset(extpot.system.pos, nhost)
+    for irep in range(5):
+        extpot.system.pos[-guest.natom:] = random_insertion(guest)
+        check_interaction(interaction, extpot, guest.natom)
+
+
+def test_mcinteraction_close_contact():
+    gcmc = get_gcmc_cau13()
+    guest = gcmc.guest
+    extpot = gcmc.external_potential
+    nhost = extpot.system.natom - guest.natom
+    interaction = MCInteraction(extpot.system.cell, extpot.nlist.rcut)
+    interaction.reset(extpot.system.pos, nhost)
+    # Put a guest atom close to the first host atom
+    extpot.system.pos[-guest.natom:] = guest.pos - guest.pos[0] + extpot.system.pos[0]
+    extpot.system.pos[-guest.natom:,0] += 0.3*angstrom
+    e, dmin = interaction.compute(extpot, guest.natom, 0.4*angstrom)
+    assert e is None
+    assert abs(dmin - 0.3*angstrom) < 1e-10
+
+
+def test_mcinteraction_errors():
+    gcmc = get_gcmc_cau13()
+    with assert_raises(ValueError):
+        MCInteraction(Cell(np.identity(3)[:2]*10*angstrom), 5*angstrom)
+    # The cutoff of the neighbor search is too short for the pair potentials.
+    ff = gcmc.get_ff(2)
+    interaction = MCInteraction(ff.system.cell, ff.nlist.rcut/2)
+    interaction.reset(ff.system.pos, gcmc.guest.natom)
+    with assert_raises(ValueError):
+        interaction.compute(ff, gcmc.guest.natom)
+
+
+def test_mcinteraction_gcmc_bins():
+    # After a simulation, the bins must contain the atoms of the current
+    # configuration.
+    gcmc = setup_gcmc_lj(15*angstrom)
+    gcmc.set_external_conditions(150*kelvin, 200*bar)
+    np.random.seed(1)
+    gcmc.run(2000)
+    assert gcmc.N > 10
+    interaction = gcmc.guest_interaction
+    nother = gcmc.N - 1
+    assert interaction.natom == nother
+    ref = MCInteraction(interaction.cell, interaction.rcut)
+    system = gcmc.current_configuration
+    ref.reset(system.pos, nother)
+    assert (interaction.atom_ibins[:nother] == ref.atom_ibins[:nother]).all()
+    assert (interaction.atom_shifts[:nother] == ref.atom_shifts[:nother]).all()
+    for ibin in range(len(ref.bin_head)):
+        atoms = set()
+        iatom = interaction.bin_head[ibin]
+        while iatom >= 0:
+            atoms.add(iatom)
+            iatom = interaction.atom_next[iatom]
+        assert atoms == set((ref.atom_ibins[:nother] == ibin).nonzero()[0])
+    # The energy is the sum of all accepted energy differences.
+    ff = gcmc.get_ff(gcmc.N)
+    nlist = NeighborList(system)
+    part_pair = ForcePartPair(system, nlist, Scalings(system), ff.part_pair_lj.pair_pot)
+    ffref = ForceField(system, [part_pair], nlist)
+    assert abs(ffref.compute_energy() - gcmc.energy) < 1e-8
+
+
+def test_host_occupancy():
+    gcmc = get_gcmc_cau13()
+    nhost = gcmc.external_potential.system.natom - gcmc.guest.natom
+    host_pos = gcmc.external_potential.system.pos[:nhost]
+    cell = gcmc.guest.cell
+    radius = 1.0*angstrom
+    occupancy = HostOccupancy(cell, host_pos, radius, spacing=0.2*angstrom)
+    assert (occupancy.bitmap == HostOccupancy.blocked).any()
+    np.random.seed(2)
+    pos = np.dot(np.random.uniform(0, 1, (2000, 3)), cell.rvecs)
+    distances = np.zeros(len(pos)*nhost)
+    cell.compute_distances(distances, pos, pos1=host_pos)
+    dmin = distances.reshape(len(pos), nhost).min(axis=1)
+    blocked = occupancy.compute_blocked(pos)
+    # Only positions within the radius are blocked, and all positions that
+    # are sufficiently close to a host atom.
+    assert (dmin[blocked] < radius).all()
+    assert blocked[dmin < radius - 2*occupancy.halfdiag].all()
+    assert occupancy.is_blocked(pos[blocked][:1])
+    assert not occupancy.is_blocked(pos[~blocked][:5])
+
+
+def test_host_occupancy_pockets():
+    cell = Cell(np.identity(3)*10*angstrom)
+    centers = np.array([[0.5, 0.5, 0.5], [0.0, 0.0, 0.95]])
+    radii = np.array([2.0, 1.5])*angstrom
+    occupancy = HostOccupancy(cell, np.zeros((0, 3)), 0.0, pockets=(centers, radii))
+    np.random.seed(3)
+    frac = np.random.uniform(0, 1, (5000, 3))
+    delta = frac[:,None,:] - centers
+    delta -= np.round(delta)
+    distances = np.sqrt((np.dot(delta, cell.rvecs)**2).sum(axis=2))
+    # Positions inside the pockets are blocked exactly
+    assert (occupancy.compute_blocked(np.dot(frac, cell.rvecs)) ==
+            (distances < radii).any(axis=1)).all()
+
+
+def test_host_occupancy_gcmc():
+    # With a radius equal to the close-contact distance, the bitmap only
+    # rejects trials that are rejected anyway.
+    results = []
+    for occupancy_radius in None, 0.4*angstrom:
+        gcmc = get_gcmc_cau13()
+        if occupancy_radius is not None:
+            nhost = gcmc.external_potential.system.natom - gcmc.guest.natom
+            gcmc.host_occupancy = HostOccupancy(gcmc.guest.cell,
+                gcmc.external_potential.system.pos[:nhost], occupancy_radius)
+        gcmc.set_external_conditions(300*kelvin, 10*bar)
+        acceptance = gcmc.run(100, mc_moves={'insertion':1.0, 'deletion':1.0,
+            'translation':1.0}, close_contact=0.4*angstrom, seed=1)
+        results.append((acceptance, gcmc.N, gcmc.energy))
+    (acc0, N0, e0), (acc1, N1, e1) = results
+    assert (acc0 == acc1).all()
+    assert N0 == N1
+    assert abs(e0 - e1) < 1e-8*max(1.0, abs(e0))
+
+
+def test_gcmcforcefield_energy():
+    fn_host = pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk')
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_CAU-13_xylene.txt')
+    fn_guest = pkg_resources.resource_filename(__name__, '../../data/test/xylene.chk')
+    kwargs = dict(rcut=8*angstrom, tailcorrections=True, reci_ei='ewald')
+    gcmc = GCMC.from_files(fn_guest, fn_pars, host=fn_host, nguests=3, **kwargs)
+    guest_ff = gcmc.guest_ff
+    guest = gcmc.guest
+    np.random.seed(2)
+    # The force field is generated again when the capacity is exceeded.
+    for nguest, capacity in (1, 3), (3, 3), (2, 3), (5, 6), (4, 6):
+        ff = gcmc.get_ff(nguest)
+        assert guest_ff.nguest == nguest
+        assert guest_ff.capacity == capacity
+        pos = np.concatenate([random_insertion(guest) for iguest in range(nguest)])
+        guest_ff.set_pos(pos)
+        ff.update_pos(ff.system.pos)
+        e = ff.compute_energy()
+        # Compare with a force field for a System with only these guests
+        system = guest_ff.get_system()
+        assert system.natom == nguest*guest.natom
+        assert abs(system.pos - pos).max() < 1e-15
+        nlow = (nguest-1)*guest.natom
+        ffref = ForceField.generate(system, fn_pars, nlow=nlow, nhigh=nlow, **kwargs)
+        eref = ffref.compute_energy()
+        assert abs(e - eref) < 1e-10*max(1.0, abs(eref))
+    assert gcmc.get_ff(0).system.natom == 6*guest.natom
+    assert guest_ff.get_system().natom == 0
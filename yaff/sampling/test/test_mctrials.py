@@ -36,7 +36,7 @@ from molmod.constants import boltzmann
 def check_insertion_energy(gcmc, fn_host, fn_pars, fn_guest):
     trial = TrialInsertion(gcmc)
     e = trial.compute()
-    system0 = System.from_file(fn_host).merge(trial.mc.get_ff(trial.mc.N).system)
+    system0 = System.from_file(fn_host).merge(trial.mc.current_configuration)
     ff0 = ForceField.generate(system0, fn_pars)
     system1 = system0.subsystem(np.arange(system0.natom-gcmc.guest.natom))
     ff1 = ForceField.generate(system1, fn_pars)
@@ -50,7 +50,7 @@ def check_insertion_energy(gcmc, fn_host, fn_pars, fn_guest):
 def check_deletion_energy(gcmc, fn_host, fn_pars, fn_guest):
     trial = TrialDeletion(gcmc)
     e = trial.compute()
-    system0 = System.from_file(fn_host).merge(trial.mc.get_ff(trial.mc.N).system)
+    system0 = System.from_file(fn_host).merge(trial.mc.current_configuration)
     ff0 = ForceField.generate(system0, fn_pars)
     system1 = system0.subsystem(np.arange(system0.natom-gcmc.guest.natom))
     ff1 = ForceField.generate(system1, fn_pars)
@@ -64,7 +64,7 @@ def check_deletion_energy(gcmc, fn_host, fn_pars, fn_guest):
 def check_translation_energy(gcmc, fn_host, fn_pars, fn_guest):
     trial = TrialTranslation(gcmc)
     e = trial.compute()
-    system0 = System.from_file(fn_host).merge(trial.mc.get_ff(trial.mc.N).system)
+    system0 = System.from_file(fn_host).merge(trial.mc.current_configuration)
     ff0 = ForceField.generate(system0, fn_pars)
     e0 = ff0.compute()
     system0.pos[-gcmc.guest.natom:] = trial.oldpos
@@ -79,7 +79,7 @@ def check_rotation_energy(gcmc, fn_host, fn_pars, fn_guest):
     trial = TrialRotation(gcmc)
     e = trial.compute()
     # Host and guests after rotation
-    system0 = System.from_file(fn_host).merge(trial.mc.get_ff(trial.mc.N).system)
+    system0 = System.from_file(fn_host).merge(trial.mc.current_configuration)
     ff0 = ForceField.generate(system0, fn_pars)
     # One single guest, in a periodic box
     system2 = system0.subsystem(np.arange(system0.natom-gcmc.guest.natom,system0.natom))
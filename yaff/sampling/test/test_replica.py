@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+from __future__ import division
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import h5py as h5
+from nose.tools import assert_raises
+
+from yaff import *
+from molmod.units import angstrom, bar, kelvin
+from molmod.constants import boltzmann
+
+from yaff.sampling.test.test_mc import setup_gcmc_lj
+
+
+def get_replicas(conditions):
+    replicas = []
+    for T, fugacity in conditions:
+        gcmc = setup_gcmc_lj(20.0*angstrom)
+        gcmc.set_external_conditions(T, fugacity)
+        replicas.append(gcmc)
+    return replicas
+
+
+def test_replica_gcmc_lj():
+    conditions = [(180*kelvin, 5*bar), (200*kelvin, 10*bar), (220*kelvin, 20*bar)]
+    # The results do not depend on the number of processes
+    results = []
+    for nproc in 1, 2:
+        remc = ReplicaExchangeMC(get_replicas(conditions))
+        remc.run(6, 200, nproc=nproc, seed=1)
+        assert remc.ncycle == 6
+        assert (remc.counters == 1200).all()
+        assert (remc.acceptance[:,:,1].sum(axis=1) == 1200).all()
+        # Swaps alternate between the even and the odd pairs
+        assert (remc.swaps[:,1] == 3).all()
+        results.append((remc.nguests.copy(), remc.energies.copy(), remc.Nmeans.copy()))
+    for result0, result1 in zip(*results):
+        assert abs(result0 - result1).max() < 1e-8
+    # Continue the run, the energies are consistent with the positions
+    remc.run(2, 100, nproc=2, seed=2)
+    assert (remc.counters == 1400).all()
+    for ireplica, replica in enumerate(remc.replicas):
+        pos = remc.positions[ireplica]
+        assert len(pos) == remc.nguests[ireplica]
+        if len(pos) > 1:
+            system = System(np.full(len(pos), 18), pos,
+                rvecs=replica.guest.cell.rvecs, bonds=np.zeros((0, 2), int))
+            sigma = 3.4*angstrom
+            pair_pot = PairPotLJ(np.full(len(pos), sigma),
+                np.full(len(pos), 120.0*boltzmann), 2.5*sigma, None)
+            nlist = NeighborList(system)
+            ff = ForceField(system, [ForcePartPair(system, nlist,
+                Scalings(system), pair_pot)], nlist=nlist)
+            e = ff.compute_energy()
+            assert abs(e - remc.energies[ireplica]) < 1e-8*max(1.0, abs(e))
+
+
+def test_replica_swaps():
+    # With identical conditions, all swaps are accepted
+    conditions = [(200*kelvin, 10*bar)]*4
+    remc = ReplicaExchangeMC(get_replicas(conditions))
+    remc.run(4, 100, seed=3)
+    assert (remc.swaps[:,0] == remc.swaps[:,1]).all()
+    assert remc.swaps[:,1].sum() == 6
+    # Without swaps, nothing is tried
+    remc = ReplicaExchangeMC(get_replicas(conditions))
+    remc.run(4, 100, swap=False, seed=3)
+    assert (remc.swaps == 0).all()
+
+
+def test_replica_hdf5():
+    conditions = [(200*kelvin, 10*bar), (220*kelvin, 10*bar)]
+    remc = ReplicaExchangeMC(get_replicas(conditions))
+    dn = tempfile.mkdtemp('yaff', 'test_replica_hdf5')
+    try:
+        fn_h5 = os.path.join(dn, 'replica_%03i.h5')
+        remc.run(3, 50, nproc=2, seed=4, fn_h5=fn_h5, h5_step=10)
+        remc.run(1, 50, nproc=1, seed=5, fn_h5=fn_h5, h5_step=10)
+        for ireplica in range(2):
+            with h5.File(fn_h5 % ireplica, 'r') as f:
+                counter = f['trajectory/counter'][:]
+                assert (counter == np.arange(0, 201, 10)).all()
+                assert 'N' in f['trajectory']
+                assert MCSnapshots(f).counter[-1] == 200
+        # The writers are removed from the hooks after the run
+        assert all(len(replica.hooks) == 0 for replica in remc.replicas)
+    finally:
+        shutil.rmtree(dn)
+
+
+def test_replica_errors():
+    with assert_raises(ValueError):
+        ReplicaExchangeMC([])
+    gcmc = setup_gcmc_lj(20.0*angstrom)
+    with assert_raises(ValueError):
+        ReplicaExchangeMC([gcmc])
+    # Hooks cannot be shared by the replicas
+    with assert_raises(ValueError):
+        ReplicaExchangeMC.from_files(None, None, [], hooks=[MCScreenLog()])
+    # Errors in a worker process are raised with the traceback of the worker
+    conditions = [(200*kelvin, 10*bar), (220*kelvin, 10*bar)]
+    remc = ReplicaExchangeMC(get_replicas(conditions))
+    try:
+        remc.run(1, 10, nproc=2, seed=6, mc_moves={'foo': 1.0})
+    except ValueError as e:
+        assert 'Traceback' in str(e.__cause__)
+        assert 'Trial move foo not allowed!' in str(e.__cause__)
+    else:
+        raise AssertionError('The error of the worker was not raised.')
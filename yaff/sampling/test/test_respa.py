@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+from __future__ import division
+
+from nose.tools import assert_raises
+import h5py as h5
+import numpy as np
+
+from yaff import *
+from yaff.sampling.test.common import get_ff_water32
+from yaff.sampling.test.test_verlet import check_hdf5_common
+
+
+# All parts but the smooth reciprocal Ewald sum
+fast_water32 = ['valence', 'pair_ei', 'ewald_cor', 'ewald_neut', 'pair_dampdisp', 'pair_exprep']
+
+
+def run_water32(cls, nstep, **kwargs):
+    np.random.seed(3)
+    md = cls(get_ff_water32(), temp0=300, **kwargs)
+    md.run(nstep)
+    return md
+
+
+def test_respa_basic_water32():
+    respa = RESPAIntegrator(get_ff_water32(), 2.0*femtosecond, nsub=4)
+    assert [part.name for part in respa.ff_fast.parts] == ['valence']
+    assert len(respa.ff_slow.parts) == len(respa.ff.parts) - 1
+    assert respa.ff_fast.nlist is None
+    assert respa.ff_slow.nlist is respa.ff.nlist
+    respa.run(5)
+    assert respa.counter == 5
+    assert abs(respa.time - 10.0*femtosecond) < 1e-10
+    # The results of the complete force field are stored.
+    ff = respa.ff
+    gpos = np.zeros(respa.pos.shape)
+    vtens = np.zeros((3, 3))
+    ff.update_pos(respa.pos)
+    epot = ff.compute(gpos, vtens)
+    assert abs(respa.epot - epot) < 1e-10*abs(epot)
+    assert abs(respa.gpos - gpos).max() < 1e-10*abs(gpos).max()
+    assert abs(respa.vtens - vtens).max() < 1e-10*abs(vtens).max()
+
+
+def test_respa_nsub1_verlet():
+    verlet = run_water32(VerletIntegrator, 5, timestep=1.0*femtosecond)
+    respa = run_water32(RESPAIntegrator, 5, timestep=1.0*femtosecond, nsub=1)
+    assert abs(verlet.pos - respa.pos).max() < 1e-10
+    assert abs(verlet.vel - respa.vel).max() < 1e-10
+    assert abs(verlet.econs - respa.econs) < 1e-8
+
+
+def test_respa_inner_timestep():
+    # With smooth slow forces, RESPA is as accurate as Verlet with the inner
+    # time step.
+    ref = run_water32(VerletIntegrator, 20, timestep=0.25*femtosecond)
+    verlet = run_water32(VerletIntegrator, 5, timestep=1.0*femtosecond)
+    respa = run_water32(RESPAIntegrator, 5, timestep=1.0*femtosecond, nsub=4, fast_parts=fast_water32)
+    assert abs(respa.time - ref.time) < 1e-10
+    assert abs(respa.pos - ref.pos).max() < 1e-2*abs(verlet.pos - ref.pos).max()
+    assert abs(respa.econs - ref.econs) < 1e-2*abs(verlet.econs - ref.econs)
+
+
+def test_respa_slow_evaluations():
+    respa = RESPAIntegrator(get_ff_water32(), 2.0*femtosecond, nsub=4)
+    counts = {'fast': 0, 'slow': 0}
+    def wrap(ff, key):
+        compute = ff.compute
+        def counted_compute(*args, **kwargs):
+            counts[key] += 1
+            return compute(*args, **kwargs)
+        ff.compute = counted_compute
+    wrap(respa.ff_fast, 'fast')
+    wrap(respa.ff_slow, 'slow')
+    respa.run(3)
+    assert counts == {'fast': 12, 'slow': 3}
+
+
+def test_respa_parts():
+    ff = get_ff_water32()
+    respa = RESPAIntegrator(ff, 1.0*femtosecond, fast_parts=[ff.part_valence, 'pair_exprep'])
+    assert respa.ff_fast.parts == [ff.part_valence, ff.part_pair_exprep]
+    assert respa.ff_fast.nlist is ff.nlist
+    assert ff.part_valence not in respa.ff_slow.parts
+    assert ff.part_pair_exprep not in respa.ff_slow.parts
+    with assert_raises(ValueError):
+        RESPAIntegrator(ff, 1.0*femtosecond, fast_parts=['foo'])
+    with assert_raises(ValueError):
+        RESPAIntegrator(ff, 1.0*femtosecond, fast_parts=[get_ff_water32().part_valence])
+    with assert_raises(ValueError):
+        RESPAIntegrator(ff, 1.0*femtosecond, nsub=0)
+
+
+def test_respa_hdf5():
+    with h5.File('yaff.sampling.test.test_respa.test_respa_hdf5.h5', driver='core', backing_store=False) as f:
+        hdf5 = HDF5Writer(f)
+        respa = RESPAIntegrator(get_ff_water32(), 2.0*femtosecond, nsub=4, hooks=hdf5)
+        respa.run(5)
+        check_hdf5_common(hdf5.f)
+        assert np.isfinite(f['trajectory/econs'][:]).all()
+        assert abs(f['trajectory/epot_contribs'][-1].sum() - f['trajectory/epot'][-1]) < 1e-8
+
+
+def test_respa_nvt():
+    thermo = NHCThermostat(300, timecon=20*femtosecond)
+    respa = RESPAIntegrator(get_ff_water32(), 1.0*femtosecond, nsub=2, hooks=thermo, fast_parts=fast_water32)
+    respa.run(5)
+    assert respa.counter == 5
+    # The thermostat contributes to the conserved quantity.
+    assert thermo.econs_correction != 0.0
+    assert abs(respa.econs - respa.etot - thermo.econs_correction) < 1e-10
+
+
+def test_respa_npt():
+    ff = get_ff_water32()
+    thermo = NHCThermostat(300, timecon=20*femtosecond)
+    baro = MTKBarostat(ff, 300, 1*bar, timecon=200*femtosecond)
+    respa = RESPAIntegrator(ff, 1.0*femtosecond, nsub=2,
+        hooks=TBCombination(thermo, baro), fast_parts=fast_water32)
+    rvecs0 = respa.ff.system.cell.rvecs.copy()
+    respa.run(5)
+    assert respa.counter == 5
+    assert (respa.ff.system.cell.rvecs != rvecs0).any()
+    # After a change of the cell, the forces are consistent with the new
+    # positions.
+    gpos = np.zeros(respa.pos.shape)
+    respa.ff.update_pos(respa.pos)
+    epot = respa.ff.compute(gpos)
+    assert abs(respa.epot - epot) < 1e-8*abs(epot)
+    assert abs(respa.gpos - gpos).max() < 1e-8*abs(gpos).max()
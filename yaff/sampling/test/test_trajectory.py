@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+from __future__ import division
+
+import os
+
+import h5py as h5
+import numpy as np
+from nose.tools import assert_raises
+
+from yaff import *
+from yaff.sampling.test.common import get_ff_water32
+from molmod.test.common import tmpdir
+
+
+class EnergyHook(Hook):
+    def __init__(self):
+        Hook.__init__(self)
+        self.frames = []
+        self.energies = []
+
+    def __call__(self, iterative):
+        self.frames.append(iterative.frame)
+        self.energies.append(iterative.epot)
+
+
+def write_reference(dn):
+    fn_h5 = os.path.join(dn, 'traj.h5')
+    with h5.File(fn_h5, mode='w') as f:
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond,
+            hooks=HDF5Writer(f))
+        nve.run(9)
+    return fn_h5
+
+
+def test_ref_trajectory():
+    with tmpdir(__name__, 'test_ref_trajectory') as dn:
+        fn_h5 = write_reference(dn)
+        with h5.File(fn_h5, mode='r') as f:
+            epot = f['trajectory/epot'][:]
+        hook = EnergyHook()
+        ref = RefTrajectory(get_ff_water32(), fn_h5, hooks=hook, block_size=4)
+        assert ref.nframes == 10
+        ref.run()
+        assert ref.counter == 10
+        assert hook.frames == list(range(10))
+        assert abs(np.array(hook.energies) - epot).max() < 1e-10
+
+
+def test_ref_trajectory_slice():
+    with tmpdir(__name__, 'test_ref_trajectory_slice') as dn:
+        fn_h5 = write_reference(dn)
+        with h5.File(fn_h5, mode='r') as f:
+            epot = f['trajectory/epot'][:]
+        hook = EnergyHook()
+        ref = RefTrajectory(get_ff_water32(), fn_h5, hooks=hook, start=1,
+            end=-1, step=3, block_size=2, prefetch=1)
+        # Run in two parts, the second continues where the first stopped.
+        ref.run(2)
+        assert hook.frames == [1, 4]
+        ref.run()
+        assert hook.frames == [1, 4, 7]
+        assert ref.counter == 3
+        assert abs(np.array(hook.energies) - epot[1::3]).max() < 1e-10
+        with assert_raises(ValueError):
+            RefTrajectory(get_ff_water32(), fn_h5, step=0)
+
+
+def test_ref_trajectory_counter0():
+    with tmpdir(__name__, 'test_ref_trajectory_counter0') as dn:
+        fn_h5 = write_reference(dn)
+        # By default, counter0 is also the first frame.
+        hook = EnergyHook()
+        ref = RefTrajectory(get_ff_water32(), fn_h5, hooks=hook, counter0=6)
+        ref.run()
+        assert hook.frames == [6, 7, 8, 9]
+        assert ref.counter == 10
+        # An explicit start overrides this.
+        hook = EnergyHook()
+        ref = RefTrajectory(get_ff_water32(), fn_h5, hooks=hook, counter0=6,
+            start=0, end=2)
+        ref.run()
+        assert hook.frames == [0, 1]
+        assert ref.counter == 8
+
+
+def test_ref_trajectory_parallel():
+    with tmpdir(__name__, 'test_ref_trajectory_parallel') as dn:
+        fn_h5 = write_reference(dn)
+        hooks = [EnergyHook(), EnergyHook()]
+        RefTrajectory(get_ff_water32(), fn_h5, hooks=hooks[0]).run()
+        with h5.File('yaff.sampling.test.test_trajectory.test_ref_trajectory_parallel.h5',
+                     driver='core', backing_store=False) as f:
+            ref = RefTrajectory(get_ff_water32(), fn_h5,
+                hooks=[hooks[1], HDF5Writer(f)], block_size=3, nproc=2)
+            ref.run()
+            # The hooks are called in the order of the frames and the
+            # contributions to the energy are also available.
+            assert hooks[1].frames == list(range(10))
+            assert abs(np.array(hooks[1].energies) - hooks[0].energies).max() < 1e-10
+            assert abs(f['trajectory/epot_contribs'][:].sum(axis=1) - f['trajectory/epot'][:]).max() < 1e-10
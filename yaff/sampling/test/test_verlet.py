@@ -30,9 +30,10 @@ import os
 import pkg_resources
 import h5py as h5
 import numpy as np
+from nose.tools import assert_raises
 
 from yaff import *
-from yaff.test.common import get_system_water
+from yaff.test.common import get_system_water, get_system_water32
 from yaff.sampling.test.common import get_ff_water32, get_ff_water
 from molmod.test.common import tmpdir
 
@@ -109,6 +110,114 @@ def test_hdf5_step():
         assert f['trajectory/counter'][2] == 4
 
 
+def test_hdf5_buffered():
+    with h5.File('yaff.sampling.test.test_verlet.test_hdf5_buffered_ref.h5', driver='core', backing_store=False) as fref, \
+         h5.File('yaff.sampling.test.test_verlet.test_hdf5_buffered.h5', driver='core', backing_store=False) as f:
+        hdf5_ref = HDF5Writer(fref)
+        hdf5 = HDF5Writer(f, buffer_size=4, compression='gzip', shuffle=True,
+            single_precision=True)
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, hooks=[hdf5_ref, hdf5])
+        nve.run(15)
+        # The last frames are written at the end of the run
+        assert hdf5.frames == []
+        check_hdf5_common(hdf5.f)
+        assert get_last_trajectory_row(f['trajectory']) == 16
+        assert f['trajectory/pos'].chunks[0] == 4
+        assert f['trajectory/pos'].compression == 'gzip'
+        assert f['trajectory/pos'].dtype == np.float32
+        assert f['trajectory/epot'].dtype == fref['trajectory/epot'].dtype
+        for key in fref['trajectory']:
+            if key in ['pos', 'vel', 'gpos']:
+                assert abs(f['trajectory'][key][:] - fref['trajectory'][key][:]).max() < \
+                    1e-6*abs(fref['trajectory'][key][:]).max()
+            else:
+                assert (f['trajectory'][key][:] == fref['trajectory'][key][:]).all()
+
+
+def test_hdf5_buffered_partial():
+    with h5.File('yaff.sampling.test.test_verlet.test_hdf5_buffered_partial.h5', driver='core', backing_store=False) as f:
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, hooks=HDF5Writer(f))
+        nve.run(4)
+        # Mimic an interrupted write of the last frame
+        f['trajectory/counter'].resize(6, axis=0)
+        hdf5 = HDF5Writer(f, buffer_size=3)
+        nve = VerletIntegrator(nve.ff, 1.0*femtosecond, hooks=hdf5, counter0=10)
+        # The first frame is still in memory
+        assert f['trajectory/counter'].shape[0] == 6
+        assert len(hdf5.frames) == 1
+        nve.run(2)
+        assert get_last_trajectory_row(f['trajectory']) == 8
+        assert (f['trajectory/counter'][:] == [0, 1, 2, 3, 4, 10, 11, 12]).all()
+
+
+def test_hdf5_buffered_missing():
+    with h5.File('yaff.sampling.test.test_verlet.test_hdf5_buffered_missing.h5', driver='core', backing_store=False) as f:
+        tgrp = f.create_group('trajectory')
+        for key in 'counter', 'epot':
+            tgrp.create_dataset(key, (0,), maxshape=(None,), dtype=float)
+        hdf5 = HDF5Writer(f, buffer_size=3)
+        hdf5.keys = ['counter', 'epot']
+        # A key without a value in some frames does not shift the rows of
+        # later frames.
+        hdf5.write([('counter', 0.0), ('epot', 1.0)])
+        hdf5.write([('counter', 1.0)])
+        hdf5.write([('counter', 2.0), ('epot', 3.0)])
+        hdf5.write([('counter', 3.0)])
+        hdf5.write_pending()
+        assert (tgrp['counter'][:] == [0.0, 1.0, 2.0, 3.0]).all()
+        assert (tgrp['epot'][:] == [1.0, 0.0, 3.0, 0.0]).all()
+
+
+def test_hdf5_async():
+    with h5.File('yaff.sampling.test.test_verlet.test_hdf5_async_ref.h5', driver='core', backing_store=False) as fref, \
+         h5.File('yaff.sampling.test.test_verlet.test_hdf5_async.h5', driver='core', backing_store=False) as f:
+        hdf5_ref = HDF5Writer(fref)
+        hdf5 = HDF5Writer(f, queue_size=3, buffer_size=2)
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, hooks=[hdf5_ref, hdf5])
+        nve.run(15)
+        # All frames are written at the end of the run
+        check_hdf5_common(hdf5.f)
+        assert get_last_trajectory_row(f['trajectory']) == 16
+        for key in fref['trajectory']:
+            assert (f['trajectory'][key][:] == fref['trajectory'][key][:]).all()
+
+
+class FailingWriter(AsyncWriter):
+    def snapshot(self, iterative):
+        return iterative.counter
+
+    def write(self, counter):
+        if counter == 2:
+            raise IOError('Disk full')
+
+
+def test_async_error():
+    nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond,
+        hooks=FailingWriter(queue_size=2))
+    # The error of the background thread is raised in the main thread, at
+    # the latest at the end of the run.
+    with assert_raises(IOError):
+        nve.run(5)
+    # The background thread is stopped at the end of the run.
+    assert nve.hooks[0]._thread is None
+
+
+class FailingIntegrator(VerletIntegrator):
+    def propagate(self):
+        # The failed write of counter 2 is only reported by flush.
+        if self.counter == 2:
+            raise ValueError('Unstable')
+        return VerletIntegrator.propagate(self)
+
+
+def test_async_error_during_run():
+    # An error while flushing the output does not hide the error of the run.
+    nve = FailingIntegrator(get_ff_water32(), 1.0*femtosecond,
+        hooks=[FailingWriter(queue_size=2)])
+    with assert_raises(ValueError):
+        nve.run(5)
+
+
 def test_hdf5_simple():
     # This test does not write all possible outputs
     sys = get_system_water()
@@ -165,6 +274,41 @@ def test_hdf5_cvs():
         assert 'cv_names' in f['trajectory'].attrs
 
 
+def test_hdf5_nlist_stats():
+    ff = get_ff_water32()
+    with h5.File('yaff.sampling.test.test_verlet.test_hdf5_nlist_stats.h5', driver='core', backing_store=False) as f:
+        hdf5 = HDF5Writer(f)
+        nve = VerletIntegrator(ff, 1.0*femtosecond, hooks=hdf5, state=[NeighborListStateItem()])
+        nve.run(5)
+        check_hdf5_common(hdf5.f)
+        stats = f['trajectory/nlist_stats'][:]
+        assert stats.shape == (6, len(ff.nlist.stats_names))
+        names = list(f['trajectory'].attrs['nlist_stats_names'])
+        assert names[0] == b'nrebuild'
+        assert names[1] == b'nrecompute'
+        # One update per step, plus the initial one.
+        assert (stats[:,0] + stats[:,1] == np.arange(1, 7)).all()
+        assert (stats[-1] == ff.nlist.get_stats()).all()
+
+
+def test_hdf5_epot_contribs_multi():
+    system = get_system_water32()
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water.txt')
+    ff = ForceField.generate(system, fn_pars, skin=2, fuse_pairs=True)
+    with h5.File('yaff.sampling.test.test_verlet.test_hdf5_epot_contribs_multi.h5', driver='core', backing_store=False) as f:
+        hdf5 = HDF5Writer(f)
+        nve = VerletIntegrator(ff, 1.0*femtosecond, hooks=hdf5)
+        nve.run(5)
+        check_hdf5_common(hdf5.f)
+        names = list(f['trajectory'].attrs['epot_contrib_names'])
+        assert names == [b'valence', b'pair_ei', b'pair_dampdisp', b'pair_exprep',
+            b'ewald_reci', b'ewald_cor', b'ewald_neut']
+        epot_contribs = f['trajectory/epot_contribs'][:]
+        assert epot_contribs.shape == (6, 7)
+        assert abs(epot_contribs.sum(axis=1) - f['trajectory/epot'][:]).max() < 1e-10
+        assert epot_contribs[-1,1] == ff.part_pair_ei.energy
+
+
 def test_xyz():
     with tmpdir(__name__, 'test_xyz') as dn:
         fn_xyz = os.path.join(dn, 'foobar.xyz')
@@ -195,6 +339,43 @@ def test_xyz_select():
         xyz.xyz_writer._f.close()
 
 
+def test_xyz_async():
+    with tmpdir(__name__, 'test_xyz_async') as dn:
+        fns = [os.path.join(dn, 'sync.xyz'), os.path.join(dn, 'async.xyz')]
+        xyzs = [XYZWriter(fns[0]), XYZWriter(fns[1], queue_size=4)]
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, hooks=list(xyzs))
+        nve.run(15)
+        for xyz in xyzs:
+            xyz.xyz_writer._auto_close = False
+            xyz.xyz_writer._f.close()
+        with open(fns[0]) as f0, open(fns[1]) as f1:
+            assert f0.read() == f1.read()
+
+
+def test_checkpoint():
+    with tmpdir(__name__, 'test_checkpoint') as dn, \
+         h5.File('yaff.sampling.test.test_verlet.test_checkpoint.h5', driver='core', backing_store=False) as fref:
+        fn_ckpt = os.path.join(dn, 'checkpoint.h5')
+        hooks = [NHCThermostat(300), RestartWriter(fref, step=5),
+                 CheckpointWriter(fn_ckpt, step=5)]
+        nvt = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, hooks=hooks)
+        nvt.run(12)
+        # Only the last state is kept, and the temporary file is gone.
+        assert os.listdir(dn) == ['checkpoint.h5']
+        with h5.File(fn_ckpt, 'r') as f:
+            assert (f['system/numbers'][:] == fref['system/numbers'][:]).all()
+            assert f['restart/thermo_name'][()] == fref['restart/thermo_name'][()]
+            for key in fref['trajectory']:
+                assert f['trajectory'][key].shape[0] == 1
+                assert (f['trajectory'][key][-1] == fref['trajectory'][key][-1]).all()
+            assert f['trajectory/counter'][-1] == 10
+            # Restart from the checkpoint
+            nvt = VerletIntegrator(get_ff_water32(), restart_h5=f)
+            assert nvt.counter == 10
+            assert abs(nvt.pos - fref['trajectory/pos'][-1]).max() < 1e-10
+            assert any(isinstance(hook, NHCThermostat) for hook in nvt.hooks)
+
+
 def test_kinetic_annealing():
     nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, hooks=KineticAnnealing())
     nve.run(5)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+from __future__ import division
+
+import numpy as np
+import pkg_resources
+from nose.tools import assert_raises
+
+from yaff import *
+from molmod.units import angstrom, bar, kelvin, kjmol
+from molmod.constants import boltzmann
+
+
+def get_cau13_xylene_files():
+    fn_host = pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk')
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_CAU-13_xylene.txt')
+    fn_guest = pkg_resources.resource_filename(__name__, '../../data/test/xylene.chk')
+    return fn_host, fn_pars, fn_guest
+
+
+def test_widom_ideal():
+    # Without interactions, all Boltzmann factors are one.
+    rvecs = np.diag([10.0, 12.0, 14.0])*angstrom
+    guest = System(np.array([18]), np.zeros((1, 3)), rvecs=rvecs)
+    ff = ForceField(guest, [])
+    widom = WidomInsertion(guest, ff)
+    T = 300*kelvin
+    widom.run(100, T, seed=1, nblock=5, batchsize=10)
+    assert abs(widom.henry - guest.cell.volume/(boltzmann*T)) < 1e-10*widom.henry
+    assert abs(widom.enthalpy + boltzmann*T) < 1e-15
+    assert abs(widom.mu_excess) < 1e-15
+    assert widom.henry_error < 1e-10*widom.henry
+
+
+def test_widom_cau13_energies():
+    # The energies of the insertions are the energies of the GCMC insertion
+    # trials when there are no other guests.
+    fn_host, fn_pars, fn_guest = get_cau13_xylene_files()
+    gcmc = GCMC.from_files(fn_guest, fn_pars, host=fn_host, rcut=8*angstrom)
+    gcmc.set_external_conditions(300*kelvin, 1*bar)
+    gcmc.run(0)
+    widom = WidomInsertion(gcmc.guest, gcmc.external_potential)
+    trial = TrialInsertion(gcmc)
+    natom = gcmc.guest.natom
+    np.random.seed(1)
+    for irep in range(5):
+        eref = trial.compute()
+        pos = gcmc.get_ff(1).system.pos[-natom:].copy()
+        trial.reject()
+        e = widom.compute_energies(pos[None])[0]
+        if eref > 1e9:
+            assert e == np.inf
+        else:
+            assert abs(e - eref) < 1e-10*max(1.0, abs(eref))
+
+
+def test_widom_cau13_reproducible():
+    fn_host, fn_pars, fn_guest = get_cau13_xylene_files()
+    widom = WidomInsertion.from_files(fn_guest, fn_pars, fn_host, rcut=8*angstrom)
+    results = []
+    for seed, nproc in (3, 1), (3, 2), (4, 1):
+        widom.run(60, 300*kelvin, seed=seed, nblock=3, batchsize=20, nproc=nproc)
+        assert np.isfinite(widom.henry)
+        assert widom.henry_error > 0
+        results.append((widom.henry, widom.henry_error, widom.enthalpy,
+                        widom.enthalpy_error, widom.mu_excess))
+    # The results do not depend on the number of processes, but they do
+    # depend on the seed.
+    assert results[0] == results[1]
+    assert results[0] != results[2]
+
+
+def test_widom_grid():
+    fn_host, fn_pars, fn_guest = get_cau13_xylene_files()
+    host = System.from_file(fn_host)
+    guest = System.from_file(fn_guest)
+    guest.cell = Cell(host.cell.rvecs)
+    grids = dict((ffatype, np.random.uniform(0, 1, (4, 5, 6))*kjmol) for ffatype in guest.ffatypes)
+    ff = make_grid_forcefield(guest, grids)
+    widom = WidomInsertion(guest, ff)
+    pos = random_insertion(guest, 5)
+    assert pos.shape == (5, guest.natom, 3)
+    energies = widom.compute_energies(pos)
+    for i in range(5):
+        ff.update_pos(pos[i])
+        assert abs(energies[i] - ff.compute_energy()) < 1e-15
+    widom.run(1000, 300*kelvin, seed=1, nblock=4, batchsize=100)
+    assert widom.enthalpy > 0
+    assert widom.mu_excess > 0
+
+
+def test_widom_errors():
+    rvecs = np.identity(3)*10*angstrom
+    guest = System(np.array([18]), np.zeros((1, 3)), rvecs=rvecs)
+    widom = WidomInsertion(guest, ForceField(guest, []))
+    with assert_raises(ValueError):
+        widom.run(100, 300*kelvin, nblock=1)
+    with assert_raises(ValueError):
+        widom.run(100, 300*kelvin, nblock=5, batchsize=30)
+    with assert_raises(TypeError):
+        guest = System(np.array([18]), np.zeros((1, 3)))
+        WidomInsertion(guest, ForceField(guest, []))
@@ -26,6 +26,11 @@
 
 from __future__ import division
 
+import collections
+import multiprocessing
+import queue
+import threading
+
 import numpy as np
 import time
 import h5py as h5
@@ -70,7 +75,9 @@ class RefTrajectory(Iterative):
 
     log_name = 'TRAJEC'
 
-    def __init__(self, ff, fn_traj, state=None, hooks=None, counter0=0):
+    def __init__(self, ff, fn_traj, state=None, hooks=None, counter0=0,
+                 start=None, end=None, step=1, block_size=100, prefetch=0,
+                 nproc=1):
         """
            **Arguments:**
 
@@ -94,10 +101,54 @@ class RefTrajectory(Iterative):
                 iterative.
 
            counter0
-                The counter value associated with the initial state.
+                The counter value associated with the initial state. By
+                default, this is also the first frame that is processed.
+
+           start, end, step
+                Only the frames ``start:end:step`` of the trajectory are
+                processed, with the usual meaning of a Python slice. When
+                start is not given, it is equal to counter0. The counter is
+                incremented by one for every processed frame. The
+                index of the current frame in the trajectory is stored in the
+                attribute ``frame``, which can be written out by adding
+                ``AttributeStateItem('frame')`` to the state.
+
+           block_size
+                The number of frames that are read from the file at once.
+                At most a few blocks are kept in memory.
+
+           prefetch
+                The number of blocks that are read ahead by a background
+                thread while the energies of the current block are computed.
+                When zero, all blocks are read in the main thread.
+
+           nproc
+                The number of worker processes that compute the energies.
+                The workers are forked when the first frame is needed, such
+                that the force field does not need to be pickled. The hooks
+                are still called in the main process, in the order of the
+                frames.
         """
+        if step < 1:
+            raise ValueError('The step must be a strictly positive integer.')
+        if block_size < 1:
+            raise ValueError('The block_size must be a strictly positive integer.')
         self.traj = h5.File(fn_traj, 'r')
-        self.nframes = len(self.traj['trajectory/pos'][:])
+        # Only the shapes of the datasets are needed to count the frames.
+        dss = [self.traj['trajectory/pos']]
+        if 'trajectory/cell' in self.traj:
+            dss.append(self.traj['trajectory/cell'])
+        self.nframes = min(ds.shape[0] for ds in dss)
+        if start is None:
+            start = counter0
+        self.frames = np.arange(self.nframes)[start:end:step]
+        self.block_size = block_size
+        self.prefetch = prefetch
+        self.nproc = nproc
+        self.iframe = 0
+        self.frame = None
+        self._results = None
+        self._pool = None
         Iterative.__init__(self, ff, state, hooks, counter0)
 
     def _add_default_hooks(self):
@@ -107,15 +158,133 @@ class RefTrajectory(Iterative):
     def initialize(self):
         return
 
+    def _iter_blocks(self):
+        '''Iterate over blocks of frames, positions and cell vectors'''
+        ds_pos = self.traj['trajectory/pos']
+        ds_cell = self.traj.get('trajectory/cell')
+        step = 1 if len(self.frames) < 2 else self.frames[1] - self.frames[0]
+        for i0 in range(0, len(self.frames), self.block_size):
+            frames = self.frames[i0:i0+self.block_size]
+            selection = slice(frames[0], frames[-1]+1, step)
+            pos = ds_pos[selection]
+            cell = None if ds_cell is None else ds_cell[selection]
+            yield frames, pos, cell
+
+    def _iter_results(self):
+        '''Iterate over the frames, with the energies when computed in parallel'''
+        if self.nproc > 1:
+            self._pool = multiprocessing.get_context('fork').Pool(
+                self.nproc, _init_worker, (self.ff,))
+        blocks = self._iter_blocks()
+        if self.prefetch > 0:
+            blocks = _read_ahead(blocks, self.prefetch)
+        if self._pool is None:
+            for frames, pos, cell in blocks:
+                for i in range(len(frames)):
+                    yield frames[i], pos[i], None if cell is None else cell[i], None
+        else:
+            # Keep a limited number of blocks in flight, such that the memory
+            # usage does not depend on the length of the trajectory.
+            pending = collections.deque()
+            for block in blocks:
+                pending.append((block, self._pool.apply_async(_compute_block, block[1:])))
+                while len(pending) > 2*self.nproc or (pending and pending[0][1].ready()):
+                    for result in _iter_block_results(*pending.popleft()):
+                        yield result
+            while pending:
+                for result in _iter_block_results(*pending.popleft()):
+                    yield result
+
     def propagate(self):
-        self.ff.update_pos(self.traj['trajectory/pos'][self.counter])
-        self.ff.update_rvecs(self.traj['trajectory/cell'][self.counter])
-        self.epot = self.ff.compute(None, None)
+        if self.iframe >= len(self.frames):
+            return True
+        if self._results is None:
+            self._results = self._iter_results()
+        self.frame, pos, rvecs, energies = next(self._results)
+        self.ff.update_pos(pos)
+        if rvecs is not None:
+            self.ff.update_rvecs(rvecs)
+        if energies is None:
+            self.epot = self.ff.compute_energy()
+        else:
+            self.epot = energies[0]
+            self.ff.energy = self.epot
+            for part, energy in zip(self.ff.iter_contribs(), energies[1:]):
+                part.energy = energy
         self.call_hooks()
         self.counter += 1
-        return self.counter==self.nframes
+        self.iframe += 1
+        return self.iframe == len(self.frames)
 
     def finalize(self):
-        self.traj.close()
+        # The file is kept open as long as not all frames are processed,
+        # such that a subsequent run continues with the next frame.
+        if self.iframe >= len(self.frames):
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+            self.traj.close()
         if log.do_medium:
             log.hline()
+
+
+def _read_ahead(iterator, size):
+    '''Iterate over the items of an iterator, which is consumed by a thread
+
+       **Arguments:**
+
+       iterator
+            The iterator to be consumed in the background.
+
+       size
+            The maximum number of items that are read ahead.
+    '''
+    items = queue.Queue(size)
+    done = object()
+    def work():
+        try:
+            for item in iterator:
+                items.put((item, None))
+            items.put((done, None))
+        except Exception as e:
+            items.put((done, e))
+    thread = threading.Thread(target=work)
+    thread.daemon = True
+    thread.start()
+    while True:
+        item, error = items.get()
+        if error is not None:
+            raise error
+        if item is done:
+            break
+        yield item
+
+
+_worker_ff = None
+
+
+def _init_worker(ff):
+    '''Store the force field in a forked worker process'''
+    global _worker_ff
+    _worker_ff = ff
+
+
+def _compute_block(pos, cell):
+    '''Compute the energy and its contributions for a block of frames'''
+    result = []
+    for i in range(len(pos)):
+        _worker_ff.update_pos(pos[i])
+        if cell is not None:
+            _worker_ff.update_rvecs(cell[i])
+        epot = _worker_ff.compute_energy()
+        result.append([epot] + [part.energy for part in _worker_ff.iter_contribs()])
+    return np.array(result)
+
+
+def _iter_block_results(block, async_result):
+    '''Iterate over the frames of a block computed by a worker process'''
+    frames, pos, cell = block
+    energies = async_result.get()
+    for i in range(len(frames)):
+        yield frames[i], pos[i], None if cell is None else cell[i], energies[i]
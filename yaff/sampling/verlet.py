@@ -138,6 +138,10 @@ class VerletIntegrator(Iterative):
         if timestep is None and restart_h5 is None:
             raise AssertionError('No Verlet timestep is found')
         self.ndof = ndof
+        if hooks is None:
+            hooks = []
+        elif not hasattr(hooks, '__len__'):
+            hooks = [hooks]
         self.hooks = hooks
         self.restart_h5 = restart_h5
 
@@ -394,6 +398,8 @@ class VerletIntegrator(Iterative):
 
     def finalize(self):
         if log.do_medium:
+            if self.ff.nlist is not None:
+                self.ff.nlist.log_stats()
             log.hline()
 
     def call_verlet_hooks(self, kind):
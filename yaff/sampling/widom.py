@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+r'''Widom test-particle insertions
+
+   The adsorption of a rigid guest molecule in a rigid host at infinite
+   dilution follows from the Boltzmann factors of the guest at random
+   positions and orientations in the host:
+
+   .. math:: K_H = \beta V \langle e^{-\beta U} \rangle
+
+   .. math:: \Delta H = \frac{\langle U e^{-\beta U} \rangle}
+             {\langle e^{-\beta U} \rangle} - k_B T
+
+   .. math:: \mu_{ex} = -k_B T \ln \langle e^{-\beta U} \rangle
+
+   where :math:`U` is the interaction energy of the guest with the host and
+   :math:`V` is the volume of the cell. The Henry coefficient :math:`K_H` is
+   the number of adsorbed guests per cell and per unit of pressure.
+
+   No Markov chain is involved, so the insertions are generated and evaluated
+   in large batches, optionally distributed over several processes.
+'''
+
+
+from __future__ import division
+
+import multiprocessing
+
+import numpy as np
+
+from molmod import boltzmann, angstrom, bar
+
+from yaff.log import log, timer
+from yaff.pes.ff import ForcePartGrid, ForcePartEwaldReciprocalInteraction
+from yaff.pes.ext import Cell
+from yaff.sampling.hostcache import HostCache
+from yaff.sampling.mcenergy import MCInteraction, make_external_potential
+from yaff.sampling.mcutils import random_insertion
+from yaff.system import System
+
+
+__all__ = ['WidomInsertion']
+
+
+class WidomInsertion(object):
+    '''Widom test-particle insertions of a rigid guest in a rigid host'''
+    log_name = 'WIDOM'
+
+    def __init__(self, guest, external_potential, eguest=0.0,
+                 close_contact=0.4*angstrom, host_cache=None):
+        '''
+           **Arguments:**
+
+           guest
+                A System instance of the guest molecule, in the 3D periodic
+                cell of the host.
+
+           external_potential
+                A ForceField instance describing the interaction of a single
+                guest molecule with the host, as in
+                :class:`yaff.sampling.mc.GCMC`. The guest must be listed last
+                in its System.
+
+           **Optional arguments:**
+
+           eguest
+                The intramolecular energy of the guest, which is subtracted
+                from the energy of the external potential.
+
+           close_contact
+                Insertions with a guest atom closer than this distance to a
+                host atom get a zero Boltzmann factor. Only used for external
+                potentials with a neighbor list.
+
+           host_cache
+                A :class:`yaff.sampling.hostcache.HostCache` instance. When
+                given, the structure factors and the linked cells of the host
+                atoms are loaded from this cache when possible.
+
+           Insertions with the same energy evaluation as the GCMC trials are
+           obtained when the external potential is constructed with
+           ``reci_ei='ewald_interaction'``. If the external potential only
+           consists of grids, e.g. obtained with
+           :func:`yaff.pes.hostgrid.make_grid_forcefield`, the batches of
+           insertions are interpolated at once.
+        '''
+        if guest.cell.nvec != 3:
+            raise TypeError('The guest must be in a 3D periodic cell for Widom insertions.')
+        self.guest = guest
+        self.external_potential = external_potential
+        self.eguest = eguest
+        self.close_contact = close_contact
+        system = external_potential.system
+        self.nhost = system.natom - guest.natom
+        # Grids can be evaluated for all insertions of a batch at once
+        if all(isinstance(part, ForcePartGrid) for part in external_potential.parts):
+            self.grid_parts = external_potential.parts
+        else:
+            self.grid_parts = None
+        # The pair interactions are computed with the host atoms in bins
+        if external_potential.nlist is not None:
+            self.host_interaction = MCInteraction(system.cell,
+                max(external_potential.nlist.rcut, close_contact))
+            if host_cache is None:
+                self.host_interaction.reset(system.pos, self.nhost)
+            else:
+                host_cache.reset_bins(self.host_interaction, system.pos, self.nhost)
+        else:
+            self.host_interaction = None
+        # The reciprocal Ewald interaction with the fixed structure factors
+        # of the host
+        self.ewald_reci = None
+        for part in external_potential.parts:
+            if isinstance(part, ForcePartEwaldReciprocalInteraction):
+                self.ewald_reci = part
+                part.cosfacs[:] = 0.0
+                part.sinfacs[:] = 0.0
+                if host_cache is None:
+                    part.compute_structurefactors(system.pos[:self.nhost],
+                        system.charges[:self.nhost], part.cosfacs, part.sinfacs)
+                else:
+                    part.cosfacs[:], part.sinfacs[:] = host_cache.get_structure_factors(
+                        part, system.pos[:self.nhost], system.charges[:self.nhost])
+                self.cosfacs = np.zeros(part.cosfacs.shape)
+                self.sinfacs = np.zeros(part.sinfacs.shape)
+        self.T = None
+
+    @classmethod
+    def from_files(cls, guest, parameters, host, **kwargs):
+        '''Automated setup of Widom insertions
+
+           **Arguments:**
+
+           guest
+                The filename of a system file describing one guest molecule,
+                or a System instance of one guest molecule.
+
+           parameters
+                Force-field parameters describing the host-guest interaction,
+                see :meth:`yaff.sampling.mc.GCMC.from_files`.
+
+           host
+                The filename of a system file describing the host system, or
+                a System instance of the host.
+
+           **Optional arguments:**
+
+           close_contact
+                See the constructor.
+
+           grid_spacing
+                When given, the host-guest interactions are tabulated on
+                grids with this spacing, see
+                :func:`yaff.pes.hostgrid.compute_host_grids`.
+
+           host_cache
+                A directory name or a
+                :class:`yaff.sampling.hostcache.HostCache` instance, see
+                :meth:`yaff.sampling.mc.GCMC.from_files`.
+
+           All other keyword arguments are passed to the ForceField
+           constructor. See the constructor of the
+           :class:`yaff.pes.generator.FFArgs` class for the available
+           optional arguments.
+        '''
+        if isinstance(guest, str):
+            guest = System.from_file(guest)
+        if isinstance(host, str):
+            host = System.from_file(host)
+        kwargs.pop('nlow', None)
+        kwargs.pop('nhigh', None)
+        close_contact = kwargs.pop('close_contact', 0.4*angstrom)
+        grid_spacing = kwargs.pop('grid_spacing', None)
+        host_cache = kwargs.pop('host_cache', None)
+        if isinstance(host_cache, str):
+            host_cache = HostCache(host_cache)
+        if not 'reci_ei' in kwargs.keys():
+            kwargs['reci_ei'] = 'ewald_interaction'
+        if guest.cell is None or guest.cell.nvec==0:
+            guest.cell = Cell(host.cell.rvecs)
+        external_potential = make_external_potential(host, guest, parameters,
+            grid_spacing, host_cache, **kwargs)
+        return cls(guest, external_potential, close_contact=close_contact,
+            host_cache=host_cache)
+
+    def compute_energies(self, pos):
+        '''Compute the interaction energies of a batch of guest insertions
+
+           **Arguments:**
+
+           pos
+                A numpy array with shape (ninsert, natom, 3), containing the
+                positions of the guest atoms for each insertion.
+
+           **Returns:** a numpy array with ninsert energies. Insertions with a
+           close contact get an infinite energy.
+        '''
+        if self.grid_parts is not None:
+            energies = np.zeros(len(pos))
+            for part in self.grid_parts:
+                energies += part.compute_batch(pos)
+            return energies - self.eguest
+        natom = self.guest.natom
+        ff = self.external_potential
+        energies = np.zeros(len(pos))
+        for i in range(len(pos)):
+            ff.system.pos[-natom:] = pos[i]
+            if self.host_interaction is not None:
+                e, dmin = self.host_interaction.compute(ff, natom, self.close_contact)
+                if e is None:
+                    energies[i] = np.inf
+                    continue
+            else:
+                ff.update_pos(ff.system.pos)
+                e = ff.compute_energy()
+            if self.ewald_reci is not None:
+                e += self.ewald_reci.insertion_energy(pos[i],
+                    ff.system.charges[-natom:], self.cosfacs, self.sinfacs)
+            energies[i] = e - self.eguest
+        return energies
+
+    def _compute_batch(self, ninsert, seed):
+        '''Return the sums of the Boltzmann factors and of the Boltzmann
+           factors times the energies for a batch of random insertions'''
+        random_state = np.random.RandomState(seed)
+        pos = random_insertion(self.guest, ninsert, random_state)
+        energies = self.compute_energies(pos)
+        weights = np.exp(-energies/(boltzmann*self.T))
+        mask = weights > 0
+        return weights.sum(), np.dot(weights[mask], energies[mask])
+
+    def run(self, ninsert, T, seed=None, nblock=10, batchsize=1000, nproc=1):
+        '''Perform Widom insertions
+
+           **Arguments:**
+
+           ninsert
+                The number of random insertions.
+
+           T
+                The temperature.
+
+           **Optional arguments:**
+
+           seed
+                The seed for the random insertions. Each batch gets its own
+                random state, seeded from this one, such that the results do
+                not depend on the number of processes. When not given, the
+                seed is drawn from the global random state of numpy.
+
+           nblock
+                The number of blocks for the error estimates. Each block
+                consists of whole batches.
+
+           batchsize
+                The number of insertions that are generated and evaluated at
+                once.
+
+           nproc
+                The number of processes over which the batches are
+                distributed. The worker processes are forked, such that the
+                force field does not need to be pickled.
+
+           The results are stored in the attributes ``henry``,
+           ``enthalpy`` and ``mu_excess``, the corresponding block-averaged
+           error estimates in ``henry_error``, ``enthalpy_error`` and
+           ``mu_excess_error``.
+        '''
+        nbatch = (ninsert + batchsize - 1)//batchsize
+        if nblock < 2:
+            raise ValueError('At least two blocks are needed for the error estimates.')
+        if nbatch < nblock:
+            raise ValueError('The number of batches, %i, is smaller than the number of blocks.' % nbatch)
+        if seed is None:
+            seed = np.random.randint(2**31)
+        seeds = np.random.RandomState(seed).randint(2**31, size=nbatch)
+        sizes = np.full(nbatch, batchsize)
+        sizes[-1] = ninsert - batchsize*(nbatch - 1)
+        self.T = T
+        with log.section(self.log_name), timer.section(self.log_name):
+            tasks = list(zip(sizes, seeds))
+            if nproc == 1:
+                sums = [self._compute_batch(*task) for task in tasks]
+            else:
+                context = multiprocessing.get_context('fork')
+                with context.Pool(nproc, _init_worker, (self,)) as pool:
+                    sums = pool.map(_compute_batch, tasks)
+            sums = np.array(sums)
+            # Combine consecutive batches into blocks
+            blocks = np.array_split(np.arange(nbatch), nblock)
+            block_results = np.array([self._estimate(sizes[block].sum(),
+                *sums[block].sum(axis=0)) for block in blocks])
+            self.ninsert = ninsert
+            self.henry, self.enthalpy, self.mu_excess = self._estimate(
+                ninsert, *sums.sum(axis=0))
+            with np.errstate(invalid='ignore'):
+                self.henry_error, self.enthalpy_error, self.mu_excess_error = \
+                    block_results.std(axis=0, ddof=1)/np.sqrt(nblock)
+            if log.do_medium:
+                log('Widom insertions: %i at T = %s' % (ninsert, log.temperature(T)))
+                log('Henry coefficient: %12.5e +- %12.5e per cell and bar' % (
+                    self.henry*bar, self.henry_error*bar))
+                log('Adsorption enthalpy: %s +- %s' % (
+                    log.energy(self.enthalpy), log.energy(self.enthalpy_error)))
+                log('Excess chemical potential: %s +- %s' % (
+                    log.energy(self.mu_excess), log.energy(self.mu_excess_error)))
+
+    def _estimate(self, ninsert, wsum, wesum):
+        '''Return the Henry coefficient, enthalpy and excess chemical
+           potential from the sums of a number of insertions'''
+        kT = boltzmann*self.T
+        wmean = wsum/ninsert
+        henry = self.guest.cell.volume*wmean/kT
+        with np.errstate(divide='ignore', invalid='ignore'):
+            enthalpy = wesum/wsum - kT
+            mu_excess = -kT*np.log(wmean)
+        return henry, enthalpy, mu_excess
+
+
+# The WidomInsertion instance in the worker processes, inherited when they
+# are forked.
+_worker_widom = None
+
+
+def _init_worker(widom):
+    global _worker_widom
+    _worker_widom = widom
+
+
+def _compute_batch(task):
+    return _worker_widom._compute_batch(*task)
@@ -490,7 +490,7 @@ class System(object):
             if key in sgrp:
                 kwargs[key] = np.asarray(sgrp[key][:], 'U22')
         if log.do_high:
-            log('Read system parameters from %s.' % f.filename)
+            log('Read system parameters from %s.' % f.file.filename)
         return cls(**kwargs)
 
     @classmethod